@@ -3,7 +3,6 @@ from flask_cors import CORS
 import os
 import logging
 import sys
-from datetime import datetime
 from models.sqlite_users import db, User, AnalysisHistory, Guest, SearchBot, NewsItem, FullNews, Question, Answer, AnswerLike, EmailCampaign, EmailSend, Article, Payment, Referral, ReferralReward, Notification, WhitelistedIP, BrandingSettings, APIKey, AnalysisSettings, AnalysisTemplate, BatchProcessingTask, BatchProcessingFile, DocumentComparison
 
 # Настройка логирования
@@ -61,7 +60,7 @@ def create_app():
         from models.limits import IPLimitManager
         
         # Пропускаем служебные запросы
-        if request.path.startswith(('/static/', '/api/', '/admin/', '/payments/', '/favicon.ico', '/robots.txt', '/sitemap.xml')):
+        if request.path.startswith(('/static/', '/api/', '/admin/', '/payments/', '/favicon.ico', '/robots.txt', '/sitemap')):
             return None
         
         # Пропускаем если пользователь авторизован
@@ -79,12 +78,13 @@ def create_app():
             
             # Проверяем на ботов перед созданием записи гостя
             from utils.bot_detector import is_search_bot, should_block_request, get_bot_type, is_wordpress_scanner
+            from services.visit_buffer import get_visit_buffer
             
             # Блокируем вредоносных ботов и WordPress-сканеры
             if should_block_request(user_agent, request_path=request.path):
                 # Если это WordPress-сканер, записываем его как бота перед блокировкой
                 if is_wordpress_scanner(request_path=request.path, user_agent=user_agent):
-                    app.user_manager.get_or_create_search_bot(real_ip, user_agent or request.path, 'WordPress Scanner')
+                    get_visit_buffer().record_bot_visit(real_ip, user_agent or request.path, 'WordPress Scanner')
                     logger.warning(f"🚫 WordPress-сканер заблокирован: {request.path} (IP={real_ip})")
                 else:
                     logger.debug(f"🚫 Вредоносный бот заблокирован в middleware: IP={real_ip}")
@@ -95,15 +95,12 @@ def create_app():
             # Записываем поисковых ботов в отдельную таблицу
             is_bot, bot_type = is_search_bot(user_agent)
             if is_bot:
-                app.user_manager.get_or_create_search_bot(real_ip, user_agent, bot_type)
+                get_visit_buffer().record_bot_visit(real_ip, user_agent, bot_type)
                 logger.debug(f"🕷️ Поисковый бот записан в middleware: {bot_type} (IP={real_ip})")
                 return None
             
-            # Создаем/обновляем запись гостя только для реальных пользователей
-            guest = app.user_manager.get_or_create_guest(real_ip, user_agent)
-            guest.last_seen = datetime.now().isoformat()
-            from models.sqlite_users import db
-            db.session.commit()
+            # Создаем/обновляем запись гостя только для реальных пользователей (в БД - при сбросе буфера)
+            get_visit_buffer().record_guest_visit(real_ip, user_agent)
         except Exception as e:
             # Не прерываем запрос при ошибке отслеживания
             logger.debug(f"⚠️ Ошибка отслеживания визита гостя: {e}")
@@ -266,6 +263,54 @@ def create_app():
             </html>
             ''', 405
     
+    # Воркеры очереди фоновых задач (асинхронный анализ, пакетная обработка, сравнение документов)
+    if Config.JOB_QUEUE_EMBEDDED_WORKERS > 0:
+        try:
+            from utils.job_queue import start_embedded_workers
+            start_embedded_workers(app, Config.JOB_QUEUE_EMBEDDED_WORKERS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска воркеров очереди: {e}")
+    
+    # Фоновый пересчет агрегатов статистики админ-панели
+    if Config.STATS_ROLLUP_INTERVAL_SECONDS > 0:
+        try:
+            from services.stats_rollup import start_stats_compactor
+            start_stats_compactor(app, Config.STATS_ROLLUP_INTERVAL_SECONDS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска пересчета агрегатов статистики: {e}")
+    
+    # Фоновая сверка счетчиков ответов на вопросы
+    if Config.QUESTION_RECONCILE_INTERVAL_SECONDS > 0:
+        try:
+            from services.question_maintenance import start_question_reconciler
+            start_question_reconciler(app, Config.QUESTION_RECONCILE_INTERVAL_SECONDS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска сверки счетчиков вопросов: {e}")
+    
+    # Фоновая запись визитов гостей, ботов и просмотров страниц
+    if Config.VISIT_BUFFER_FLUSH_SECONDS > 0:
+        try:
+            from services.visit_buffer import start_visit_buffer
+            start_visit_buffer(app, Config.VISIT_BUFFER_FLUSH_SECONDS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска буфера визитов: {e}")
+    
+    # Обучение классификатора типов документов на размеченных текстах (вне запросов)
+    if Config.DOC_CLASSIFIER_REFRESH_SECONDS > 0:
+        try:
+            from services.document_classifier import start_classifier_trainer
+            start_classifier_trainer(Config.DOC_CLASSIFIER_REFRESH_SECONDS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска обучения классификатора типов документов: {e}")
+    
+    # Пакетная запись счетчиков использования API-ключей
+    if Config.API_KEY_USAGE_FLUSH_SECONDS > 0:
+        try:
+            from services.api_key_cache import start_api_key_usage_buffer
+            start_api_key_usage_buffer(app, Config.API_KEY_USAGE_FLUSH_SECONDS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка запуска буфера использования API-ключей: {e}")
+    
     logger.info("🚀 DocScan App инициализирован!")
     return app
 
@@ -2,17 +2,21 @@
 Скрипт для резервного копирования базы данных DocScan AI
 Использование:
     python backup_database.py              # Создать бэкап с автоматическим именем
+    python backup_database.py --incremental  # Только страницы, измененные после последнего полного бэкапа
     python backup_database.py --manual     # Интерактивный режим
     python backup_database.py --clean     # Удалить старые бэкапы (старше 30 дней)
+
+Бэкап снимается на работающем сайте через SQLite backup API (services/db_backup.py)
+и сразу сжимается в целевой файл.
 """
 import os
 import sys
-import shutil
-import gzip
 from datetime import datetime, timedelta
 from pathlib import Path
 import logging
 
+from services.db_backup import run_backup, prune_orphans, is_backup_file, MANIFEST_SUFFIX
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -35,8 +39,8 @@ def ensure_backup_dir():
     Path(BACKUP_DIR).mkdir(parents=True, exist_ok=True)
     logger.info(f"📁 Папка для бэкапов: {BACKUP_DIR}")
 
-def create_backup(compress=True):
-    """Создает резервную копию базы данных"""
+def create_backup(compress=True, kind='full'):
+    """Создает резервную копию базы данных (full или incremental)"""
     try:
         # Проверяем существование БД
         if not os.path.exists(DB_FILE):
@@ -46,32 +50,14 @@ def create_backup(compress=True):
         # Создаем папку для бэкапов
         ensure_backup_dir()
         
-        # Генерируем имя файла с датой и временем
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'docscan_backup_{timestamp}.db'
-        if compress:
-            backup_filename += '.gz'
-        
-        backup_path = os.path.join(BACKUP_DIR, backup_filename)
-        
-        # Копируем файл БД
-        logger.info(f"📦 Создание бэкапа: {backup_filename}")
-        shutil.copy2(DB_FILE, backup_path.replace('.gz', ''))
-        
-        # Сжимаем, если нужно
-        if compress:
-            logger.info("🗜️ Сжатие бэкапа...")
-            with open(backup_path.replace('.gz', ''), 'rb') as f_in:
-                with gzip.open(backup_path, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            os.remove(backup_path.replace('.gz', ''))
+        logger.info(f"📦 Создание бэкапа ({'инкрементальный' if kind == 'incremental' else 'полный'})...")
+        result = run_backup(kind, db_path=DB_FILE, backup_dir=BACKUP_DIR, compress=compress)
         
-        # Получаем размер файла
-        file_size = os.path.getsize(backup_path)
-        size_mb = file_size / (1024 * 1024)
-        
-        logger.info(f"✅ Бэкап успешно создан: {backup_filename} ({size_mb:.2f} MB)")
-        logger.info(f"📂 Путь: {backup_path}")
+        size_mb = result['size_bytes'] / (1024 * 1024)
+        logger.info(f"✅ Бэкап успешно создан: {result['filename']} ({size_mb:.2f} MB)")
+        if result['kind'] == 'incremental':
+            logger.info(f"🧩 Изменено страниц: {result['changed_pages']} из {result['pages']} (основа: {result['base']})")
+        logger.info(f"📂 Путь: {os.path.join(BACKUP_DIR, result['filename'])}")
         
         return True
         
@@ -111,6 +97,8 @@ def clean_old_backups():
                 except Exception as e:
                     logger.warning(f"⚠️ Не удалось удалить {filename}: {e}")
         
+        deleted_count += len(prune_orphans(BACKUP_DIR))
+        
         if deleted_count > 0:
             logger.info(f"✅ Удалено {deleted_count} старых бэкапов")
         else:
@@ -148,9 +136,14 @@ def limit_backups_count():
                     os.remove(file_path)
                     deleted_count += 1
                     logger.info(f"🗑️ Удален бэкап (превышен лимит): {filename}")
+                    if os.path.exists(file_path + MANIFEST_SUFFIX):
+                        os.remove(file_path + MANIFEST_SUFFIX)
                 except Exception as e:
                     logger.warning(f"⚠️ Не удалось удалить {filename}: {e}")
         
+        # Инкрементальные бэкапы без своего полного бесполезны
+        deleted_count += len(prune_orphans(BACKUP_DIR))
+        
         if deleted_count > 0:
             logger.info(f"✅ Удалено {deleted_count} бэкапов (превышен лимит {MAX_BACKUPS_COUNT})")
         
@@ -170,7 +163,7 @@ def list_backups():
         backups = []
         for filename in os.listdir(BACKUP_DIR):
             file_path = os.path.join(BACKUP_DIR, filename)
-            if os.path.isfile(file_path) and (filename.startswith('docscan_backup_') and filename.endswith('.db.gz')):
+            if os.path.isfile(file_path) and is_backup_file(filename):
                 file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
                 file_size = os.path.getsize(file_path)
                 size_mb = file_size / (1024 * 1024)
@@ -217,7 +210,7 @@ def get_backup_info():
         
         for filename in os.listdir(BACKUP_DIR):
             file_path = os.path.join(BACKUP_DIR, filename)
-            if os.path.isfile(file_path) and (filename.startswith('docscan_backup_') and filename.endswith('.db.gz')):
+            if os.path.isfile(file_path) and is_backup_file(filename):
                 file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
                 file_size = os.path.getsize(file_path)
                 total_size += file_size
@@ -253,6 +246,7 @@ def main():
     parser.add_argument('--list', action='store_true', help='Показать список бэкапов')
     parser.add_argument('--info', action='store_true', help='Показать информацию о бэкапах')
     parser.add_argument('--no-compress', action='store_true', help='Не сжимать бэкап')
+    parser.add_argument('--incremental', action='store_true', help='Инкрементальный бэкап (изменения после последнего полного)')
     
     args = parser.parse_args()
     
@@ -292,7 +286,7 @@ def main():
             return
     
     # Создаем бэкап
-    success = create_backup(compress=not args.no_compress)
+    success = create_backup(compress=not args.no_compress, kind='incremental' if args.incremental else 'full')
     
     if success:
         # Очищаем старые бэкапы
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарк определения ботов: стоимость проверок на один запрос
+
+Сравнивает прежние линейные проверки (lower() + цикл по каждому списку в
+каждой функции) со скомпилированным матчером utils.bot_detector - без кеша
+(первый запрос с новым User-Agent) и с LRU-кешем вердиктов (повторные
+запросы). На каждый запрос выполняется тот же набор вызовов, что в
+middleware track_guest_visits: should_block_request + is_search_bot.
+
+Запуск: python benchmark_bot_detector.py [количество_итераций]
+"""
+
+import sys
+import time
+import logging
+
+from utils import bot_detector
+from utils.bot_detector import (
+    MALICIOUS_BOTS, SEARCH_BOTS, SUSPICIOUS_UA_PATTERNS, BOT_INDICATORS,
+    BROWSER_MARKERS_STRICT, BROWSER_MARKERS, WORDPRESS_UA_INDICATORS, WORDPRESS_PATHS
+)
+
+SAMPLE_USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 YaBrowser/24.4.0.0 Safari/537.36',
+    'Mozilla/5.0 (compatible; YandexBot/3.0; +http://yandex.com/bots)',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; GPTBot/1.2; +https://openai.com/gptbot)',
+    'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)',
+    'python-requests/2.31.0',
+    'curl/8.4.0',
+    'Go-http-client/1.1',
+    'Python/3.11 aiohttp/3.9.1',
+    'Hello from Palo Alto Networks, find out more about our scans in https://docs-cortex.paloaltonetworks.com/r/1',
+    'Mozilla/5.0 (compatible; SomeCrawler/1.0)',
+    'HeadlessChecker/2.0 scanner',
+    'WordPress/6.4.2; https://example.com',
+    'Не определен',
+    '-',
+    'abc',
+    'TelegramBot (like TwitterBot)',
+]
+
+
+def legacy_verdict(user_agent, request_path=None):
+    """Прежняя реализация: отдельный lower() и линейный проход в каждой проверке"""
+    def malicious():
+        if not user_agent or user_agent == 'Не определен' or user_agent == '-' or user_agent.strip() == '':
+            return True
+        if len(user_agent.strip()) < 5:
+            return True
+        user_agent_lower = user_agent.lower()
+        return any(bot_name.lower() in user_agent_lower for bot_name in MALICIOUS_BOTS)
+
+    def wordpress():
+        if user_agent:
+            user_agent_lower = user_agent.lower()
+            if any(indicator in user_agent_lower for indicator in WORDPRESS_UA_INDICATORS):
+                return True
+        if not request_path:
+            return False
+        request_path_lower = request_path.lower()
+        return any(wp_path in request_path_lower for wp_path in WORDPRESS_PATHS)
+
+    def search_bot():
+        if not user_agent or user_agent == 'Не определен':
+            return False, None
+        user_agent_lower = user_agent.lower()
+        for bot_name in SEARCH_BOTS:
+            if bot_name.lower() in user_agent_lower:
+                return True, bot_name
+        if 'python' in user_agent_lower and 'aiohttp' in user_agent_lower:
+            return True, 'Python Bot'
+        for pattern in SUSPICIOUS_UA_PATTERNS:
+            if pattern.lower() in user_agent_lower:
+                if not any(browser in user_agent_lower for browser in BROWSER_MARKERS_STRICT):
+                    return True, 'Unknown Bot'
+        if user_agent in ['-', 'Не определен', ''] or len(user_agent.strip()) < 5:
+            if 'mozilla' not in user_agent_lower and 'webkit' not in user_agent_lower:
+                return True, 'Unknown Bot'
+        has_bot_indicator = any(indicator in user_agent_lower for indicator in BOT_INDICATORS)
+        is_browser = any(browser in user_agent_lower for browser in BROWSER_MARKERS)
+        if has_bot_indicator and not is_browser:
+            return True, 'Unknown Bot'
+        return False, None
+
+    return (malicious() or wordpress()), search_bot()
+
+
+def compiled_verdict(user_agent, request_path=None):
+    return bot_detector.should_block_request(user_agent, request_path), bot_detector.is_search_bot(user_agent)
+
+
+def measure(func, user_agents, iterations, before_each=None):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if before_each:
+            before_each()
+        for user_agent in user_agents:
+            func(user_agent, '/index')
+    elapsed = time.perf_counter() - started
+    return elapsed / (iterations * len(user_agents)) * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    # Логи детектора на каждый вызов исказили бы замер
+    logging.disable(logging.CRITICAL)
+
+    mismatches = [ua for ua in SAMPLE_USER_AGENTS if legacy_verdict(ua, '/index') != compiled_verdict(ua, '/index')]
+    if mismatches:
+        print(f"ERROR: verdicts differ for: {mismatches}")
+        sys.exit(1)
+    print(f"OK: verdicts match on {len(SAMPLE_USER_AGENTS)} user agents")
+
+    matcher = bot_detector.get_matcher()
+    legacy = measure(legacy_verdict, SAMPLE_USER_AGENTS, iterations)
+    uncached = measure(compiled_verdict, SAMPLE_USER_AGENTS, max(iterations // 10, 1), before_each=matcher.classify.cache_clear)
+    cached = measure(compiled_verdict, SAMPLE_USER_AGENTS, iterations)
+
+    print(f"legacy linear scans:     {legacy:8.2f} us/request")
+    print(f"compiled, cache miss:    {uncached:8.2f} us/request ({legacy / uncached:.1f}x)")
+    print(f"compiled, cache hit:     {cached:8.2f} us/request ({legacy / cached:.1f}x)")
+    print(f"verdict cache: {bot_detector.get_verdict_cache_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк сравнения документов: старый difflib.Differ по строкам против
+services.text_diff (пункты + patience/Myers + пословный diff)
+
+Синтетический договор из N строк: нумерованные пункты, повторяющиеся
+строки (подписи, реквизиты), перенос строк по ширине. Во второй версии
+часть пунктов переверстана с другой шириной строки (как другой PDF),
+в 1% пунктов изменены слова, часть пунктов вставлена и удалена.
+Differ на больших документах работает очень долго, поэтому он запускается
+только до размера old_max.
+
+Запуск: python benchmark_document_diff.py [размеры через запятую] [old_max] [бюджет, с]
+"""
+
+import sys
+import time
+import random
+import difflib
+import textwrap
+
+from services.text_diff import compare_texts
+
+WORDS = ('поставщик покупатель товар оплата срок договор сторона обязуется передать принять '
+         'неустойка ответственность расторжение уведомление письменный рабочих дней цена '
+         'качество гарантия претензия акт приемки спецификация доставка счет').split()
+
+
+def make_clause(rng, number):
+    sentences = []
+    for _ in range(rng.randint(1, 4)):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 25))]
+        sentences.append(' '.join(words).capitalize() + f' {rng.randint(1, 999)}.')
+    return f'{number}. ' + ' '.join(sentences)
+
+
+def make_documents(lines, seed=0):
+    """Две версии договора примерно по lines строк"""
+    rng = random.Random(seed)
+    clauses = []
+    total = 0
+    while total < lines:
+        clause = make_clause(rng, len(clauses) + 1)
+        clauses.append(clause)
+        total += len(textwrap.wrap(clause, 80)) + 1
+
+    modified = []
+    for clause in clauses:
+        roll = rng.random()
+        if roll < 0.005:
+            continue  # пункт удален
+        if roll < 0.015:
+            words = clause.split()
+            pos = rng.randrange(1, len(words))
+            words[pos] = rng.choice(WORDS) + 'ы'
+            clause = ' '.join(words)
+        modified.append(clause)
+        if rng.random() < 0.005:
+            modified.append(make_clause(rng, 0))  # пункт добавлен
+
+    def render(items, width_for):
+        out = []
+        for n, clause in enumerate(items):
+            out.extend(textwrap.wrap(clause, width_for(n)))
+            if n % 50 == 49:
+                out.extend(['Подпись ____________', 'М.П.'])  # одинаковые строки без уникальных опор
+            out.append('')
+        return '\n'.join(out)
+
+    original_text = render(clauses, lambda n: 80)
+    # Каждый пятый пункт переверстан другой шириной строки
+    modified_text = render(modified, lambda n: 72 if n % 5 == 0 else 80)
+    return original_text, modified_text
+
+
+def old_diff(original_text, modified_text):
+    """Прежний алгоритм DocumentComparator"""
+    original_lines = [line.strip() for line in original_text.split('\n') if line.strip()]
+    modified_lines = [line.strip() for line in modified_text.split('\n') if line.strip()]
+    return list(difflib.Differ().compare(original_lines, modified_lines))
+
+
+def main():
+    sizes = [int(x) for x in (sys.argv[1] if len(sys.argv) > 1 else '1000,5000,20000,50000').split(',')]
+    old_max = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    budget = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+
+    print(f"{'lines':>7} {'difflib.Differ':>15} {'text_diff':>10} {'units':>13} {'modified':>9} {'added':>6} {'removed':>8} {'budget':>7}")
+    for size in sizes:
+        original_text, modified_text = make_documents(size)
+        if size <= old_max:
+            started = time.perf_counter()
+            old_diff(original_text, modified_text)
+            old_time = f'{time.perf_counter() - started:.2f} s'
+        else:
+            old_time = 'skipped'
+
+        started = time.perf_counter()
+        result = compare_texts(original_text, modified_text, time_budget=budget)
+        new_time = time.perf_counter() - started
+        changes = result['changes']
+        units = len(changes['unchanged']) + len(changes['removed']) + len(changes['modified'])
+        print(f"{size:>7} {old_time:>15} {new_time:>8.2f} s {units:>13} {len(changes['modified']):>9} "
+              f"{len(changes['added']):>6} {len(changes['removed']):>8} {'over' if result['budget_exceeded'] else 'ok':>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк рендеринга PDF-отчетов: время на отчет и пропускная способность
+
+Сравнивает рендер в потоках веб-процесса (как раньше - reportlab держит GIL)
+с пулом процессов services.pdf_render_service и попаданием в кеш готовых PDF.
+Конкурентная нагрузка - N потоков, каждый запрашивает отчеты с разными данными,
+как одновременные /api/download-analysis. Параллельно поток-зонд раз в 5 мс
+просыпается, как легкий запрос веб-процесса: его задержка показывает, насколько
+рендер мешает остальным запросам (на одном ядре пул не ускоряет сам рендер,
+но освобождает GIL).
+
+Запуск: python benchmark_pdf_render.py [отчетов] [потоков] [процессов пула]
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from services import pdf_render_service
+from services.pdf_generator import generate_analysis_pdf
+
+
+def sample_analysis(seed):
+    """Анализ со всеми разделами отчета; seed делает данные (и ключ кеша) уникальными"""
+    return {
+        'document_type_name': f'Договор поставки №{seed}',
+        'executive_summary': {
+            'risk_level': ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL'][seed % 4],
+            'risk_icon': '⚠️',
+            'risk_description': 'Обнаружены условия, требующие внимания перед подписанием.',
+            'decision_support': 'Подписывать после согласования сроков оплаты и ответственности сторон. ' * 3
+        },
+        'risk_analysis': {
+            'risk_statistics': {'CRITICAL': 1, 'HIGH': 2, 'MEDIUM': 4, 'LOW': 3, 'total': 10},
+            'key_risks': [
+                {
+                    'level': ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL'][i % 4],
+                    'title': f'Риск {i}',
+                    'description': 'Пункт договора допускает одностороннее изменение цены поставщиком. ' * 4
+                }
+                for i in range(10)
+            ]
+        },
+        'expert_analysis': {
+            'legal_expertise': 'Неустойка несоразмерна последствиям нарушения обязательства. ' * 6,
+            'financial_analysis': 'Отсрочка платежа не предусмотрена, предоплата 100%. ' * 6,
+            'operational_risks': 'Сроки поставки не закреплены календарными датами. ' * 6,
+            'strategic_assessment': 'Договор заключается на 5 лет без права расторжения. ' * 6
+        },
+        'recommendations': {
+            'practical_actions': [{'action': f'Действие {i}', 'effect': 'снижает риск штрафов'} for i in range(8)],
+            'priority_actions': [f'Срочно: согласовать пункт {i}' for i in range(4)]
+        }
+    }
+
+
+def run_concurrent(render, reports, threads):
+    """Возвращает (секунд всего, отчетов в секунду, задержка зонда p99 в мс)"""
+    stop = threading.Event()
+    delays = []
+
+    def probe():
+        while not stop.is_set():
+            started = time.perf_counter()
+            time.sleep(0.005)
+            delays.append((time.perf_counter() - started - 0.005) * 1000)
+
+    probe_thread = threading.Thread(target=probe, daemon=True)
+    probe_thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda seed: render(sample_analysis(seed), f'doc_{seed}.pdf', None), range(reports)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    probe_thread.join()
+    delays.sort()
+    p99 = delays[int(len(delays) * 0.99)] if delays else 0
+    return elapsed, reports / elapsed, p99
+
+
+def main():
+    reports = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else max(os.cpu_count() or 1, 2)
+    print(f"cpu: {os.cpu_count()}, reports: {reports}, threads: {threads}, pool: {workers}")
+    logging.disable(logging.CRITICAL)
+
+    Config.PDF_RENDER_CACHE_PATH = os.path.join(tempfile.mkdtemp(prefix='pdf_bench_'), 'pdf_render_cache.db')
+
+    # Один отчет: время рендеринга
+    generate_analysis_pdf(sample_analysis(0), 'warmup.pdf')
+    started = time.perf_counter()
+    for seed in range(5):
+        pdf_bytes = generate_analysis_pdf(sample_analysis(seed), f'doc_{seed}.pdf')
+    single_ms = (time.perf_counter() - started) / 5 * 1000
+    print(f"single report:                 {single_ms:8.1f} ms ({len(pdf_bytes) // 1024} KB)")
+
+    # Без кеша: потоки в процессе против пула процессов
+    Config.PDF_RENDER_CACHE_ENABLED = False
+    inline_elapsed, inline_rate, inline_p99 = run_concurrent(generate_analysis_pdf, reports, threads)
+    print(f"{threads} threads, in-process:        {inline_rate:8.1f} reports/s ({inline_elapsed:.2f} s), probe p99 delay {inline_p99:.1f} ms")
+
+    def pooled(analysis_data, filename, branding_settings):
+        return pdf_render_service.render_analysis_pdf(analysis_data, filename, branding_settings, workers=workers)
+
+    pooled(sample_analysis(0), 'warmup.pdf', None)  # старт процессов пула
+    pool_elapsed, pool_rate, pool_p99 = run_concurrent(pooled, reports, threads)
+    print(f"{threads} threads, pool of {workers}:       {pool_rate:8.1f} reports/s ({pool_elapsed:.2f} s, {pool_rate / inline_rate:.1f}x), probe p99 delay {pool_p99:.1f} ms")
+
+    # С кешем: первый проход заполняет, второй читает
+    Config.PDF_RENDER_CACHE_ENABLED = True
+    run_concurrent(pooled, reports, threads)
+    cached_elapsed, cached_rate, _ = run_concurrent(pooled, reports, threads)
+    print(f"{threads} threads, cache hit:         {cached_rate:8.1f} reports/s ({cached_elapsed / reports * 1000:.1f} ms/report)")
+    print(f"cache: {pdf_render_service.get_render_cache().get_stats()}")
+
+    pdf_render_service.shutdown_render_pool()
+
+
+if __name__ == '__main__':
+    main()
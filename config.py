@@ -12,6 +12,72 @@ class Config:
     # Yandex Cloud
     YANDEX_API_KEY = os.getenv('YANDEX_API_KEY')
     YANDEX_FOLDER_ID = os.getenv('YANDEX_FOLDER_ID')
+
+    # HTTP-клиент Yandex Cloud: пул соединений, ретраи, circuit breaker
+    YANDEX_HTTP_POOL_SIZE = int(os.getenv('YANDEX_HTTP_POOL_SIZE', 10))
+    YANDEX_HTTP_MAX_RETRIES = int(os.getenv('YANDEX_HTTP_MAX_RETRIES', 3))
+    YANDEX_HTTP_BACKOFF_BASE = float(os.getenv('YANDEX_HTTP_BACKOFF_BASE', 0.5))  # Секунды
+    YANDEX_HTTP_BACKOFF_MAX = float(os.getenv('YANDEX_HTTP_BACKOFF_MAX', 10))  # Секунды
+    YANDEX_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('YANDEX_CIRCUIT_FAILURE_THRESHOLD', 5))  # Сбоев подряд до размыкания
+    YANDEX_CIRCUIT_RESET_SECONDS = int(os.getenv('YANDEX_CIRCUIT_RESET_SECONDS', 30))
+    YANDEX_CONNECT_TIMEOUT = float(os.getenv('YANDEX_CONNECT_TIMEOUT', 5))
+    YANDEX_REQUEST_TIMEOUT = int(os.getenv('YANDEX_REQUEST_TIMEOUT', 30))  # Таймаут чтения ответа
+    YANDEX_ANALYSIS_TIMEOUT = int(os.getenv('YANDEX_ANALYSIS_TIMEOUT', 60))  # Таймаут полного анализа документа
+
+    # Локальный классификатор типа документа (YandexGPT - только при низкой уверенности)
+    DOC_CLASSIFIER_MAX_CHARS = int(os.getenv('DOC_CLASSIFIER_MAX_CHARS', 20000))  # Анализируем начало документа
+    DOC_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv('DOC_CLASSIFIER_MIN_CONFIDENCE', 0.35))  # Отрыв лучшего типа от второго
+    DOC_CLASSIFIER_MIN_SCORE = float(os.getenv('DOC_CLASSIFIER_MIN_SCORE', 3.0))
+    DOC_CLASSIFIER_HISTORY_WEIGHT = float(os.getenv('DOC_CLASSIFIER_HISTORY_WEIGHT', 5.0))
+    DOC_CLASSIFIER_HISTORY_LIMIT = int(os.getenv('DOC_CLASSIFIER_HISTORY_LIMIT', 5000))  # Хранимых размеченных текстов
+    DOC_CLASSIFIER_REFRESH_SECONDS = int(os.getenv('DOC_CLASSIFIER_REFRESH_SECONDS', 3600))  # Переобучение фоном (0 - выключено)
+    DOC_CLASSIFIER_SAMPLES_PATH = os.getenv('DOC_CLASSIFIER_SAMPLES_PATH', os.path.join(os.path.dirname(__file__), 'classifier_samples.db'))
+
+    # Извлечение текста из PDF
+    PDF_TEXT_CHAR_BUDGET = int(os.getenv('PDF_TEXT_CHAR_BUDGET', 400000))  # Для анализа: ANALYSIS_MAX_CHUNKS частей по ANALYSIS_CHUNK_CHARS
+    PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', 0))  # Процессов для больших PDF (0/1 - в текущем процессе)
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 40))
+    PDF_PARALLEL_CHUNK_PAGES = int(os.getenv('PDF_PARALLEL_CHUNK_PAGES', 10))
+
+    # Анализ больших документов по частям (map-reduce)
+    ANALYSIS_CHUNK_CHARS = int(os.getenv('ANALYSIS_CHUNK_CHARS', 50000))  # Лимит текста в одном запросе к YandexGPT
+    ANALYSIS_MAX_CHUNKS = int(os.getenv('ANALYSIS_MAX_CHUNKS', 8))  # Остаток документа сверх этого не анализируется
+    ANALYSIS_CHUNK_WORKERS = int(os.getenv('ANALYSIS_CHUNK_WORKERS', 4))  # Частей одного документа параллельно
+
+    # Асинхронный анализ (/api/analyze/async + опрос этапов); выполняют воркеры очереди JOB_QUEUE_*
+    ANALYSIS_POLL_INTERVAL_SECONDS = float(os.getenv('ANALYSIS_POLL_INTERVAL_SECONDS', 1.5))  # Интервал опроса, который сообщается клиенту
+
+    # Кеш записей пользователей (get_user): запрос + процесс, инвалидация через общий mmap-файл
+    USER_CACHE_ENABLED = os.getenv('USER_CACHE_ENABLED', 'True').lower() == 'true'
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 60))  # Секунды
+    USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000))
+    USER_CACHE_INVALIDATION_PATH = os.getenv('USER_CACHE_INVALIDATION_PATH', os.path.join(os.path.dirname(__file__), 'user_cache_generations.bin'))
+    USER_CACHE_INVALIDATION_SLOTS = int(os.getenv('USER_CACHE_INVALIDATION_SLOTS', 65536))
+
+    # Предагрегированные метрики админ-панели (stats_rollups)
+    STATS_ROLLUP_INTERVAL_SECONDS = int(os.getenv('STATS_ROLLUP_INTERVAL_SECONDS', 300))  # Фоновый пересчет (0 - только по запросу)
+    STATS_ROLLUP_MAX_AGE_SECONDS = int(os.getenv('STATS_ROLLUP_MAX_AGE_SECONDS', 60))  # /admin/stats пересчитывает более старые агрегаты
+    STATS_ROLLUP_RECOMPUTE_DAYS = int(os.getenv('STATS_ROLLUP_RECOMPUTE_DAYS', 1))  # Сколько прошлых дней пересчитывать (поздние записи)
+    STATS_ROLLUP_HOURLY_RETENTION_DAYS = int(os.getenv('STATS_ROLLUP_HOURLY_RETENTION_DAYS', 14))  # Не меньше 7 - по часам считается выручка за неделю
+
+    # Фоновая сверка answers_count/статусов вопросов с таблицей ответов (0 - отключить)
+    QUESTION_RECONCILE_INTERVAL_SECONDS = int(os.getenv('QUESTION_RECONCILE_INTERVAL_SECONDS', 3600))
+
+    # Sitemap: индекс и дочерние файлы строятся заранее и отдаются как статика
+    SITEMAP_DIR = os.getenv('SITEMAP_DIR', os.path.join(os.path.dirname(__file__), 'sitemaps'))
+    SITEMAP_BASE_URL = os.getenv('SITEMAP_BASE_URL', 'https://docscan-ai.ru')
+    SITEMAP_SHARD_SIZE = int(os.getenv('SITEMAP_SHARD_SIZE', 5000))  # id вопросов на файл (лимит протокола - 50000 URL)
+    SITEMAP_CHECK_SECONDS = int(os.getenv('SITEMAP_CHECK_SECONDS', 60))  # Как часто проверять изменения контента
+
+    # Отложенная запись визитов гостей/ботов и просмотров страниц
+    VISIT_BUFFER_FLUSH_SECONDS = float(os.getenv('VISIT_BUFFER_FLUSH_SECONDS', 5))  # 0 - писать в БД сразу в запросе
+    VISIT_BUFFER_MAX_PENDING = int(os.getenv('VISIT_BUFFER_MAX_PENDING', 500))  # Досрочный сброс при таком числе записей
+
+    # Кеш проверенных API-ключей (/api/v1) и пакетная запись их использования
+    API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', 30))  # Секунды
+    API_KEY_CACHE_MAX_ENTRIES = int(os.getenv('API_KEY_CACHE_MAX_ENTRIES', 5000))
+    API_KEY_USAGE_FLUSH_SECONDS = float(os.getenv('API_KEY_USAGE_FLUSH_SECONDS', 10))  # 0 - писать requests_count/last_used сразу
+    API_KEY_USAGE_MAX_PENDING = int(os.getenv('API_KEY_USAGE_MAX_PENDING', 1000))  # Досрочный сброс при таком числе ключей
     
     # YooMoney
     YOOMONEY_CLIENT_ID = os.getenv('YOOMONEY_CLIENT_ID')
@@ -21,11 +87,93 @@ class Config:
     # Пути к файлам
     USER_DB_FILE = '/var/www/data/docscan_users.json'
     IP_LIMITS_FILE = '/var/www/data/docscan_ip_limits.json'
+
+    # Счетчики бесплатных анализов по IP, общие для всех воркеров
+    IP_LIMIT_BACKEND = os.getenv('IP_LIMIT_BACKEND', 'sqlite')  # sqlite | shm (общая память, один хост)
+    IP_LIMIT_DB_PATH = os.getenv('IP_LIMIT_DB_PATH', os.path.join(os.path.dirname(__file__), 'ip_limits.db'))
+    IP_LIMIT_RETENTION_DAYS = int(os.getenv('IP_LIMIT_RETENTION_DAYS', 2))
+    IP_LIMIT_SHM_PATH = os.getenv('IP_LIMIT_SHM_PATH', '/dev/shm/docscan_ip_limits.bin')
+    IP_LIMIT_SHM_SLOTS = int(os.getenv('IP_LIMIT_SHM_SLOTS', 65536))
     
     # НОВЫЕ НАСТРОЙКИ ДЛЯ SQLite
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(os.path.dirname(__file__), 'docscan.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Кеш результатов анализа YandexGPT (отдельная SQLite-база)
+    ANALYSIS_CACHE_ENABLED = os.getenv('ANALYSIS_CACHE_ENABLED', 'True').lower() == 'true'
+    ANALYSIS_CACHE_PATH = os.getenv('ANALYSIS_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'analysis_cache.db'))
+    ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', 7 * 24 * 3600))  # 7 дней
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 5000))
+    ANALYSIS_CACHE_MAX_BYTES = int(os.getenv('ANALYSIS_CACHE_MAX_BYTES', 200 * 1024 * 1024))  # 200 МБ
+
+    # Кеш извлеченного текста (ключ - SHA-256 файла, отдельная SQLite-база)
+    TEXT_CACHE_ENABLED = os.getenv('TEXT_CACHE_ENABLED', 'True').lower() == 'true'
+    TEXT_CACHE_PATH = os.getenv('TEXT_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'text_cache.db'))
+    TEXT_CACHE_TTL = int(os.getenv('TEXT_CACHE_TTL', 30 * 24 * 3600))  # 30 дней
+    TEXT_CACHE_MAX_ENTRIES = int(os.getenv('TEXT_CACHE_MAX_ENTRIES', 2000))
+    TEXT_CACHE_MAX_BYTES = int(os.getenv('TEXT_CACHE_MAX_BYTES', 500 * 1024 * 1024))  # 500 МБ (текст хранится сжатым)
+
+    # Рендеринг PDF-отчетов: пул процессов и кеш готовых PDF (отдельная SQLite-база)
+    PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', 2))  # 0 - рендерить в текущем процессе
+    PDF_RENDER_TIMEOUT_SECONDS = int(os.getenv('PDF_RENDER_TIMEOUT_SECONDS', 120))
+    PDF_RENDER_CACHE_ENABLED = os.getenv('PDF_RENDER_CACHE_ENABLED', 'True').lower() == 'true'
+    PDF_RENDER_CACHE_PATH = os.getenv('PDF_RENDER_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'pdf_render_cache.db'))
+    PDF_RENDER_CACHE_TTL = int(os.getenv('PDF_RENDER_CACHE_TTL', 24 * 3600))  # Сутки (в отчете печатается дата)
+    PDF_RENDER_CACHE_MAX_ENTRIES = int(os.getenv('PDF_RENDER_CACHE_MAX_ENTRIES', 2000))
+    PDF_RENDER_CACHE_MAX_BYTES = int(os.getenv('PDF_RENDER_CACHE_MAX_BYTES', 300 * 1024 * 1024))  # 300 МБ
+
+    # Пакетная обработка: параллельность
+    BATCH_TASK_WORKERS = int(os.getenv('BATCH_TASK_WORKERS', 4))  # Потоков на одну задачу
+    BATCH_PER_USER_CONCURRENCY = int(os.getenv('BATCH_PER_USER_CONCURRENCY', 4))  # Файлов одновременно на пользователя
+    BATCH_GLOBAL_CONCURRENCY = int(os.getenv('BATCH_GLOBAL_CONCURRENCY', 8))  # Файлов одновременно на процесс
+
+    # Очередь фоновых задач (таблица background_jobs)
+    JOB_QUEUE_EMBEDDED_WORKERS = int(os.getenv('JOB_QUEUE_EMBEDDED_WORKERS', 2))  # Воркеров внутри веб-процесса (0 - только job_worker.py); второй - чтобы анализ не ждал пакетную задачу
+    JOB_QUEUE_LEADER_LOCK = os.getenv('JOB_QUEUE_LEADER_LOCK', os.path.join(os.path.dirname(__file__), 'job_queue.lock'))  # Один процесс на хост запускает воркеры и восстановление
+    JOB_QUEUE_LEASE_SECONDS = int(os.getenv('JOB_QUEUE_LEASE_SECONDS', 60))  # Аренда задачи, продлевается heartbeat-ом
+    JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv('JOB_QUEUE_MAX_ATTEMPTS', 3))
+    JOB_QUEUE_RETRY_BASE_SECONDS = int(os.getenv('JOB_QUEUE_RETRY_BASE_SECONDS', 30))
+    JOB_QUEUE_RETRY_MAX_SECONDS = int(os.getenv('JOB_QUEUE_RETRY_MAX_SECONDS', 900))
+    JOB_QUEUE_POLL_SECONDS = int(os.getenv('JOB_QUEUE_POLL_SECONDS', 2))
+    JOB_QUEUE_RECOVERY_GRACE_SECONDS = int(os.getenv('JOB_QUEUE_RECOVERY_GRACE_SECONDS', 600))  # Моложе - запись еще создается, не восстанавливаем
+
+    # Сравнение документов
+    COMPARISON_DIFF_TIME_BUDGET = float(os.getenv('COMPARISON_DIFF_TIME_BUDGET', 10))  # Секунды на diff; дальше участки - замена целиком
+    COMPARISON_REVIEW_CHUNK_CHARS = int(os.getenv('COMPARISON_REVIEW_CHUNK_CHARS', 12000))  # Размер части изменений для YandexGPT
+    COMPARISON_REVIEW_ITEM_CHARS = int(os.getenv('COMPARISON_REVIEW_ITEM_CHARS', 1500))  # Длинные пункты обрезаются
+    COMPARISON_REVIEW_MAX_CHUNKS = int(os.getenv('COMPARISON_REVIEW_MAX_CHUNKS', 30))
+    COMPARISON_REVIEW_WORKERS = int(os.getenv('COMPARISON_REVIEW_WORKERS', 4))  # Частей параллельно
+    COMPARISON_REVIEW_CONTEXT_CHARS = int(os.getenv('COMPARISON_REVIEW_CONTEXT_CHARS', 1500))  # Начало документа для контекста
+
+    # Отправка email: пул SMTP-соединений, лимит скорости, рассылки
+    SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+    SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+    SMTP_USER = os.getenv('SMTP_USER')
+    SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+    FROM_EMAIL = os.getenv('FROM_EMAIL', SMTP_USER or 'noreply@docscan-ai.ru')
+    SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'True').lower() == 'true'  # STARTTLS
+    SMTP_TIMEOUT = int(os.getenv('SMTP_TIMEOUT', 30))
+    SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 3))  # Одновременных соединений на процесс
+    SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
+    SMTP_POOL_IDLE_SECONDS = int(os.getenv('SMTP_POOL_IDLE_SECONDS', 60))  # После простоя соединение проверяется NOOP
+    SMTP_RATE_PER_SECOND = float(os.getenv('SMTP_RATE_PER_SECOND', 10))  # Общий лимит писем в секунду (0 - без лимита)
+    SMTP_MAX_ATTEMPTS = int(os.getenv('SMTP_MAX_ATTEMPTS', 3))  # Попыток при временных ошибках (4xx, обрыв)
+    SMTP_RETRY_BACKOFF_SECONDS = float(os.getenv('SMTP_RETRY_BACKOFF_SECONDS', 2))
+    EMAIL_CAMPAIGN_WORKERS = int(os.getenv('EMAIL_CAMPAIGN_WORKERS', 3))  # Параллельных отправителей рассылки
+    # Транзакционные письма (подтверждение email, сброс пароля) - свой пул без лимита скорости рассылок
+    SMTP_TRANSACTIONAL_POOL_SIZE = int(os.getenv('SMTP_TRANSACTIONAL_POOL_SIZE', 2))
+    SMTP_TRANSACTIONAL_MAX_ATTEMPTS = int(os.getenv('SMTP_TRANSACTIONAL_MAX_ATTEMPTS', 2))  # Письмо отправляется в веб-запросе - повторов мало
+    SMTP_TRANSACTIONAL_RETRY_BACKOFF_SECONDS = float(os.getenv('SMTP_TRANSACTIONAL_RETRY_BACKOFF_SECONDS', 0.5))
+    EMAIL_CHECKPOINT_SIZE = int(os.getenv('EMAIL_CHECKPOINT_SIZE', 100))  # Результатов на одну запись в email_sends
+    EMAIL_RECIPIENT_CHUNK_SIZE = int(os.getenv('EMAIL_RECIPIENT_CHUNK_SIZE', 500))  # Получателей на одну выборку/вставку
+
+    # Резервное копирование БД (SQLite backup API)
+    BACKUP_STEP_PAGES = int(os.getenv('BACKUP_STEP_PAGES', 1024))  # Страниц за шаг; между шагами база доступна писателям
+    BACKUP_STEP_SLEEP_MS = int(os.getenv('BACKUP_STEP_SLEEP_MS', 20))  # Пауза между шагами
+    BACKUP_MAX_RESTARTS = int(os.getenv('BACKUP_MAX_RESTARTS', 3))  # Затем снимок одним шагом (в WAL запись не блокируется)
+    BACKUP_MEMORY_LIMIT_MB = int(os.getenv('BACKUP_MEMORY_LIMIT_MB', 256))  # База больше - снимок во временный файл, а не в память
+    BACKUP_COMPRESS_LEVEL = int(os.getenv('BACKUP_COMPRESS_LEVEL', 6))  # Уровень gzip
+
 # Умная система анализа документов
 SMART_ANALYSIS_CONFIG = {
     'business_plan': {
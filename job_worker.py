@@ -0,0 +1,97 @@
+"""
+Отдельный процесс-воркер очереди фоновых задач DocScan AI
+Использование:
+    python job_worker.py                # Один процесс, один воркер
+    python job_worker.py --processes 4  # Несколько процессов-воркеров
+    python job_worker.py --stats        # Показать количество задач по статусам
+
+Воркер берет блокировку ведущего процесса очереди (JOB_QUEUE_LEADER_LOCK):
+веб-процессы, запущенные после него, встроенных воркеров не поднимают. Чтобы
+задачи выполнял только этот скрипт независимо от порядка запуска, веб-процессы
+можно запускать с JOB_QUEUE_EMBEDDED_WORKERS=0.
+"""
+import os
+import sys
+import signal
+import logging
+import multiprocessing
+
+# Встроенные воркеры внутри этого процесса не нужны - он сам воркер
+os.environ['JOB_QUEUE_EMBEDDED_WORKERS'] = '0'
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(processName)s | %(levelname)s | %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def run_worker():
+    """Запуск цикла воркера в текущем процессе"""
+    from app import app
+    from utils.job_queue import JobQueue, JobWorker, acquire_queue_leadership
+
+    # Восстановление зависших задач - только в одном процессе на хост
+    if acquire_queue_leadership():
+        with app.app_context():
+            JobQueue.recover_stale_jobs()
+
+    worker = JobWorker(app)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+def show_stats():
+    from app import app
+    from utils.job_queue import JobQueue
+
+    with app.app_context():
+        stats = JobQueue.get_stats()
+    if not stats:
+        print("Очередь пуста")
+        return
+    for status, count in sorted(stats.items()):
+        print(f"{status}: {count}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Воркер очереди фоновых задач DocScan AI')
+    parser.add_argument('--processes', type=int, default=1, help='Количество процессов-воркеров')
+    parser.add_argument('--stats', action='store_true', help='Показать статистику очереди')
+
+    args = parser.parse_args()
+
+    if args.stats:
+        show_stats()
+        return
+
+    if args.processes <= 1:
+        run_worker()
+        return
+
+    processes = []
+    for i in range(args.processes):
+        process = multiprocessing.Process(target=run_worker, name=f'job-worker-{i}')
+        process.start()
+        processes.append(process)
+    logger.info(f"🚀 Запущено процессов-воркеров: {len(processes)}")
+
+    def stop_all(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop_all)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop_all(None, None)
+        for process in processes:
+            process.join()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
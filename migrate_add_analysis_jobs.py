@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: добавление таблицы analysis_jobs (асинхронные анализы документов)
+"""
+
+import sqlite3
+import os
+
+def migrate():
+    db_path = os.path.join(os.path.dirname(__file__), 'docscan.db')
+
+    if not os.path.exists(db_path):
+        print(f"❌ База данных не найдена: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        # Проверяем, существует ли таблица
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name='analysis_jobs'
+        """)
+
+        if cursor.fetchone():
+            print("OK: Table analysis_jobs already exists")
+            return
+
+        # Создаем таблицу
+        cursor.execute("""
+            CREATE TABLE analysis_jobs (
+                id VARCHAR(36) PRIMARY KEY,
+                user_id VARCHAR(8),
+                ip_address VARCHAR(45),
+                filename VARCHAR(255) NOT NULL,
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                stage VARCHAR(30) NOT NULL DEFAULT 'queued',
+                progress INTEGER DEFAULT 0,
+                events_json TEXT,
+                result_json TEXT,
+                error_message TEXT,
+                created_at VARCHAR(30) NOT NULL,
+                updated_at VARCHAR(30) NOT NULL,
+                completed_at VARCHAR(30)
+            )
+        """)
+
+        # Создаем индексы
+        cursor.execute("CREATE INDEX ix_analysis_jobs_user_id ON analysis_jobs(user_id)")
+
+        conn.commit()
+        print("OK: Table analysis_jobs created successfully")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: Migration error: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
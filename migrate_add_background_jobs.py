@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: добавление таблицы background_jobs (очередь фоновых задач)
+"""
+
+import sqlite3
+import os
+
+def migrate():
+    db_path = os.path.join(os.path.dirname(__file__), 'docscan.db')
+
+    if not os.path.exists(db_path):
+        print(f"❌ База данных не найдена: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        # Проверяем, существует ли таблица
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name='background_jobs'
+        """)
+
+        if cursor.fetchone():
+            print("OK: Table background_jobs already exists")
+            return
+
+        # Создаем таблицу
+        cursor.execute("""
+            CREATE TABLE background_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_type VARCHAR(50) NOT NULL,
+                payload_json TEXT,
+                dedupe_key VARCHAR(100),
+                status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                priority INTEGER DEFAULT 100,
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 3,
+                run_after VARCHAR(30) NOT NULL,
+                lease_owner VARCHAR(100),
+                lease_token VARCHAR(36),
+                lease_expires_at VARCHAR(30),
+                heartbeat_at VARCHAR(30),
+                last_error TEXT,
+                created_at VARCHAR(30) NOT NULL,
+                started_at VARCHAR(30),
+                completed_at VARCHAR(30)
+            )
+        """)
+
+        # Создаем индексы
+        cursor.execute("CREATE INDEX ix_background_jobs_dedupe_key ON background_jobs(dedupe_key)")
+        cursor.execute("CREATE INDEX idx_background_jobs_status_run_after ON background_jobs(status, run_after)")
+
+        # WAL позволяет воркерам и веб-процессам писать/читать без взаимных блокировок чтения
+        cursor.execute("PRAGMA journal_mode=WAL")
+
+        conn.commit()
+        print("OK: Table background_jobs created successfully")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: Migration error: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: этап и процент выполнения сравнения документов
+(document_comparisons.stage, document_comparisons.progress)
+"""
+
+import sqlite3
+import os
+
+COLUMNS = [
+    ('stage', 'VARCHAR(20)'),
+    ('progress', 'INTEGER DEFAULT 0'),
+]
+
+def migrate():
+    db_path = os.path.join(os.path.dirname(__file__), 'docscan.db')
+
+    if not os.path.exists(db_path):
+        print(f"❌ База данных не найдена: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='document_comparisons'")
+        if not cursor.fetchone():
+            print("SKIP: Table document_comparisons not found")
+            return
+
+        cursor.execute("PRAGMA table_info(document_comparisons)")
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, column_type in COLUMNS:
+            if name in existing:
+                print(f"OK: Column {name} already exists")
+                continue
+            cursor.execute(f"ALTER TABLE document_comparisons ADD COLUMN {name} {column_type}")
+            print(f"OK: Column {name} added")
+        conn.commit()
+
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: Migration error: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
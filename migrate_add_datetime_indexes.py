@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: индексы по датам для запросов по диапазону времени
+
+Даты хранятся ISO-строками (SQLite не имеет отдельного типа datetime), и
+запросы "за сегодня" / "за месяц" идут условиями >= / < по индексам
+(user_id, created_at), (status, created_at) и т.п. Перед созданием индексов
+значения вида 'YYYY-MM-DD HH:MM:SS' приводятся к 'YYYY-MM-DDTHH:MM:SS',
+чтобы строковый порядок совпадал с хронологическим. Обновление идет
+небольшими пачками с коммитом после каждой - база остается доступной
+для работающего приложения.
+"""
+
+import sqlite3
+import os
+import time
+
+BATCH_SIZE = 5000
+
+# Колонки с датами, которые приводим к единому ISO-формату
+DATETIME_COLUMNS = [
+    ('users', 'created_at'),
+    ('analysis_history', 'created_at'),
+    ('guests', 'first_seen'),
+    ('guests', 'last_seen'),
+    ('page_views', 'created_at'),
+    ('search_bots', 'first_seen'),
+    ('search_bots', 'last_seen'),
+    ('notifications', 'created_at'),
+    ('payments', 'created_at'),
+    ('batch_processing_tasks', 'created_at'),
+    ('document_comparisons', 'created_at'),
+    ('chat_messages', 'created_at'),
+]
+
+INDEXES = [
+    ('idx_users_created_at', 'users', 'created_at'),
+    ('idx_analysis_history_user_created', 'analysis_history', 'user_id, created_at'),
+    ('idx_analysis_history_created_at', 'analysis_history', 'created_at'),
+    ('idx_guests_first_seen', 'guests', 'first_seen'),
+    ('idx_guests_last_seen', 'guests', 'last_seen'),
+    ('idx_page_views_path_created', 'page_views', 'path, created_at'),
+    ('idx_search_bots_first_seen', 'search_bots', 'first_seen'),
+    ('idx_search_bots_last_seen', 'search_bots', 'last_seen'),
+    ('idx_notifications_user_created', 'notifications', 'user_id, created_at'),
+    ('idx_payments_status_created', 'payments', 'status, created_at'),
+    ('idx_payments_user_created', 'payments', 'user_id, created_at'),
+    ('idx_batch_tasks_user_created', 'batch_processing_tasks', 'user_id, created_at'),
+    ('idx_document_comparisons_user_created', 'document_comparisons', 'user_id, created_at'),
+    ('idx_chat_messages_user_created', 'chat_messages', 'user_id, created_at'),
+]
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cursor.fetchone() is not None
+
+def normalize_column(conn, table, column):
+    """Заменяет пробел между датой и временем на 'T' пачками по BATCH_SIZE строк"""
+    total = 0
+    while True:
+        cursor = conn.execute(f"""
+            UPDATE {table} SET {column} = replace({column}, ' ', 'T')
+            WHERE rowid IN (
+                SELECT rowid FROM {table}
+                WHERE {column} LIKE '____-__-__ %'
+                LIMIT {BATCH_SIZE}
+            )
+        """)
+        conn.commit()
+        total += cursor.rowcount
+        if cursor.rowcount < BATCH_SIZE:
+            return total
+        # Даем приложению взять блокировку на запись между пачками
+        time.sleep(0.05)
+
+def migrate():
+    db_path = os.path.join(os.path.dirname(__file__), 'docscan.db')
+
+    if not os.path.exists(db_path):
+        print(f"❌ База данных не найдена: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    cursor = conn.cursor()
+
+    try:
+        for table, column in DATETIME_COLUMNS:
+            if not table_exists(cursor, table):
+                print(f"SKIP: Table {table} not found")
+                continue
+            updated = normalize_column(conn, table, column)
+            if updated:
+                print(f"OK: {table}.{column}: normalized {updated} values")
+
+        for index_name, table, columns in INDEXES:
+            if not table_exists(cursor, table):
+                continue
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+            conn.commit()
+            print(f"OK: Index {index_name} on {table} ({columns})")
+
+        # Обновляем статистику планировщика, чтобы новые индексы использовались
+        cursor.execute("ANALYZE")
+        conn.commit()
+        print("OK: Datetime indexes created successfully")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: Migration error: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
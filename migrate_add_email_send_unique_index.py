@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: уникальный индекс email_sends(campaign_id, email)
+
+Рассылка заводит pending-записи через INSERT ... ON CONFLICT DO NOTHING,
+для этого нужна уникальность адреса в рассылке. Дубли, оставшиеся от
+старой отправки (один адрес дважды в ручном списке), удаляются - остается
+самая ранняя запись.
+"""
+
+import sqlite3
+import os
+
+def migrate():
+    db_path = os.path.join(os.path.dirname(__file__), 'docscan.db')
+
+    if not os.path.exists(db_path):
+        print(f"❌ База данных не найдена: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='email_sends'")
+        if not cursor.fetchone():
+            print("SKIP: Table email_sends not found")
+            return
+
+        cursor.execute("""
+            DELETE FROM email_sends
+            WHERE id NOT IN (SELECT MIN(id) FROM email_sends GROUP BY campaign_id, email)
+        """)
+        print(f"OK: Removed {cursor.rowcount} duplicate email_sends rows")
+
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_email_sends_campaign_email ON email_sends (campaign_id, email)")
+        conn.commit()
+        print("OK: Index uq_email_sends_campaign_email on email_sends (campaign_id, email)")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: Migration error: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: индексы для списка вопросов (keyset-пагинация) и ответов по вопросу,
+плюс однократная сверка answers_count/статусов с таблицей ответов
+"""
+
+import sqlite3
+import os
+from datetime import datetime
+
+INDEXES = [
+    ('idx_questions_created', 'questions', 'created_at, id'),
+    ('idx_questions_popular', 'questions', 'views_count, answers_count, id'),
+    ('idx_questions_unanswered', 'questions', 'answers_count, created_at, id'),
+    ('idx_questions_category_created', 'questions', 'category, created_at, id'),
+    ('idx_questions_status_created', 'questions', 'status, created_at, id'),
+    ('ix_answers_question_id', 'answers', 'question_id'),
+]
+
+def migrate():
+    db_path = os.path.join(os.path.dirname(__file__), 'docscan.db')
+
+    if not os.path.exists(db_path):
+        print(f"❌ База данных не найдена: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN ('questions', 'answers')")
+        if len(cursor.fetchall()) < 2:
+            print("SKIP: Tables questions/answers not found")
+            return
+
+        for index_name, table, columns in INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+            print(f"OK: Index {index_name} on {table} ({columns})")
+        conn.commit()
+
+        # Сверяем счетчики, которые раньше исправлялись при каждом чтении списка
+        real_count = "(SELECT COUNT(*) FROM answers a WHERE a.question_id = questions.id)"
+        cursor.execute(f"""
+            UPDATE questions SET
+                answers_count = {real_count},
+                status = CASE
+                    WHEN status = 'answered' AND {real_count} = 0 THEN 'open'
+                    WHEN status = 'open' AND {real_count} > 0 THEN 'answered'
+                    ELSE status
+                END,
+                updated_at = ?
+            WHERE COALESCE(answers_count, 0) != {real_count}
+               OR (status = 'answered' AND {real_count} = 0)
+               OR (status = 'open' AND {real_count} > 0)
+        """, (datetime.now().isoformat(),))
+        print(f"OK: Reconciled {cursor.rowcount} questions")
+
+        cursor.execute("ANALYZE")
+        conn.commit()
+        print("OK: Question indexes created successfully")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: Migration error: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
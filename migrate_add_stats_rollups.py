@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: добавление таблицы stats_rollups (предагрегированные метрики админ-панели)
+"""
+
+import sqlite3
+import os
+
+def migrate():
+    db_path = os.path.join(os.path.dirname(__file__), 'docscan.db')
+
+    if not os.path.exists(db_path):
+        print(f"❌ База данных не найдена: {db_path}")
+        return
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        # Проверяем, существует ли таблица
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name='stats_rollups'
+        """)
+
+        if cursor.fetchone():
+            print("OK: Table stats_rollups already exists")
+            return
+
+        # Создаем таблицу
+        cursor.execute("""
+            CREATE TABLE stats_rollups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                granularity VARCHAR(10) NOT NULL,
+                bucket VARCHAR(13) NOT NULL,
+                metric VARCHAR(50) NOT NULL,
+                value FLOAT NOT NULL DEFAULT 0,
+                updated_at VARCHAR(30) NOT NULL,
+                CONSTRAINT uq_stats_rollups_bucket_metric UNIQUE (granularity, bucket, metric)
+            )
+        """)
+
+        conn.commit()
+        print("OK: Table stats_rollups created successfully")
+        print("   Rollups are filled on the first /admin/stats request (or by the background compactor)")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"ERROR: Migration error: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Миграция: перенос сегодняшних счетчиков из docscan_ip_limits.json
+в хранилище IP-лимитов (Config.IP_LIMIT_BACKEND)
+
+Счетчики прошлых дней не переносятся - они уже не влияют на лимиты.
+После переноса файл переименовывается в docscan_ip_limits.json.migrated.
+"""
+
+import os
+import json
+from datetime import date
+
+LEGACY_FILE = os.path.join(os.path.dirname(__file__), 'docscan_ip_limits.json')
+
+def migrate():
+    if not os.path.exists(LEGACY_FILE):
+        print(f"SKIP: {LEGACY_FILE} not found")
+        return
+
+    from services.ip_limit_store import get_ip_limit_store
+
+    try:
+        with open(LEGACY_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        store = get_ip_limit_store()
+        today = date.today().isoformat()
+        imported = 0
+        for ip, ip_data in data.items():
+            if ip_data.get('last_reset') != today:
+                continue
+            # Счетчик уже мог начать расти в новом хранилище - добираем только разницу
+            missing = ip_data.get('used_today', 0) - store.get(ip, today)
+            for _ in range(max(missing, 0)):
+                store.increment(ip, today, ip_data.get('last_user'))
+            imported += 1
+
+        os.rename(LEGACY_FILE, LEGACY_FILE + '.migrated')
+        print(f"OK: Imported {imported} IP counters for {today} into {type(store).__name__}")
+
+    except Exception as e:
+        print(f"ERROR: Migration error: {e}")
+        raise
+
+if __name__ == '__main__':
+    migrate()
@@ -1,45 +1,33 @@
-import json
-import os
-from datetime import datetime, date
+from datetime import date
 from config import Config
+from services.ip_limit_store import get_ip_limit_store
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Бесплатных анализов в день с одного IP
+GUEST_DAILY_LIMIT = 1
+
+# Локальные IP не ограничиваем (тестирование)
+LOCAL_IPS = ('127.0.0.1', 'localhost')
+
 class IPLimitManager:
-    def __init__(self):
-        self.ip_limits = self.load_ip_limits()
-        logger.info(f"🌐 Менеджер IP-лимитов загружен: {len(self.ip_limits)} IP-адресов")
+    def __init__(self, store=None):
+        # Счетчики хранятся вне процесса - все воркеры видят одни и те же лимиты
+        self.store = store or get_ip_limit_store()
+        logger.info(f"🌐 Менеджер IP-лимитов загружен ({type(self.store).__name__})")
 
-    def load_ip_limits(self):
-        """Загружает лимиты по IP из файла"""
-        try:
-            if os.path.exists("docscan_ip_limits.json"):
-                with open("docscan_ip_limits.json", 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    # Очищаем старые записи (старше 1 дня)
-                    today = date.today().isoformat()
-                    clean_data = {}
-                    for ip, ip_data in data.items():
-                        if ip_data.get('last_reset', today) >= today:
-                            clean_data[ip] = ip_data
-                    
-                    logger.info(f"✅ Загружено {len(clean_data)} IP-адресов")
-                    return clean_data
-        except Exception as e:
-            logger.error(f"❌ Ошибка загрузки IP-лимитов: {e}")
-        
-        return {}
+    def get_used_today(self, real_ip):
+        """Сколько бесплатных анализов IP использовал сегодня"""
+        return self.store.get(real_ip, date.today().isoformat())
 
-    def save_ip_limits(self):
-        """Сохраняет лимиты по IP в файл"""
-        try:
-            with open("docscan_ip_limits.json", 'w') as f:
-                json.dump(self.ip_limits, f, ensure_ascii=False, indent=2)
-            logger.info("💾 IP-лимиты сохранены")
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения IP-лимитов: {e}")
+    def rollback_ip_usage(self, real_ip):
+        """Откатывает одно использование IP за сегодня"""
+        self.store.decrement(real_ip, date.today().isoformat())
+
+    def get_last_ips(self, user_ids):
+        """Последние IP пользователей по записям лимитов: {user_id: ip}"""
+        return self.store.last_ips_by_user(list(user_ids))
 
     def get_client_ip(self, request):
         """Получаем реальный IP клиента - ВАЖНО: консистентный порядок проверки"""
@@ -72,39 +60,26 @@ class IPLimitManager:
         logger.info(f"🔍 IP клиента: {real_ip}")
         
         # Исключаем локальные IP для тестирования
-        if real_ip in ['127.0.0.1', 'localhost']:
+        if real_ip in LOCAL_IPS:
             logger.info("✅ Локальный IP - пропускаем проверку")
             return True
             
-        if real_ip not in self.ip_limits:
-            self.ip_limits[real_ip] = {
-                'used_today': 0,
-                'last_reset': date.today().isoformat(),
-                'first_seen': datetime.now().isoformat()
-            }
-            logger.info(f"➕ Новый IP добавлен: {real_ip}")
-        
-        ip_data = self.ip_limits[real_ip]
-        
-        # Сбрасываем лимит если новый день
-        if ip_data['last_reset'] < date.today().isoformat():
-            ip_data['used_today'] = 0
-            ip_data['last_reset'] = date.today().isoformat()
-            logger.info(f"🔄 Сброшен лимит для IP {real_ip}")
+        used_today = self.get_used_today(real_ip)
         
         # МАКСИМУМ 1 БЕСПЛАТНЫЙ АНАЛИЗ В ДЕНЬ С ОДНОГО IP
-        can_analyze = ip_data['used_today'] < 1
+        can_analyze = used_today < GUEST_DAILY_LIMIT
         
         if can_analyze:
-            logger.info(f"📡 IP {real_ip} может сделать анализ ({ip_data['used_today']}/1)")
+            logger.info(f"📡 IP {real_ip} может сделать анализ ({used_today}/{GUEST_DAILY_LIMIT})")
         else:
-            logger.info(f"🚫 IP {real_ip} уже использовал бесплатный анализ сегодня ({ip_data['used_today']}/1)")
+            logger.info(f"🚫 IP {real_ip} уже использовал бесплатный анализ сегодня ({used_today}/{GUEST_DAILY_LIMIT})")
         
         # СОЗДАЕМ/ОБНОВЛЯЕМ ЗАПИСЬ ГОСТЯ В БД при каждом визите (только для реальных пользователей, не ботов)
         if user_manager:
             try:
                 user_agent = request.headers.get('User-Agent', 'Не определен')
                 from utils.bot_detector import is_search_bot, should_block_request
+                from services.visit_buffer import get_visit_buffer
                 
                 # Проверяем на вредоносных ботов - не создаем запись
                 if should_block_request(user_agent):
@@ -116,41 +91,31 @@ class IPLimitManager:
                 if is_bot:
                     from utils.bot_detector import get_bot_type
                     bot_display_type = get_bot_type(user_agent)
-                    user_manager.get_or_create_search_bot(real_ip, user_agent, bot_type)
+                    get_visit_buffer().record_bot_visit(real_ip, user_agent, bot_type)
                     logger.info(f"🕷️ Поисковый бот записан: {bot_display_type} (IP={real_ip})")
                     return can_analyze
                 
-                # Если это реальный пользователь - создаем запись гостя
-                guest = user_manager.get_or_create_guest(real_ip, user_agent)
-                # Обновляем last_seen уже сделано в get_or_create_guest, но на всякий случай
-                guest.last_seen = datetime.now().isoformat()
-                from models.sqlite_users import db
-                db.session.commit()
+                # Если это реальный пользователь - создаем/обновляем запись гостя (при сбросе буфера)
+                get_visit_buffer().record_guest_visit(real_ip, user_agent)
             except Exception as e:
                 logger.error(f"❌ Ошибка создания/обновления гостя для IP {real_ip}: {e}")
         
         return can_analyze
 
     def record_ip_usage(self, request, user_id=None):
-        """Записывает использование для IP"""
+        """Записывает использование для IP
+
+        Инкремент атомарный, поэтому из двух одновременных запросов с одного IP
+        (в том числе в разных воркерах) лимит пройдет только один. Возвращает
+        False, если лимит уже исчерпан - использование при этом откатывается.
+        """
         real_ip = self.get_client_ip(request)
         
-        if real_ip not in self.ip_limits:
-            self.ip_limits[real_ip] = {
-                'used_today': 0,
-                'last_reset': date.today().isoformat(),
-                'first_seen': datetime.now().isoformat(),
-                'last_user': user_id
-            }
-        
-        # Сбрасываем лимит IP если новый день
-        if self.ip_limits[real_ip]['last_reset'] < date.today().isoformat():
-            self.ip_limits[real_ip]['used_today'] = 0
-            self.ip_limits[real_ip]['last_reset'] = date.today().isoformat()
-        
-        # Обновляем последнего пользователя для этого IP
-        self.ip_limits[real_ip]['last_user'] = user_id
+        used_today = self.store.increment(real_ip, date.today().isoformat(), user_id)
+        logger.info(f"📡 Записано использование для IP {real_ip}: {used_today}/{GUEST_DAILY_LIMIT} (user: {user_id})")
         
-        self.ip_limits[real_ip]['used_today'] += 1
-        self.save_ip_limits()
-        logger.info(f"📡 Записано использование для IP {real_ip}: {self.ip_limits[real_ip]['used_today']}/1 (user: {user_id})")
\ No newline at end of file
+        if used_today > GUEST_DAILY_LIMIT and real_ip not in LOCAL_IPS:
+            self.rollback_ip_usage(real_ip)
+            logger.info(f"🚫 IP {real_ip} превысил лимит в параллельном запросе - использование откатано")
+            return False
+        return True
@@ -40,6 +40,8 @@ class User(db.Model):
     referrer_id = db.Column(db.String(8), db.ForeignKey('users.user_id'), nullable=True)  # Кто пригласил этого пользователя
     payment_details = db.Column(db.Text, nullable=True)  # Реквизиты для получения выплат (JSON)
 
+    __table_args__ = (db.Index('idx_users_created_at', 'created_at'),)
+
     def to_dict(self):
         return {
             'user_id': self.user_id,
@@ -75,7 +77,12 @@ class AnalysisHistory(db.Model):
     risk_level = db.Column(db.String(20), nullable=True)
     created_at = db.Column(db.String(30), nullable=False)
     analysis_summary = db.Column(db.Text, nullable=True)  # Краткое резюме для отображения
-    
+
+    __table_args__ = (
+        db.Index('idx_analysis_history_user_created', 'user_id', 'created_at'),
+        db.Index('idx_analysis_history_created_at', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -101,7 +108,12 @@ class Guest(db.Model):
     calculator_uses = db.Column(db.Integer, default=0)
     registration_prompted = db.Column(db.Boolean, default=False)
     registered_user_id = db.Column(db.String(8), db.ForeignKey('users.user_id'), nullable=True)
-    
+
+    __table_args__ = (
+        db.Index('idx_guests_first_seen', 'first_seen'),
+        db.Index('idx_guests_last_seen', 'last_seen'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -126,6 +138,8 @@ class PageView(db.Model):
     user_agent = db.Column(db.String(500), nullable=True)
     created_at = db.Column(db.String(30), nullable=False, index=True)  # ISO datetime
 
+    __table_args__ = (db.Index('idx_page_views_path_created', 'path', 'created_at'),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -148,7 +162,12 @@ class SearchBot(db.Model):
     first_seen = db.Column(db.String(30), nullable=False)
     last_seen = db.Column(db.String(30), nullable=False)
     visits_count = db.Column(db.Integer, default=0)
-    
+
+    __table_args__ = (
+        db.Index('idx_search_bots_first_seen', 'first_seen'),
+        db.Index('idx_search_bots_last_seen', 'last_seen'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -252,6 +271,15 @@ class Question(db.Model):
     created_at = db.Column(db.String(30), nullable=False)
     updated_at = db.Column(db.String(30), nullable=True)
     best_answer_id = db.Column(db.Integer, nullable=True)  # ID лучшего ответа
+
+    # Индексы под сортировки списка вопросов (id - для keyset-пагинации)
+    __table_args__ = (
+        db.Index('idx_questions_created', 'created_at', 'id'),
+        db.Index('idx_questions_popular', 'views_count', 'answers_count', 'id'),
+        db.Index('idx_questions_unanswered', 'answers_count', 'created_at', 'id'),
+        db.Index('idx_questions_category_created', 'category', 'created_at', 'id'),
+        db.Index('idx_questions_status_created', 'status', 'created_at', 'id'),
+    )
     
     def to_dict(self):
         # Подсчитываем реальное количество ответов
@@ -277,7 +305,7 @@ class Answer(db.Model):
     __tablename__ = 'answers'
     
     id = db.Column(db.Integer, primary_key=True)
-    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False, index=True)
     user_id = db.Column(db.String(8), db.ForeignKey('users.user_id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     is_best = db.Column(db.Boolean, default=False)
@@ -325,7 +353,9 @@ class Notification(db.Model):
     link = db.Column(db.String(500), nullable=True)
     is_read = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.String(30), nullable=False)
-    
+
+    __table_args__ = (db.Index('idx_notifications_user_created', 'user_id', 'created_at'),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -384,6 +414,9 @@ class EmailSend(db.Model):
     status = db.Column(db.String(20), default='pending')  # Статус: 'pending', 'sent', 'failed', 'bounced'
     sent_at = db.Column(db.String(30), nullable=True)
     error_message = db.Column(db.Text, nullable=True)  # Сообщение об ошибке, если была
+
+    # Одна запись на адрес в рассылке: на нем держится идемпотентность повторного запуска
+    __table_args__ = (db.Index('uq_email_sends_campaign_email', 'campaign_id', 'email', unique=True),)
     
     def to_dict(self):
         return {
@@ -453,7 +486,12 @@ class Payment(db.Model):
     label = db.Column(db.String(100), nullable=True)  # Метка платежа (user_id_plan)
     created_at = db.Column(db.String(30), nullable=False)  # Дата и время платежа
     raw_data = db.Column(db.Text, nullable=True)  # Сырые данные webhook (JSON)
-    
+
+    __table_args__ = (
+        db.Index('idx_payments_status_created', 'status', 'created_at'),
+        db.Index('idx_payments_user_created', 'user_id', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -707,7 +745,9 @@ class BatchProcessingTask(db.Model):
     started_at = db.Column(db.String(30), nullable=True)  # Дата начала обработки
     completed_at = db.Column(db.String(30), nullable=True)  # Дата завершения
     error_message = db.Column(db.Text, nullable=True)  # Сообщение об ошибке (если есть)
-    
+
+    __table_args__ = (db.Index('idx_batch_tasks_user_created', 'user_id', 'created_at'),)
+
     def to_dict(self):
         import json
         return {
@@ -784,12 +824,17 @@ class DocumentComparison(db.Model):
     
     # Статус обработки: 'pending', 'processing', 'completed', 'failed'
     status = db.Column(db.String(20), default='pending')
+    # Этап при 'processing': 'extracting', 'diffing', 'reviewing', 'report'
+    stage = db.Column(db.String(20), nullable=True)
+    progress = db.Column(db.Integer, default=0)  # 0-100
     error_message = db.Column(db.Text, nullable=True)  # Сообщение об ошибке
     
     # Метаданные
     created_at = db.Column(db.String(30), nullable=False)  # Дата создания
     completed_at = db.Column(db.String(30), nullable=True)  # Дата завершения
-    
+
+    __table_args__ = (db.Index('idx_document_comparisons_user_created', 'user_id', 'created_at'),)
+
     def to_dict(self):
         import json
         return {
@@ -798,6 +843,8 @@ class DocumentComparison(db.Model):
             'original_filename': self.original_filename,
             'modified_filename': self.modified_filename,
             'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress or 0,
             'comparison_result': json.loads(self.comparison_result_json) if self.comparison_result_json else None,
             'risk_analysis': json.loads(self.risk_analysis_json) if self.risk_analysis_json else None,
             'report_path': self.report_path,
@@ -806,6 +853,106 @@ class DocumentComparison(db.Model):
             'error_message': self.error_message
         }
 
+class BackgroundJob(db.Model):
+    """Таблица очереди фоновых задач (пакетная обработка, сравнения документов, бэкапы БД)"""
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)  # 'batch_task', 'document_comparison', 'db_backup'
+    payload_json = db.Column(db.Text, nullable=True)  # JSON с параметрами задачи
+    dedupe_key = db.Column(db.String(100), nullable=True, index=True)  # Ключ для защиты от дублей (например batch_task:12)
+
+    # Статус: 'queued', 'running', 'completed', 'failed'
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    priority = db.Column(db.Integer, default=100)  # Меньше - раньше
+    attempts = db.Column(db.Integer, default=0)  # Сколько раз задача бралась в работу
+    max_attempts = db.Column(db.Integer, default=3)
+    run_after = db.Column(db.String(30), nullable=False)  # Не запускать раньше (для повторов с задержкой)
+
+    # Аренда задачи воркером
+    lease_owner = db.Column(db.String(100), nullable=True)  # Идентификатор воркера (host:pid:thread)
+    lease_token = db.Column(db.String(36), nullable=True)  # Уникальный токен захвата
+    lease_expires_at = db.Column(db.String(30), nullable=True)  # Когда аренда истекает без heartbeat
+    heartbeat_at = db.Column(db.String(30), nullable=True)
+
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.String(30), nullable=False)
+    started_at = db.Column(db.String(30), nullable=True)
+    completed_at = db.Column(db.String(30), nullable=True)
+
+    __table_args__ = (db.Index('idx_background_jobs_status_run_after', 'status', 'run_after'),)
+
+    def to_dict(self):
+        import json
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'payload': json.loads(self.payload_json) if self.payload_json else {},
+            'dedupe_key': self.dedupe_key,
+            'status': self.status,
+            'priority': self.priority,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': self.run_after,
+            'lease_owner': self.lease_owner,
+            'lease_expires_at': self.lease_expires_at,
+            'heartbeat_at': self.heartbeat_at,
+            'last_error': self.last_error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'completed_at': self.completed_at
+        }
+
+class AnalysisJob(db.Model):
+    """Таблица асинхронных анализов документов (/api/analyze/async + опрос этапов)"""
+    __tablename__ = 'analysis_jobs'
+
+    id = db.Column(db.String(36), primary_key=True)  # UUID задачи
+    user_id = db.Column(db.String(8), nullable=True, index=True)  # Пользователь (None для гостей)
+    ip_address = db.Column(db.String(45), nullable=True)  # IP гостя - по нему проверяется доступ
+    filename = db.Column(db.String(255), nullable=False)
+
+    # Статус: 'queued', 'processing', 'completed', 'failed'
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    # Этап: 'queued', 'extracted', 'classified', 'analyzed', 'report_ready'
+    stage = db.Column(db.String(30), default='queued', nullable=False)
+    progress = db.Column(db.Integer, default=0)  # 0-100
+    events_json = db.Column(db.Text, nullable=True)  # JSON-список событий этапов для опроса
+    result_json = db.Column(db.Text, nullable=True)  # Итоговый ответ (как у /api/analyze)
+    error_message = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.String(30), nullable=False)
+    updated_at = db.Column(db.String(30), nullable=False)  # Обновляется на каждом этапе
+    completed_at = db.Column(db.String(30), nullable=True)
+
+    def to_dict(self):
+        import json
+        return {
+            'job_id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'error': self.error_message,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+            'completed_at': self.completed_at,
+            'result': json.loads(self.result_json) if self.result_json else None
+        }
+
+class StatsRollup(db.Model):
+    """Таблица предагрегированных метрик для /admin/stats (по дням, по часам и итоговые значения)"""
+    __tablename__ = 'stats_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # 'day', 'hour', 'total'
+    bucket = db.Column(db.String(13), nullable=False)  # 'YYYY-MM-DD', 'YYYY-MM-DDTHH' или '' для 'total'
+    metric = db.Column(db.String(50), nullable=False)  # 'new_users', 'revenue', 'page_views' и т.д.
+    value = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.String(30), nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('granularity', 'bucket', 'metric', name='uq_stats_rollups_bucket_metric'),)
+
 class ChatMessage(db.Model):
     """Таблица для хранения сообщений юридического чата"""
     __tablename__ = 'chat_messages'
@@ -816,7 +963,9 @@ class ChatMessage(db.Model):
     answer = db.Column(db.Text, nullable=False)
     is_legal = db.Column(db.Boolean, default=True)  # Является ли вопрос юридическим
     created_at = db.Column(db.String(30), nullable=False)
-    
+
+    __table_args__ = (db.Index('idx_chat_messages_user_created', 'user_id', 'created_at'),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -835,6 +984,9 @@ class SQLiteUserManager:
         self.User = UserModel
         from models.sqlite_users import Guest
         self.Guest = Guest
+        # Сброс кеша пользователей после любых закоммиченных изменений User
+        from services.user_cache import install_invalidation_hooks
+        install_invalidation_hooks(db.session, UserModel)
 
     def create_user(self, user_data):
         """Создает нового пользователя"""
@@ -853,38 +1005,48 @@ class SQLiteUserManager:
         self.db.session.commit()
         return user
 
-    def get_user(self, user_id):
-        """Получает пользователя по ID с проверкой тарифа"""
-        # ВАЖНО: Всегда получаем свежие данные из БД
-        # Используем expire_all() чтобы очистить кеш сессии перед запросом
-        self.db.session.expire_all()
+    def get_user(self, user_id, fresh=False):
+        """Получает пользователя по ID с проверкой тарифа
+
+        Сначала ищет в кеше запроса и процесса (services.user_cache); fresh=True -
+        всегда читать из БД (для операций чтение-изменение-запись баланса).
+        """
+        from config import Config
+        from services.user_cache import get_user_cache, lookup_user, remember_user
         
-        # Прямой запрос к БД для получения актуальных данных
-        user = self.User.query.filter_by(user_id=user_id).first()
+        user = None
+        use_cache = Config.USER_CACHE_ENABLED and user_id and not fresh
+        if use_cache:
+            user = lookup_user(self.db.session, self.User, user_id)
         
-        # Если пользователь найден, принудительно обновляем его данные из БД
-        if user:
-            try:
-                # Принудительно обновляем данные из БД для этого объекта
-                self.db.session.refresh(user)
-            except Exception as e:
-                logger.debug(f"Refresh не сработал для {user_id}: {e}, но пользователь получен")
+        if user is None:
+            # Поколение запоминаем ДО чтения: изменение, закоммиченное во время чтения, сбросит эту запись
+            generation = get_user_cache().generation(user_id) if Config.USER_CACHE_ENABLED and user_id else 0
+            
+            # Прямой запрос к БД для получения актуальных данных
+            user = self.User.query.filter_by(user_id=user_id).first()
+            
+            # Если пользователь найден, принудительно обновляем его данные из БД
+            if user:
+                try:
+                    # Объект мог остаться в сессии с прошлого чтения - перечитываем строку
+                    self.db.session.refresh(user)
+                except Exception as e:
+                    logger.debug(f"Refresh не сработал для {user_id}: {e}, но пользователь получен")
+                if Config.USER_CACHE_ENABLED:
+                    remember_user(user, generation)
+                logger.info(f"🔍 get_user({user_id}): plan={user.plan}, used_today={user.used_today}, last_reset={user.last_reset}, available_analyses={user.available_analyses}")
     
         # Для бесплатного тарифа НЕ сбрасываем счетчик (используется free_analysis_used - один раз навсегда)
         # Сброс счетчика убран, т.к. бесплатный анализ дается только один раз после регистрации
     
         # Проверяем просроченный тариф
         if user and user.plan != 'free' and user.plan_expires:
-            from datetime import date
             if user.plan_expires < date.today().isoformat():
                 user.plan = 'free'
                 user.plan_expires = None
                 self.db.session.commit()
         
-        # Логируем для диагностики
-        if user:
-            logger.info(f"🔍 get_user({user_id}): plan={user.plan}, used_today={user.used_today}, last_reset={user.last_reset}, available_analyses={user.available_analyses}")
-        
         return user
 
     def get_or_create_user(self, user_id=None):
@@ -934,44 +1096,16 @@ class SQLiteUserManager:
         return users
 
     def get_stats(self):
-        """Возвращает статистику по пользователям и гостям"""
-        from models.sqlite_users import Guest, AnalysisHistory
-        from datetime import datetime, date
-        
-        users = self.get_all_users()
-        total_users = len(users)
-        
-        # Анализы зарегистрированных пользователей (общее количество)
-        registered_analyses = sum(user.total_used for user in users)
-        
-        # ТОЧНЫЙ подсчет анализов за сегодня через AnalysisHistory
-        today = date.today().isoformat()
-        today_registered_analyses = AnalysisHistory.query.filter(
-            AnalysisHistory.created_at.like(f'{today}%')
-        ).count()
-        
-        # Анализы гостей (незарегистрированных пользователей)
-        guests = Guest.query.all()
-        total_guest_analyses = sum(guest.analyses_count for guest in guests)
-        
-        # Анализы гостей за сегодня (если last_seen сегодня, считаем что был анализ)
-        today_guest_analyses = 0
-        for guest in guests:
-            if guest.last_seen and guest.last_seen[:10] == today:
-                # Если последний визит сегодня, считаем что был хотя бы 1 анализ сегодня
-                # (но не больше чем analyses_count)
-                today_guest_analyses += min(1, guest.analyses_count)
-        
-        # Общая статистика
-        total_analyses = registered_analyses + total_guest_analyses
-        today_analyses = today_registered_analyses + today_guest_analyses
+        """Возвращает статистику по пользователям и гостям (из предагрегированных метрик)"""
+        from services.stats_rollup import StatsRollupManager
         
+        stats = StatsRollupManager.get_dashboard_stats()
         return {
-            'total_users': total_users,
-            'total_analyses': total_analyses,
-            'today_analyses': today_analyses,
-            'registered_analyses': registered_analyses,
-            'guest_analyses': total_guest_analyses
+            'total_users': stats['total_users'],
+            'total_analyses': stats['total_analyses'],
+            'today_analyses': stats['today_analyses'],
+            'registered_analyses': stats['registered_analyses'],
+            'guest_analyses': stats['guest_analyses']
         }
         
     def can_analyze(self, user_id):
@@ -1003,7 +1137,7 @@ class SQLiteUserManager:
 
     def record_usage(self, user_id):
         """Записывает использование для пользователя"""
-        user = self.get_user(user_id)
+        user = self.get_user(user_id, fresh=True)
         if user:
             user.total_used += 1
             
@@ -1024,6 +1158,96 @@ class SQLiteUserManager:
             
             self.db.session.commit()
 
+    def reserve_analysis(self, user_id):
+        """Атомарно списывает один анализ до его выполнения. Возвращает резерв (dict) или None, если лимит исчерпан
+
+        Списание - один UPDATE ... WHERE остаток > 0, поэтому параллельные потоки и
+        процессы (веб-воркеры, job_worker.py) не израсходуют больше, чем доступно.
+        Резерв сериализуется в JSON (его можно передать в задачу очереди) и
+        завершается commit_analysis (анализ выполнен) или refund_analysis.
+        """
+        user = self.get_user(user_id, fresh=True)
+        if not user:
+            return None
+        
+        plan = user.plan
+        if plan == 'free':
+            kind = 'free'
+            reserved = self.User.query.filter(
+                self.User.user_id == user_id,
+                self.User.plan == 'free',
+                self.db.or_(self.User.free_analysis_used.is_(None), self.User.free_analysis_used == False)
+            ).update({self.User.free_analysis_used: True}, synchronize_session=False)
+        elif user.available_analyses == -1:
+            # Безлимит: списывать нечего, учитывается только total_used
+            return {'user_id': user_id, 'kind': 'unlimited', 'plan': plan}
+        else:
+            kind = 'paid'
+            reserved = self.User.query.filter(
+                self.User.user_id == user_id,
+                self.User.plan == plan,
+                self.User.available_analyses > 0
+            ).update({self.User.available_analyses: self.User.available_analyses - 1}, synchronize_session=False)
+        self.db.session.commit()
+        if not reserved:
+            return None
+        self._forget_cached_user(user_id)
+        return {'user_id': user_id, 'kind': kind, 'plan': plan}
+
+    def commit_analysis(self, reservation):
+        """Завершает резерв выполненным анализом: total_used, переход на free при нулевом остатке"""
+        user_id = reservation['user_id']
+        self.User.query.filter_by(user_id=user_id).update(
+            {self.User.total_used: self.db.func.coalesce(self.User.total_used, 0) + 1},
+            synchronize_session=False
+        )
+        if reservation['kind'] == 'free':
+            logger.info(f"📊 Бесплатный анализ использован для пользователя {user_id}. Дальше доступна только покупка тарифа.")
+        elif reservation['kind'] == 'paid':
+            # Если анализы закончились, переводим на бесплатный тариф
+            switched = self.User.query.filter(
+                self.User.user_id == user_id,
+                self.User.plan == reservation['plan'],
+                self.User.available_analyses <= 0
+            ).update({self.User.plan: 'free', self.User.available_analyses: 0}, synchronize_session=False)
+            if switched:
+                logger.info(f"📊 У пользователя {user_id} закончились анализы, переведен на бесплатный тариф")
+            else:
+                logger.info(f"📊 Использован анализ для {user_id} (платный тариф)")
+        self.db.session.commit()
+        self._forget_cached_user(user_id)
+
+    def refund_analysis(self, reservation):
+        """Возвращает анализ, списанный reserve_analysis (анализ не состоялся)"""
+        user_id = reservation['user_id']
+        if reservation['kind'] == 'free':
+            self.User.query.filter_by(user_id=user_id, plan='free').update(
+                {self.User.free_analysis_used: False}, synchronize_session=False
+            )
+        elif reservation['kind'] == 'paid':
+            # Параллельный commit_analysis мог перевести пользователя на free при нулевом остатке -
+            # вместе с анализом возвращаем и тариф
+            self.User.query.filter_by(user_id=user_id).update({
+                self.User.available_analyses: self.User.available_analyses + 1,
+                self.User.plan: self.db.case(
+                    (self.db.and_(self.User.plan == 'free', self.User.available_analyses == 0), reservation['plan']),
+                    else_=self.User.plan
+                )
+            }, synchronize_session=False)
+        else:
+            return
+        self.db.session.commit()
+        self._forget_cached_user(user_id)
+        logger.info(f"↩️ Анализ возвращен пользователю {user_id}")
+
+    @staticmethod
+    def _forget_cached_user(user_id):
+        """UPDATE мимо сессии не вызывает хуки инвалидации - сбрасываем кеш пользователя явно"""
+        from config import Config
+        if Config.USER_CACHE_ENABLED:
+            from services.user_cache import forget_user
+            forget_user(user_id)
+
     def set_user_plan(self, user_id, plan_type):
         """Устанавливает тариф пользователю и добавляет анализы к балансу"""
         from config import PLANS
@@ -1342,18 +1566,16 @@ class SQLiteUserManager:
     def get_search_bots_stats(self):
         """Получает статистику по поисковым ботам"""
         from models.sqlite_users import SearchBot
-        from datetime import date
-        
-        today_str = date.today().isoformat()
+        from utils.helpers import today_filter
         
         # Новые боты за сегодня
-        new_bots_24h = SearchBot.query.filter(SearchBot.first_seen.like(f'{today_str}%')).count()
+        new_bots_24h = SearchBot.query.filter(*today_filter(SearchBot.first_seen)).count()
         
         # Всего ботов
         total_bots = SearchBot.query.count()
         
         # Активность ботов сегодня (визиты)
-        today_visits = SearchBot.query.filter(SearchBot.last_seen.like(f'{today_str}%')).count()
+        today_visits = SearchBot.query.filter(*today_filter(SearchBot.last_seen)).count()
         
         # Количество уникальных типов ботов
         unique_bot_types = self.db.session.query(SearchBot.bot_type).distinct().count()
@@ -1387,41 +1609,59 @@ class SQLiteUserManager:
         Returns:
             list: Список словарей с user_id и email
         """
-        from models.sqlite_users import EmailCampaign
+        recipients = []
+        for chunk in self.iter_recipients_for_campaign(recipient_filter):
+            recipients.extend(chunk)
         
-        query = self.User.query.filter(
-            self.User.is_registered == True,
-            self.User.email.isnot(None),
-            self.User.email != '',
-            self.User.email_subscribed == True  # Только подписанные
+        logger.info(f"📧 Получено {len(recipients)} получателей для фильтра '{recipient_filter}'")
+        return recipients
+
+    def iter_recipients_for_campaign(self, recipient_filter='all', chunk_size=500):
+        """
+        Получатели рассылки пачками по chunk_size (keyset-пагинация по users.id)
+        
+        Читаются только нужные колонки, в памяти - одна пачка, поэтому
+        рассылка по большой аудитории не загружает всех пользователей сразу.
+        
+        Yields:
+            list: Пачка словарей с user_id, email, plan, email_verified
+        """
+        User = self.User
+        query = self.db.session.query(
+            User.id, User.user_id, User.email, User.plan, User.email_verified
+        ).filter(
+            User.is_registered == True,
+            User.email.isnot(None),
+            User.email != '',
+            User.email_subscribed == True  # Только подписанные
         )
         
         if recipient_filter == 'free':
-            query = query.filter(self.User.plan == 'free')
+            query = query.filter(User.plan == 'free')
         elif recipient_filter == 'paid':
             # Платные тарифы в текущей системе
-            query = query.filter(self.User.plan.in_([
+            query = query.filter(User.plan.in_([
                 'standard', 'premium',
                 'business_start', 'business_pro', 'business_max', 'business_unlimited'
             ]))
         elif recipient_filter == 'verified':
-            query = query.filter(self.User.email_verified == True)
+            query = query.filter(User.email_verified == True)
         # 'all' - без дополнительных фильтров
         
-        users = query.all()
-        
-        recipients = []
-        for user in users:
-            if user.email:  # Дополнительная проверка
-                recipients.append({
-                    'user_id': user.user_id,
-                    'email': user.email,
-                    'plan': user.plan,
-                    'email_verified': user.email_verified
-                })
-        
-        logger.info(f"📧 Получено {len(recipients)} получателей для фильтра '{recipient_filter}'")
-        return recipients
+        last_id = 0
+        while True:
+            rows = query.filter(User.id > last_id).order_by(User.id).limit(chunk_size).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield [{
+                'user_id': row.user_id,
+                'email': row.email,
+                'plan': row.plan,
+                'email_verified': row.email_verified
+            } for row in rows]
+            if len(rows) < chunk_size:
+                return
 
     def get_registered_users_for_manual_selection(self):
         """
@@ -1517,16 +1757,22 @@ class SQLiteUserManager:
         """Получает статистику по рассылке"""
         from models.sqlite_users import EmailSend
         
-        total = EmailSend.query.filter_by(campaign_id=campaign_id).count()
-        sent = EmailSend.query.filter_by(campaign_id=campaign_id, status='sent').count()
-        failed = EmailSend.query.filter_by(campaign_id=campaign_id, status='failed').count()
-        pending = EmailSend.query.filter_by(campaign_id=campaign_id, status='pending').count()
+        # Один проход по индексу (campaign_id, email) вместо запроса на каждый статус
+        counts = dict(
+            self.db.session.query(EmailSend.status, self.db.func.count(EmailSend.id))
+            .filter(EmailSend.campaign_id == campaign_id)
+            .group_by(EmailSend.status)
+            .all()
+        )
+        total = sum(counts.values())
+        sent = counts.get('sent', 0)
         
         return {
             'total': total,
             'sent': sent,
-            'failed': failed,
-            'pending': pending,
+            'failed': counts.get('failed', 0),
+            'bounced': counts.get('bounced', 0),
+            'pending': counts.get('pending', 0),
             'success_rate': (sent / total * 100) if total > 0 else 0
         }
     
@@ -1940,10 +2186,30 @@ class SQLiteUserManager:
         logger.info(f"❓ Создан вопрос: {title} (ID: {question.id}, пользователь: {user_id})")
         return question
     
-    def get_questions(self, category=None, status=None, limit=50, offset=0, sort_by='newest'):
-        """Получает список вопросов с фильтрацией"""
-        from models.sqlite_users import Question, Answer
-        from datetime import datetime
+    # Сортировки списка вопросов с keyset-пагинацией: колонки ключа (все по убыванию)
+    QUESTION_KEYSET_SORTS = {
+        'newest': ('created_at', 'id'),
+        'popular': ('views_count', 'answers_count', 'id'),
+        'unanswered': ('created_at', 'id'),
+    }
+
+    def get_questions(self, category=None, status=None, limit=50, offset=0, sort_by='newest', after=None):
+        """Получает список вопросов с фильтрацией (см. get_questions_page)"""
+        return self.get_questions_page(category, status, limit, offset, sort_by, after)['questions']
+
+    def get_questions_page(self, category=None, status=None, limit=50, offset=0, sort_by='newest', after=None):
+        """Страница вопросов одним запросом: {'questions': [...], 'next_cursor': str или None}
+
+        Счетчики ответов и статусы не пересчитываются при чтении - они
+        обновляются в create_answer/delete_answer и сверяются фоном
+        (reconcile_question_counters). Для сортировок newest/popular/unanswered
+        after - курсор следующей страницы из предыдущего ответа, offset тогда
+        не используется.
+        """
+        import json
+        import base64
+        from sqlalchemy import tuple_
+        from models.sqlite_users import Question
         
         query = Question.query
         
@@ -1952,43 +2218,76 @@ class SQLiteUserManager:
         if status:
             query = query.filter_by(status=status)
         
-        # Сортировка
-        if sort_by == 'newest':
-            query = query.order_by(Question.created_at.desc())
-        elif sort_by == 'popular':
-            query = query.order_by(Question.views_count.desc(), Question.answers_count.desc())
-        elif sort_by == 'unanswered':
-            query = query.filter(Question.answers_count == 0).order_by(Question.created_at.desc())
+        keyset = self.QUESTION_KEYSET_SORTS.get(sort_by)
+        if sort_by == 'unanswered':
+            query = query.filter(Question.answers_count == 0)
         elif sort_by == 'solved':
-            query = query.filter_by(status='solved').order_by(Question.updated_at.desc())
-        else:
-            query = query.order_by(Question.created_at.desc())
+            query = query.filter_by(status='solved').order_by(Question.updated_at.desc(), Question.id.desc())
+        elif keyset is None:
+            keyset = self.QUESTION_KEYSET_SORTS['newest']
+        
+        if keyset:
+            columns = [getattr(Question, name) for name in keyset]
+            query = query.order_by(*[column.desc() for column in columns])
+            if after:
+                try:
+                    values = json.loads(base64.urlsafe_b64decode(after.encode('ascii')))
+                    # Курсор приходит от клиента: принимаем только список значений нужных типов
+                    if not isinstance(values, list) or len(values) != len(columns):
+                        raise ValueError('cursor shape')
+                    for value, column in zip(values, columns):
+                        if value is not None and (isinstance(value, bool) or not isinstance(value, column.type.python_type)):
+                            raise ValueError('cursor value type')
+                    query = query.filter(tuple_(*columns) < tuple_(*values))
+                    offset = 0
+                except (ValueError, TypeError):
+                    logger.warning(f"⚠️ Некорректный курсор списка вопросов: {after[:50]}")
         
         questions = query.limit(limit).offset(offset).all()
         
-        # ИСПРАВЛЕНИЕ: Синхронизируем статусы вопросов с реальным количеством ответов
-        for question in questions:
-            real_answers_count = Answer.query.filter_by(question_id=question.id).count()
-            
-            # Обновляем счетчик ответов
-            if question.answers_count != real_answers_count:
-                question.answers_count = real_answers_count
-            
-            # Обновляем статус если нужно
-            if real_answers_count == 0 and question.status == 'answered':
-                question.status = 'open'
-                question.updated_at = datetime.now().isoformat()
-                logger.info(f"🔄 Статус вопроса {question.id} обновлен на 'open' (ответов нет)")
-            elif real_answers_count > 0 and question.status == 'open':
-                question.status = 'answered'
-                question.updated_at = datetime.now().isoformat()
-                logger.info(f"🔄 Статус вопроса {question.id} обновлен на 'answered' ({real_answers_count} ответов)")
+        next_cursor = None
+        if keyset and questions and len(questions) == limit:
+            last = questions[-1]
+            values = [getattr(last, name) for name in keyset]
+            next_cursor = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
         
-        # Сохраняем изменения
-        if questions:
-            self.db.session.commit()
+        return {'questions': [q.to_dict() for q in questions], 'next_cursor': next_cursor}
+
+    @staticmethod
+    def _apply_answers_count(question, answers_count):
+        """Счетчик ответов и статус open/answered по фактическому числу ответов"""
+        question.answers_count = answers_count
+        if answers_count == 0 and question.status == 'answered':
+            question.status = 'open'
+        elif answers_count > 0 and question.status == 'open':
+            question.status = 'answered'
+
+    def reconcile_question_counters(self):
+        """Исправляет расхождения answers_count/статуса с таблицей ответов. Возвращает число исправленных вопросов
+
+        Один агрегатный запрос по всем вопросам, изменяются только разошедшиеся строки.
+        """
+        from models.sqlite_users import Question, Answer
         
-        return [q.to_dict() for q in questions]
+        real_count = self.db.func.count(Answer.id)
+        drifted = self.db.session.query(Question, real_count) \
+            .outerjoin(Answer, Answer.question_id == Question.id) \
+            .group_by(Question.id) \
+            .having(self.db.or_(
+                self.db.func.coalesce(Question.answers_count, 0) != real_count,
+                self.db.and_(Question.status == 'answered', real_count == 0),
+                self.db.and_(Question.status == 'open', real_count > 0)
+            )).all()
+        
+        now = datetime.now().isoformat()
+        for question, answers_count in drifted:
+            logger.info(f"🔄 Вопрос {question.id}: ответов {question.answers_count} -> {answers_count}, статус '{question.status}'")
+            self._apply_answers_count(question, answers_count)
+            question.updated_at = now
+        
+        if drifted:
+            self.db.session.commit()
+        return len(drifted)
     
     def get_question(self, question_id):
         """Получает вопрос по ID и увеличивает счетчик просмотров"""
@@ -2032,9 +2331,8 @@ class SQLiteUserManager:
             return False
         
         # Удаляем все лайки ответов этого вопроса
-        answers = Answer.query.filter_by(question_id=question_id).all()
-        for answer in answers:
-            AnswerLike.query.filter_by(answer_id=answer.id).delete()
+        answer_ids = self.db.session.query(Answer.id).filter_by(question_id=question_id)
+        AnswerLike.query.filter(AnswerLike.answer_id.in_(answer_ids.scalar_subquery())).delete(synchronize_session=False)
         
         # Удаляем все ответы
         Answer.query.filter_by(question_id=question_id).delete()
@@ -2061,10 +2359,10 @@ class SQLiteUserManager:
         
         self.db.session.add(answer)
         
-        # Обновляем счетчик ответов в вопросе
+        # Обновляем счетчик ответов в вопросе в той же транзакции (инкремент на стороне SQL)
         question = Question.query.filter_by(id=question_id).first()
         if question:
-            question.answers_count += 1
+            question.answers_count = Question.answers_count + 1
             if question.status == 'open':
                 question.status = 'answered'
             question.updated_at = datetime.now().isoformat()
@@ -2168,6 +2466,31 @@ DocScan AI
         logger.info(f"💬 Создан ответ на вопрос ID: {question_id} (пользователь: {user_id})")
         return answer
     
+    def delete_answer(self, answer_id):
+        """Удаляет ответ и в той же транзакции обновляет счетчик, статус и лучший ответ вопроса"""
+        from models.sqlite_users import Answer, AnswerLike, Question
+        
+        answer = Answer.query.filter_by(id=answer_id).first()
+        if not answer:
+            return False
+        
+        question_id = answer.question_id
+        AnswerLike.query.filter_by(answer_id=answer_id).delete()
+        self.db.session.delete(answer)
+        self.db.session.flush()
+        
+        question = Question.query.filter_by(id=question_id).first()
+        if question:
+            self._apply_answers_count(question, Answer.query.filter_by(question_id=question_id).count())
+            if question.best_answer_id == answer_id:
+                question.best_answer_id = None
+            question.updated_at = datetime.now().isoformat()
+        
+        self.db.session.commit()
+        
+        logger.info(f"🗑️ Удален ответ ID: {answer_id} (вопрос ID: {question_id})")
+        return True
+    
     def get_answers(self, question_id, sort_by='best_first'):
         """Получает ответы на вопрос"""
         from models.sqlite_users import Answer
@@ -4,15 +4,20 @@
     python restore_database.py                    # Интерактивный выбор бэкапа
     python restore_database.py --file backup.db.gz  # Восстановить из конкретного файла
     python restore_database.py --list              # Показать список бэкапов
+
+Инкрементальный бэкап (docscan_incr_*.bin.gz) восстанавливается поверх своего
+полного бэкапа - он должен лежать в той же папке.
 """
 import os
 import sys
 import shutil
-import gzip
+import sqlite3
 from datetime import datetime
 from pathlib import Path
 import logging
 
+from services.db_backup import restore_snapshot, is_backup_file
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -39,7 +44,7 @@ def list_backups():
         backups = []
         for filename in os.listdir(BACKUP_DIR):
             file_path = os.path.join(BACKUP_DIR, filename)
-            if os.path.isfile(file_path) and (filename.startswith('docscan_backup_') and filename.endswith('.db.gz')):
+            if os.path.isfile(file_path) and is_backup_file(filename):
                 file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
                 file_size = os.path.getsize(file_path)
                 size_mb = file_size / (1024 * 1024)
@@ -71,12 +76,18 @@ def list_backups():
         return []
 
 def decompress_backup(backup_path, output_path):
-    """Распаковывает сжатый бэкап"""
+    """Распаковывает сжатый бэкап (инкрементальный - поверх своего полного) и проверяет целостность"""
     try:
         logger.info(f"🗜️ Распаковка бэкапа: {os.path.basename(backup_path)}")
-        with gzip.open(backup_path, 'rb') as f_in:
-            with open(output_path, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        restore_snapshot(backup_path, output_path)
+        conn = sqlite3.connect(output_path)
+        try:
+            check = conn.execute('PRAGMA quick_check').fetchone()[0]
+        finally:
+            conn.close()
+        if check != 'ok':
+            logger.error(f"❌ Восстановленная БД повреждена: {check}")
+            return False
         logger.info(f"✅ Бэкап распакован: {output_path}")
         return True
     except Exception as e:
@@ -9,7 +9,7 @@ from datetime import datetime
 from functools import wraps
 from config import ADMINS
 import logging
-from models.limits import IPLimitManager
+from utils.helpers import today_filter
 
 logger = logging.getLogger(__name__)
 
@@ -848,11 +848,15 @@ def admin_panel():
                     <div class="card">
                         <h3>Создать резервную копию</h3>
                         <p style="color: #666; font-size: 0.9rem; margin-bottom: 15px;">
-                            Создает полную резервную копию базы данных в сжатом формате. Бэкап будет сохранен в папке backups/.
+                            Создает полную резервную копию базы данных в сжатом формате без остановки сайта. Бэкап будет сохранен в папке backups/.
+                            Инкрементальный бэкап содержит только страницы, измененные после последнего полного, и восстанавливается вместе с ним.
                         </p>
                         <button onclick="createBackup()" style="background: #48bb78; color: white; padding: 12px 24px; border: none; border-radius: 5px; cursor: pointer; font-weight: 600; font-size: 1rem;">
                             💾 Создать бэкап сейчас
                         </button>
+                        <button onclick="createBackup('incremental')" style="background: #667eea; color: white; padding: 12px 24px; border: none; border-radius: 5px; cursor: pointer; font-weight: 600; font-size: 1rem; margin-left: 10px;">
+                            ➕ Инкрементальный бэкап
+                        </button>
                         <div id="backupStatus" style="margin-top: 15px; color: #666; font-size: 14px;"></div>
                     </div>
                     
@@ -3346,19 +3350,20 @@ def admin_panel():
             
             // ========== ФУНКЦИИ ДЛЯ РЕЗЕРВНЫХ КОПИЙ ==========
             
-            function createBackup() {
+            function createBackup(kind) {
                 const statusEl = document.getElementById('backupStatus');
                 statusEl.innerHTML = '<span style="color: #667eea;">⏳ Создание бэкапа...</span>';
                 
                 fetch('/admin/create-backup', {
                     method: 'POST',
-                    credentials: 'include'
+                    credentials: 'include',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ kind: kind || 'full' })
                 })
                 .then(r => r.json())
                 .then(result => {
                     if (result.success) {
-                        statusEl.innerHTML = '<span style="color: #48bb78;">✅ ' + result.message + '</span>';
-                        loadBackups();
+                        pollBackupStatus(statusEl, result.job_id);
                     } else {
                         statusEl.innerHTML = '<span style="color: #e53e3e;">❌ ' + result.error + '</span>';
                     }
@@ -3368,6 +3373,36 @@ def admin_panel():
                 });
             }
             
+            function pollBackupStatus(statusEl, jobId) {
+                const stages = { snapshot: 'снимок базы', compress: 'сжатие' };
+                fetch('/admin/backup-status', {
+                    method: 'GET',
+                    credentials: 'include'
+                })
+                .then(r => r.json())
+                .then(result => {
+                    const job = result.job || {};
+                    const backup = result.backup || {};
+                    if (!result.success || job.id !== jobId) {
+                        statusEl.innerHTML = '<span style="color: #e53e3e;">❌ ' + (result.error || 'Задача бэкапа не найдена') + '</span>';
+                    } else if (job.status === 'completed') {
+                        statusEl.innerHTML = '<span style="color: #48bb78;">✅ Резервная копия создана: ' + (backup.filename || '') + '</span>';
+                        loadBackups();
+                    } else if (job.status === 'failed') {
+                        statusEl.innerHTML = '<span style="color: #e53e3e;">❌ Ошибка создания бэкапа: ' + (job.last_error || backup.error || '') + '</span>';
+                    } else {
+                        const text = job.status === 'running' && backup.state === 'running'
+                            ? 'Создание бэкапа: ' + (stages[backup.stage] || backup.stage) + ', ' + (backup.progress || 0) + '%'
+                            : 'Бэкап в очереди...';
+                        statusEl.innerHTML = '<span style="color: #667eea;">⏳ ' + text + '</span>';
+                        setTimeout(() => pollBackupStatus(statusEl, jobId), 1000);
+                    }
+                })
+                .catch(error => {
+                    statusEl.innerHTML = '<span style="color: #e53e3e;">❌ Ошибка: ' + error.message + '</span>';
+                });
+            }
+            
             function loadBackups() {
                 fetch('/admin/list-backups', {
                     method: 'GET',
@@ -4910,39 +4945,26 @@ def get_all_users():
     """Получить всех пользователей (отсортированных по дате создания, новые сначала)"""
     from app import app
     from models.sqlite_users import AnalysisHistory
-    from datetime import date
     
     # Получаем пользователей из SQLite (уже отсортированы по created_at DESC)
     users_list = app.user_manager.get_all_users()
     
-    # Получаем сегодняшнюю дату для фильтрации анализов
-    today = date.today().isoformat()
-    
     # Конвертируем в dict для совместимости, сохраняя порядок
     users_dict = {}
     for user in users_list:
         users_dict[user.user_id] = user.to_dict()
     
-    # Создаем менеджер IP-лимитов
-    ip_manager = IPLimitManager()
+    # IP пользователей из счетчиков IP-лимитов - одним запросом на всех
+    last_ips = app.ip_limit_manager.get_last_ips(users_dict.keys())
     
     # Добавляем IP-адреса и анализы за сегодня к каждому пользователю
     for user_id, user_data in users_dict.items():
-        user_ip = "Не определен"
-        
-        # Ищем IP пользователя в данных IP-лимитов
-        for ip, ip_data in ip_manager.ip_limits.items():
-            if (ip_data.get('user_id') == user_id or 
-                ip_data.get('last_user') == user_id):
-                user_ip = ip
-                break
-        
-        user_data['ip_address'] = user_ip
+        user_data['ip_address'] = last_ips.get(user_id, "Не определен")
         
         # Подсчитываем реальные анализы за сегодня из AnalysisHistory
         analyses_today = AnalysisHistory.query.filter(
             AnalysisHistory.user_id == user_id,
-            AnalysisHistory.created_at.like(f'{today}%')
+            *today_filter(AnalysisHistory.created_at)
         ).count()
         
         user_data['analyses_today'] = analyses_today
@@ -5440,47 +5462,60 @@ def admin_save_analysis_settings():
 @admin_bp.route('/create-backup', methods=['POST'])
 @require_admin_auth
 def admin_create_backup():
-    """Создать резервную копию базы данных"""
-    import subprocess
-    import sys
+    """Поставить создание резервной копии в очередь фоновых задач (full или incremental)"""
+    from utils.job_queue import JobQueue
     
     try:
-        # Запускаем скрипт бэкапа
-        script_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'backup_database.py')
-        result = subprocess.run(
-            [sys.executable, script_path],
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 минут максимум
-        )
+        data = request.get_json(silent=True) or {}
+        kind = data.get('kind', 'full')
+        if kind not in ('full', 'incremental'):
+            return jsonify({'success': False, 'error': 'Неверный тип бэкапа'})
+        
+        job_id, error = JobQueue.enqueue('db_backup', {'kind': kind}, dedupe_key='db_backup')
+        if error:
+            return jsonify({'success': False, 'error': f'Ошибка постановки бэкапа в очередь: {error}'})
         
-        if result.returncode == 0:
-            return jsonify({
-                'success': True,
-                'message': 'Резервная копия успешно создана',
-                'output': result.stdout
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Ошибка создания бэкапа: {result.stderr}'
-            })
-            
-    except subprocess.TimeoutExpired:
         return jsonify({
-            'success': False,
-            'error': 'Таймаут создания бэкапа (превышено 5 минут)'
+            'success': True,
+            'message': 'Создание резервной копии запущено',
+            'job_id': job_id
         })
+        
     except Exception as e:
         logger.error(f"❌ Ошибка создания бэкапа: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@admin_bp.route('/backup-status', methods=['GET'])
+@require_admin_auth
+def admin_backup_status():
+    """Ход последнего бэкапа: задача очереди и этап/процент из backup_status.json"""
+    from models.sqlite_users import BackgroundJob
+    from services.db_backup import get_backup_status
+    
+    try:
+        job = BackgroundJob.query.filter_by(job_type='db_backup').order_by(BackgroundJob.id.desc()).first()
+        return jsonify({
+            'success': True,
+            'job': {
+                'id': job.id,
+                'status': job.status,
+                'attempts': job.attempts,
+                'last_error': job.last_error
+            } if job else None,
+            'backup': get_backup_status()
+        })
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статуса бэкапа: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @admin_bp.route('/list-backups', methods=['GET'])
 @require_admin_auth
 def admin_list_backups():
-    """Получить список всех бэкапов"""
+    """Получить список всех бэкапов (полные и инкрементальные)"""
     import os
     from datetime import datetime
+    from services.db_backup import is_backup_file, backup_kind
     
     try:
         backup_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'backups')
@@ -5495,12 +5530,13 @@ def admin_list_backups():
         backups = []
         for filename in os.listdir(backup_dir):
             file_path = os.path.join(backup_dir, filename)
-            if os.path.isfile(file_path) and (filename.startswith('docscan_backup_') and filename.endswith('.db.gz')):
+            if os.path.isfile(file_path) and is_backup_file(filename):
                 file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
                 file_size = os.path.getsize(file_path)
                 size_mb = file_size / (1024 * 1024)
                 backups.append({
                     'filename': filename,
+                    'kind': backup_kind(filename),
                     'date': file_time.isoformat(),
                     'size_mb': round(size_mb, 2),
                     'size_bytes': file_size
@@ -5526,8 +5562,9 @@ def admin_list_backups():
 @admin_bp.route('/delete-backup', methods=['POST'])
 @require_admin_auth
 def admin_delete_backup():
-    """Удалить бэкап"""
+    """Удалить бэкап (полный - вместе с зависящими от него инкрементальными)"""
     import os
+    from services.db_backup import is_backup_file, delete_backup
     
     try:
         data = request.json
@@ -5540,14 +5577,14 @@ def admin_delete_backup():
         file_path = os.path.join(backup_dir, filename)
         
         # Проверяем безопасность (только файлы бэкапов)
-        if not filename.startswith('docscan_backup_') or not filename.endswith('.db.gz'):
+        if not is_backup_file(filename) or os.path.basename(filename) != filename:
             return jsonify({'success': False, 'error': 'Неверный формат имени файла'})
         
         if not os.path.exists(file_path):
             return jsonify({'success': False, 'error': 'Файл не найден'})
         
-        os.remove(file_path)
-        logger.info(f"🗑️ Бэкап удален администратором: {filename}")
+        removed = delete_backup(filename, backup_dir)
+        logger.info(f"🗑️ Бэкап удален администратором: {', '.join(removed)}")
         
         return jsonify({
             'success': True,
@@ -5806,79 +5843,38 @@ def delete_news(news_id):
 @admin_bp.route('/stats')
 @require_admin_auth
 def admin_stats():
-    """Статистика для админ-панели"""
-    from app import app
-    from models.sqlite_users import Guest, Payment, User, PageView
-    from datetime import datetime, date, timedelta
-    
-    stats = app.user_manager.get_stats()
-    
-    # Добавляем статистику по гостям
-    total_guests = Guest.query.filter_by(registered_user_id=None).count()
-    stats['total_guests'] = total_guests
-    
-    # Новые пользователи за сегодня (с 0:00)
-    today_str = date.today().isoformat()
-    new_users_24h = User.query.filter(User.created_at.like(f'{today_str}%')).count()
-    stats['new_users_24h'] = new_users_24h
-    
-    # Новые гости за сегодня (с 0:00) - только реальные пользователи, исключаем ботов
-    new_guests_24h = Guest.query.filter(Guest.first_seen.like(f'{today_str}%')).count()
-    stats['new_guests_24h'] = new_guests_24h
-    
-    # Статистика по поисковым ботам
-    bots_stats = app.user_manager.get_search_bots_stats()
-    stats.update(bots_stats)
-    
-    # Статистика доходов
-    all_payments = Payment.query.filter_by(status='success').all()
-    total_revenue = sum(p.amount for p in all_payments)
-    stats['total_revenue'] = total_revenue
-    
-    # Доход за сегодня
-    today_str = date.today().isoformat()
-    today_payments = Payment.query.filter(
-        Payment.status == 'success',
-        Payment.created_at.like(f'{today_str}%')
-    ).all()
-    today_revenue = sum(p.amount for p in today_payments)
-    stats['today_revenue'] = today_revenue
-    
-    # Доход за последние 7 дней
-    week_ago = (datetime.now() - timedelta(days=7)).isoformat()
-    week_payments = Payment.query.filter(
-        Payment.status == 'success',
-        Payment.created_at >= week_ago
-    ).all()
-    week_revenue = sum(p.amount for p in week_payments)
-    stats['week_revenue'] = week_revenue
-    
-    # Количество успешных платежей
-    stats['total_payments'] = len(all_payments)
-    stats['today_payments'] = len(today_payments)
+    """Статистика для админ-панели
 
-    # ====== Статистика по /business-ip ======
-    try:
-        today_str = date.today().isoformat()
-        business_total = PageView.query.filter(PageView.path == '/business-ip').count()
-        business_today = PageView.query.filter(
-            PageView.path == '/business-ip',
-            PageView.created_at.like(f'{today_str}%')
-        ).count()
-        business_unique_today = PageView.query.filter(
-            PageView.path == '/business-ip',
-            PageView.created_at.like(f'{today_str}%')
-        ).with_entities(PageView.ip_address).distinct().count()
+    Читается из предагрегированных метрик (stats_rollups): дневные бакеты,
+    часовые за последнюю неделю и итоговые значения вместо полной истории.
+    """
+    from services.stats_rollup import StatsRollupManager
+    
+    return jsonify(StatsRollupManager.get_dashboard_stats())
 
-        stats['business_ip_views_total'] = business_total
-        stats['business_ip_views_today'] = business_today
-        stats['business_ip_unique_today'] = business_unique_today
-    except Exception:
-        stats['business_ip_views_total'] = 0
-        stats['business_ip_views_today'] = 0
-        stats['business_ip_unique_today'] = 0
+@admin_bp.route('/stats/timeseries')
+@require_admin_auth
+def admin_stats_timeseries():
+    """Ряд значений метрики по дням или часам (?metric=new_users&granularity=day&periods=30)"""
+    from config import Config
+    from services.stats_rollup import StatsRollupManager
+    
+    metric = request.args.get('metric', 'registered_analyses')
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'hour'):
+        return jsonify({'success': False, 'error': 'granularity должен быть day или hour'}), 400
+    max_periods = 24 * Config.STATS_ROLLUP_HOURLY_RETENTION_DAYS if granularity == 'hour' else 366
+    periods = min(max(request.args.get('periods', 30, type=int), 1), max_periods)
     
-    return jsonify(stats)
+    try:
+        return jsonify({
+            'success': True,
+            'metric': metric,
+            'granularity': granularity,
+            'series': StatsRollupManager.get_timeseries(metric, granularity, periods)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
         
 @admin_bp.route('/calculator-stats-data')
 @require_admin_auth
@@ -5889,6 +5885,151 @@ def calculator_stats_data():
     stats = app.user_manager.get_calculator_stats()
     return jsonify(stats)
 
+@admin_bp.route('/analysis-cache-stats')
+@require_admin_auth
+def analysis_cache_stats():
+    """Статистика кеша результатов анализа (попадания/промахи/размер)"""
+    from services.analysis_cache import get_analysis_cache
+
+    try:
+        return jsonify(get_analysis_cache().get_stats())
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики кеша анализов: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/analysis-cache/clear', methods=['POST'])
+@require_admin_auth
+def clear_analysis_cache():
+    """Очистить кеш результатов анализа"""
+    from services.analysis_cache import get_analysis_cache
+
+    try:
+        deleted = get_analysis_cache().clear()
+        logger.info(f"🧹 Кеш анализов очищен: удалено {deleted} записей")
+        return jsonify({'success': True, 'deleted': deleted})
+    except Exception as e:
+        logger.error(f"❌ Ошибка очистки кеша анализов: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@admin_bp.route('/text-cache-stats')
+@require_admin_auth
+def text_cache_stats():
+    """Статистика кеша извлеченного текста"""
+    from services.text_cache import get_text_cache
+
+    try:
+        return jsonify(get_text_cache().get_stats())
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики кеша текстов: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/text-cache/clear', methods=['POST'])
+@require_admin_auth
+def clear_text_cache():
+    """Очистить кеш извлеченного текста"""
+    from services.text_cache import get_text_cache
+
+    try:
+        deleted = get_text_cache().clear()
+        logger.info(f"🧹 Кеш текстов очищен: удалено {deleted} записей")
+        return jsonify({'success': True, 'deleted': deleted})
+    except Exception as e:
+        logger.error(f"❌ Ошибка очистки кеша текстов: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@admin_bp.route('/pdf-render-cache-stats')
+@require_admin_auth
+def pdf_render_cache_stats():
+    """Статистика кеша готовых PDF-отчетов"""
+    from services.pdf_render_service import get_render_cache
+
+    try:
+        return jsonify(get_render_cache().get_stats())
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики кеша PDF-отчетов: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/pdf-render-cache/clear', methods=['POST'])
+@require_admin_auth
+def clear_pdf_render_cache():
+    """Очистить кеш готовых PDF-отчетов"""
+    from services.pdf_render_service import get_render_cache
+
+    try:
+        deleted = get_render_cache().clear()
+        logger.info(f"🧹 Кеш PDF-отчетов очищен: удалено {deleted} записей")
+        return jsonify({'success': True, 'deleted': deleted})
+    except Exception as e:
+        logger.error(f"❌ Ошибка очистки кеша PDF-отчетов: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@admin_bp.route('/yandex-client-stats')
+@require_admin_auth
+def yandex_client_stats():
+    """Метрики запросов к Yandex Cloud: латентность, ретраи, состояние circuit breaker"""
+    from services.yandex_client import get_yandex_client
+
+    try:
+        return jsonify(get_yandex_client().get_stats())
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения метрик Yandex Cloud: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/user-cache-stats')
+@require_admin_auth
+def user_cache_stats():
+    """Статистика кеша пользователей: попадания по уровням, сэкономленные запросы"""
+    from services.user_cache import get_user_cache
+
+    try:
+        return jsonify(get_user_cache().get_stats())
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики кеша пользователей: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/api-key-cache-stats')
+@require_admin_auth
+def api_key_cache_stats():
+    """Статистика кеша проверок API-ключей и буфера их использования"""
+    from services.api_key_cache import get_api_key_cache, get_api_key_usage_buffer
+
+    try:
+        return jsonify({
+            'cache': get_api_key_cache().get_stats(),
+            'usage_buffer': get_api_key_usage_buffer().get_stats()
+        })
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики кеша API-ключей: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/smtp-pool-stats')
+@require_admin_auth
+def smtp_pool_stats():
+    """Статистика пулов SMTP-соединений рассылок и транзакционных писем (подключения, переиспользования, отправлено)"""
+    from services.smtp_delivery import get_email_engine, get_transactional_email_engine
+
+    try:
+        return jsonify({
+            'campaigns': get_email_engine().pool.get_stats(),
+            'transactional': get_transactional_email_engine().pool.get_stats()
+        })
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики пула SMTP: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/sitemap/rebuild', methods=['POST'])
+@require_admin_auth
+def rebuild_sitemap():
+    """Полная пересборка файлов sitemap (обычно обновляются сами по изменениям контента)"""
+    from services.sitemap import get_sitemap_builder
+
+    try:
+        rebuilt = get_sitemap_builder().refresh(force=True)
+        return jsonify({'success': True, 'rebuilt': rebuilt})
+    except Exception as e:
+        logger.error(f"❌ Ошибка пересборки sitemap: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @admin_bp.route('/payments')
 @require_admin_auth
 def get_payments():
@@ -5918,14 +6059,10 @@ def get_payments():
 def get_new_users():
     """Получить новых пользователей за сегодня (с 0:00)"""
     from models.sqlite_users import User, AnalysisHistory
-    from datetime import datetime, timedelta, date
     
-    today_str = date.today().isoformat()
-    new_users = User.query.filter(User.created_at.like(f'{today_str}%')).order_by(User.created_at.desc()).all()
+    new_users = User.query.filter(*today_filter(User.created_at)).order_by(User.created_at.desc()).all()
     
     users_list = []
-    # Получаем сегодняшнюю дату для проверки анализов за сегодня
-    today = date.today().isoformat()
     
     for user in new_users:
         user_dict = user.to_dict()
@@ -5933,7 +6070,7 @@ def get_new_users():
         # Проверяем, сделал ли пользователь анализ СЕГОДНЯ (не вообще когда-либо)
         has_analysis_today = AnalysisHistory.query.filter(
             AnalysisHistory.user_id == user.user_id,
-            AnalysisHistory.created_at.like(f'{today}%')
+            *today_filter(AnalysisHistory.created_at)
         ).first() is not None
         user_dict['has_analysis'] = has_analysis_today
         
@@ -6025,9 +6162,7 @@ def send_email_campaign(campaign_id):
         # Запускаем отправку рассылки в фоне (можно сделать через Celery в будущем)
         result = send_email_campaign(
             campaign_id=campaign_id,
-            user_manager=app.user_manager,
-            batch_size=10,
-            delay_between_batches=1
+            user_manager=app.user_manager
         )
         
         if result['success']:
@@ -6599,16 +6734,13 @@ def update_question_status(question_id):
 def delete_question(question_id):
     """Удалить вопрос"""
     from app import app
-    from models.sqlite_users import db, Question
+    from models.sqlite_users import db
     
     try:
-        question = Question.query.filter_by(id=question_id).first()
-        if not question:
+        # Вместе с вопросом удаляются его ответы и лайки
+        if not app.user_manager.delete_question(question_id):
             return jsonify({'success': False, 'error': 'Вопрос не найден'}), 404
         
-        db.session.delete(question)
-        db.session.commit()
-        
         logger.info(f"✅ Вопрос {question_id} удален администратором")
         return jsonify({'success': True})
     except Exception as e:
@@ -6620,38 +6752,14 @@ def delete_question(question_id):
 @require_admin_auth
 def delete_answer(answer_id):
     """Удалить ответ на вопрос"""
-    from models.sqlite_users import db, Answer, Question
-    from datetime import datetime
+    from app import app
+    from models.sqlite_users import db
     
     try:
-        answer = Answer.query.filter_by(id=answer_id).first()
-        if not answer:
+        # Счетчик ответов, статус и лучший ответ вопроса обновляются в той же транзакции
+        if not app.user_manager.delete_answer(answer_id):
             return jsonify({'success': False, 'error': 'Ответ не найден'}), 404
         
-        question_id = answer.question_id
-        db.session.delete(answer)
-        db.session.commit()
-        
-        # Обновляем счетчик ответов и статус вопроса
-        question = Question.query.filter_by(id=question_id).first()
-        if question:
-            # Пересчитываем количество ответов
-            remaining_answers = Answer.query.filter_by(question_id=question_id).count()
-            question.answers_count = remaining_answers
-            
-            # Если ответов не осталось, меняем статус на 'open'
-            if remaining_answers == 0:
-                if question.status == 'answered':
-                    question.status = 'open'
-                    logger.info(f"🔄 Статус вопроса {question_id} изменен на 'open' (ответов не осталось)")
-            
-            # Удаляем best_answer_id если удаляемый ответ был лучшим
-            if question.best_answer_id == answer_id:
-                question.best_answer_id = None
-            
-            question.updated_at = datetime.now().isoformat()
-            db.session.commit()
-        
         logger.info(f"✅ Ответ {answer_id} удален администратором")
         return jsonify({'success': True})
     except Exception as e:
@@ -8,10 +8,11 @@ import logging
 from urllib.parse import quote
 from services.file_processing import extract_text_from_file, validate_file
 from services.analysis import analyze_text
-from services.pdf_generator import generate_analysis_pdf
+from services.pdf_render_service import render_analysis_pdf
 from services.export_generator import generate_analysis_word, generate_analysis_excel
 from services.contract_pdf_generator import generate_contract_pdf, generate_contract_pdf_from_data
-from config import PLANS, CHAT_LIMITS
+from config import Config, PLANS, CHAT_LIMITS
+from utils.helpers import today_filter
 from flask_cors import cross_origin, CORS
 from io import BytesIO
 
@@ -45,12 +46,14 @@ def create_user():
         logger.error(f"❌ Ошибка создания пользователя: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-@api_bp.route('/analyze', methods=['POST'])
-@cross_origin()
-def analyze_document():
-    """Анализ документа - поддерживает multipart/form-data и application/json с base64"""
-    from app import app
+def _prepare_analysis_upload(app, ctx):
+    """Прием файла и проверки перед анализом (разделы 1-4 /api/analyze)
+
+    Заполняет ctx данными запроса. Возвращает ответ с ошибкой или None, если
+    можно анализировать. Сохраненный файл (ctx['temp_path']) удаляет вызывающий код.
+    """
     from utils.bot_detector import should_block_request, is_search_bot, get_bot_type
+    from services.visit_buffer import get_visit_buffer
     
     real_ip = app.ip_limit_manager.get_client_ip(request)
     user_agent = request.headers.get('User-Agent', 'Не определен')
@@ -67,7 +70,7 @@ def analyze_document():
     is_bot, bot_type = is_search_bot(user_agent)
     if is_bot:
         bot_display_type = get_bot_type(user_agent)
-        app.user_manager.get_or_create_search_bot(real_ip, user_agent, bot_type)
+        get_visit_buffer().record_bot_visit(real_ip, user_agent, bot_type)
         logger.info(f"🕷️ Поисковый бот обнаружен: {bot_display_type} (IP: {real_ip})")
         # Поисковые боты не должны делать анализ, но мы их записали
         return jsonify({
@@ -102,276 +105,239 @@ def analyze_document():
     filename = ""
     user = None
     
-    try:
-        # РАЗДЕЛ 1: ОПРЕДЕЛЯЕМ ФОРМАТ ЗАПРОСА И ОБРАБАТЫВАЕМ ФАЙЛ
-        if request.content_type and 'application/json' in request.content_type:
-            # 🆕 РЕЖИМ 1: JSON с base64 (для мобильного приложения)
-            logger.info("📱 Режим: JSON с base64 (мобильное приложение)")
-            
-            data = request.get_json()
-            logger.info(f"📱 JSON данные: {data}")
-            
-            if not data:
-                return jsonify({'error': 'Пустой JSON'}), 400
-            
-            # Для мобильного приложения user_id должен быть в сессии или в JSON
-            if not is_authenticated:
-                # Проверяем, не передан ли user_id в JSON (для обратной совместимости)
-                user_id_from_json = data.get('user_id')
-                if user_id_from_json and user_id_from_json != 'default':
-                    # Пытаемся найти пользователя - может быть зарегистрирован
-                    user = app.user_manager.get_user(user_id_from_json)
-                    if user and user.is_registered:
-                        # Пользователь существует и зарегистрирован - используем его
-                        user_id = user_id_from_json
-                        is_authenticated = True
-                        logger.info(f"✅ Найден зарегистрированный пользователь из JSON: {user_id}")
-            
-            file_base64 = data.get('file')
-            filename = data.get('filename', 'document.pdf')
-            mime_type = data.get('mimeType', 'application/octet-stream')
-            
-            if not file_base64:
-                return jsonify({'error': 'Файл не загружен (отсутствует base64)'}), 400
-            
-            # Декодируем base64 в файл
-            import base64
+    # РАЗДЕЛ 1: ОПРЕДЕЛЯЕМ ФОРМАТ ЗАПРОСА И ОБРАБАТЫВАЕМ ФАЙЛ
+    if request.content_type and 'application/json' in request.content_type:
+        # 🆕 РЕЖИМ 1: JSON с base64 (для мобильного приложения)
+        logger.info("📱 Режим: JSON с base64 (мобильное приложение)")
+        
+        data = request.get_json()
+        logger.info(f"📱 JSON данные: {data}")
+        
+        if not data:
+            return jsonify({'error': 'Пустой JSON'}), 400
+        
+        # Для мобильного приложения user_id должен быть в сессии или в JSON
+        if not is_authenticated:
+            # Проверяем, не передан ли user_id в JSON (для обратной совместимости)
+            user_id_from_json = data.get('user_id')
+            if user_id_from_json and user_id_from_json != 'default':
+                # Пытаемся найти пользователя - может быть зарегистрирован
+                user = app.user_manager.get_user(user_id_from_json)
+                if user and user.is_registered:
+                    # Пользователь существует и зарегистрирован - используем его
+                    user_id = user_id_from_json
+                    is_authenticated = True
+                    logger.info(f"✅ Найден зарегистрированный пользователь из JSON: {user_id}")
+        
+        file_base64 = data.get('file')
+        filename = data.get('filename', 'document.pdf')
+        mime_type = data.get('mimeType', 'application/octet-stream')
+        
+        if not file_base64:
+            return jsonify({'error': 'Файл не загружен (отсутствует base64)'}), 400
+        
+        # Декодируем base64 в файл
+        import base64
+        try:
+            file_content = base64.b64decode(file_base64)
+        except Exception as e:
+            logger.error(f"❌ Ошибка декодирования base64: {e}")
+            return jsonify({'error': f'Неверный формат base64: {str(e)}'}), 400
+        
+        # Сохраняем временный файл
+        temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}_{filename}")
+        ctx['temp_path'] = temp_path
+        with open(temp_path, 'wb') as f:
+            f.write(file_content)
+        
+        logger.info(f"📱 Файл сохранен: {temp_path}, размер: {len(file_content)} байт")
+        
+    else:
+        # 📄 РЕЖИМ 2: Multipart/form-data (для веб-сайта)
+        logger.info("🌐 Режим: multipart/form-data (веб-сайт)")
+        
+        # НОВАЯ ЛОГИКА: для веб-сайта user_id НЕ берем из формы для незарегистрированных
+        # Если пользователь авторизован, user_id будет в сессии
+        # Если не авторизован - работаем только с IP
+        
+        logger.info(f"📨 Файлы в запросе: {request.files}")
+        logger.info(f"📨 Форма данные: {request.form}")
+        
+        if 'file' not in request.files:
+            return jsonify({'error': 'Файл не загружен'}), 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': 'Файл не выбран'}), 400
+        
+        filename = file.filename
+        
+        # Валидация файла
+        is_valid, message = validate_file(file)
+        if not is_valid:
+            return jsonify({'error': message}), 400
+        
+        # Сохраняем временный файл
+        temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}_{filename}")
+        ctx['temp_path'] = temp_path
+        file.save(temp_path)
+    
+    # РАЗДЕЛ 2: ПРОВЕРКА ЛИМИТОВ (разная логика для зарегистрированных и незарегистрированных)
+    
+    if is_authenticated:
+        # ========== ЗАРЕГИСТРИРОВАННЫЙ ПОЛЬЗОВАТЕЛЬ ==========
+        logger.info(f"👤 Обработка для ЗАРЕГИСТРИРОВАННОГО пользователя: {user_id}")
+        
+        # Получаем пользователя по user_id из сессии
+        user = app.user_manager.get_user(user_id)
+        if not user or not user.is_registered:
+            logger.error(f"❌ Пользователь {user_id} не найден или не зарегистрирован!")
+            return jsonify({
+                'success': False,
+                'error': 'Пользователь не найден. Пожалуйста, войдите заново.',
+                'login_required': True
+            }), 401
+        
+        # ========== ИЗМЕНЕННАЯ ЛОГИКА ==========
+        # Если тариф бесплатный - сразу на покупку (без бесплатных анализов)
+        if user.plan == 'free':
+            return jsonify({
+                'success': False,
+                'error': '❌ Для продолжения работы необходимо приобрести тариф. Бесплатные анализы после регистрации не предоставляются.',
+                'upgrade_required': True
+            }), 402
+        
+        # Для платных тарифов - проверяем лимиты
+        if not app.user_manager.can_analyze(user_id):
+            return jsonify({
+                'success': False,
+                'error': f'❌ Анализы закончились! Доступно: {user.available_analyses or 0} анализов.',
+                'upgrade_required': True
+            }), 402
+        
+    else:
+        # ========== НЕЗАРЕГИСТРИРОВАННЫЙ ПОЛЬЗОВАТЕЛЬ (ГОСТЬ) ==========
+        logger.info(f"👥 Обработка для НЕЗАРЕГИСТРИРОВАННОГО пользователя (IP: {real_ip})")
+        
+        # Проверяем IP-лимиты (1 анализ в день)
+        if not app.ip_limit_manager.can_analyze_by_ip(request, app.user_manager):
+            # IP лимит превышен - обновляем флаг registration_prompted для гостя
+            # Ищем существующего гостя с этим IP или создаем нового
             try:
-                file_content = base64.b64decode(file_base64)
+                guest = app.user_manager.get_or_create_guest(real_ip, user_agent)
+                guest.registration_prompted = True
+                # Если гость только что создан (analyses_count = 0), это странно, но логируем
+                if guest.analyses_count == 0:
+                    logger.warning(f"⚠️ IP лимит превышен для IP {real_ip}, но у гостя 0 анализов. Возможно, IP изменился между запросами.")
+                from models.sqlite_users import db
+                db.session.commit()
             except Exception as e:
-                logger.error(f"❌ Ошибка декодирования base64: {e}")
-                return jsonify({'error': f'Неверный формат base64: {str(e)}'}), 400
-            
-            # Сохраняем временный файл
-            temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}_{filename}")
-            with open(temp_path, 'wb') as f:
-                f.write(file_content)
-            
-            logger.info(f"📱 Файл сохранен: {temp_path}, размер: {len(file_content)} байт")
-            
-        else:
-            # 📄 РЕЖИМ 2: Multipart/form-data (для веб-сайта)
-            logger.info("🌐 Режим: multipart/form-data (веб-сайт)")
-            
-            # НОВАЯ ЛОГИКА: для веб-сайта user_id НЕ берем из формы для незарегистрированных
-            # Если пользователь авторизован, user_id будет в сессии
-            # Если не авторизован - работаем только с IP
-            
-            logger.info(f"📨 Файлы в запросе: {request.files}")
-            logger.info(f"📨 Форма данные: {request.form}")
-            
-            if 'file' not in request.files:
-                return jsonify({'error': 'Файл не загружен'}), 400
-            
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'error': 'Файл не выбран'}), 400
-            
-            filename = file.filename
+                logger.error(f"❌ Ошибка обновления гостя при превышении лимита: {e}")
             
-            # Валидация файла
-            is_valid, message = validate_file(file)
-            if not is_valid:
-                return jsonify({'error': message}), 400
-            
-            # Сохраняем временный файл
-            temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}_{filename}")
-            file.save(temp_path)
-        
-        # РАЗДЕЛ 2: ПРОВЕРКА ЛИМИТОВ (разная логика для зарегистрированных и незарегистрированных)
+            return jsonify({
+                'success': False,
+                'error': '❌ Бесплатный анализ с этого IP уже использован. Зарегистрируйтесь для продолжения.',
+                'registration_required': True,
+                'ip_limit_exceeded': True
+            }), 403
         
-        if is_authenticated:
-            # ========== ЗАРЕГИСТРИРОВАННЫЙ ПОЛЬЗОВАТЕЛЬ ==========
-            logger.info(f"👤 Обработка для ЗАРЕГИСТРИРОВАННОГО пользователя: {user_id}")
-            
-            # Получаем пользователя по user_id из сессии
-            user = app.user_manager.get_user(user_id)
-            if not user or not user.is_registered:
-                logger.error(f"❌ Пользователь {user_id} не найден или не зарегистрирован!")
-                return jsonify({
-                    'success': False,
-                    'error': 'Пользователь не найден. Пожалуйста, войдите заново.',
-                    'login_required': True
-                }), 401
-            
-            # ========== ИЗМЕНЕННАЯ ЛОГИКА ==========
-            # Если тариф бесплатный - сразу на покупку (без бесплатных анализов)
-            if user.plan == 'free':
-                return jsonify({
-                    'success': False,
-                    'error': '❌ Для продолжения работы необходимо приобрести тариф. Бесплатные анализы после регистрации не предоставляются.',
-                    'upgrade_required': True
-                }), 402
-            
-            # Для платных тарифов - проверяем лимиты
-            if not app.user_manager.can_analyze(user_id):
-                return jsonify({
-                    'success': False,
-                    'error': f'❌ Анализы закончились! Доступно: {user.available_analyses or 0} анализов.',
-                    'upgrade_required': True
-                }), 402
-            
-        else:
-            # ========== НЕЗАРЕГИСТРИРОВАННЫЙ ПОЛЬЗОВАТЕЛЬ (ГОСТЬ) ==========
-            logger.info(f"👥 Обработка для НЕЗАРЕГИСТРИРОВАННОГО пользователя (IP: {real_ip})")
-            
-            # Проверяем IP-лимиты (1 анализ в день)
-            if not app.ip_limit_manager.can_analyze_by_ip(request, app.user_manager):
-                # IP лимит превышен - обновляем флаг registration_prompted для гостя
-                # Ищем существующего гостя с этим IP или создаем нового
-                try:
-                    guest = app.user_manager.get_or_create_guest(real_ip, user_agent)
-                    guest.registration_prompted = True
-                    # Если гость только что создан (analyses_count = 0), это странно, но логируем
-                    if guest.analyses_count == 0:
-                        logger.warning(f"⚠️ IP лимит превышен для IP {real_ip}, но у гостя 0 анализов. Возможно, IP изменился между запросами.")
-                    from models.sqlite_users import db
-                    db.session.commit()
-                except Exception as e:
-                    logger.error(f"❌ Ошибка обновления гостя при превышении лимита: {e}")
-                
+        # ВАЖНО: Увеличиваем счетчик СРАЗУ после проверки, ДО начала анализа
+        # Это гарантирует, что второй запрос будет заблокирован даже если первый упадет с ошибкой
+        if not app.ip_limit_manager.record_ip_usage(request, None):  # user_id=None для незарегистрированных
+            # Параллельный запрос с этого IP (возможно, в другом воркере) уже занял лимит
+            return jsonify({
+                'success': False,
+                'error': '❌ Бесплатный анализ с этого IP уже использован. Зарегистрируйтесь для продолжения.',
+                'registration_required': True,
+                'ip_limit_exceeded': True
+            }), 403
+        logger.info(f"📊 Счетчик IP увеличен ДО анализа: IP={real_ip}")
+        
+        # user остается None для незарегистрированных
+    
+    # РАЗДЕЛ 3: ПРОВЕРКА БЕЛОГО СПИСКА IP (для бизнес-тарифов)
+    if is_authenticated and user:
+        # Проверяем, есть ли у пользователя белый список IP
+        whitelisted_ips = app.user_manager.get_whitelisted_ips(user_id)
+        if whitelisted_ips:
+            # Если белый список не пуст, проверяем IP
+            if not app.user_manager.is_ip_whitelisted(user_id, real_ip):
+                logger.warning(f"🚫 IP {real_ip} не разрешен для пользователя {user_id} (белый список активен)")
                 return jsonify({
                     'success': False,
-                    'error': '❌ Бесплатный анализ с этого IP уже использован. Зарегистрируйтесь для продолжения.',
-                    'registration_required': True,
-                    'ip_limit_exceeded': True
+                    'error': '❌ Доступ разрешен только с корпоративных IP-адресов. Обратитесь к администратору для добавления вашего IP в белый список.',
+                    'ip_whitelist_required': True,
+                    'user_ip': real_ip
                 }), 403
-            
-            # ВАЖНО: Увеличиваем счетчик СРАЗУ после проверки, ДО начала анализа
-            # Это гарантирует, что второй запрос будет заблокирован даже если первый упадет с ошибкой
-            app.ip_limit_manager.record_ip_usage(request, None)  # user_id=None для незарегистрированных
-            logger.info(f"📊 Счетчик IP увеличен ДО анализа: IP={real_ip}")
-            
-            # user остается None для незарегистрированных
-        
-        # РАЗДЕЛ 3: ПРОВЕРКА БЕЛОГО СПИСКА IP (для бизнес-тарифов)
-        if is_authenticated and user:
-            # Проверяем, есть ли у пользователя белый список IP
-            whitelisted_ips = app.user_manager.get_whitelisted_ips(user_id)
-            if whitelisted_ips:
-                # Если белый список не пуст, проверяем IP
-                if not app.user_manager.is_ip_whitelisted(user_id, real_ip):
-                    logger.warning(f"🚫 IP {real_ip} не разрешен для пользователя {user_id} (белый список активен)")
-                    return jsonify({
-                        'success': False,
-                        'error': '❌ Доступ разрешен только с корпоративных IP-адресов. Обратитесь к администратору для добавления вашего IP в белый список.',
-                        'ip_whitelist_required': True,
-                        'user_ip': real_ip
-                    }), 403
-        
-        # РАЗДЕЛ 4: ПРОВЕРКА ТАРИФА ДЛЯ ФОТО (только для зарегистрированных)
-        if is_authenticated:
-            plan_type = user.plan if user else 'free'
-        else:
-            plan_type = 'free'  # Для незарегистрированных - бесплатный тариф
+    
+    # РАЗДЕЛ 4: ПРОВЕРКА ТАРИФА ДЛЯ ФОТО (только для зарегистрированных)
+    if is_authenticated:
+        plan_type = user.plan if user else 'free'
+    else:
+        plan_type = 'free'  # Для незарегистрированных - бесплатный тариф
+    
+    if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+        if plan_type == 'free':
+            logger.info(f"❌ Отказано в анализе фото для {'пользователя' if is_authenticated else 'гостя'}")
+            return jsonify({
+                'success': False,
+                'error': '📸 Распознавание фото доступно только для платных тарифов!',
+                'upgrade_required': True,
+                'message': '💎 Зарегистрируйтесь и перейдите на тариф Стандарт (5 анализов за 590₽, 30 дней) или выше для анализа фото документов'
+            }), 402
+        
+        logger.info(f"✅ Разрешено распознавание фото (тариф: {plan_type})")
+    
+    ctx.update({
+        'filename': filename,
+        'user_id': user_id if is_authenticated else None,
+        'is_authenticated': is_authenticated,
+        'plan_type': plan_type,
+        'real_ip': real_ip,
+        'user_agent': user_agent
+    })
+    return None
+
+@api_bp.route('/analyze', methods=['POST'])
+@cross_origin()
+def analyze_document():
+    """Анализ документа - поддерживает multipart/form-data и application/json с base64"""
+    from app import app
+    from services.analysis_pipeline import rollback_guest_ip_usage, finalize_analysis
+    
+    ctx = {'temp_path': None}
+    
+    try:
+        # РАЗДЕЛЫ 1-4: ПРИЕМ ФАЙЛА, ЛИМИТЫ, БЕЛЫЙ СПИСОК IP, ТАРИФ ДЛЯ ФОТО
+        error_response = _prepare_analysis_upload(app, ctx)
+        if error_response is not None:
+            return error_response
         
-        if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-            if plan_type == 'free':
-                logger.info(f"❌ Отказано в анализе фото для {'пользователя' if is_authenticated else 'гостя'}")
-                return jsonify({
-                    'success': False,
-                    'error': '📸 Распознавание фото доступно только для платных тарифов!',
-                    'upgrade_required': True,
-                    'message': '💎 Зарегистрируйтесь и перейдите на тариф Стандарт (5 анализов за 590₽, 30 дней) или выше для анализа фото документов'
-                }), 402
-            
-            logger.info(f"✅ Разрешено распознавание фото (тариф: {plan_type})")
+        is_authenticated = ctx['is_authenticated']
         
         # РАЗДЕЛ 5: ИЗВЛЕЧЕНИЕ ТЕКСТА И АНАЛИЗ
         # Извлекаем текст
-        text = extract_text_from_file(temp_path, filename)
+        text = extract_text_from_file(ctx['temp_path'], ctx['filename'], max_chars=Config.PDF_TEXT_CHAR_BUDGET)
         
         # Проверяем что текст извлекся
         if not text or len(text.strip()) < 10:
             # Если анализ не удался из-за ошибки файла, откатываем счетчик для незарегистрированных
             if not is_authenticated:
-                try:
-                    real_ip = app.ip_limit_manager.get_client_ip(request)
-                    if real_ip in app.ip_limit_manager.ip_limits:
-                        app.ip_limit_manager.ip_limits[real_ip]['used_today'] = max(0, app.ip_limit_manager.ip_limits[real_ip]['used_today'] - 1)
-                        app.ip_limit_manager.save_ip_limits()
-                        logger.info(f"🔄 Откат счетчика IP из-за ошибки файла: IP={real_ip}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отката счетчика IP: {e}")
+                rollback_guest_ip_usage(app, ctx['real_ip'])
             return jsonify({'error': 'Не удалось извлечь текст из файла'}), 400
         
         # Анализируем текст (передаем user_id для загрузки настроек анализа)
         analysis_result = analyze_text(
             text, 
-            plan_type, 
+            ctx['plan_type'], 
             is_authenticated=is_authenticated,
-            user_id=user_id if is_authenticated else None
+            user_id=ctx['user_id']
         )
         
-        logger.info(f"✅ АНАЛИЗ УСПЕШЕН для {'пользователя' if is_authenticated else 'гостя'}, IP: {real_ip}")
-        
-        # РАЗДЕЛ 6: ЗАПИСЬ ИСПОЛЬЗОВАНИЯ И ИСТОРИИ
-        if is_authenticated:
-            # Для зарегистрированных: записываем использование и историю
-            app.user_manager.record_usage(user_id)
-            try:
-                app.user_manager.save_analysis_history(user_id, filename, analysis_result)
-            except Exception as e:
-                logger.warning(f"⚠️ Не удалось сохранить историю анализа: {e}")
-        else:
-            # Для незарегистрированных: записываем только в guests
-            # ВАЖНО: IP-лимиты уже обновлены ДО анализа (см. выше), здесь только обновляем guests
-            guest = app.user_manager.record_guest_analysis(real_ip, user_agent)
-            logger.info(f"👤 Гость записан: IP={real_ip}, analyses_count={guest.analyses_count}, registration_prompted={guest.registration_prompted}")
-            # История анализов НЕ сохраняется для незарегистрированных
-        
-        # РАЗДЕЛ 7: ФОРМИРОВАНИЕ ОТВЕТА
-        # Добавляем информацию о лимитах в ответ
-        if is_authenticated:
-            # Для зарегистрированных - получаем актуальные данные пользователя
-            user = app.user_manager.get_user(user_id)
-            plan = PLANS[user.plan] if user else PLANS['free']
-            
-            # Для бесплатного тарифа используем free_analysis_used (но теперь он всегда 0 после регистрации)
-            if user and user.plan == 'free':
-                remaining = 0
-                analysis_result['usage_info'] = {
-                    'free_analysis_used': True,
-                    'remaining': remaining,
-                    'plan_name': plan['name'],
-                    'is_registered': True,
-                    'available_analyses': 0,
-                    'upgrade_required': True
-                }
-            else:
-                # Для платных тарифов используем available_analyses
-                analysis_result['usage_info'] = {
-                    'available_analyses': user.available_analyses if user else 0,
-                    'plan_name': plan['name'],
-                    'is_registered': True
-                }
-        else:
-            # Для незарегистрированных показываем что бесплатный анализ использован
-            analysis_result['usage_info'] = {
-                'used_today': 1,
-                'daily_limit': 1,
-                'plan_name': 'Пробный',
-                'remaining': 0,
-                'free_analysis_used': True,
-                'registration_required': True,
-                'is_registered': False
-            }
-        
-        # Добавляем флаг is_authenticated в результат для фронтенда
-        analysis_result['is_authenticated'] = is_authenticated
-        
-        # Возвращаем результат (user_id только для зарегистрированных)
-        response_data = {
-            'success': True,
-            'filename': filename,
-            'result': analysis_result
-        }
-        
-        # Добавляем user_id только если пользователь авторизован
-        if is_authenticated:
-            response_data['user_id'] = user_id
+        logger.info(f"✅ АНАЛИЗ УСПЕШЕН для {'пользователя' if is_authenticated else 'гостя'}, IP: {ctx['real_ip']}")
         
-        return jsonify(response_data)
+        # РАЗДЕЛЫ 6-7: ЗАПИСЬ ИСПОЛЬЗОВАНИЯ, ИСТОРИИ И ФОРМИРОВАНИЕ ОТВЕТА
+        return jsonify(finalize_analysis(app, ctx, analysis_result))
 
     except Exception as e:
         logger.error(f"❌ Ошибка анализа документа: {e}")
@@ -380,11 +346,142 @@ def analyze_document():
     finally:
         # Удаляем временный файл
         try:
-            if temp_path and os.path.exists(temp_path):
-                os.unlink(temp_path)
+            if ctx['temp_path'] and os.path.exists(ctx['temp_path']):
+                os.unlink(ctx['temp_path'])
         except Exception as e:
             logger.error(f"❌ Ошибка при удалении временного файла: {e}")
 
+@api_bp.route('/analyze/async', methods=['POST'])
+@cross_origin()
+def analyze_document_async():
+    """Асинхронный анализ документа: принимает файл и сразу возвращает job_id
+
+    Анализ выполняет воркер персистентной очереди (тип задачи 'analysis').
+    Прогресс и результат - опросом GET /api/analyze/jobs/<job_id>/events?after=<id>
+    или GET /api/analyze/jobs/<job_id>.
+    """
+    from app import app
+    from services.analysis_pipeline import (
+        create_analysis_job, enqueue_analysis_job, update_analysis_job, release_analysis_quota
+    )
+    
+    ctx = {'temp_path': None}
+    job_id = None
+    handed_off = False
+    
+    try:
+        # Те же проверки, что и у /api/analyze (лимиты, белый список IP, тариф для фото)
+        error_response = _prepare_analysis_upload(app, ctx)
+        if error_response is not None:
+            return error_response
+        
+        # Анализ списывается сразу (атомарно в БД), а не по завершении задачи: иначе
+        # несколько одновременных загрузок проходят can_analyze и превышают лимит тарифа.
+        # Если задача провалится, лимит вернет обработчик очереди.
+        if ctx['is_authenticated']:
+            ctx['reservation'] = app.user_manager.reserve_analysis(ctx['user_id'])
+            if not ctx['reservation']:
+                return jsonify({
+                    'success': False,
+                    'error': '❌ Анализы закончились! Дождитесь завершения уже запущенных анализов или пополните тариф.',
+                    'upgrade_required': True
+                }), 402
+        
+        job_id = create_analysis_job(ctx)
+        enqueue_analysis_job(job_id, ctx)
+        handed_off = True  # Временный файл удалит задача очереди
+        
+        logger.info(f"📥 Асинхронный анализ {job_id} принят: {ctx['filename']}")
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status': 'queued',
+            'events_url': f'/api/analyze/jobs/{job_id}/events',
+            'status_url': f'/api/analyze/jobs/{job_id}'
+        }), 202
+    
+    except Exception as e:
+        logger.error(f"❌ Ошибка запуска асинхронного анализа: {e}")
+        if not handed_off:
+            if job_id:
+                try:
+                    update_analysis_job(job_id, status='failed', error=f'Ошибка обработки: {str(e)}')
+                except Exception as db_error:
+                    logger.error(f"❌ Ошибка сохранения статуса анализа {job_id}: {db_error}")
+            if 'real_ip' in ctx:
+                release_analysis_quota(app, ctx)
+        return jsonify({'error': f'Ошибка обработки: {str(e)}'}), 500
+    
+    finally:
+        if not handed_off:
+            try:
+                if ctx['temp_path'] and os.path.exists(ctx['temp_path']):
+                    os.unlink(ctx['temp_path'])
+            except Exception as e:
+                logger.error(f"❌ Ошибка при удалении временного файла: {e}")
+
+def _get_own_analysis_job(app, job_id):
+    """Задача асинхронного анализа, если она принадлежит текущему пользователю (гостю - по IP)"""
+    from models.sqlite_users import AnalysisJob
+    
+    job = AnalysisJob.query.get(job_id)
+    if not job:
+        return None
+    if job.user_id:
+        return job if session.get('user_id') == job.user_id else None
+    return job if app.ip_limit_manager.get_client_ip(request) == job.ip_address else None
+
+@api_bp.route('/analyze/jobs/<job_id>', methods=['GET'])
+@cross_origin()
+def get_analysis_job(job_id):
+    """Статус и результат асинхронного анализа (без истории этапов)"""
+    from app import app
+    
+    job = _get_own_analysis_job(app, job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+@api_bp.route('/analyze/jobs/<job_id>/events', methods=['GET'])
+@cross_origin()
+def analysis_job_events(job_id):
+    """Новые события этапов асинхронного анализа (короткий опрос)
+
+    Отвечает сразу: события с id больше after (или заголовка Last-Event-ID),
+    статус и, когда задача завершена, результат или ошибку. Пока анализ идет,
+    клиент повторяет запрос через poll_after_ms - соединение не держит
+    синхронный воркер gunicorn.
+    """
+    import json
+    from app import app
+    
+    job = _get_own_analysis_job(app, job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+    
+    try:
+        after = int(request.args.get('after') or request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        after = 0
+    
+    events = [event for event in json.loads(job.events_json or '[]') if event['id'] > after]
+    response = {
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'stage': job.stage,
+        'progress': job.progress,
+        'events': events,
+        'last_event_id': events[-1]['id'] if events else after
+    }
+    if job.status == 'completed':
+        response['result'] = json.loads(job.result_json) if job.result_json else None
+    elif job.status == 'failed':
+        response['error'] = job.error_message
+    else:
+        response['poll_after_ms'] = int(Config.ANALYSIS_POLL_INTERVAL_SECONDS * 1000)
+    return jsonify(response)
+
 @api_bp.route('/usage', methods=['GET'])
 def get_usage():
     """Получить информацию об использовании"""
@@ -560,7 +657,7 @@ def download_analysis():
                 file_extension = 'xlsx'
             else:  # pdf по умолчанию
                 logger.info(f"📄 Генерация PDF: filename={filename}, branding={branding_settings is not None}")
-                file_content = generate_analysis_pdf(analysis_data, filename, branding_settings)
+                file_content = render_analysis_pdf(analysis_data, filename, branding_settings)
                 mime_type = 'application/pdf'
                 file_extension = 'pdf'
             
@@ -1591,6 +1688,55 @@ def get_batch_task_status(task_id):
         logger.error(f"❌ Ошибка получения статуса задачи: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@api_bp.route('/user/batch-processing/<int:task_id>/export', methods=['GET'])
+def export_batch_task(task_id):
+    """Выгрузить все анализы пакетной задачи одной книгой Excel"""
+    from app import app
+    from utils.batch_processor import BatchProcessor
+    from services.export_generator import generate_batch_excel
+
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'error': 'Требуется авторизация'}), 401
+
+    user = app.user_manager.get_user(user_id)
+    if not user or not check_plan_feature(user.plan, 'export_excel'):
+        return jsonify({'success': False, 'error': 'Экспорт в Excel недоступен для вашего тарифа'}), 403
+
+    try:
+        task_dict, error = BatchProcessor.get_task_status(task_id)
+        if error:
+            return jsonify({'success': False, 'error': error}), 404
+
+        # Проверяем, что задача принадлежит пользователю
+        if task_dict['user_id'] != user_id:
+            return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+
+        branding_settings = None
+        try:
+            branding_settings = app.user_manager.get_branding_settings(user_id)
+        except Exception as branding_error:
+            logger.warning(f"⚠️ Ошибка получения брендинга: {branding_error}")
+
+        # Книга пишется во временный файл и отдается из него - без копии в памяти
+        export_file = tempfile.TemporaryFile(suffix='.xlsx')
+        try:
+            generate_batch_excel(task_id, export_file, branding_settings)
+            export_file.seek(0)
+        except Exception:
+            export_file.close()
+            raise
+
+        return send_file(
+            export_file,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'batch_{task_id}.xlsx'
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка выгрузки пакетной задачи {task_id}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @api_bp.route('/user/batch-processing', methods=['GET'])
 def get_user_batch_tasks():
     """Получить все пакетные задачи пользователя"""
@@ -1636,11 +1782,10 @@ def create_document_comparison():
         if comparison_limit != -1:
             # Проверяем количество сравнений пользователя за текущий месяц
             from models.sqlite_users import DocumentComparison
-            from datetime import datetime
-            current_month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            from utils.helpers import date_range_filter, month_bounds
             comparisons_this_month = DocumentComparison.query.filter(
                 DocumentComparison.user_id == user_id,
-                DocumentComparison.created_at >= current_month_start.isoformat()
+                *date_range_filter(DocumentComparison.created_at, *month_bounds())
             ).count()
             if comparisons_this_month >= comparison_limit:
                 return jsonify({'success': False, 'error': f'Достигнут лимит сравнений для вашего тарифа ({comparison_limit} в месяц)'}), 403
@@ -1690,15 +1835,10 @@ def create_document_comparison():
         if error:
             return jsonify({'success': False, 'error': error}), 400
         
-        # Запускаем сравнение в фоне
-        import threading
-        def compare_in_background():
-            with app.app_context():
-                DocumentComparator.compare_documents(comparison_id, user_id, app)
-        
-        thread = threading.Thread(target=compare_in_background)
-        thread.daemon = True
-        thread.start()
+        # Запускаем сравнение в фоне (через очередь задач)
+        _, error = DocumentComparator.compare_documents_async(comparison_id, user_id)
+        if error:
+            return jsonify({'success': False, 'error': error}), 500
         
         return jsonify({
             'success': True,
@@ -1784,10 +1924,9 @@ def chat_ask():
         chat_limit = CHAT_LIMITS.get(user_plan, 1)  # По умолчанию 1 для free
         
         # Подсчитываем вопросы за сегодня
-        today = datetime.now().strftime('%Y-%m-%d')
         messages_today = ChatMessage.query.filter(
             ChatMessage.user_id == user_id,
-            ChatMessage.created_at.like(f'{today}%')
+            *today_filter(ChatMessage.created_at)
         ).count()
         
         # Проверка лимита
@@ -1868,8 +2007,6 @@ def chat_limits():
     """Получить информацию о лимитах чата для текущего пользователя"""
     from app import app
     from config import CHAT_LIMITS
-    from datetime import datetime
-    from models.sqlite_users import db
     from models.sqlite_users import ChatMessage
     
     try:
@@ -1899,10 +2036,9 @@ def chat_limits():
         chat_limit = CHAT_LIMITS.get(user_plan, 0)
         
         # Подсчитываем вопросы за сегодня
-        today = datetime.now().strftime('%Y-%m-%d')
         messages_today = ChatMessage.query.filter(
             ChatMessage.user_id == user_id,
-            ChatMessage.created_at.like(f'{today}%')
+            *today_filter(ChatMessage.created_at)
         ).count()
         
         remaining = max(0, chat_limit - messages_today)
@@ -14,9 +14,10 @@ import os
 import base64
 import uuid
 import logging
-from services.file_processing import extract_text_from_file, validate_file
+from services.file_processing import extract_text_with_pages, validate_file
 from services.analysis import analyze_text
 from utils.api_key_manager import APIKeyManager
+from config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -138,7 +139,7 @@ def analyze_document():
             file.save(temp_path)
         
         # Извлекаем текст из файла
-        text, pages_count = extract_text_from_file(temp_path)
+        text, pages_count = extract_text_with_pages(temp_path, filename, max_chars=Config.PDF_TEXT_CHAR_BUDGET)
         
         if not text or len(text.strip()) < 50:
             return jsonify({
@@ -42,29 +42,18 @@ def tariffs():
 def business_ip():
     """Интерактивный конструктор договоров (без ИИ)"""
     try:
-        from datetime import datetime
         from flask import session, request
         from app import app
-        from models.sqlite_users import db, PageView
+        from services.visit_buffer import get_visit_buffer
 
         real_ip = app.ip_limit_manager.get_client_ip(request) if hasattr(app, 'ip_limit_manager') else request.remote_addr
         user_agent = request.headers.get('User-Agent', '')
-        user_id = session.get('user_id')
-
-        db.session.add(PageView(
-            path='/business-ip',
-            ip_address=real_ip,
-            user_id=user_id,
-            user_agent=user_agent[:500] if user_agent else None,
-            created_at=datetime.now().isoformat()
-        ))
-        db.session.commit()
+
+        # Просмотр попадает в БД при сбросе буфера визитов
+        get_visit_buffer().record_page_view('/business-ip', real_ip, session.get('user_id'), user_agent)
     except Exception:
         # Статистика не должна ломать страницу
-        try:
-            db.session.rollback()
-        except Exception:
-            pass
+        pass
     return render_template('business-ip.html')
 
 @main_bp.route('/api')
@@ -74,131 +63,43 @@ def api_docs():
     return render_template('api.html')
 
 @main_bp.route('/sitemap.xml')
-def sitemap():
-    """Sitemap для SEO с динамическими датами"""
-    from datetime import datetime
-    base_url = "https://docscan-ai.ru"
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    # Приоритетные страницы (обновляются часто)
-    priority_pages = [
-        ('/', 'daily', '1.0'),
-        ('/news', 'weekly', '0.9'),
-        ('/analiz-dokumentov', 'weekly', '0.9'),
-        ('/proverka-dogovorov', 'weekly', '0.9'),
-        ('/business-ip', 'weekly', '0.8'),
-        ('/articles', 'weekly', '0.9'),
-        ('/questions', 'daily', '0.9'),
-        ('/faq', 'monthly', '0.8'),
-        ('/calculator-penalty', 'monthly', '0.8'),
-        ('/mobile-app', 'weekly', '0.8'),
-        ('/proverka-dokumentov-onlayn', 'weekly', '0.9'),
-        ('/articles/nalogovaya-proverka', 'monthly', '0.8'),
-        ('/partners', 'weekly', '0.8'),
-        ('/tariffs', 'weekly', '0.9'),
-    ]
-    
-    # Статьи (обновляются реже)
-    articles = [
-        '/articles/about',
-        '/articles/guide',
-        '/articles/tech',
-        '/articles/rent',
-        '/articles/labor',
-        '/articles/tax',
-        '/articles/business-protection',
-        '/articles/freelance-gph',
-        '/articles/ipoteka-2025',
-        '/articles/lizing',
-        '/articles/strahovanie',
-        '/articles/okazanie-uslug',
-    ]
-    
-    # Дополнительные страницы
-    additional_pages = [
-        ('/riski-dogovora-zayma', 'weekly', '0.9'),
-        ('/avtokredit-skrytye-usloviya', 'monthly', '0.8'),
-        ('/ii-dlya-proverki-dogovorov-onlayn-besplatno', 'monthly', '0.8'),
-        ('/medicinskie-dokumenty-analiz', 'monthly', '0.8'),
-        ('/contact', 'monthly', '0.7'),
-    ]
-    
-    # Служебные страницы (низкий приоритет)
-    service_pages = [
-        ('/terms', 'yearly', '0.3'),
-        ('/privacy', 'yearly', '0.3'),
-        ('/offer', 'yearly', '0.3'),
-    ]
-    
-    sitemap_xml = f'''<?xml version="1.0" encoding="UTF-8"?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
-        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">'''
-    
-    # Приоритетные страницы
-    for url, changefreq, priority in priority_pages:
-        sitemap_xml += f'''
-    <url>
-        <loc>{base_url}{url}</loc>
-        <lastmod>{today}</lastmod>
-        <changefreq>{changefreq}</changefreq>
-        <priority>{priority}</priority>
-    </url>'''
-    
-    # Статьи
-    for article in articles:
-        sitemap_xml += f'''
-    <url>
-        <loc>{base_url}{article}</loc>
-        <lastmod>{today}</lastmod>
-        <changefreq>monthly</changefreq>
-        <priority>0.8</priority>
-    </url>'''
-    
-    # Дополнительные страницы
-    for url, changefreq, priority in additional_pages:
-        sitemap_xml += f'''
-    <url>
-        <loc>{base_url}{url}</loc>
-        <lastmod>{today}</lastmod>
-        <changefreq>{changefreq}</changefreq>
-        <priority>{priority}</priority>
-    </url>'''
-    
-    # Служебные страницы
-    for url, changefreq, priority in service_pages:
-        sitemap_xml += f'''
-    <url>
-        <loc>{base_url}{url}</loc>
-        <lastmod>{today}</lastmod>
-        <changefreq>{changefreq}</changefreq>
-        <priority>{priority}</priority>
-    </url>'''
-    
-    # Вопросы (динамически из базы данных)
+@main_bp.route('/sitemap-<any(pages, articles, news):section>.xml')
+@main_bp.route('/sitemap-questions-<int:shard>.xml')
+def sitemap(section=None, shard=None):
+    """Sitemap для SEO: индекс и дочерние файлы, заранее построенные в SITEMAP_DIR"""
+    from flask import send_file, abort
+    import os
+    from services.sitemap import get_sitemap_builder, INDEX_FILE
+
+    if shard is not None:
+        filename = f'sitemap-questions-{shard}.xml'
+    elif section:
+        filename = f'sitemap-{section}.xml'
+    else:
+        filename = INDEX_FILE
+
+    builder = get_sitemap_builder()
     try:
-        from app import app
-        questions = app.user_manager.get_questions(limit=1000, offset=0, sort_by='newest')
-        for question in questions:
-            question_date = question.get('updated_at', question.get('created_at', today))
-            if isinstance(question_date, str) and len(question_date) > 10:
-                question_date = question_date[:10]
-            elif isinstance(question_date, str):
-                question_date = today
-            sitemap_xml += f'''
-    <url>
-        <loc>{base_url}/questions/{question['id']}</loc>
-        <lastmod>{question_date}</lastmod>
-        <changefreq>weekly</changefreq>
-        <priority>0.8</priority>
-    </url>'''
+        builder.ensure_fresh()
     except Exception as e:
-        # Если ошибка при получении вопросов, просто пропускаем
-        pass
-    
-    sitemap_xml += '''
-</urlset>'''
-    
-    return sitemap_xml, 200, {'Content-Type': 'application/xml'}
+        # Отдаем последнюю построенную версию, если она есть
+        logger.error(f"❌ Ошибка обновления sitemap: {e}")
+
+    path = builder.path(filename)
+    if not os.path.exists(path):
+        abort(404)
+
+    response = send_file(
+        path,
+        mimetype='application/xml',
+        conditional=True,
+        etag=builder.etag(filename) or True,
+        last_modified=os.path.getmtime(path)
+    )
+    # Поисковики перепроверяют sitemap сами - даем им кешировать на время проверки изменений
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
 
 @main_bp.route('/robots.txt')
 def robots():
@@ -356,17 +257,20 @@ def questions():
     status = request.args.get('status', None)
     sort_by = request.args.get('sort', 'newest')
     page = int(request.args.get('page', 1))
+    after = request.args.get('after')  # Курсор keyset-пагинации со ссылки "Следующая"
     limit = 20
     offset = (page - 1) * limit
     
     # Получаем вопросы
-    questions_list = app.user_manager.get_questions(
+    questions_page = app.user_manager.get_questions_page(
         category=category,
         status=status,
         limit=limit,
         offset=offset,
-        sort_by=sort_by
+        sort_by=sort_by,
+        after=after
     )
+    questions_list = questions_page['questions']
     
     # Категории для фильтра
     categories = [
@@ -386,7 +290,8 @@ def questions():
                          current_category=category,
                          current_status=status,
                          current_sort=sort_by,
-                         current_page=page)
+                         current_page=page,
+                         next_cursor=questions_page['next_cursor'])
 
 @main_bp.route('/questions/ask')
 def ask_question():
@@ -432,8 +337,6 @@ def question_detail(question_id):
     """Страница просмотра вопроса с ответами"""
     from app import app
     from flask import request, session
-    from models.sqlite_users import db, Question, Answer
-    from datetime import datetime
     RussianLogger.log_page_view(f"Вопрос #{question_id}")
     
     # Получаем вопрос
@@ -446,28 +349,15 @@ def question_detail(question_id):
     sort_by = request.args.get('sort', 'best_first')
     answers = app.user_manager.get_answers(question_id, sort_by=sort_by)
     
-    # ИСПРАВЛЕНИЕ: Проверяем и обновляем статус вопроса на основе реального количества ответов
+    question_dict = question.to_dict()
+    
+    # Показываем фактическое число ответов; расхождение в БД исправит фоновая сверка счетчиков
     real_answers_count = len(answers)
+    question_dict['answers_count'] = real_answers_count
     if real_answers_count == 0 and question.status == 'answered':
-        # Если ответов нет, но статус "answered", меняем на "open"
-        question.status = 'open'
-        question.answers_count = 0
-        question.updated_at = datetime.now().isoformat()
-        db.session.commit()
-        logger.info(f"🔄 Статус вопроса {question_id} обновлен на 'open' (ответов нет)")
+        question_dict['status'] = 'open'
     elif real_answers_count > 0 and question.status == 'open':
-        # Если есть ответы, но статус "open", меняем на "answered"
-        question.status = 'answered'
-        question.answers_count = real_answers_count
-        question.updated_at = datetime.now().isoformat()
-        db.session.commit()
-        logger.info(f"🔄 Статус вопроса {question_id} обновлен на 'answered' ({real_answers_count} ответов)")
-    elif question.answers_count != real_answers_count:
-        # Синхронизируем счетчик ответов
-        question.answers_count = real_answers_count
-        db.session.commit()
-    
-    question_dict = question.to_dict()
+        question_dict['status'] = 'answered'
     
     # Проверяем, лайкнул ли пользователь каждый ответ
     user_id = session.get('user_id')
@@ -4,7 +4,7 @@ from config import PLANS, SMART_ANALYSIS_CONFIG, RISK_LEVELS
 
 logger = logging.getLogger(__name__)
 
-def analyze_text(text, user_plan='free', is_authenticated=False, user_id=None, analysis_settings=None):
+def analyze_text(text, user_plan='free', is_authenticated=False, user_id=None, analysis_settings=None, document_type=None):
     """Умная функция анализа с определением типа документа
     
     Args:
@@ -13,10 +13,12 @@ def analyze_text(text, user_plan='free', is_authenticated=False, user_id=None, a
         is_authenticated: Авторизован ли пользователь
         user_id: ID пользователя (для загрузки настроек)
         analysis_settings: Настройки анализа (если уже загружены)
+        document_type: Тип документа (если уже определен)
     """
     
     # Определяем тип документа
-    document_type = detect_document_type(text)
+    if not document_type:
+        document_type = detect_document_type(text)
     doc_config = SMART_ANALYSIS_CONFIG[document_type]
     
     logger.info(f"🔍 Анализируем документ типа: {doc_config['name']}, план пользователя: {user_plan}, зарегистрирован: {is_authenticated}")
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш результатов анализа YandexGPT
+
+Ключ кеша - SHA-256 от нормализованного текста документа, типа документа
+и эффективных настроек анализа. Хранилище - отдельная SQLite-база с TTL
+и вытеснением по LRU (по количеству записей и суммарному размеру).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Версия формата ключа/промпта: при изменении промпта увеличиваем, чтобы старые записи не использовались
+CACHE_KEY_VERSION = 1
+
+# Поля настроек анализа, которые влияют на промпт
+SETTINGS_KEY_FIELDS = (
+    'legal_priority',
+    'financial_priority',
+    'operational_priority',
+    'strategic_priority',
+    'detail_level',
+    'custom_checks'
+)
+
+
+def normalize_text(text):
+    """Нормализует текст для ключа кеша (схлопывает пробелы и переводы строк)"""
+    if not text:
+        return ''
+    return ' '.join(text.split())
+
+
+def effective_settings(analysis_settings):
+    """Возвращает только те настройки анализа, которые реально попадают в промпт"""
+    if not analysis_settings or analysis_settings.get('use_default'):
+        return None
+    return {field: analysis_settings.get(field) for field in SETTINGS_KEY_FIELDS}
+
+
+def make_cache_key(text, document_type, analysis_settings=None):
+    """Формирует ключ кеша для анализа"""
+    payload = json.dumps({
+        'v': CACHE_KEY_VERSION,
+        'document_type': document_type,
+        'settings': effective_settings(analysis_settings)
+    }, ensure_ascii=False, sort_keys=True)
+
+    hasher = hashlib.sha256()
+    hasher.update(payload.encode('utf-8'))
+    hasher.update(b'\x00')
+    hasher.update(normalize_text(text).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class AnalysisCache:
+    """SQLite-кеш результатов анализа с TTL и LRU-вытеснением"""
+
+    def __init__(self, db_path, ttl_seconds=7 * 24 * 3600, max_entries=5000, max_bytes=200 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        """Открывает соединение с базой кеша (одно соединение на операцию - безопасно для потоков)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._initialized:
+            self._init_schema(conn)
+        return conn
+
+    def _init_schema(self, conn):
+        """Создает таблицы кеша при первом обращении"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    document_type TEXT,
+                    result_json TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_accessed
+                    ON analysis_cache (last_accessed);
+                CREATE TABLE IF NOT EXISTS analysis_cache_stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                );
+            ''')
+            conn.commit()
+            self._initialized = True
+
+    def _bump_counter(self, conn, name, delta=1):
+        conn.execute(
+            'INSERT INTO analysis_cache_stats (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, delta)
+        )
+
+    def get(self, cache_key):
+        """Возвращает сохраненный результат или None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT result_json, created_at FROM analysis_cache WHERE cache_key = ?',
+                (cache_key,)
+            ).fetchone()
+
+            if row and now - row[1] > self.ttl_seconds:
+                conn.execute('DELETE FROM analysis_cache WHERE cache_key = ?', (cache_key,))
+                self._bump_counter(conn, 'expired')
+                row = None
+
+            if not row:
+                self._bump_counter(conn, 'misses')
+                conn.commit()
+                return None
+
+            conn.execute(
+                'UPDATE analysis_cache SET last_accessed = ?, hits = hits + 1 WHERE cache_key = ?',
+                (now, cache_key)
+            )
+            self._bump_counter(conn, 'hits')
+            conn.commit()
+            return json.loads(row[0])
+        finally:
+            conn.close()
+
+    def set(self, cache_key, result, document_type=None):
+        """Сохраняет результат анализа и при необходимости вытесняет старые записи"""
+        result_json = json.dumps(result, ensure_ascii=False)
+        size_bytes = len(result_json.encode('utf-8'))
+        now = time.time()
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO analysis_cache '
+                '(cache_key, document_type, result_json, size_bytes, created_at, last_accessed, hits) '
+                'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                (cache_key, document_type, result_json, size_bytes, now, now)
+            )
+            self._bump_counter(conn, 'stores')
+            self._evict(conn, now)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _evict(self, conn, now):
+        """Удаляет просроченные записи и вытесняет наименее используемые сверх лимитов"""
+        expired = conn.execute(
+            'DELETE FROM analysis_cache WHERE created_at < ?',
+            (now - self.ttl_seconds,)
+        ).rowcount
+        if expired:
+            self._bump_counter(conn, 'expired', expired)
+
+        count, total_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM analysis_cache'
+        ).fetchone()
+
+        evicted = 0
+        if self.max_entries and count > self.max_entries:
+            evicted += conn.execute(
+                'DELETE FROM analysis_cache WHERE cache_key IN ('
+                'SELECT cache_key FROM analysis_cache ORDER BY last_accessed ASC LIMIT ?)',
+                (count - self.max_entries,)
+            ).rowcount
+            total_bytes = conn.execute(
+                'SELECT COALESCE(SUM(size_bytes), 0) FROM analysis_cache'
+            ).fetchone()[0]
+
+        if self.max_bytes and total_bytes > self.max_bytes:
+            rows = conn.execute(
+                'SELECT cache_key, size_bytes FROM analysis_cache ORDER BY last_accessed ASC'
+            ).fetchall()
+            to_delete = []
+            for key, size in rows:
+                if total_bytes <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                total_bytes -= size
+            conn.executemany('DELETE FROM analysis_cache WHERE cache_key = ?', to_delete)
+            evicted += len(to_delete)
+
+        if evicted:
+            self._bump_counter(conn, 'evictions', evicted)
+            logger.info(f"🧹 Кеш анализов: вытеснено {evicted} записей")
+
+    def get_stats(self):
+        """Статистика кеша: попадания, промахи, размер"""
+        conn = self._connect()
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM analysis_cache_stats').fetchall())
+            count, total_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM analysis_cache'
+            ).fetchone()
+        finally:
+            conn.close()
+
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            'enabled': Config.ANALYSIS_CACHE_ENABLED,
+            'entries': count,
+            'size_bytes': total_bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': hits,
+            'misses': misses,
+            'stores': counters.get('stores', 0),
+            'evictions': counters.get('evictions', 0),
+            'expired': counters.get('expired', 0),
+            'hit_rate': round(hits / lookups * 100, 1) if lookups else 0
+        }
+
+    def clear(self):
+        """Полностью очищает кеш (счетчики сохраняются)"""
+        conn = self._connect()
+        try:
+            deleted = conn.execute('DELETE FROM analysis_cache').rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    """Возвращает общий экземпляр кеша анализов"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                cache_dir = os.path.dirname(Config.ANALYSIS_CACHE_PATH)
+                if cache_dir:
+                    os.makedirs(cache_dir, exist_ok=True)
+                _cache_instance = AnalysisCache(
+                    Config.ANALYSIS_CACHE_PATH,
+                    ttl_seconds=Config.ANALYSIS_CACHE_TTL,
+                    max_entries=Config.ANALYSIS_CACHE_MAX_ENTRIES,
+                    max_bytes=Config.ANALYSIS_CACHE_MAX_BYTES
+                )
+    return _cache_instance
+
+
+def get_cached_analysis(text, document_type, analysis_settings=None):
+    """Ищет результат в кеше. Возвращает (cache_key, result или None)"""
+    if not Config.ANALYSIS_CACHE_ENABLED:
+        return None, None
+    cache_key = make_cache_key(text, document_type, analysis_settings)
+    try:
+        return cache_key, get_analysis_cache().get(cache_key)
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка чтения кеша анализов: {e}")
+        return cache_key, None
+
+
+def store_cached_analysis(cache_key, result, document_type=None):
+    """Сохраняет успешный результат анализа в кеш"""
+    if not Config.ANALYSIS_CACHE_ENABLED or not cache_key:
+        return
+    # Результаты-заглушки (ошибка API, нет ключей) и неполный анализ по частям не кешируем
+    if not result or not result.get('ai_used') or result.get('partial'):
+        return
+    try:
+        get_analysis_cache().set(cache_key, result, document_type)
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка записи в кеш анализов: {e}")
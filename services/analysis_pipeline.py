@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Конвейер анализа документа
+
+Общие шаги /api/analyze (учет использования, формирование ответа) и
+асинхронный режим: /api/analyze/async принимает файл и сразу возвращает
+job_id, а анализ ставится в персистентную очередь (utils.job_queue, тип
+задачи 'analysis') и переживает рестарт и деплой. Этапы (extracted,
+classified, analyzed, report_ready) пишутся в таблицу analysis_jobs,
+откуда клиент забирает их коротким опросом у любого воркера gunicorn.
+"""
+
+import os
+import json
+import uuid
+import logging
+from datetime import datetime
+from config import Config, PLANS, SMART_ANALYSIS_CONFIG
+from models.sqlite_users import db, AnalysisJob
+
+logger = logging.getLogger(__name__)
+
+# Пользователь ждет результат на странице - анализ берется из очереди раньше пакетных задач (приоритет 100)
+ANALYSIS_JOB_PRIORITY = 50
+
+# Прогресс (0-100) по этапам асинхронного анализа
+STAGE_PROGRESS = {
+    'queued': 0,
+    'extracted': 30,
+    'classified': 45,
+    'analyzed': 85,
+    'report_ready': 100
+}
+
+
+def rollback_guest_ip_usage(app, real_ip):
+    """Откат счетчика IP, если анализ гостя не удался из-за ошибки файла"""
+    try:
+        app.ip_limit_manager.rollback_ip_usage(real_ip)
+        logger.info(f"🔄 Откат счетчика IP из-за ошибки файла: IP={real_ip}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка отката счетчика IP: {e}")
+
+
+def finalize_analysis(app, ctx, analysis_result):
+    """Запись использования/истории и формирование ответа (разделы 6-7 /api/analyze)
+
+    ctx - данные запроса из _prepare_analysis_upload. Если анализ был
+    зарезервирован при приеме (ctx['reservation'], асинхронный режим), резерв
+    списывается, иначе записывается использование. Возвращает словарь ответа.
+    """
+    filename = ctx['filename']
+    user_id = ctx['user_id']
+    is_authenticated = ctx['is_authenticated']
+    real_ip = ctx['real_ip']
+    user_agent = ctx['user_agent']
+    
+    # РАЗДЕЛ 6: ЗАПИСЬ ИСПОЛЬЗОВАНИЯ И ИСТОРИИ
+    if is_authenticated:
+        # Для зарегистрированных: записываем использование и историю
+        if ctx.get('reservation'):
+            app.user_manager.commit_analysis(ctx['reservation'])
+        else:
+            app.user_manager.record_usage(user_id)
+        try:
+            app.user_manager.save_analysis_history(user_id, filename, analysis_result)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить историю анализа: {e}")
+    else:
+        # Для незарегистрированных: записываем только в guests
+        # ВАЖНО: IP-лимиты уже обновлены ДО анализа (см. выше), здесь только обновляем guests
+        guest = app.user_manager.record_guest_analysis(real_ip, user_agent)
+        logger.info(f"👤 Гость записан: IP={real_ip}, analyses_count={guest.analyses_count}, registration_prompted={guest.registration_prompted}")
+        # История анализов НЕ сохраняется для незарегистрированных
+    
+    # РАЗДЕЛ 7: ФОРМИРОВАНИЕ ОТВЕТА
+    # Добавляем информацию о лимитах в ответ
+    if is_authenticated:
+        # Для зарегистрированных - получаем актуальные данные пользователя
+        user = app.user_manager.get_user(user_id)
+        plan = PLANS[user.plan] if user else PLANS['free']
+        
+        # Для бесплатного тарифа используем free_analysis_used (но теперь он всегда 0 после регистрации)
+        if user and user.plan == 'free':
+            remaining = 0
+            analysis_result['usage_info'] = {
+                'free_analysis_used': True,
+                'remaining': remaining,
+                'plan_name': plan['name'],
+                'is_registered': True,
+                'available_analyses': 0,
+                'upgrade_required': True
+            }
+        else:
+            # Для платных тарифов используем available_analyses
+            analysis_result['usage_info'] = {
+                'available_analyses': user.available_analyses if user else 0,
+                'plan_name': plan['name'],
+                'is_registered': True
+            }
+    else:
+        # Для незарегистрированных показываем что бесплатный анализ использован
+        analysis_result['usage_info'] = {
+            'used_today': 1,
+            'daily_limit': 1,
+            'plan_name': 'Пробный',
+            'remaining': 0,
+            'free_analysis_used': True,
+            'registration_required': True,
+            'is_registered': False
+        }
+    
+    # Добавляем флаг is_authenticated в результат для фронтенда
+    analysis_result['is_authenticated'] = is_authenticated
+    
+    # Возвращаем результат (user_id только для зарегистрированных)
+    response_data = {
+        'success': True,
+        'filename': filename,
+        'result': analysis_result
+    }
+    
+    # Добавляем user_id только если пользователь авторизован
+    if is_authenticated:
+        response_data['user_id'] = user_id
+    
+    
+    return response_data
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+def create_analysis_job(ctx):
+    """Создает запись асинхронного анализа (в контексте запроса)"""
+    now = _now()
+    job = AnalysisJob(
+        id=str(uuid.uuid4()),
+        user_id=ctx['user_id'],
+        ip_address=None if ctx['is_authenticated'] else ctx['real_ip'],
+        filename=ctx['filename'],
+        status='queued',
+        stage='queued',
+        progress=0,
+        events_json=json.dumps([{'id': 1, 'stage': 'queued', 'progress': 0, 'at': now}], ensure_ascii=False),
+        created_at=now,
+        updated_at=now
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def update_analysis_job(job_id, stage=None, status=None, details=None, result=None, error=None):
+    """Переводит задачу на новый этап и добавляет событие для опроса (нужен контекст приложения)"""
+    job = AnalysisJob.query.get(job_id)
+    if not job:
+        return
+    now = _now()
+    events = json.loads(job.events_json or '[]')
+    if stage:
+        job.stage = stage
+        job.progress = STAGE_PROGRESS.get(stage, job.progress)
+    if status:
+        job.status = status
+    event = {'id': len(events) + 1, 'stage': job.stage, 'progress': job.progress, 'status': job.status, 'at': now}
+    if details:
+        event.update(details)
+    if error:
+        job.error_message = error
+        event['error'] = error
+    events.append(event)
+    job.events_json = json.dumps(events, ensure_ascii=False)
+    if result is not None:
+        job.result_json = json.dumps(result, ensure_ascii=False)
+    if status in ('completed', 'failed'):
+        job.completed_at = now
+    job.updated_at = now
+    db.session.commit()
+
+
+def enqueue_analysis_job(job_id, ctx):
+    """Ставит асинхронный анализ в персистентную очередь (ctx - данные запроса, сериализуются в JSON)"""
+    from utils.job_queue import JobQueue
+    queue_job_id, error = JobQueue.enqueue(
+        'analysis',
+        {'analysis_job_id': job_id, 'ctx': ctx},
+        dedupe_key=f'analysis:{job_id}',
+        priority=ANALYSIS_JOB_PRIORITY
+    )
+    if error:
+        raise Exception(f"Не удалось поставить анализ в очередь: {error}")
+    return queue_job_id
+
+
+def release_analysis_quota(app, ctx):
+    """Возвращает лимит анализа, который не состоялся: резерв пользователя или счетчик IP гостя"""
+    try:
+        if ctx.get('reservation'):
+            app.user_manager.refund_analysis(ctx['reservation'])
+        elif not ctx.get('is_authenticated') and ctx.get('real_ip'):
+            rollback_guest_ip_usage(app, ctx['real_ip'])
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"❌ Ошибка возврата лимита анализа: {e}")
+
+
+def _remove_upload(ctx):
+    try:
+        if ctx.get('temp_path') and os.path.exists(ctx['temp_path']):
+            os.unlink(ctx['temp_path'])
+    except Exception as e:
+        logger.error(f"❌ Ошибка при удалении временного файла: {e}")
+
+
+def run_analysis_job(app_instance, payload):
+    """Асинхронный анализ в воркере очереди: извлечение, тип, анализ, учет использования
+
+    Временный файл удаляется после успешного анализа, а при ошибке - в
+    fail_analysis_job, когда попытки кончились: для повтора он еще нужен.
+    Там же возвращается зарезервированный при приеме лимит.
+    """
+    from utils.job_queue import PermanentJobError
+    from services.file_processing import extract_text_from_file
+    from services.yandex_gpt import detect_document_type
+    from services.analysis import analyze_text
+
+    job_id = payload['analysis_job_id']
+    ctx = payload['ctx']
+    with app_instance.app_context():
+        job = AnalysisJob.query.get(job_id)
+        if not job:
+            raise PermanentJobError(f"Задача анализа {job_id} не найдена")
+        if job.status == 'completed':
+            return
+        update_analysis_job(job_id, status='processing')
+
+        text = extract_text_from_file(ctx['temp_path'], ctx['filename'], max_chars=Config.PDF_TEXT_CHAR_BUDGET)
+        if not text or len(text.strip()) < 10:
+            raise PermanentJobError('Не удалось извлечь текст из файла')
+        update_analysis_job(job_id, stage='extracted', details={'chars': len(text)})
+
+        document_type = detect_document_type(text)
+        update_analysis_job(job_id, stage='classified', details={
+            'document_type': document_type,
+            'document_type_name': SMART_ANALYSIS_CONFIG[document_type]['name']
+        })
+
+        analysis_result = analyze_text(
+            text, ctx['plan_type'],
+            is_authenticated=ctx['is_authenticated'],
+            user_id=ctx['user_id'],
+            document_type=document_type
+        )
+        update_analysis_job(job_id, stage='analyzed')
+        logger.info(f"✅ АСИНХРОННЫЙ АНАЛИЗ УСПЕШЕН ({job_id}) для {'пользователя' if ctx['is_authenticated'] else 'гостя'}, IP: {ctx['real_ip']}")
+
+        response_data = finalize_analysis(app_instance, ctx, analysis_result)
+        update_analysis_job(job_id, stage='report_ready', status='completed', result=response_data)
+    _remove_upload(ctx)
+
+
+def fail_analysis_job(payload, error):
+    """Попытки анализа кончились: задача failed, лимит возвращается, временный файл удаляется
+
+    Нужен контекст приложения.
+    """
+    from flask import current_app
+    job = AnalysisJob.query.get(payload['analysis_job_id'])
+    if job and job.status not in ('completed', 'failed'):
+        update_analysis_job(job.id, status='failed', error=error)
+        release_analysis_quota(current_app._get_current_object(), payload['ctx'])
+    _remove_upload(payload['ctx'])
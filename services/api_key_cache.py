@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш проверенных API-ключей и отложенный учет их использования
+
+1. Кеш ключей: хеш ключа -> сведения для request.api_user (пользователь,
+   тариф, id и название ключа). Запись живет API_KEY_CACHE_TTL секунд и
+   помнит срок действия ключа - истекший ключ отклоняется и из кеша.
+   Деактивация, удаление и любое другое изменение строки api_keys через
+   сессию обновляют поколение ключа в общем mmap-файле кеша пользователей
+   (services.user_cache.SharedGenerations), изменение пользователя (тариф) -
+   поколение пользователя, поэтому другие воркеры gunicorn видят это сразу.
+2. Буфер использования: запросы только увеличивают счетчик ключа в памяти,
+   фоновый поток раз в API_KEY_USAGE_FLUSH_SECONDS (или раньше, при
+   API_KEY_USAGE_MAX_PENDING ключах) пишет requests_count/last_used одним
+   пакетным UPDATE. Без фонового потока (интервал 0) пишется сразу.
+"""
+
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from sqlalchemy import event, bindparam, func
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _key_generation_name(api_key_id):
+    return f"api_key:{api_key_id}"
+
+
+class APIKeyCache:
+    """Процессный TTL/LRU кеш проверенных API-ключей"""
+
+    def __init__(self, ttl_seconds, max_entries, generations):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.generations = generations
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'expired': 0, 'invalidations': 0}
+
+    def generations_for(self, api_key_id, user_id):
+        return self.generations.get(_key_generation_name(api_key_id)), self.generations.get(user_id)
+
+    def get(self, api_key_hash):
+        """Сведения о ключе, (None, ошибка) для истекшего ключа или None при промахе"""
+        with self._lock:
+            entry = self._entries.get(api_key_hash)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            info, key_expires_at, generations, deadline = entry
+            if time.monotonic() > deadline or generations != self.generations_for(info['api_key_id'], info['user_id']):
+                del self._entries[api_key_hash]
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return None
+            if key_expires_at and datetime.now() > key_expires_at:
+                del self._entries[api_key_hash]
+                self.stats['expired'] += 1
+                return None, "API-ключ истек"
+            self._entries.move_to_end(api_key_hash)
+            self.stats['hits'] += 1
+            return dict(info), None
+
+    def set(self, api_key_hash, info, key_expires_at, generations):
+        with self._lock:
+            self._entries[api_key_hash] = (dict(info), key_expires_at, generations, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(api_key_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, api_key_id):
+        """Сбрасывает ключ из кеша (во всех воркерах)"""
+        self.generations.bump(_key_generation_name(api_key_id))
+        with self._lock:
+            for api_key_hash in [h for h, entry in self._entries.items() if entry[0]['api_key_id'] == api_key_id]:
+                del self._entries[api_key_hash]
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'ttl_seconds': self.ttl_seconds,
+            'max_entries': self.max_entries,
+            'shared_invalidation': self.generations._map is not None,
+            'hit_rate': round(stats['hits'] / lookups * 100, 1) if lookups else 0
+        })
+        return stats
+
+
+class APIKeyUsageBuffer:
+    """Счетчики запросов по API-ключам, накапливаемые в памяти процесса"""
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._usage = {}
+        self.app = None
+        self.background = False
+        self.stats = {'requests': 0, 'flushes': 0, 'rows_written': 0, 'errors': 0}
+
+    def record(self, api_key_id):
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.stats['requests'] += 1
+            usage = self._usage.get(api_key_id)
+            if usage is None:
+                self._usage[api_key_id] = [1, now]
+            else:
+                usage[0] += 1
+                usage[1] = now
+            pending = len(self._usage)
+        if not self.background:
+            self.flush()
+        elif pending >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_for(self, api_key_id):
+        """Еще не записанные в БД запросы ключа: (количество, last_used) или None"""
+        with self._lock:
+            usage = self._usage.get(api_key_id)
+            return tuple(usage) if usage else None
+
+    def _requeue(self, usage):
+        with self._lock:
+            for api_key_id, (count, last_used) in usage.items():
+                newer = self._usage.get(api_key_id)
+                if newer:
+                    count += newer[0]
+                    last_used = max(last_used, newer[1])
+                self._usage[api_key_id] = [count, last_used]
+
+    def flush(self):
+        """Записывает накопленные счетчики одним пакетным UPDATE. Возвращает число ключей"""
+        with self._flush_lock:
+            with self._lock:
+                usage, self._usage = self._usage, {}
+            if not usage:
+                return 0
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        self._write(usage)
+                else:
+                    self._write(usage)
+            except Exception as e:
+                self._requeue(usage)
+                with self._lock:
+                    self.stats['errors'] += 1
+                logger.error(f"❌ Ошибка записи использования API-ключей (повтор при следующем сбросе): {e}")
+                return 0
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['rows_written'] += len(usage)
+            return len(usage)
+
+    def _write(self, usage):
+        from models.sqlite_users import db, APIKey
+
+        table = APIKey.__table__
+        statement = table.update().where(table.c.id == bindparam('key_id')).values(
+            requests_count=func.coalesce(table.c.requests_count, 0) + bindparam('delta'),
+            last_used=func.max(func.coalesce(table.c.last_used, ''), bindparam('used_at'))
+        )
+        try:
+            db.session.execute(statement, [
+                {'key_id': api_key_id, 'delta': count, 'used_at': last_used}
+                for api_key_id, (count, last_used) in usage.items()
+            ])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                'pending_keys': len(self._usage),
+                'pending_requests': sum(count for count, _ in self._usage.values()),
+                'background': self.background
+            })
+        return stats
+
+
+_cache_instance = None
+_buffer_instance = None
+_instance_lock = threading.Lock()
+_hooks_installed = False
+
+
+def get_api_key_cache():
+    """Возвращает общий для процесса кеш API-ключей"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _instance_lock:
+            if _cache_instance is None:
+                from services.user_cache import get_user_cache
+                # Поколения пользователей и ключей живут в одном общем файле
+                _cache_instance = APIKeyCache(
+                    ttl_seconds=Config.API_KEY_CACHE_TTL,
+                    max_entries=Config.API_KEY_CACHE_MAX_ENTRIES,
+                    generations=get_user_cache().generations
+                )
+    return _cache_instance
+
+
+def get_api_key_usage_buffer():
+    """Возвращает общий для процесса буфер использования API-ключей"""
+    global _buffer_instance
+    if _buffer_instance is None:
+        with _instance_lock:
+            if _buffer_instance is None:
+                _buffer_instance = APIKeyUsageBuffer(max_pending=Config.API_KEY_USAGE_MAX_PENDING)
+    return _buffer_instance
+
+
+def install_invalidation_hooks(session, APIKeyModel):
+    """Инвалидирует кеш после commit, в котором ключи изменялись или удалялись"""
+    global _hooks_installed
+    with _instance_lock:
+        if _hooks_installed:
+            return
+        _hooks_installed = True
+
+    @event.listens_for(session, 'after_flush')
+    def _collect_changed_keys(flush_session, flush_context):
+        changed = flush_session.info.setdefault('changed_api_key_ids', set())
+        for obj in list(flush_session.dirty) + list(flush_session.deleted):
+            if isinstance(obj, APIKeyModel) and obj.id:
+                changed.add(obj.id)
+
+    @event.listens_for(session, 'after_commit')
+    def _invalidate_changed_keys(commit_session):
+        changed = commit_session.info.pop('changed_api_key_ids', ())
+        if changed:
+            cache = get_api_key_cache()
+            for api_key_id in changed:
+                cache.invalidate(api_key_id)
+
+    @event.listens_for(session, 'after_soft_rollback')
+    def _discard_changed_keys(rollback_session, previous_transaction):
+        rollback_session.info.pop('changed_api_key_ids', None)
+
+
+def start_api_key_usage_buffer(app_instance, interval):
+    """Фоновый поток, сбрасывающий счетчики использования ключей по таймеру или по размеру"""
+    buffer = get_api_key_usage_buffer()
+    buffer.app = app_instance
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.is_set():
+            buffer._wakeup.wait(interval)
+            buffer._wakeup.clear()
+            buffer.flush()
+
+    def shutdown():
+        stop_event.set()
+        buffer._wakeup.set()
+        buffer.background = False
+        buffer.flush()
+
+    buffer.background = True
+    thread = threading.Thread(target=run, name='api-key-usage', daemon=True)
+    thread.start()
+    atexit.register(shutdown)
+    return stop_event
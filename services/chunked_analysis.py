@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Анализ больших документов по частям (map-reduce)
+
+Текст длиннее ANALYSIS_CHUNK_CHARS режется по границам страниц (маркеры
+"--- Страница N ---" из извлечения PDF), а слишком длинные страницы - по
+статьям/пунктам, абзацам и строкам. Части анализируются YandexGPT
+параллельно (не больше ANALYSIS_CHUNK_WORKERS одновременно), поэтому время
+анализа определяется самой долгой частью, а не их суммой. Затем риски
+дедуплицируются (остается наибольший уровень), рекомендации и тексты
+экспертизы объединяются, и результат собирается обычным
+create_smart_analysis_result - со статистикой рисков по всему документу.
+"""
+
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config
+from services.yandex_client import CircuitOpenError
+from services.yandex_gpt import (
+    YandexGPTError, request_analysis_response, parse_analysis_sections,
+    create_smart_analysis_result, create_fallback_analysis
+)
+
+logger = logging.getLogger(__name__)
+
+PAGE_MARKER_RE = re.compile(r'\n?--- Страница (\d+) ---\n')
+
+# Границы, по которым режем слишком длинный фрагмент - от крупных к мелким
+SPLIT_PATTERNS = [
+    re.compile(r'(?=\n[ \t]*(?:Статья|Раздел|Глава|СТАТЬЯ|РАЗДЕЛ|ГЛАВА)\s+\d+)|(?=\n[ \t]*\d{1,2}\.\s+[А-ЯЁA-Z])'),
+    re.compile(r'(?<=\n\n)'),
+    re.compile(r'(?<=\n)'),
+    re.compile(r'(?<=[.!?;] )'),
+]
+
+# Порядок уровней риска: при слиянии дублей остается более серьезный
+LEVEL_ORDER = {'CRITICAL': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
+
+# Доля общих основ слов в названиях, начиная с которой риски считаются одним и тем же
+DUPLICATE_SIMILARITY = 0.6
+
+_WORD_RE = re.compile(r'[а-яёa-z0-9]{3,}')
+
+TEXT_SECTIONS = ['legal_expertise', 'financial_analysis', 'operational_risks',
+                 'strategic_assessment', 'expert_conclusion']
+
+
+def _split_oversized(text, max_chars, level=0):
+    """Режет фрагмент на куски не длиннее max_chars по самым крупным доступным границам"""
+    if len(text) <= max_chars:
+        return [text]
+    if level >= len(SPLIT_PATTERNS):
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+    parts = [part for part in SPLIT_PATTERNS[level].split(text) if part]
+    if len(parts) == 1:
+        return _split_oversized(text, max_chars, level + 1)
+
+    pieces = []
+    for part in parts:
+        pieces.extend(_split_oversized(part, max_chars, level + 1))
+    return pieces
+
+
+def _page_units(text):
+    """Разбивает текст на [(номер страницы или None, текст)] по маркерам страниц"""
+    matches = list(PAGE_MARKER_RE.finditer(text))
+    if not matches:
+        return [(None, text)]
+
+    units = []
+    if matches[0].start() > 0 and text[:matches[0].start()].strip():
+        units.append((None, text[:matches[0].start()]))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        units.append((int(match.group(1)), text[match.start():end]))
+    return units
+
+
+def _chunk_label(pages, index):
+    if not pages:
+        return f"фрагмент {index}"
+    first, last = min(pages), max(pages)
+    return f"страница {first}" if first == last else f"страницы {first}-{last}"
+
+
+def split_into_chunks(text, max_chars, max_chunks=None):
+    """Делит текст на части для анализа. Возвращает (chunks, skipped_chars)
+
+    chunks - [{'text', 'label'}]: страницы целиком упаковываются в части до
+    max_chars символов; длинные страницы делятся по статьям, абзацам, строкам.
+    Части сверх max_chunks отбрасываются, skipped_chars - сколько символов не вошло.
+    """
+    pieces = []
+    for page, unit_text in _page_units(text):
+        pieces.extend((page, piece) for piece in _split_oversized(unit_text, max_chars))
+
+    chunks = []
+    current, current_len, current_pages = [], 0, set()
+    for page, piece in pieces:
+        if current and current_len + len(piece) > max_chars:
+            chunks.append({'text': ''.join(current), 'pages': current_pages})
+            current, current_len, current_pages = [], 0, set()
+        current.append(piece)
+        current_len += len(piece)
+        if page is not None:
+            current_pages.add(page)
+    if current and ''.join(current).strip():
+        chunks.append({'text': ''.join(current), 'pages': current_pages})
+
+    skipped_chars = 0
+    if max_chunks and len(chunks) > max_chunks:
+        skipped_chars = sum(len(chunk['text']) for chunk in chunks[max_chunks:])
+        chunks = chunks[:max_chunks]
+
+    return [
+        {'text': chunk['text'], 'label': _chunk_label(chunk['pages'], i + 1)}
+        for i, chunk in enumerate(chunks)
+    ], skipped_chars
+
+
+def _title_key(title):
+    """Множество основ слов названия - для поиска дублей"""
+    return frozenset(word[:6] for word in _WORD_RE.findall((title or '').lower().replace('ё', 'е')))
+
+
+def _is_duplicate(key, other_key):
+    if not key or not other_key:
+        return key == other_key
+    return len(key & other_key) / len(key | other_key) >= DUPLICATE_SIMILARITY
+
+
+def merge_risks(risk_lists):
+    """Объединяет риски частей: дубли сливаются с наибольшим уровнем, сортировка по серьезности"""
+    merged = []
+    for risks in risk_lists:
+        for risk in risks:
+            key = _title_key(risk.get('title'))
+            existing = next((item for item in merged if _is_duplicate(item[0], key)), None)
+            if existing is None:
+                merged.append((key, dict(risk)))
+                continue
+
+            kept = existing[1]
+            if LEVEL_ORDER.get(risk['level'], len(LEVEL_ORDER)) < LEVEL_ORDER.get(kept['level'], len(LEVEL_ORDER)):
+                kept.update(level=risk['level'], color=risk['color'], icon=risk['icon'])
+            if len(risk.get('description', '')) > len(kept.get('description', '')):
+                kept['description'] = risk['description']
+
+    risks = [risk for _, risk in merged]
+    risks.sort(key=lambda risk: LEVEL_ORDER.get(risk['level'], len(LEVEL_ORDER)))
+    return risks
+
+
+def _merge_items(item_lists, field):
+    """Объединяет рекомендации/альтернативы без повторов (по полю field)"""
+    merged, keys = [], []
+    for items in item_lists:
+        for item in items:
+            key = _title_key(item.get(field))
+            if any(_is_duplicate(key, other) for other in keys):
+                continue
+            keys.append(key)
+            merged.append(item)
+    return merged
+
+
+def merge_chunk_sections(sections_list):
+    """Reduce-шаг: собирает разделы всех частей в один набор разделов"""
+    merged = {
+        'key_risks': merge_risks(sections['key_risks'] for sections in sections_list),
+        'practical_recommendations': _merge_items(
+            (sections['practical_recommendations'] for sections in sections_list), 'action'
+        ),
+        'alternative_solutions': _merge_items(
+            (sections['alternative_solutions'] for sections in sections_list), 'solution'
+        ),
+    }
+    for name in TEXT_SECTIONS:
+        texts = []
+        for sections in sections_list:
+            text = sections.get(name, '').strip()
+            if text and text not in texts:
+                texts.append(text)
+        merged[name] = ' '.join(texts)
+    return merged
+
+
+def _analyze_chunk(chunk, index, total, document_type, analysis_settings):
+    """Map-шаг: анализ одной части, возвращает разобранные разделы"""
+    ai_response = request_analysis_response(
+        chunk['text'], document_type, analysis_settings, part=(index, total, chunk['label'])
+    )
+    return parse_analysis_sections(ai_response, document_type)
+
+
+def _error_message(error):
+    if isinstance(error, (YandexGPTError, CircuitOpenError)):
+        return str(error)
+    return f"Ошибка соединения: {str(error)}"
+
+
+def analyze_in_chunks(text, document_type='general', analysis_settings=None):
+    """Анализирует большой документ по частям и сводит результаты в один анализ"""
+    chunks, skipped_chars = split_into_chunks(text, Config.ANALYSIS_CHUNK_CHARS, Config.ANALYSIS_MAX_CHUNKS)
+    if not chunks:
+        return create_fallback_analysis(document_type, "Документ не содержит текста")
+    if skipped_chars:
+        logger.warning(f"⚠️ Документ длиннее {Config.ANALYSIS_MAX_CHUNKS} частей: {skipped_chars} символов не анализируются")
+
+    workers = max(1, min(Config.ANALYSIS_CHUNK_WORKERS, len(chunks)))
+    logger.info(f"🧩 Анализ по частям: {len(chunks)} частей ({len(text)} символов), параллельно {workers}")
+    started = time.monotonic()
+
+    results = [None] * len(chunks)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis-chunk') as executor:
+        futures = {
+            executor.submit(_analyze_chunk, chunk, i + 1, len(chunks), document_type, analysis_settings): i
+            for i, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+                logger.error(f"❌ Ошибка анализа части {i + 1}/{len(chunks)} ({chunks[i]['label']}): {e}")
+
+    elapsed = time.monotonic() - started
+    sections_list = [sections for sections in results if sections is not None]
+    if not sections_list:
+        first_error = errors[min(errors)]
+        return create_fallback_analysis(document_type, _error_message(first_error))
+
+    result = create_smart_analysis_result(merge_chunk_sections(sections_list), document_type)
+    result['chunked_analysis'] = {
+        'chunks': len(chunks),
+        'analyzed_chunks': len(sections_list),
+        'failed_chunks': [chunks[i]['label'] for i in sorted(errors)],
+        'skipped_chars': skipped_chars,
+        'elapsed_seconds': round(elapsed, 2)
+    }
+    if errors:
+        # Неполный анализ не кешируется (store_cached_analysis), повторный запрос проанализирует документ заново
+        result['partial'] = True
+        result['executive_summary']['quick_facts'].append(f"Проанализировано частей: {len(sections_list)} из {len(chunks)}")
+    if skipped_chars:
+        result['executive_summary']['quick_facts'].append(f"Не проанализировано (сверх лимита): {skipped_chars} символов в конце документа")
+
+    logger.info(f"✅ Анализ по частям завершен за {elapsed:.1f} сек: "
+                f"{result['risk_analysis']['risk_statistics']['total']} рисков после объединения")
+    return result
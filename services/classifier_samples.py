@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Размеченные тексты документов для обучения классификатора типов
+
+Пример - начало извлеченного текста документа (тот же фрагмент, который
+классификатор видит при определении типа) и тип, который назначил YandexGPT,
+когда локальный классификатор не был уверен. Собственные ответы
+классификатора сюда не попадают - модель не учится на своих метках.
+Хранится в отдельной SQLite-базе, ключ - SHA-256 фрагмента; старые
+примеры вытесняются при превышении DOC_CLASSIFIER_HISTORY_LIMIT.
+"""
+
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ClassifierSampleStore:
+    """SQLite-хранилище размеченных фрагментов документов"""
+
+    def __init__(self, db_path, max_samples=5000):
+        self.db_path = db_path
+        self.max_samples = max_samples
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        """Открывает соединение (одно соединение на операцию - безопасно для потоков)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._initialized:
+            self._init_schema(conn)
+        return conn
+
+    def _init_schema(self, conn):
+        """Создает таблицу примеров при первом обращении"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS classifier_samples (
+                    text_hash TEXT PRIMARY KEY,
+                    document_type TEXT NOT NULL,
+                    text_gz BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_classifier_samples_created_at
+                    ON classifier_samples (created_at);
+            ''')
+            conn.commit()
+            self._initialized = True
+
+    def add(self, document_type, text):
+        """Сохраняет пример (повторный текст обновляет метку) и вытесняет самые старые сверх лимита"""
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO classifier_samples (text_hash, document_type, text_gz, created_at) '
+                'VALUES (?, ?, ?, ?)',
+                (text_hash, document_type, gzip.compress(text.encode('utf-8')), time.time())
+            )
+            conn.execute(
+                'DELETE FROM classifier_samples WHERE text_hash IN ('
+                'SELECT text_hash FROM classifier_samples ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_samples,)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def load(self):
+        """Все примеры: [(document_type, text), ...], новые первыми"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT document_type, text_gz FROM classifier_samples ORDER BY created_at DESC'
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(document_type, gzip.decompress(text_gz).decode('utf-8')) for document_type, text_gz in rows]
+
+    def get_stats(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT document_type, COUNT(*) FROM classifier_samples GROUP BY document_type'
+            ).fetchall()
+        finally:
+            conn.close()
+        return {'samples': sum(count for _, count in rows), 'by_type': dict(rows)}
+
+
+_store_instance = None
+_store_lock = threading.Lock()
+
+
+def get_classifier_samples():
+    """Возвращает общее хранилище примеров"""
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                store_dir = os.path.dirname(Config.DOC_CLASSIFIER_SAMPLES_PATH)
+                if store_dir:
+                    os.makedirs(store_dir, exist_ok=True)
+                _store_instance = ClassifierSampleStore(
+                    Config.DOC_CLASSIFIER_SAMPLES_PATH,
+                    max_samples=Config.DOC_CLASSIFIER_HISTORY_LIMIT
+                )
+    return _store_instance
+
+
+def record_labeled_sample(document_type, text):
+    """Запоминает тип, назначенный YandexGPT, для начала текста документа (ошибки не пробрасываются)"""
+    head = text[:Config.DOC_CLASSIFIER_MAX_CHARS]
+    if not head.strip():
+        return
+    try:
+        get_classifier_samples().add(document_type, head)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"⚠️ Не удалось сохранить пример для классификатора типов: {e}")
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI-оценка рисков изменений при сравнении документов (map-reduce)
+
+Все изменения из services.text_diff нумеруются (#1, #2, ...) и
+группируются по пункту договора, группы упаковываются в части до
+COMPARISON_REVIEW_CHUNK_CHARS символов и оцениваются YandexGPT параллельно
+(не больше COMPARISON_REVIEW_WORKERS одновременно). Модель ссылается на
+номера изменений, поэтому слияние не зависит от порядка ответов: части
+сводятся по своему индексу, общий риск - наибольший, предупреждения без
+повторов в порядке документа, разбор изменений - по первому номеру.
+В coverage видно, сколько изменений оценено и какие части не удались.
+"""
+
+import re
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config
+from services.yandex_client import get_yandex_client
+
+logger = logging.getLogger(__name__)
+
+# Порядок уровней риска: в сводке остается более серьезный
+LEVEL_ORDER = {'CRITICAL': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3, 'INFO': 4}
+
+KIND_NAMES = {'added': 'Добавлено', 'removed': 'Удалено', 'modified': 'Изменено'}
+
+SYSTEM_PROMPT = """Ты эксперт по анализу изменений в юридических документах. Проанализируй изменения между двумя версиями документа и оцени риски.
+
+Изменения пронумерованы (#N) и сгруппированы по пунктам документа.
+Для каждого значимого изменения определи:
+1. Тип изменения (условия оплаты, сроки, ответственность, права сторон, условия расторжения и т.д.)
+2. Уровень риска (CRITICAL, HIGH, MEDIUM, LOW, INFO)
+3. Влияние на права и обязанности сторон
+4. Рекомендации
+
+Верни результат ТОЛЬКО в формате JSON без дополнительного текста с полями:
+- summary: краткое резюме изменений
+- overall_risk: общий уровень риска изменений (CRITICAL, HIGH, MEDIUM, LOW, INFO)
+- key_warnings: массив ключевых предупреждений
+- changes_analysis: массив объектов с полями:
+  - change_ids: массив номеров изменений (N из #N), к которым относится разбор
+  - type: тип изменения
+  - risk_level: уровень риска
+  - description: описание изменения
+  - impact: влияние на стороны
+  - recommendation: рекомендация"""
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit] + '…'
+
+
+def collect_changes(hunks):
+    """Плоский пронумерованный список изменений в порядке документа"""
+    items = []
+    for hunk in hunks:
+        for change in hunk['modified']:
+            items.append({'clause': hunk['clause'], 'kind': 'modified',
+                          'original': change['original'], 'modified': change['modified']})
+        for text in hunk['removed']:
+            items.append({'clause': hunk['clause'], 'kind': 'removed', 'text': text})
+        for text in hunk['added']:
+            items.append({'clause': hunk['clause'], 'kind': 'added', 'text': text})
+    for number, item in enumerate(items, 1):
+        item['id'] = number
+    return items
+
+
+def _format_change(item, item_chars):
+    head = f"#{item['id']} {KIND_NAMES[item['kind']]}"
+    if item['kind'] == 'modified':
+        return (f"{head}:\n   Было: {_clip(item['original'], item_chars)}\n"
+                f"   Стало: {_clip(item['modified'], item_chars)}")
+    return f"{head}: {_clip(item['text'], item_chars)}"
+
+
+def _clause_title(clause):
+    return f"Пункт {clause}" if clause else "Начало документа"
+
+
+def build_review_chunks(items, max_chars, item_chars, max_chunks=None):
+    """
+    Группирует изменения по пункту и упаковывает группы в части до max_chars
+
+    Группа, которая не помещается в одну часть, делится по изменениям.
+    Returns: (chunks, skipped) - chunks: [{'text', 'ids', 'label'}],
+    skipped - изменения сверх max_chunks частей.
+    """
+    groups = []
+    for item in items:
+        if groups and groups[-1]['clause'] == item['clause']:
+            groups[-1]['items'].append(item)
+        else:
+            groups.append({'clause': item['clause'], 'items': [item]})
+
+    chunks = []
+    current = None
+
+    def close():
+        if current and current['ids']:
+            clauses = [c for c in current['clauses'] if c]
+            if not clauses:
+                current['label'] = 'начало документа'
+            elif clauses[0] == clauses[-1]:
+                current['label'] = f"п. {clauses[0]}"
+            else:
+                current['label'] = f"п. {clauses[0]}–{clauses[-1]}"
+            chunks.append({'text': '\n'.join(current['lines']), 'ids': current['ids'], 'label': current['label']})
+
+    for group in groups:
+        header = f"\n[{_clause_title(group['clause'])}]"
+        for item in group['items']:
+            line = _format_change(item, item_chars)
+            if current is None or current['size'] + len(header) + len(line) > max_chars and current['ids']:
+                close()
+                current = {'lines': [], 'ids': [], 'clauses': [], 'size': 0, 'clause': object()}
+            if current['clause'] != group['clause']:
+                current['lines'].append(header)
+                current['size'] += len(header)
+                current['clause'] = group['clause']
+                current['clauses'].append(group['clause'])
+            current['lines'].append(line)
+            current['ids'].append(item['id'])
+            current['size'] += len(line) + 1
+    close()
+
+    skipped = []
+    if max_chunks and len(chunks) > max_chunks:
+        skipped = [i for chunk in chunks[max_chunks:] for i in chunk['ids']]
+        chunks = chunks[:max_chunks]
+    return chunks, skipped
+
+
+def _review_chunk(chunk, index, total, context):
+    """Map-шаг: оценка одной части изменений"""
+    user_prompt = f"""НАЧАЛО ОРИГИНАЛЬНОГО ДОКУМЕНТА (для контекста):
+{context}
+
+ВЫЯВЛЕННЫЕ ИЗМЕНЕНИЯ (часть {index} из {total}, {chunk['label']}, изменений: {len(chunk['ids'])}):
+{chunk['text']}
+
+Проанализируй эти изменения и верни JSON с анализом рисков."""
+
+    data = {
+        "modelUri": f"gpt://{Config.YANDEX_FOLDER_ID}/yandexgpt/latest",
+        "completionOptions": {
+            "stream": False,
+            "temperature": 0.3,
+            "maxTokens": 2000
+        },
+        "messages": [
+            {"role": "system", "text": SYSTEM_PROMPT},
+            {"role": "user", "text": user_prompt}
+        ]
+    }
+
+    resp = get_yandex_client().completion(data, endpoint='comparison')
+    if resp.status_code != 200:
+        raise Exception(f"YandexGPT {resp.status_code}: {resp.text[:200]}")
+
+    response_text = resp.json()['result']['alternatives'][0]['message']['text'].strip()
+    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group())
+        except ValueError:
+            pass
+    # Если не удалось распарсить JSON, создаем простой анализ
+    logger.warning(f"⚠️ Не удалось распарсить JSON ответ от YandexGPT (часть {index}/{total})")
+    return {
+        'summary': 'Изменения проанализированы',
+        'overall_risk': 'MEDIUM' if len(chunk['ids']) > 5 else 'LOW',
+        'key_warnings': ['Рекомендуется внимательно изучить все изменения'],
+        'changes_analysis': []
+    }
+
+
+def _level(value):
+    value = str(value or '').upper()
+    return value if value in LEVEL_ORDER else None
+
+
+def _change_ids(entry, allowed):
+    ids = []
+    for value in entry.get('change_ids') or []:
+        try:
+            number = int(str(value).lstrip('#'))
+        except ValueError:
+            continue
+        if number in allowed and number not in ids:
+            ids.append(number)
+    return ids
+
+
+def merge_reviews(chunks, results, errors, skipped, total_changes):
+    """Reduce-шаг: одна risk_analysis по всем частям (results/errors - по индексу части)"""
+    levels = []
+    summaries = []
+    warnings, seen_warnings = [], set()
+    analysis = []
+    reviewed_ids, mentioned_ids = set(), set()
+
+    for i, chunk in enumerate(chunks):
+        result = results[i]
+        if result is None:
+            continue
+        allowed = set(chunk['ids'])
+        reviewed_ids |= allowed
+        level = _level(result.get('overall_risk'))
+        if level:
+            levels.append(level)
+        summary = str(result.get('summary') or '').strip()
+        if summary:
+            summaries.append(summary if len(chunks) == 1 else f"{chunk['label']}: {summary}")
+        for warning in result.get('key_warnings') or []:
+            warning = str(warning).strip()
+            key = ' '.join(warning.lower().split())
+            if warning and key not in seen_warnings:
+                seen_warnings.add(key)
+                warnings.append(warning)
+        for position, entry in enumerate(result.get('changes_analysis') or []):
+            if not isinstance(entry, dict):
+                continue
+            entry = dict(entry)
+            entry['change_ids'] = _change_ids(entry, allowed)
+            entry['risk_level'] = _level(entry.get('risk_level')) or 'INFO'
+            levels.append(entry['risk_level'])
+            mentioned_ids.update(entry['change_ids'])
+            order = entry['change_ids'][0] if entry['change_ids'] else chunk['ids'][0]
+            analysis.append(((order, i, position), entry))
+
+    if not reviewed_ids:
+        return None
+
+    analysis.sort(key=lambda pair: pair[0])
+    failed = [chunks[i]['label'] for i in sorted(errors)]
+    if failed:
+        warnings.append(f"Не удалось оценить часть изменений ({', '.join(failed)}) - проверьте их вручную")
+    if skipped:
+        warnings.append(f"Изменений больше лимита анализа: {len(skipped)} не оценено - проверьте их вручную")
+
+    return {
+        'summary': ' '.join(summaries) or 'Изменения проанализированы',
+        'overall_risk': min(levels, key=LEVEL_ORDER.get) if levels else 'INFO',
+        'key_warnings': warnings,
+        'changes_analysis': [entry for _, entry in analysis],
+        'coverage': {
+            'total_changes': total_changes,
+            'reviewed_changes': len(reviewed_ids),
+            'mentioned_changes': len(mentioned_ids),
+            'chunks': len(chunks),
+            'failed_chunks': failed,
+            'skipped_changes': len(skipped)
+        }
+    }
+
+
+def review_changes(hunks, original_text, on_progress=None):
+    """
+    Оценивает риски всех изменений сравнения
+
+    on_progress(done, total) вызывается в вызывающем потоке после каждой
+    части - там можно обновлять запись сравнения в БД.
+    Returns: risk_analysis или None, если не оценена ни одна часть.
+    """
+    items = collect_changes(hunks)
+    if not items:
+        return None
+    chunks, skipped = build_review_chunks(
+        items, Config.COMPARISON_REVIEW_CHUNK_CHARS, Config.COMPARISON_REVIEW_ITEM_CHARS,
+        Config.COMPARISON_REVIEW_MAX_CHUNKS
+    )
+    context = original_text[:Config.COMPARISON_REVIEW_CONTEXT_CHARS]
+
+    workers = max(1, min(Config.COMPARISON_REVIEW_WORKERS, len(chunks)))
+    logger.info(f"🤖 Оценка {len(items)} изменений: {len(chunks)} частей, параллельно {workers}")
+    started = time.monotonic()
+
+    results = [None] * len(chunks)
+    errors = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='comparison-review') as executor:
+        futures = {
+            executor.submit(_review_chunk, chunk, i + 1, len(chunks), context): i
+            for i, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+                logger.error(f"❌ Ошибка оценки изменений, часть {i + 1}/{len(chunks)} ({chunks[i]['label']}): {e}")
+            done += 1
+            if on_progress:
+                on_progress(done, len(chunks))
+
+    risk_analysis = merge_reviews(chunks, results, errors, skipped, len(items))
+    logger.info(f"✅ Оценка изменений завершена за {time.monotonic() - started:.1f} сек: "
+                f"частей {len(chunks) - len(errors)}/{len(chunks)}")
+    return risk_analysis
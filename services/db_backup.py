@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Горячее резервное копирование SQLite: backup API по шагам, потоковое сжатие, инкрементальные снимки
+
+Снимок снимается sqlite3.Connection.backup порциями по BACKUP_STEP_PAGES
+страниц с паузой между шагами, поэтому писатели продолжают работать. Если базу
+меняет другое соединение, SQLite начинает копирование заново; после
+BACKUP_MAX_RESTARTS перезапусков снимок снимается одним шагом - в WAL-режиме это
+одна согласованная транзакция чтения, которая не блокирует запись. Небольшая
+база копируется в память, большая - во временный файл, и образ сразу
+сжимается в целевой .gz (без промежуточной несжатой копии в backups/).
+
+Рядом с полным бэкапом лежит файл хешей страниц (.pages). Инкрементальный
+снимок (docscan_incr_*.bin.gz) хранит только страницы, которые отличаются от
+последнего полного бэкапа: восстановление - полный бэкап плюс один
+инкрементальный. Ход работы пишется в backups/backup_status.json, поэтому его
+видно из любого процесса (веб, job_worker.py, cron).
+"""
+
+import io
+import os
+import gzip
+import json
+import time
+import shutil
+import struct
+import sqlite3
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backups')
+
+FULL_PREFIX = 'docscan_backup_'
+INCREMENTAL_PREFIX = 'docscan_incr_'
+FULL_SUFFIX = '.db.gz'
+INCREMENTAL_SUFFIX = '.bin.gz'
+MANIFEST_SUFFIX = '.pages'
+STATUS_FILE = 'backup_status.json'
+
+DIGEST_SIZE = 16
+READ_PAGES = 256  # Страниц на одно чтение образа при сжатии
+PAGE_RECORD = struct.Struct('>I')  # Номер страницы в инкрементальном снимке
+
+# Доли прогресса: снятие снимка и запись/сжатие
+SNAPSHOT_SHARE = 60
+
+
+def _default_db_path():
+    return Config.SQLALCHEMY_DATABASE_URI.replace('sqlite:///', '', 1)
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _digest(page):
+    return hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest()
+
+
+def is_backup_file(filename):
+    """Полный или инкрементальный бэкап (по имени файла)"""
+    return ((filename.startswith(FULL_PREFIX) and filename.endswith(FULL_SUFFIX)) or
+            (filename.startswith(INCREMENTAL_PREFIX) and filename.endswith(INCREMENTAL_SUFFIX)))
+
+
+def backup_kind(filename):
+    return 'incremental' if filename.startswith(INCREMENTAL_PREFIX) else 'full'
+
+
+# ========== Статус ==========
+
+def get_backup_status(backup_dir=None):
+    """Состояние последнего запуска: state (idle/running/completed/failed), stage, progress, filename, error"""
+    path = os.path.join(backup_dir or BACKUP_DIR, STATUS_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'state': 'idle', 'progress': 0}
+
+
+def _write_status(backup_dir, status):
+    """Атомарная запись статуса (временный файл + os.replace)"""
+    status['updated_at'] = _now()
+    path = os.path.join(backup_dir, STATUS_FILE)
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось записать статус бэкапа: {e}")
+
+
+def mark_backup_failed(error, backup_dir=None):
+    """Пометить незавершенный запуск как failed (задача очереди исчерпала попытки)"""
+    backup_dir = backup_dir or BACKUP_DIR
+    status = get_backup_status(backup_dir)
+    if status.get('state') != 'completed' and os.path.isdir(backup_dir):
+        status.update(state='failed', error=error, finished_at=_now())
+        _write_status(backup_dir, status)
+
+
+# ========== Снимок ==========
+
+class _RestartLimit(Exception):
+    """Копирование по шагам перезапускалось слишком часто"""
+
+
+def _copy_database(src, dest, on_progress):
+    """backup API по шагам; при частых перезапусках - одним шагом. Returns: число перезапусков"""
+    state = {'remaining': None, 'restarts': 0}
+
+    def step(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > Config.BACKUP_MAX_RESTARTS:
+                raise _RestartLimit()
+        state['remaining'] = remaining
+        if total:
+            on_progress((total - remaining) / total)
+
+    try:
+        src.backup(dest, pages=max(1, Config.BACKUP_STEP_PAGES), progress=step,
+                   sleep=Config.BACKUP_STEP_SLEEP_MS / 1000)
+    except _RestartLimit:
+        logger.warning(f"⚠️ База меняется во время копирования ({state['restarts']} перезапусков) - снимок одним шагом")
+        src.backup(dest, pages=-1)
+        on_progress(1.0)
+    return state['restarts']
+
+
+@contextmanager
+def _snapshot(db_path, work_dir, on_progress):
+    """Согласованный снимок базы. Yields: (файл с образом БД, page_size, page_count, перезапуски)"""
+    in_memory = os.path.getsize(db_path) <= Config.BACKUP_MEMORY_LIMIT_MB * 1024 * 1024
+    temp_path = None
+    image = None
+    try:
+        if in_memory:
+            dest = sqlite3.connect(':memory:')
+        else:
+            fd, temp_path = tempfile.mkstemp(prefix='.snapshot_', suffix='.db', dir=work_dir)
+            os.close(fd)
+            dest = sqlite3.connect(temp_path)
+        try:
+            src = sqlite3.connect(db_path, timeout=30)
+            try:
+                restarts = _copy_database(src, dest, on_progress)
+            finally:
+                src.close()
+            page_size = dest.execute('PRAGMA page_size').fetchone()[0]
+            page_count = dest.execute('PRAGMA page_count').fetchone()[0]
+            if in_memory:
+                image = io.BytesIO(dest.serialize())
+        finally:
+            dest.close()
+        if image is None:
+            image = open(temp_path, 'rb')
+        with image:
+            yield image, page_size, page_count, restarts
+    finally:
+        if temp_path:
+            for suffix in ('', '-journal', '-wal', '-shm'):
+                if os.path.exists(temp_path + suffix):
+                    os.remove(temp_path + suffix)
+
+
+def _read_blocks(image, page_size):
+    return iter(lambda: image.read(page_size * READ_PAGES), b'')
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ========== Полный и инкрементальный бэкап ==========
+
+def _write_full(image, page_size, page_count, target_path, compress, on_progress):
+    """Образ БД -> target_path (gzip потоком) + файл хешей страниц"""
+    digests = []
+    part_path = target_path + '.part'
+    try:
+        if compress:
+            out = gzip.open(part_path, 'wb', compresslevel=Config.BACKUP_COMPRESS_LEVEL)
+        else:
+            out = open(part_path, 'wb')
+        with out:
+            for block in _read_blocks(image, page_size):
+                out.write(block)
+                view = memoryview(block)
+                for offset in range(0, len(block), page_size):
+                    digests.append(_digest(view[offset:offset + page_size]))
+                on_progress(len(digests) / page_count)
+        os.replace(part_path, target_path)
+    finally:
+        _remove_quietly(part_path)
+
+    manifest_path = target_path + MANIFEST_SUFFIX
+    with open(manifest_path + '.part', 'wb') as f:
+        f.write(json.dumps({'page_size': page_size, 'page_count': page_count}).encode() + b'\n')
+        f.write(b''.join(digests))
+    os.replace(manifest_path + '.part', manifest_path)
+
+
+def _write_incremental(image, page_size, page_count, base, target_path, on_progress):
+    """Только страницы, отличающиеся от полного бэкапа base. Returns: число записанных страниц"""
+    base_digests = base['digests']
+    header = {'base': base['filename'], 'page_size': page_size, 'page_count': page_count, 'created_at': _now()}
+    changed = 0
+    page_number = 0
+    part_path = target_path + '.part'
+    try:
+        with gzip.open(part_path, 'wb', compresslevel=Config.BACKUP_COMPRESS_LEVEL) as out:
+            out.write(json.dumps(header, ensure_ascii=False).encode() + b'\n')
+            for block in _read_blocks(image, page_size):
+                view = memoryview(block)
+                for offset in range(0, len(block), page_size):
+                    page = view[offset:offset + page_size]
+                    start = page_number * DIGEST_SIZE
+                    page_number += 1
+                    if base_digests[start:start + DIGEST_SIZE] != _digest(page):
+                        out.write(PAGE_RECORD.pack(page_number))
+                        out.write(page)
+                        changed += 1
+                on_progress(page_number / page_count)
+        os.replace(part_path, target_path)
+    finally:
+        _remove_quietly(part_path)
+    return changed
+
+
+def _latest_base(backup_dir):
+    """Последний полный бэкап с файлом хешей страниц или None"""
+    names = sorted(
+        f for f in os.listdir(backup_dir)
+        if f.startswith(FULL_PREFIX) and f.endswith(FULL_SUFFIX)
+        and os.path.exists(os.path.join(backup_dir, f + MANIFEST_SUFFIX))
+    )
+    if not names:
+        return None
+    with open(os.path.join(backup_dir, names[-1] + MANIFEST_SUFFIX), 'rb') as f:
+        header = json.loads(f.readline())
+        digests = f.read()
+    return {'filename': names[-1], 'page_size': header['page_size'], 'digests': digests}
+
+
+def run_backup(kind='full', db_path=None, backup_dir=None, compress=True):
+    """
+    Создает полный или инкрементальный бэкап, ход пишет в backup_status.json
+
+    Инкрементальный без полного бэкапа (или после смены page_size) делается полным.
+    Returns: dict - filename, kind, size_bytes, pages, changed_pages, restarts, elapsed_seconds.
+    """
+    db_path = db_path or _default_db_path()
+    backup_dir = backup_dir or BACKUP_DIR
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"База данных не найдена: {db_path}")
+    os.makedirs(backup_dir, exist_ok=True)
+
+    started = time.monotonic()
+    status = {'state': 'running', 'kind': kind, 'stage': 'snapshot', 'progress': 0,
+              'filename': None, 'error': None, 'started_at': _now(), 'finished_at': None}
+    _write_status(backup_dir, status)
+
+    def report(stage, low, high):
+        def on_progress(fraction):
+            percent = int(low + (high - low) * min(1.0, fraction))
+            # Файл статуса переписываем не чаще чем на каждые 5%
+            if stage != status['stage'] or percent - status['progress'] >= 5:
+                status.update(stage=stage, progress=percent)
+                _write_status(backup_dir, status)
+        return on_progress
+
+    try:
+        base = _latest_base(backup_dir) if kind == 'incremental' else None
+        with _snapshot(db_path, backup_dir, report('snapshot', 0, SNAPSHOT_SHARE)) as (image, page_size, page_count, restarts):
+            if kind == 'incremental' and (base is None or base['page_size'] != page_size):
+                logger.info("ℹ️ Нет подходящего полного бэкапа - вместо инкрементального создается полный")
+                kind = 'full'
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            write_progress = report('compress', SNAPSHOT_SHARE, 99)
+            if kind == 'full':
+                filename = f'{FULL_PREFIX}{timestamp}' + (FULL_SUFFIX if compress else '.db')
+                _write_full(image, page_size, page_count, os.path.join(backup_dir, filename), compress, write_progress)
+                changed = page_count
+            else:
+                filename = f'{INCREMENTAL_PREFIX}{timestamp}{INCREMENTAL_SUFFIX}'
+                changed = _write_incremental(image, page_size, page_count, base,
+                                             os.path.join(backup_dir, filename), write_progress)
+    except Exception as e:
+        status.update(state='failed', error=str(e), finished_at=_now())
+        _write_status(backup_dir, status)
+        logger.error(f"❌ Ошибка создания бэкапа: {e}")
+        raise
+
+    result = {
+        'filename': filename,
+        'kind': kind,
+        'base': base['filename'] if kind == 'incremental' else None,
+        'size_bytes': os.path.getsize(os.path.join(backup_dir, filename)),
+        'pages': page_count,
+        'changed_pages': changed,
+        'restarts': restarts,
+        'elapsed_seconds': round(time.monotonic() - started, 2)
+    }
+    status.update(state='completed', stage='completed', progress=100, kind=kind, filename=filename,
+                  finished_at=_now(), result=result)
+    _write_status(backup_dir, status)
+    logger.info(f"✅ Бэкап создан: {filename} ({result['size_bytes'] / (1024 * 1024):.2f} MB, "
+                f"страниц {changed}/{page_count}, {result['elapsed_seconds']} сек)")
+    return result
+
+
+# ========== Восстановление и удаление ==========
+
+def _open_backup(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def restore_snapshot(backup_path, output_path):
+    """Собирает образ БД из полного или инкрементального бэкапа в output_path"""
+    if not os.path.basename(backup_path).startswith(INCREMENTAL_PREFIX):
+        with _open_backup(backup_path) as f_in, open(output_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        return
+
+    with gzip.open(backup_path, 'rb') as f_in:
+        header = json.loads(f_in.readline())
+        base_path = os.path.join(os.path.dirname(backup_path), header['base'])
+        if not os.path.exists(base_path):
+            raise FileNotFoundError(f"Не найден полный бэкап {header['base']}, на котором основан инкрементальный")
+        restore_snapshot(base_path, output_path)
+
+        page_size = header['page_size']
+        with open(output_path, 'r+b') as f_out:
+            while True:
+                record = f_in.read(PAGE_RECORD.size)
+                if not record:
+                    break
+                page = f_in.read(page_size)
+                if len(record) != PAGE_RECORD.size or len(page) != page_size:
+                    raise ValueError("Инкрементальный бэкап поврежден (обрезанная страница)")
+                f_out.seek((PAGE_RECORD.unpack(record)[0] - 1) * page_size)
+                f_out.write(page)
+            f_out.truncate(header['page_count'] * page_size)
+
+
+def prune_orphans(backup_dir=None):
+    """Удаляет файлы хешей и инкрементальные бэкапы, чей полный бэкап уже удален. Returns: список имен"""
+    backup_dir = backup_dir or BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    names = set(os.listdir(backup_dir))
+    removed = []
+    for name in sorted(names):
+        path = os.path.join(backup_dir, name)
+        if name.startswith(FULL_PREFIX) and name.endswith(MANIFEST_SUFFIX):
+            orphan = name[:-len(MANIFEST_SUFFIX)] not in names
+        elif name.startswith(INCREMENTAL_PREFIX) and name.endswith(INCREMENTAL_SUFFIX):
+            try:
+                with gzip.open(path, 'rb') as f:
+                    orphan = json.loads(f.readline()).get('base') not in names
+            except (OSError, ValueError, EOFError):
+                orphan = True
+        else:
+            continue
+        if orphan:
+            _remove_quietly(path)
+            removed.append(name)
+    if removed:
+        logger.info(f"🧹 Удалены файлы без полного бэкапа: {', '.join(removed)}")
+    return removed
+
+
+def delete_backup(filename, backup_dir=None):
+    """Удаляет бэкап; для полного - вместе с файлом хешей и зависящими инкрементальными. Returns: список имен"""
+    backup_dir = backup_dir or BACKUP_DIR
+    os.remove(os.path.join(backup_dir, filename))
+    return [filename] + prune_orphans(backup_dir)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Локальный классификатор типа документа
+
+Взвешенный поиск ключевых слов из SMART_ANALYSIS_CONFIG (IDF по типам,
+бонус за совпадение в заголовке) плюс TF-IDF близость к центроидам,
+построенным по текстам документов, тип которых назначил YandexGPT
+(services.classifier_samples). Работает за миллисекунды; YandexGPT
+спрашиваем только при низкой уверенности. Центроиды переобучаются
+фоновым потоком (start_classifier_trainer), а не в запросе.
+"""
+
+import re
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from config import Config, SMART_ANALYSIS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Порядок при равных баллах - сначала более специфичные типы (как в старом поиске по ключевым словам)
+PRIORITY_ORDER = [
+    'court', 'business_plan', 'invoice', 'waybill', 'act', 'power_of_attorney',
+    'loan', 'insurance', 'lease', 'employment', 'contract', 'supply', 'nda',
+    'partnership', 'service', 'commission', 'agency', 'mandate', 'gift',
+    'exchange', 'sale', 'general'
+]
+
+# Первые символы документа считаем заголовком - совпадения там весят больше
+TITLE_CHARS = 600
+TITLE_BONUS = 3.0
+# Название типа ("договор аренды") - сильнее обычного ключевого слова
+NAME_PHRASE_BONUS = 2.0
+# Классы истории с меньшим числом примеров не учитываем
+MIN_HISTORY_SAMPLES = 5
+
+_TOKEN_RE = re.compile(r'[а-яёa-z]{3,}')
+
+
+def _tokenize(text):
+    """Токены с грубым стеммингом (обрезка до 6 символов) - хватает для русской морфологии"""
+    return [token[:6] for token in _TOKEN_RE.findall(text.lower().replace('ё', 'е'))]
+
+
+def _type_phrases():
+    """Фразы для поиска по каждому типу: ключевые слова + название типа"""
+    phrases = {}
+    for doc_type, config in SMART_ANALYSIS_CONFIG.items():
+        weighted = {keyword.lower(): 1.0 for keyword in config.get('keywords', []) if keyword}
+        for name_part in config.get('name', '').split('/'):
+            name_part = name_part.strip().lower()
+            # "Общий договор" - не признак, а отсутствие признаков
+            if name_part and doc_type != 'general':
+                weighted[name_part] = max(weighted.get(name_part, 0), NAME_PHRASE_BONUS)
+        phrases[doc_type] = weighted
+    return phrases
+
+
+class DocumentTypeClassifier:
+    """Классификатор типа документа по ключевым словам и размеченным текстам"""
+
+    def __init__(self):
+        self.phrases = _type_phrases()
+        # IDF фразы: чем в большем числе типов она встречается, тем меньше ее вес
+        type_count = len(self.phrases)
+        document_frequency = Counter(phrase for weighted in self.phrases.values() for phrase in weighted)
+        self.phrase_idf = {
+            phrase: math.log(1 + type_count / df) for phrase, df in document_frequency.items()
+        }
+        # (centroids, token_idf) - публикуется одним присваиванием, чтобы classify
+        # в другом потоке не увидел новые центроиды со старыми IDF
+        self.history_model = ({}, {})
+        self.history_samples = 0
+        self.trained_at = 0.0
+
+    def train_from_history(self, labeled_texts):
+        """Строит TF-IDF центроиды по размеченным текстам [(document_type, text), ...]
+
+        Тексты обрабатываются так же, как при классификации (первые
+        DOC_CLASSIFIER_MAX_CHARS символов), чтобы обучение и применение
+        видели одно и то же распределение.
+        """
+        class_counts = {}
+        for doc_type, text in labeled_texts:
+            if doc_type not in SMART_ANALYSIS_CONFIG or not text:
+                continue
+            class_counts.setdefault(doc_type, [Counter(), 0])
+            class_counts[doc_type][0].update(_tokenize(text[:Config.DOC_CLASSIFIER_MAX_CHARS]))
+            class_counts[doc_type][1] += 1
+
+        classes = {doc_type: counts for doc_type, (counts, samples) in class_counts.items()
+                   if samples >= MIN_HISTORY_SAMPLES}
+        token_df = Counter(token for counts in classes.values() for token in counts)
+        token_idf = {token: math.log(1 + len(classes) / df) for token, df in token_df.items()}
+
+        centroids = {}
+        for doc_type, counts in classes.items():
+            total = sum(counts.values())
+            vector = {token: (count / total) * token_idf[token] for token, count in counts.items()}
+            norm = math.sqrt(sum(v * v for v in vector.values()))
+            if norm:
+                centroids[doc_type] = {token: v / norm for token, v in vector.items()}
+
+        self.history_model = (centroids, token_idf)
+        self.history_samples = sum(samples for _, samples in class_counts.values())
+        self.trained_at = time.time()
+
+    def _history_scores(self, text):
+        centroids, token_idf = self.history_model
+        if not centroids:
+            return {}
+        counts = Counter(token for token in _tokenize(text) if token in token_idf)
+        if not counts:
+            return {}
+        total = sum(counts.values())
+        vector = {token: (count / total) * token_idf[token] for token, count in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        if not norm:
+            return {}
+        return {
+            doc_type: sum(weight * centroid.get(token, 0.0) for token, weight in vector.items()) / norm
+            for doc_type, centroid in centroids.items()
+        }
+
+    def score(self, text):
+        """Баллы каждого типа для текста (учитываются первые DOC_CLASSIFIER_MAX_CHARS символов)"""
+        head = text[:Config.DOC_CLASSIFIER_MAX_CHARS].lower().replace('ё', 'е')
+        title = head[:TITLE_CHARS]
+        scores = {}
+        for doc_type, weighted in self.phrases.items():
+            total = 0.0
+            for phrase, weight in weighted.items():
+                count = head.count(phrase)
+                if not count:
+                    continue
+                # Многословные фразы специфичнее одиночных основ
+                phrase_weight = weight * self.phrase_idf[phrase] * len(phrase.split())
+                if phrase in title:
+                    phrase_weight *= TITLE_BONUS
+                total += phrase_weight * math.log1p(count)
+            if total:
+                scores[doc_type] = total
+
+        for doc_type, similarity in self._history_scores(head).items():
+            scores[doc_type] = scores.get(doc_type, 0.0) + Config.DOC_CLASSIFIER_HISTORY_WEIGHT * similarity
+        return scores
+
+    def classify(self, text):
+        """Возвращает (document_type, confidence, scores)
+
+        confidence - относительный отрыв лучшего типа от второго (0..1);
+        при слишком малом абсолютном балле уверенность нулевая.
+        """
+        scores = self.score(text)
+        if not scores:
+            return 'general', 0.0, scores
+
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (-item[1], PRIORITY_ORDER.index(item[0]) if item[0] in PRIORITY_ORDER else len(PRIORITY_ORDER))
+        )
+        best_type, best_score = ranked[0]
+        second_score = ranked[1][1] if len(ranked) > 1 else 0.0
+        if best_score < Config.DOC_CLASSIFIER_MIN_SCORE:
+            return best_type, 0.0, scores
+        return best_type, (best_score - second_score) / best_score, scores
+
+
+_classifier_instance = None
+_classifier_lock = threading.Lock()
+
+
+def get_document_classifier():
+    """Возвращает общий классификатор (обучение - train_document_classifier, не в запросе)"""
+    global _classifier_instance
+    if _classifier_instance is None:
+        with _classifier_lock:
+            if _classifier_instance is None:
+                _classifier_instance = DocumentTypeClassifier()
+    return _classifier_instance
+
+
+def train_document_classifier():
+    """Переобучает центроиды общего классификатора на размеченных текстах документов
+
+    Тексты загружаются и токенизируются без блокировки: classify продолжает
+    работать со старой моделью, новая публикуется одним присваиванием.
+    """
+    from services.classifier_samples import get_classifier_samples
+
+    started = time.time()
+    samples = get_classifier_samples().load()
+    classifier = get_document_classifier()
+    classifier.train_from_history(samples)
+    logger.info(f"🧠 Классификатор типов документов обучен на {classifier.history_samples} размеченных текстах "
+                f"за {time.time() - started:.1f} сек")
+    return classifier.history_samples
+
+
+def start_classifier_trainer(interval):
+    """Фоновый поток: обучение классификатора при старте процесса и затем каждые interval секунд"""
+    stop_event = threading.Event()
+
+    def run():
+        while True:
+            try:
+                train_document_classifier()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обучения классификатора типов документов: {e}")
+            if stop_event.wait(interval):
+                return
+
+    thread = threading.Thread(target=run, name='classifier-trainer', daemon=True)
+    thread.start()
+    return stop_event
+
+
+def classify_document_type(text):
+    """Локальная классификация: (document_type, confidence, scores)"""
+    return get_document_classifier().classify(text)
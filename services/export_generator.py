@@ -1,52 +1,201 @@
+"""
+Экспорт результатов анализа в Word (DOCX) и Excel (XLSX)
+
+Excel пишется потоково (openpyxl write_only): строки уходят во временный
+файл листа сразу, без графа ячеек в памяти, поэтому память и время не
+растут с числом рисков. Этот же движок выгружает всю пакетную задачу
+(generate_batch_excel) - файлы читаются из БД по одному.
+
+Word собирается из кешированного шаблона: базовый документ со стилями
+и заготовки абзацев (заголовки, текст, риски по уровням) строятся один
+раз на цвет брендинга, а в отчет вставляются копии заготовок с текстом -
+без поиска стилей и форматирования на каждый абзац.
+"""
+
 from docx import Document
 from docx.shared import Pt, RGBColor, Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+from docx.text.paragraph import Paragraph
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+from copy import deepcopy
+from functools import lru_cache
 from io import BytesIO
 from datetime import datetime
+import json
 import logging
 import os
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PRIMARY_COLOR = '#4361ee'
+DEFAULT_RISK_COLOR = '3182CE'
+RISK_COLORS = {
+    'CRITICAL': 'E53E3E',
+    'HIGH': 'DD6B20',
+    'MEDIUM': 'D69E2E',
+    'LOW': '38A169'
+}
+
+# Тексты-заглушки экспертной оценки, которые не выводятся в отчет
+EXPERT_SECTIONS = [
+    ('legal_expertise', '🧑‍⚖️ Юридическая экспертиза', 'Юридический анализ не выявил критических нарушений'),
+    ('financial_analysis', '💰 Финансовый анализ', 'Финансовые условия требуют дополнительной проверки'),
+    ('operational_risks', '⚙️ Операционные риски', 'Операционные риски находятся в допустимых пределах'),
+    ('strategic_assessment', '🎯 Стратегическая оценка', 'Документ соответствует базовым стратегическим целям')
+]
+
 def hex_to_rgb(hex_color):
     """Конвертирует hex цвет в RGB"""
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
+def _branding(branding_settings):
+    """(primary_color, company_name, logo_path) из настроек брендинга"""
+    if branding_settings and branding_settings.get('is_active'):
+        return (
+            branding_settings.get('primary_color', DEFAULT_PRIMARY_COLOR),
+            branding_settings.get('company_name'),
+            branding_settings.get('logo_path')
+        )
+    return DEFAULT_PRIMARY_COLOR, None, None
+
+def _action_parts(action):
+    """(действие, эффект) для практической рекомендации"""
+    if isinstance(action, dict):
+        return action.get('action', action.get('title', '')), action.get('effect', action.get('description', ''))
+    return str(action), None
+
+
+class _DocxTemplate:
+    """Кешированный шаблон отчета Word: базовый документ и заготовки абзацев"""
+
+    def __init__(self, primary_color):
+        doc = Document()
+        # Настройка шрифта по умолчанию для поддержки кириллицы
+        font = doc.styles['Normal'].font
+        font.name = 'Arial'
+        font.size = Pt(11)
+
+        self.prototypes = {}
+
+        title = doc.add_heading('-', 0)
+        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        title_run = title.runs[0]
+        title_run.font.size = Pt(24)
+        title_run.font.color.rgb = RGBColor(*hex_to_rgb(primary_color))
+        title_run.bold = True
+        self._keep('title', title)
+
+        for level, color in list(RISK_COLORS.items()) + [(None, DEFAULT_RISK_COLOR)]:
+            risk_heading = doc.add_heading('-', 1)
+            risk_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            risk_heading.runs[0].font.color.rgb = RGBColor(*hex_to_rgb(color))
+            risk_heading.runs[0].bold = True
+            self._keep(('risk_heading', level), risk_heading)
+
+            risk_title = doc.add_heading('-', 3)
+            risk_title.runs[0].font.color.rgb = RGBColor(*hex_to_rgb(color))
+            self._keep(('risk_title', level), risk_title)
+
+        self._keep('body', doc.add_paragraph('-'))
+        self._keep('empty', doc.add_paragraph())
+        self._keep('page_break', doc.add_page_break())
+        self._keep('heading2', doc.add_heading('-', 2))
+        self._keep('heading3', doc.add_heading('-', 3))
+
+        centered = doc.add_paragraph('-')
+        centered.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        self._keep('body_center', centered)
+
+        decision = doc.add_paragraph()
+        decision.add_run('💡 Решение: ').bold = True
+        decision.add_run('-')
+        decision.paragraph_format.space_after = Pt(12)
+        self._keep('decision', decision)
+
+        action = doc.add_paragraph('-', style='List Number')
+        action.add_run('-').bold = True
+        self._keep('action', action)
+        action = doc.add_paragraph('-', style='List Number')
+        action.add_run('-')
+        self._keep('action_plain', action)
+        action = doc.add_paragraph('-', style='List Number')
+        action.add_run('-').bold = True
+        action.add_run('-')
+        self._keep('action_effect', action)
+
+        bullet = doc.add_paragraph('• ', style='List Bullet')
+        bullet.add_run('-')
+        self._keep('bullet', bullet)
+
+        footer = doc.add_paragraph('Сгенерировано DocScan AI - https://docscan-ai.ru')
+        footer.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        footer.runs[0].font.size = Pt(9)
+        footer.runs[0].font.color.rgb = RGBColor(108, 117, 125)
+        self._keep('footer', footer)
+
+        buffer = BytesIO()
+        doc.save(buffer)
+        self.document_bytes = buffer.getvalue()
+
+    def _keep(self, kind, paragraph):
+        """Запоминает абзац как заготовку и убирает его из базового документа"""
+        element = paragraph._p
+        element.getparent().remove(element)
+        self.prototypes[kind] = element
+
+    def new_document(self):
+        return _DocxReport(Document(BytesIO(self.document_bytes)), self.prototypes)
+
+
+class _DocxReport:
+    """Документ из шаблона: абзацы добавляются копиями заготовок"""
+
+    def __init__(self, doc, prototypes):
+        self.doc = doc
+        self.prototypes = prototypes
+        # Абзацы вставляются перед свойствами раздела; ищем их один раз, а не при каждой вставке
+        self._section = doc.element.body.sectPr
+
+    def add(self, kind, *texts):
+        element = deepcopy(self.prototypes[kind])
+        self._section.addprevious(element)
+        paragraph = Paragraph(element, self.doc._body)
+        for run, text in zip(paragraph.runs[-len(texts):] if texts else (), texts):
+            run.text = text
+        return paragraph
+
+    def text(self, text, kind='body'):
+        if text:
+            return self.add(kind, text)
+        # Пустой текст - абзац без run, как у add_paragraph('')
+        paragraph = self.add(kind)
+        for run in paragraph._p.r_lst:
+            paragraph._p.remove(run)
+        return paragraph
+
+
+@lru_cache(maxsize=32)
+def _get_docx_template(primary_color):
+    return _DocxTemplate(primary_color)
+
+
 def generate_analysis_word(analysis_data, filename="document.pdf", branding_settings=None):
     """Генерирует Word документ (DOCX) с результатами анализа
-    
+
     Args:
         analysis_data: Данные анализа
         filename: Имя файла
         branding_settings: Настройки брендинга (dict с logo_path, primary_color, secondary_color, company_name)
     """
     try:
-        # Получаем настройки брендинга или используем значения по умолчанию
-        if branding_settings and branding_settings.get('is_active'):
-            primary_color = branding_settings.get('primary_color', '#4361ee')
-            secondary_color = branding_settings.get('secondary_color', '#764ba2')
-            company_name = branding_settings.get('company_name')
-            logo_path = branding_settings.get('logo_path')
-        else:
-            primary_color = '#4361ee'
-            secondary_color = '#764ba2'
-            company_name = None
-            logo_path = None
-        
-        doc = Document()
-        
-        # Настройка шрифта по умолчанию для поддержки кириллицы
-        style = doc.styles['Normal']
-        font = style.font
-        font.name = 'Arial'
-        font.size = Pt(11)
-        
+        primary_color, company_name, logo_path = _branding(branding_settings)
+        report = _get_docx_template(primary_color).new_document()
+        doc = report.doc
+
         # Логотип (если есть)
         if logo_path and os.path.exists(logo_path):
             try:
@@ -54,66 +203,44 @@ def generate_analysis_word(analysis_data, filename="document.pdf", branding_sett
                 paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
                 run = paragraph.add_run()
                 run.add_picture(logo_path, width=Inches(2))
-                doc.add_paragraph()  # Пустая строка после логотипа
+                report.add('empty')  # Пустая строка после логотипа
             except Exception as e:
                 logger.warning(f"⚠️ Не удалось добавить логотип: {e}")
-        
+
         # Заголовок
-        title_text = company_name if company_name else 'Анализ документа'
-        title = doc.add_heading(title_text, 0)
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        title_run = title.runs[0]
-        title_run.font.size = Pt(24)
-        # Конвертируем hex в RGB
-        rgb_color = hex_to_rgb(primary_color)
-        title_run.font.color.rgb = RGBColor(rgb_color[0], rgb_color[1], rgb_color[2])
-        title_run.bold = True
-        
+        report.add('title', company_name if company_name else 'Анализ документа')
+
         # Информация о документе
-        doc.add_paragraph(f'Файл: {filename}')
-        doc.add_paragraph(f'Дата анализа: {datetime.now().strftime("%d.%m.%Y %H:%M")}')
-        doc.add_paragraph(f'Тип документа: {analysis_data.get("document_type_name", "Не определен")}')
-        doc.add_paragraph()  # Пустая строка
-        
+        report.text(f'Файл: {filename}')
+        report.text(f'Дата анализа: {datetime.now().strftime("%d.%m.%Y %H:%M")}')
+        report.text(f'Тип документа: {analysis_data.get("document_type_name", "Не определен")}')
+        report.add('empty')
+
         # Общий уровень риска
-        risk_level = analysis_data.get('executive_summary', {}).get('risk_level', 'LOW')
-        risk_colors = {
-            'CRITICAL': RGBColor(229, 62, 62),
-            'HIGH': RGBColor(221, 107, 32),
-            'MEDIUM': RGBColor(214, 158, 46),
-            'LOW': RGBColor(56, 161, 105)
-        }
-        risk_color = risk_colors.get(risk_level, RGBColor(49, 130, 206))
-        
-        risk_icon = analysis_data.get('executive_summary', {}).get('risk_icon', '⚠️')
-        risk_desc = analysis_data.get('executive_summary', {}).get('risk_description', 'Риск не определен')
-        
-        risk_heading = doc.add_heading(f'{risk_icon} Уровень риска: {risk_level}', 1)
-        risk_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        risk_heading_run = risk_heading.runs[0]
-        risk_heading_run.font.color.rgb = risk_color
-        risk_heading_run.bold = True
-        
-        doc.add_paragraph(risk_desc).alignment = WD_ALIGN_PARAGRAPH.CENTER
-        doc.add_paragraph()  # Пустая строка
-        
+        summary = analysis_data.get('executive_summary', {})
+        risk_level = summary.get('risk_level', 'LOW')
+        risk_icon = summary.get('risk_icon', '⚠️')
+        risk_desc = summary.get('risk_description', 'Риск не определен')
+
+        heading_kind = ('risk_heading', risk_level if risk_level in RISK_COLORS else None)
+        report.add(heading_kind, f'{risk_icon} Уровень риска: {risk_level}')
+        report.text(risk_desc, 'body_center')
+        report.add('empty')
+
         # Решение
-        decision = analysis_data.get('executive_summary', {}).get('decision_support', '')
+        decision = summary.get('decision_support', '')
         if decision:
-            decision_para = doc.add_paragraph()
-            decision_para.add_run('💡 Решение: ').bold = True
-            decision_para.add_run(decision)
-            decision_para.paragraph_format.space_after = Pt(12)
-            doc.add_paragraph()  # Пустая строка
-        
+            report.add('decision', decision)
+            report.add('empty')
+
         # Статистика рисков
         risk_stats = analysis_data.get('risk_analysis', {}).get('risk_statistics', {})
         if risk_stats:
-            doc.add_heading('📊 Статистика рисков', 2)
-            
+            report.add('heading2', '📊 Статистика рисков')
+
             stats_table = doc.add_table(rows=6, cols=2)
             stats_table.style = 'Light Grid Accent 1'
-            
+
             # Заголовки
             header_cells = stats_table.rows[0].cells
             header_cells[0].text = 'Уровень риска'
@@ -121,7 +248,7 @@ def generate_analysis_word(analysis_data, filename="document.pdf", branding_sett
             for cell in header_cells:
                 cell.paragraphs[0].runs[0].bold = True
                 cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
+
             # Данные
             stats_data = [
                 ('Критических', risk_stats.get('CRITICAL', 0)),
@@ -130,7 +257,7 @@ def generate_analysis_word(analysis_data, filename="document.pdf", branding_sett
                 ('Низких', risk_stats.get('LOW', 0)),
                 ('Всего', risk_stats.get('total', 0))
             ]
-            
+
             for i, (label, value) in enumerate(stats_data, 1):
                 row_cells = stats_table.rows[i].cells
                 row_cells[0].text = label
@@ -138,101 +265,67 @@ def generate_analysis_word(analysis_data, filename="document.pdf", branding_sett
                 if i == 5:  # Последняя строка "Всего"
                     for cell in row_cells:
                         cell.paragraphs[0].runs[0].bold = True
-            
-            doc.add_paragraph()  # Пустая строка
-        
+
+            report.add('empty')
+
         # Экспертная оценка
         expert = analysis_data.get('expert_analysis', {})
-        
-        legal = expert.get('legal_expertise', '')
-        if legal and legal != 'Юридический анализ не выявил критических нарушений':
-            doc.add_heading('🧑‍⚖️ Юридическая экспертиза', 2)
-            doc.add_paragraph(legal)
-            doc.add_paragraph()
-        
-        financial = expert.get('financial_analysis', '')
-        if financial and financial != 'Финансовые условия требуют дополнительной проверки':
-            doc.add_heading('💰 Финансовый анализ', 2)
-            doc.add_paragraph(financial)
-            doc.add_paragraph()
-        
-        operational = expert.get('operational_risks', '')
-        if operational and operational != 'Операционные риски находятся в допустимых пределах':
-            doc.add_heading('⚙️ Операционные риски', 2)
-            doc.add_paragraph(operational)
-            doc.add_paragraph()
-        
-        strategic = expert.get('strategic_assessment', '')
-        if strategic and strategic != 'Документ соответствует базовым стратегическим целям':
-            doc.add_heading('🎯 Стратегическая оценка', 2)
-            doc.add_paragraph(strategic)
-            doc.add_paragraph()
-        
+        for key, section_title, skip_text in EXPERT_SECTIONS:
+            section_text = expert.get(key, '')
+            if section_text and section_text != skip_text:
+                report.add('heading2', section_title)
+                report.text(section_text)
+                report.add('empty')
+
         # Ключевые риски
         key_risks = analysis_data.get('risk_analysis', {}).get('key_risks', [])
         if key_risks:
-            doc.add_page_break()
-            doc.add_heading('⚠️ Детальный анализ рисков', 2)
-            
+            report.add('page_break')
+            report.add('heading2', '⚠️ Детальный анализ рисков')
+
             for i, risk in enumerate(key_risks, 1):
                 risk_level = risk.get('level', 'MEDIUM')
-                risk_color = risk_colors.get(risk_level, RGBColor(49, 130, 206))
-                
-                risk_title = doc.add_heading(f"{i}. {risk.get('icon', '⚠️')} {risk.get('title', 'Риск')} ({risk_level})", 3)
-                risk_title_run = risk_title.runs[0]
-                risk_title_run.font.color.rgb = risk_color
-                
-                doc.add_paragraph(risk.get('description', ''))
-                doc.add_paragraph()
-        
+                title_kind = ('risk_title', risk_level if risk_level in RISK_COLORS else None)
+                report.add(title_kind, f"{i}. {risk.get('icon', '⚠️')} {risk.get('title', 'Риск')} ({risk_level})")
+                report.text(risk.get('description', ''))
+                report.add('empty')
+
         # Рекомендации
         recommendations = analysis_data.get('recommendations', {})
         if recommendations:
-            doc.add_page_break()
-            doc.add_heading('💡 Практические рекомендации', 2)
-            
+            report.add('page_break')
+            report.add('heading2', '💡 Практические рекомендации')
+
             practical_actions = recommendations.get('practical_actions', [])
             if practical_actions:
-                doc.add_heading('📋 Рекомендуемые действия:', 3)
+                report.add('heading3', '📋 Рекомендуемые действия:')
                 for i, action in enumerate(practical_actions, 1):
-                    para = doc.add_paragraph(f"{i}. ", style='List Number')
-                    if isinstance(action, dict):
-                        action_text = action.get('action', action.get('title', ''))
-                        effect = action.get('effect', action.get('description', ''))
-                        para.add_run(action_text).bold = True
-                        if effect:
-                            para.add_run(f" - {effect}")
+                    action_text, effect = _action_parts(action)
+                    if effect:
+                        report.add('action_effect', f"{i}. ", action_text, f" - {effect}")
                     else:
-                        para.add_run(str(action))
-            
+                        report.add('action' if isinstance(action, dict) else 'action_plain', f"{i}. ", action_text)
+
             priority_actions = recommendations.get('priority_actions', [])
             if priority_actions:
-                doc.add_paragraph()
-                doc.add_heading('🚨 Срочные действия:', 3)
+                report.add('empty')
+                report.add('heading3', '🚨 Срочные действия:')
                 for action in priority_actions:
-                    para = doc.add_paragraph("• ", style='List Bullet')
-                    if isinstance(action, dict):
-                        action_text = action.get('action', action.get('title', ''))
-                        para.add_run(action_text)
-                    else:
-                        para.add_run(str(action))
-        
+                    action_text, _ = _action_parts(action)
+                    report.add('bullet', action_text)
+
         # Футер
-        doc.add_paragraph()
-        footer = doc.add_paragraph('Сгенерировано DocScan AI - https://docscan-ai.ru')
-        footer.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        footer_run = footer.runs[0]
-        footer_run.font.size = Pt(9)
-        footer_run.font.color.rgb = RGBColor(108, 117, 125)
-        
+        report.add('empty')
+        report.add('footer')
+
         # Сохраняем в BytesIO
         buffer = BytesIO()
         doc.save(buffer)
         buffer.seek(0)
-        
+
         logger.info(f"✅ Word документ успешно сгенерирован для файла: {filename}")
         return buffer.getvalue()
-        
+
     except Exception as e:
         logger.error(f"❌ Ошибка генерации Word документа: {e}")
         import traceback
@@ -240,271 +333,311 @@ def generate_analysis_word(analysis_data, filename="document.pdf", branding_sett
         raise
 
 
-def generate_analysis_excel(analysis_data, filename="document.pdf", branding_settings=None):
-    """Генерирует Excel файл (XLSX) с результатами анализа
-    
-    Args:
-        analysis_data: Данные анализа
-        filename: Имя файла
-        branding_settings: Настройки брендинга (dict с logo_path, primary_color, secondary_color, company_name)
-    """
-    try:
-        # Получаем настройки брендинга или используем значения по умолчанию
-        if branding_settings and branding_settings.get('is_active'):
-            primary_color = branding_settings.get('primary_color', '#4361ee')
-            secondary_color = branding_settings.get('secondary_color', '#764ba2')
-            company_name = branding_settings.get('company_name')
-            logo_path = branding_settings.get('logo_path')
-        else:
-            primary_color = '#4361ee'
-            secondary_color = '#764ba2'
-            company_name = None
-            logo_path = None
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = company_name if company_name else "Анализ документа"
-        
-        # Конвертируем hex в RGB для Excel (убираем #)
-        primary_color_excel = primary_color.lstrip('#')
-        
-        # Стили
-        header_fill = PatternFill(start_color=primary_color_excel, end_color=primary_color_excel, fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        title_font = Font(bold=True, size=16, color=primary_color_excel)
-        risk_font = Font(bold=True, size=11)
-        border = Border(
+class _SheetWriter:
+    """Построчная запись в write-only лист: номера строк, пропуски и объединения"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.next_row = 1
+
+    def put(self, row, *values, merge=None):
+        """Пишет строку row (пропущенные строки - пустые); merge - колонки 'A:D'"""
+        while self.next_row < row:
+            self.ws.append([])
+            self.next_row += 1
+        self.ws.append(values)
+        self.next_row += 1
+        if merge:
+            first, last = merge.split(':')
+            # Строки не повторяются, поэтому без MultiCellRange.add - он проверяет пересечение со всеми диапазонами
+            self.ws.merged_cells.ranges.add(CellRange(f'{first}{row}:{last}{row}'))
+
+    def cell(self, value, font=None, fill=None, alignment=None, border=None):
+        cell = WriteOnlyCell(self.ws, value=value)
+        if font is not None:
+            cell.font = font
+        if fill is not None:
+            cell.fill = fill
+        if alignment is not None:
+            cell.alignment = alignment
+        if border is not None:
+            cell.border = border
+        return cell
+
+
+@lru_cache(maxsize=32)
+def _excel_styles(primary_color_excel):
+    """Стили ячеек Excel (один набор на цвет брендинга)"""
+    return {
+        'header_fill': PatternFill(start_color=primary_color_excel, end_color=primary_color_excel, fill_type="solid"),
+        'header_font': Font(bold=True, color="FFFFFF", size=12),
+        'title_font': Font(bold=True, color="FFFFFF", size=16),
+        'risk_font': Font(bold=True, color="FFFFFF", size=14),
+        'risk_fills': {
+            level: PatternFill(start_color=color, end_color=color, fill_type="solid")
+            for level, color in list(RISK_COLORS.items()) + [(None, DEFAULT_RISK_COLOR)]
+        },
+        'bold': Font(bold=True),
+        'section_font': Font(bold=True, size=12),
+        'footer_font': Font(size=9, color="6C757D"),
+        'border': Border(
             left=Side(style='thin'),
             right=Side(style='thin'),
             top=Side(style='thin'),
             bottom=Side(style='thin')
-        )
-        center_align = Alignment(horizontal='center', vertical='center')
-        wrap_align = Alignment(wrap_text=True, vertical='top')
-        
-        row = 1
-        
-        # Заголовок
-        title_text = company_name if company_name else "Анализ документа"
-        ws.merge_cells(f'A{row}:D{row}')
-        cell = ws[f'A{row}']
-        cell.value = title_text
-        cell.font = title_font
-        cell.fill = header_fill
-        cell.font = Font(bold=True, color="FFFFFF", size=16)
-        cell.alignment = center_align
-        row += 1
-        
-        # Информация о документе
-        row += 1
-        ws[f'A{row}'] = "Файл:"
-        ws[f'B{row}'] = filename
-        ws[f'B{row}'].font = Font(bold=True)
+        ),
+        'center': Alignment(horizontal='center', vertical='center'),
+        'wrap': Alignment(wrap_text=True, vertical='top')
+    }
+
+
+def _write_analysis_sheet(sheet, analysis_data, filename, company_name, styles):
+    """Отчет по одному анализу на write-only листе (раскладка строк как в прежнем отчете)"""
+    ws = sheet.ws
+    # Ширина колонок задается до первой строки
+    ws.column_dimensions['A'].width = 25
+    ws.column_dimensions['B'].width = 30
+    ws.column_dimensions['C'].width = 30
+    ws.column_dimensions['D'].width = 30
+
+    row = 1
+
+    # Заголовок
+    title_text = company_name if company_name else "Анализ документа"
+    sheet.put(row, sheet.cell(title_text, styles['title_font'], styles['header_fill'], styles['center']), merge='A:D')
+    row += 2
+
+    # Информация о документе
+    sheet.put(row, "Файл:", sheet.cell(filename, styles['bold']))
+    row += 1
+    sheet.put(row, "Дата анализа:", datetime.now().strftime("%d.%m.%Y %H:%M"))
+    row += 1
+    sheet.put(row, "Тип документа:", analysis_data.get('document_type_name', 'Не определен'))
+    row += 2
+
+    # Общий уровень риска
+    summary = analysis_data.get('executive_summary', {})
+    risk_level = summary.get('risk_level', 'LOW')
+    risk_fill = styles['risk_fills'].get(risk_level, styles['risk_fills'][None])
+    risk_icon = summary.get('risk_icon', '⚠️')
+    risk_desc = summary.get('risk_description', 'Риск не определен')
+    sheet.put(row, sheet.cell(f"{risk_icon} Уровень риска: {risk_level}", styles['risk_font'], risk_fill, styles['center']), merge='A:D')
+    row += 1
+    sheet.put(row, sheet.cell(risk_desc, alignment=styles['center']), merge='A:D')
+    row += 2
+
+    # Решение
+    decision = summary.get('decision_support', '')
+    if decision:
+        sheet.put(row, sheet.cell("💡 Решение:", styles['bold']), sheet.cell(decision, alignment=styles['wrap']), merge='B:D')
+        row += 2
+
+    # Статистика рисков
+    risk_stats = analysis_data.get('risk_analysis', {}).get('risk_statistics', {})
+    if risk_stats:
+        sheet.put(row, sheet.cell("📊 Статистика рисков", styles['section_font']))
         row += 1
-        
-        ws[f'A{row}'] = "Дата анализа:"
-        ws[f'B{row}'] = datetime.now().strftime("%d.%m.%Y %H:%M")
+
+        sheet.put(row, *[
+            sheet.cell(header, styles['header_font'], styles['header_fill'], styles['center'], styles['border'])
+            for header in ('Уровень риска', 'Количество')
+        ])
         row += 1
-        
-        ws[f'A{row}'] = "Тип документа:"
-        ws[f'B{row}'] = analysis_data.get('document_type_name', 'Не определен')
-        row += 2
-        
-        # Общий уровень риска
-        risk_level = analysis_data.get('executive_summary', {}).get('risk_level', 'LOW')
-        risk_colors_map = {
-            'CRITICAL': 'E53E3E',
-            'HIGH': 'DD6B20',
-            'MEDIUM': 'D69E2E',
-            'LOW': '38A169'
-        }
-        risk_color = risk_colors_map.get(risk_level, '3182CE')
-        risk_fill = PatternFill(start_color=risk_color, end_color=risk_color, fill_type="solid")
-        
-        ws.merge_cells(f'A{row}:D{row}')
-        cell = ws[f'A{row}']
-        risk_icon = analysis_data.get('executive_summary', {}).get('risk_icon', '⚠️')
-        risk_desc = analysis_data.get('executive_summary', {}).get('risk_description', 'Риск не определен')
-        cell.value = f"{risk_icon} Уровень риска: {risk_level}"
-        cell.font = risk_font
-        cell.fill = risk_fill
-        cell.font = Font(bold=True, color="FFFFFF", size=14)
-        cell.alignment = center_align
+
+        stats_data = [
+            ('Критических', risk_stats.get('CRITICAL', 0)),
+            ('Высоких', risk_stats.get('HIGH', 0)),
+            ('Средних', risk_stats.get('MEDIUM', 0)),
+            ('Низких', risk_stats.get('LOW', 0)),
+            ('Всего', risk_stats.get('total', 0))
+        ]
+        for label, value in stats_data:
+            font = styles['bold'] if label == 'Всего' else None
+            sheet.put(row, *[
+                sheet.cell(cell_value, font, alignment=styles['center'], border=styles['border'])
+                for cell_value in (label, value)
+            ])
+            row += 1
         row += 1
-        
-        ws.merge_cells(f'A{row}:D{row}')
-        ws[f'A{row}'] = risk_desc
-        ws[f'A{row}'].alignment = center_align
-        row += 2
-        
-        # Решение
-        decision = analysis_data.get('executive_summary', {}).get('decision_support', '')
-        if decision:
-            ws[f'A{row}'] = "💡 Решение:"
-            ws[f'A{row}'].font = Font(bold=True)
-            ws.merge_cells(f'B{row}:D{row}')
-            ws[f'B{row}'] = decision
-            ws[f'B{row}'].alignment = wrap_align
+
+    # Экспертная оценка
+    expert = analysis_data.get('expert_analysis', {})
+    for key, section_title, skip_text in EXPERT_SECTIONS:
+        section_text = expert.get(key, '')
+        if section_text and section_text != skip_text:
+            sheet.put(row, sheet.cell(section_title, styles['section_font']))
+            row += 1
+            sheet.put(row, sheet.cell(section_text, alignment=styles['wrap']), merge='A:D')
             row += 2
-        
-        # Статистика рисков
-        risk_stats = analysis_data.get('risk_analysis', {}).get('risk_statistics', {})
-        if risk_stats:
-            ws[f'A{row}'] = "📊 Статистика рисков"
-            ws[f'A{row}'].font = Font(bold=True, size=12)
+
+    # Ключевые риски
+    key_risks = analysis_data.get('risk_analysis', {}).get('key_risks', [])
+    if key_risks:
+        sheet.put(row, sheet.cell("⚠️ Детальный анализ рисков", styles['section_font']))
+        row += 1
+        for i, risk in enumerate(key_risks, 1):
+            risk_title = f"{i}. {risk.get('icon', '⚠️')} {risk.get('title', 'Риск')} ({risk.get('level', 'MEDIUM')})"
+            sheet.put(row, sheet.cell(risk_title, styles['bold']))
             row += 1
-            
-            # Заголовки таблицы
-            headers = ['Уровень риска', 'Количество']
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=row, column=col)
-                cell.value = header
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = center_align
-                cell.border = border
+            sheet.put(row, sheet.cell(risk.get('description', ''), alignment=styles['wrap']), merge='A:D')
             row += 1
-            
-            # Данные
-            stats_data = [
-                ('Критических', risk_stats.get('CRITICAL', 0)),
-                ('Высоких', risk_stats.get('HIGH', 0)),
-                ('Средних', risk_stats.get('MEDIUM', 0)),
-                ('Низких', risk_stats.get('LOW', 0)),
-                ('Всего', risk_stats.get('total', 0))
-            ]
-            
-            for label, value in stats_data:
-                ws.cell(row=row, column=1).value = label
-                ws.cell(row=row, column=2).value = value
-                if label == 'Всего':
-                    for col in [1, 2]:
-                        ws.cell(row=row, column=col).font = Font(bold=True)
-                for col in [1, 2]:
-                    ws.cell(row=row, column=col).border = border
-                    ws.cell(row=row, column=col).alignment = center_align
-                row += 1
-            
+
+    # Рекомендации
+    recommendations = analysis_data.get('recommendations', {})
+    if recommendations:
+        sheet.put(row, sheet.cell("💡 Практические рекомендации", styles['section_font']))
+        row += 1
+
+        practical_actions = recommendations.get('practical_actions', [])
+        if practical_actions:
+            sheet.put(row, sheet.cell("📋 Рекомендуемые действия:", styles['bold']))
             row += 1
-        
-        # Экспертная оценка
-        expert = analysis_data.get('expert_analysis', {})
-        
-        sections = [
-            ('🧑‍⚖️ Юридическая экспертиза', expert.get('legal_expertise', '')),
-            ('💰 Финансовый анализ', expert.get('financial_analysis', '')),
-            ('⚙️ Операционные риски', expert.get('operational_risks', '')),
-            ('🎯 Стратегическая оценка', expert.get('strategic_assessment', ''))
-        ]
-        
-        skip_texts = [
-            'Юридический анализ не выявил критических нарушений',
-            'Финансовые условия требуют дополнительной проверки',
-            'Операционные риски находятся в допустимых пределах',
-            'Документ соответствует базовым стратегическим целям'
-        ]
-        
-        for section_title, section_text in sections:
-            if section_text and section_text not in skip_texts:
-                ws[f'A{row}'] = section_title
-                ws[f'A{row}'].font = Font(bold=True, size=12)
+            for i, action in enumerate(practical_actions, 1):
+                action_text, effect = _action_parts(action)
+                action_str = f"{i}. {action_text}"
+                if effect:
+                    action_str += f" - {effect}"
+                sheet.put(row, sheet.cell(action_str, alignment=styles['wrap']), merge='A:D')
                 row += 1
-                
-                ws.merge_cells(f'A{row}:D{row}')
-                ws[f'A{row}'] = section_text
-                ws[f'A{row}'].alignment = wrap_align
-                row += 2
-        
-        # Ключевые риски
-        key_risks = analysis_data.get('risk_analysis', {}).get('key_risks', [])
-        if key_risks:
-            ws[f'A{row}'] = "⚠️ Детальный анализ рисков"
-            ws[f'A{row}'].font = Font(bold=True, size=12)
+
+        priority_actions = recommendations.get('priority_actions', [])
+        if priority_actions:
             row += 1
-            
-            for i, risk in enumerate(key_risks, 1):
-                risk_level = risk.get('level', 'MEDIUM')
-                risk_title = f"{i}. {risk.get('icon', '⚠️')} {risk.get('title', 'Риск')} ({risk_level})"
-                
-                ws[f'A{row}'] = risk_title
-                ws[f'A{row}'].font = Font(bold=True)
-                row += 1
-                
-                ws.merge_cells(f'A{row}:D{row}')
-                ws[f'A{row}'] = risk.get('description', '')
-                ws[f'A{row}'].alignment = wrap_align
-                row += 1
-        
-        # Рекомендации
-        recommendations = analysis_data.get('recommendations', {})
-        if recommendations:
-            ws[f'A{row}'] = "💡 Практические рекомендации"
-            ws[f'A{row}'].font = Font(bold=True, size=12)
+            sheet.put(row, sheet.cell("🚨 Срочные действия:", styles['bold']))
             row += 1
-            
-            practical_actions = recommendations.get('practical_actions', [])
-            if practical_actions:
-                ws[f'A{row}'] = "📋 Рекомендуемые действия:"
-                ws[f'A{row}'].font = Font(bold=True)
-                row += 1
-                
-                for i, action in enumerate(practical_actions, 1):
-                    if isinstance(action, dict):
-                        action_text = action.get('action', action.get('title', ''))
-                        effect = action.get('effect', action.get('description', ''))
-                        action_str = f"{i}. {action_text}"
-                        if effect:
-                            action_str += f" - {effect}"
-                    else:
-                        action_str = f"{i}. {action}"
-                    
-                    ws.merge_cells(f'A{row}:D{row}')
-                    ws[f'A{row}'] = action_str
-                    ws[f'A{row}'].alignment = wrap_align
-                    row += 1
-            
-            priority_actions = recommendations.get('priority_actions', [])
-            if priority_actions:
-                row += 1
-                ws[f'A{row}'] = "🚨 Срочные действия:"
-                ws[f'A{row}'].font = Font(bold=True)
+            for action in priority_actions:
+                action_text, _ = _action_parts(action)
+                sheet.put(row, sheet.cell(f"• {action_text}", alignment=styles['wrap']), merge='A:D')
                 row += 1
-                
-                for action in priority_actions:
-                    if isinstance(action, dict):
-                        action_text = action.get('action', action.get('title', ''))
-                    else:
-                        action_text = str(action)
-                    
-                    ws.merge_cells(f'A{row}:D{row}')
-                    ws[f'A{row}'] = f"• {action_text}"
-                    ws[f'A{row}'].alignment = wrap_align
-                    row += 1
-        
-        # Настройка ширины столбцов
-        ws.column_dimensions['A'].width = 25
-        ws.column_dimensions['B'].width = 30
-        ws.column_dimensions['C'].width = 30
-        ws.column_dimensions['D'].width = 30
-        
-        # Футер
-        row += 2
-        ws.merge_cells(f'A{row}:D{row}')
-        ws[f'A{row}'] = "Сгенерировано DocScan AI - https://docscan-ai.ru"
-        ws[f'A{row}'].font = Font(size=9, color="6C757D")
-        ws[f'A{row}'].alignment = center_align
-        
+
+    # Футер
+    row += 2
+    sheet.put(row, sheet.cell("Сгенерировано DocScan AI - https://docscan-ai.ru", styles['footer_font'], alignment=styles['center']), merge='A:D')
+
+
+def generate_analysis_excel(analysis_data, filename="document.pdf", branding_settings=None):
+    """Генерирует Excel файл (XLSX) с результатами анализа
+
+    Args:
+        analysis_data: Данные анализа
+        filename: Имя файла
+        branding_settings: Настройки брендинга (dict с logo_path, primary_color, secondary_color, company_name)
+    """
+    try:
+        primary_color, company_name, _ = _branding(branding_settings)
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(title=(company_name if company_name else "Анализ документа")[:31])
+        _write_analysis_sheet(_SheetWriter(ws), analysis_data, filename, company_name, _excel_styles(primary_color.lstrip('#')))
+
         # Сохраняем в BytesIO
         buffer = BytesIO()
         wb.save(buffer)
         buffer.seek(0)
-        
+
         logger.info(f"✅ Excel файл успешно сгенерирован для файла: {filename}")
         return buffer.getvalue()
-        
+
     except Exception as e:
         logger.error(f"❌ Ошибка генерации Excel файла: {e}")
         import traceback
         logger.error(traceback.format_exc())
         raise
 
+
+BATCH_SUMMARY_COLUMNS = [
+    ('№', 6), ('Файл', 40), ('Статус', 14), ('Тип документа', 30), ('Уровень риска', 16),
+    ('Критических', 12), ('Высоких', 12), ('Средних', 12), ('Низких', 12), ('Всего рисков', 12),
+    ('Решение', 60), ('Ошибка', 40)
+]
+BATCH_RISK_COLUMNS = [('Файл', 40), ('№', 6), ('Уровень', 12), ('Риск', 40), ('Описание', 90)]
+BATCH_ACTION_COLUMNS = [('Файл', 40), ('Тип', 14), ('Рекомендация', 60), ('Эффект', 60)]
+
+
+def generate_batch_excel(task_id, output, branding_settings=None, chunk_size=200):
+    """Выгружает все анализы пакетной задачи в одну книгу Excel
+
+    Листы: сводка по файлам, все риски и все рекомендации. Файлы задачи
+    читаются из БД порциями по chunk_size строк (только нужные колонки),
+    строки сразу уходят в write-only листы - память не зависит от числа
+    файлов и рисков. output - путь или файловый объект.
+    Возвращает число выгруженных файлов.
+    """
+    from models.sqlite_users import db, BatchProcessingTask, BatchProcessingFile
+
+    task = db.session.get(BatchProcessingTask, task_id)
+    if task is None:
+        raise ValueError(f"Пакетная задача {task_id} не найдена")
+
+    primary_color, company_name, _ = _branding(branding_settings)
+    styles = _excel_styles(primary_color.lstrip('#'))
+
+    wb = Workbook(write_only=True)
+    sheets = {}
+    for title, columns in (('Сводка', BATCH_SUMMARY_COLUMNS), ('Риски', BATCH_RISK_COLUMNS), ('Рекомендации', BATCH_ACTION_COLUMNS)):
+        ws = wb.create_sheet(title=title)
+        ws.freeze_panes = 'A2'
+        for index, (_, width) in enumerate(columns, 1):
+            ws.column_dimensions[chr(64 + index)].width = width
+        sheet = _SheetWriter(ws)
+        sheet.put(1, *[
+            sheet.cell(header, styles['header_font'], styles['header_fill'], styles['center'], styles['border'])
+            for header, _ in columns
+        ])
+        sheets[title] = sheet
+
+    files = db.session.query(
+        BatchProcessingFile.filename,
+        BatchProcessingFile.status,
+        BatchProcessingFile.analysis_result_json,
+        BatchProcessingFile.error_message
+    ).filter(BatchProcessingFile.task_id == task_id).order_by(BatchProcessingFile.id).yield_per(chunk_size)
+
+    exported = 0
+    for number, (filename, status, result_json, error_message) in enumerate(files, 1):
+        analysis = json.loads(result_json) if result_json else {}
+        summary = analysis.get('executive_summary', {})
+        risk_analysis = analysis.get('risk_analysis', {})
+        risk_stats = risk_analysis.get('risk_statistics', {})
+        risk_level = summary.get('risk_level') or analysis.get('risk_level')
+
+        risk_cell = risk_level
+        if risk_level:
+            risk_cell = sheets['Сводка'].cell(risk_level, styles['bold'], styles['risk_fills'].get(risk_level, styles['risk_fills'][None]))
+        sheets['Сводка'].put(
+            number + 1,
+            number, filename, status,
+            analysis.get('document_type_name'),
+            risk_cell,
+            risk_stats.get('CRITICAL', 0), risk_stats.get('HIGH', 0), risk_stats.get('MEDIUM', 0), risk_stats.get('LOW', 0),
+            risk_stats.get('total', 0),
+            sheets['Сводка'].cell(summary.get('decision_support') or analysis.get('summary'), alignment=styles['wrap']),
+            error_message
+        )
+
+        risks_sheet = sheets['Риски']
+        for i, risk in enumerate(risk_analysis.get('key_risks', []), 1):
+            risks_sheet.put(
+                risks_sheet.next_row,
+                filename, i, risk.get('level', 'MEDIUM'),
+                risks_sheet.cell(risk.get('title', 'Риск'), styles['bold']),
+                risks_sheet.cell(risk.get('description', ''), alignment=styles['wrap'])
+            )
+
+        actions_sheet = sheets['Рекомендации']
+        recommendations = analysis.get('recommendations', {})
+        for kind, actions in (('Практическая', recommendations.get('practical_actions', [])),
+                              ('Срочная', recommendations.get('priority_actions', []))):
+            for action in actions:
+                action_text, effect = _action_parts(action)
+                actions_sheet.put(
+                    actions_sheet.next_row,
+                    filename, kind,
+                    actions_sheet.cell(action_text, alignment=styles['wrap']),
+                    actions_sheet.cell(effect, alignment=styles['wrap']) if effect else None
+                )
+        exported += 1
+
+    wb.save(output)
+    logger.info(f"✅ Excel выгрузка пакетной задачи {task_id} ({task.task_name or 'без названия'}): файлов {exported}")
+    return exported
@@ -1,41 +1,151 @@
 import PyPDF2
 import docx
-import requests
 import tempfile
 import os
 import base64
 import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from config import Config
+from services.yandex_client import get_yandex_client
+from services.text_cache import get_cached_text, store_cached_text, normalize_extracted_text
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(file_path):
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Пул процессов для извлечения больших PDF (создается при первом использовании)
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool(workers):
+    global _pdf_pool
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                # spawn: форк из многопоточного веб-процесса небезопасен
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return _pdf_pool
+
+
+def _extract_pdf_page_range(file_path, start, stop):
+    """Извлекает текст страниц [start, stop) - выполняется в процессе пула"""
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        return [(page_num + 1, reader.pages[page_num].extract_text() or '') for page_num in range(start, stop)]
+
+
+def iter_pdf_pages(file_path, workers=None):
+    """Генератор страниц PDF: (номер страницы, текст, всего страниц)
+
+    Страницы отдаются по порядку. Для больших документов при workers > 1
+    страницы извлекаются пачками в пуле процессов; пачки запрашиваются
+    с небольшим опережением, поэтому прекращение итерации останавливает
+    и дальнейшее извлечение.
+    """
+    workers = Config.PDF_EXTRACT_WORKERS if workers is None else workers
+    with open(file_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        total_pages = len(reader.pages)
+
+        if workers <= 1 or total_pages < Config.PDF_PARALLEL_MIN_PAGES:
+            for page_num, page in enumerate(reader.pages, 1):
+                yield page_num, page.extract_text() or '', total_pages
+            return
+
+    pool = _get_pdf_pool(workers)
+    chunk = Config.PDF_PARALLEL_CHUNK_PAGES
+    ranges = [(start, min(start + chunk, total_pages)) for start in range(0, total_pages, chunk)]
+    pending = deque()
+    next_range = 0
+    try:
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < workers * 2:
+                start, stop = ranges[next_range]
+                pending.append(pool.submit(_extract_pdf_page_range, file_path, start, stop))
+                next_range += 1
+            for page_num, page_text in pending.popleft().result():
+                yield page_num, page_text, total_pages
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_pdf(file_path, max_chars=None, workers=None):
+    """Извлекает текст из PDF за один проход
+
+    max_chars - бюджет символов: как только он набран, остальные страницы
+    не читаются. Возвращает словарь: text, pages_count, pages_extracted,
+    empty_pages, truncated, page_stats ([{page, chars}]).
+    """
+    parts = []
+    page_stats = []
+    empty_pages = []
+    total_chars = 0
+    pages_count = 0
+    truncated = False
+
+    for page_num, page_text, pages_count in iter_pdf_pages(file_path, workers):
+        page_stats.append({'page': page_num, 'chars': len(page_text)})
+        if not page_text:
+            empty_pages.append(page_num)
+            continue
+        part = f"\n--- Страница {page_num} ---\n{page_text}\n"
+        parts.append(part)
+        total_chars += len(part)
+        if max_chars and total_chars >= max_chars:
+            truncated = page_num < pages_count
+            break
+
+    return {
+        'text': ''.join(parts),
+        'pages_count': pages_count,
+        'pages_extracted': len(page_stats),
+        'empty_pages': empty_pages,
+        'truncated': truncated,
+        'page_stats': page_stats
+    }
+
+
+def extract_text_from_pdf(file_path, max_chars=None):
     """Извлекает текст из PDF файла"""
-    text = ""
+    text, _ = extract_text_from_pdf_with_pages(file_path, max_chars)
+    return text
+
+
+def extract_text_from_pdf_with_pages(file_path, max_chars=None):
+    """Извлекает текст из PDF файла. Возвращает (текст или строка ошибки, количество страниц)"""
+    text, pages_count, _ = _extract_pdf_logged(file_path, max_chars)
+    return text, pages_count
+
+
+def _extract_pdf_logged(file_path, max_chars=None):
+    """Извлечение PDF с логированием: (текст или строка ошибки, страниц, текст усечен бюджетом)"""
     try:
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            total_pages = len(reader.pages)
-            logger.info(f"📄 PDF содержит {total_pages} страниц")
-            
-            for page_num, page in enumerate(reader.pages, 1):
-                page_text = page.extract_text()
-                if page_text:
-                    text += f"\n--- Страница {page_num} ---\n"
-                    text += page_text + "\n"
-                else:
-                    logger.warning(f"⚠️ Страница {page_num} не содержит текста (возможно, это сканированное изображение)")
-            
-        logger.info(f"✅ Извлечен текст из PDF: {len(text)} символов из {total_pages} страниц")
+        result = extract_pdf(file_path, max_chars=max_chars)
+        text = result['text']
+        logger.info(f"📄 PDF содержит {result['pages_count']} страниц")
+        if result['empty_pages']:
+            logger.warning(f"⚠️ Страницы без текста (возможно, сканированные изображения): {result['empty_pages'][:20]}")
+        if result['truncated']:
+            logger.info(f"✂️ Достигнут лимит {max_chars} символов - прочитано {result['pages_extracted']} из {result['pages_count']} страниц")
+        
+        logger.info(f"✅ Извлечен текст из PDF: {len(text)} символов из {result['pages_count']} страниц")
         
         if len(text.strip()) < 100:
             logger.warning("⚠️ Извлечено очень мало текста. Возможно, PDF содержит только изображения (сканированный документ)")
+        return text, result['pages_count'], result['truncated']
             
     except Exception as e:
         error_msg = f"Ошибка чтения PDF: {str(e)}"
         logger.error(f"❌ {error_msg}")
-        return error_msg
-    return text
+        return error_msg, 0, False
 
 def extract_text_from_docx(file_path):
     """Извлекает текст из DOCX файла"""
@@ -78,11 +188,6 @@ def extract_text_from_image(file_path):
         with open(file_path, 'rb') as image_file:
             image_data = base64.b64encode(image_file.read()).decode('utf-8')
         
-        headers = {
-            "Authorization": f"Api-Key {Config.YANDEX_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
             "folderId": Config.YANDEX_FOLDER_ID,
             "analyzeSpecs": [{
@@ -97,12 +202,7 @@ def extract_text_from_image(file_path):
             }]
         }
         
-        response = requests.post(
-            "https://vision.api.cloud.yandex.net/vision/v1/batchAnalyze",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
+        response = get_yandex_client().vision(data)
         
         logger.info(f"📊 Ответ Vision API: статус {response.status_code}")
         
@@ -139,8 +239,57 @@ def extract_text_from_image(file_path):
         logger.error(f"❌ {error_msg}")
         return error_msg
 
-def extract_text_from_file(file_path, filename):
-    """Основная функция извлечения текста из файла"""
+def extract_text_from_file(file_path, filename, max_chars=None):
+    """Основная функция извлечения текста из файла
+
+    max_chars ограничивает чтение PDF: страницы после набранного бюджета не извлекаются.
+    """
+    text, _ = extract_text_with_pages(file_path, filename, max_chars)
+    return text
+
+def extract_text_with_pages(file_path, filename, max_chars=None):
+    """Извлекает текст и количество страниц за один проход: (текст или строка ошибки, страниц)
+
+    Результат кешируется по SHA-256 содержимого файла, поэтому повторная
+    загрузка того же файла (анализ, пакет, сравнение) не извлекается заново.
+    """
+    filename_lower = filename.lower()
+    kind = _extraction_kind(filename_lower)
+    if kind is None:
+        return _extract_text_by_type(file_path, filename), 1
+
+    file_hash, cached = get_cached_text(file_path, kind, max_chars)
+    if cached is not None:
+        logger.info(f"⚡ Текст {filename} взят из кеша ({cached['char_count']} символов, страниц: {cached['pages_count']})")
+        return cached['text'], cached['pages_count']
+
+    stored_max_chars = None
+    if kind == 'pdf':
+        text, pages_count, truncated = _extract_pdf_logged(file_path, max_chars)
+        # Полностью прочитанный PDF подходит для любого бюджета
+        stored_max_chars = max_chars if truncated else None
+    else:
+        text, pages_count = _extract_text_by_type(file_path, filename), 1
+
+    if isinstance(text, str):
+        text = normalize_extracted_text(text)
+        store_cached_text(
+            file_hash, text, pages_count,
+            max_chars=stored_max_chars,
+            is_ocr=(kind == 'image')
+        )
+    return text, pages_count
+
+def _extraction_kind(filename_lower):
+    """Способ извлечения текста по расширению (None - формат не поддерживается)"""
+    if filename_lower.endswith(IMAGE_EXTENSIONS):
+        return 'image'
+    for extension in ('.pdf', '.docx', '.txt'):
+        if filename_lower.endswith(extension):
+            return extension[1:]
+    return None
+
+def _extract_text_by_type(file_path, filename):
     filename_lower = filename.lower()
     
     if filename_lower.endswith('.pdf'):
@@ -149,7 +298,7 @@ def extract_text_from_file(file_path, filename):
         return extract_text_from_docx(file_path)
     elif filename_lower.endswith('.txt'):
         return extract_text_from_txt(file_path)
-    elif filename_lower.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+    elif filename_lower.endswith(IMAGE_EXTENSIONS):
         return extract_text_from_image(file_path)
     else:
         error_msg = "Неподдерживаемый формат файла"
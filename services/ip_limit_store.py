@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Хранилища счетчиков IP-лимитов, общие для всех воркеров
+
+Ключ счетчика - (IP, день): новый день начинается с нового ключа, поэтому
+сброс лимитов не нужен, а устаревшие дни удаляются фоном.
+
+- SQLiteLimitStore (по умолчанию) - таблица в отдельной WAL-базе,
+  инкремент одним UPSERT ... RETURNING.
+- SharedMemoryLimitStore - хеш-таблица в mmap-файле под flock, только
+  для одного хоста. Слот с прошлым днем считается свободным и
+  переиспользуется, отдельная очистка не нужна. IP, которым не хватило
+  места в окне пробирования, считаются в SQLiteLimitStore.
+"""
+
+import os
+import mmap
+import time
+import zlib
+import struct
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только между потоками процесса
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteLimitStore:
+    """Счетчики IP в SQLite (WAL, атомарный UPSERT)"""
+
+    def __init__(self, db_path, retention_days=2, cleanup_interval=3600):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.cleanup_interval = cleanup_interval
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._next_cleanup = 0
+
+    def _connect(self):
+        """Открывает соединение (одно соединение на операцию - безопасно для потоков)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._initialized:
+            self._init_schema(conn)
+        return conn
+
+    def _init_schema(self, conn):
+        """Создает таблицу счетчиков при первом обращении"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS ip_limit_counters (
+                    ip TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    used INTEGER NOT NULL DEFAULT 0,
+                    last_user TEXT,
+                    first_seen TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (ip, day)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_ip_limit_counters_day
+                    ON ip_limit_counters (day);
+                CREATE INDEX IF NOT EXISTS idx_ip_limit_counters_last_user
+                    ON ip_limit_counters (last_user);
+            ''')
+            conn.commit()
+            self._initialized = True
+
+    def get(self, ip, day):
+        """Сколько раз IP использовал лимит за день"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT used FROM ip_limit_counters WHERE ip = ? AND day = ?', (ip, day)
+            ).fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+
+    def increment(self, ip, day, user_id=None):
+        """Атомарно увеличивает счетчик и возвращает новое значение"""
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        try:
+            used = conn.execute(
+                'INSERT INTO ip_limit_counters (ip, day, used, last_user, first_seen, updated_at) '
+                'VALUES (?, ?, 1, ?, ?, ?) '
+                'ON CONFLICT(ip, day) DO UPDATE SET used = used + 1, '
+                'last_user = excluded.last_user, updated_at = excluded.updated_at '
+                'RETURNING used',
+                (ip, day, user_id, now, now)
+            ).fetchone()[0]
+            conn.commit()
+        finally:
+            conn.close()
+        self._maybe_cleanup()
+        return used
+
+    def decrement(self, ip, day):
+        """Откатывает одно использование (не ниже нуля)"""
+        conn = self._connect()
+        try:
+            conn.execute(
+                'UPDATE ip_limit_counters SET used = max(used - 1, 0), updated_at = ? '
+                'WHERE ip = ? AND day = ?',
+                (datetime.now().isoformat(), ip, day)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def last_ips_by_user(self, user_ids):
+        """Последний IP каждого пользователя из списка: {user_id: ip}"""
+        user_ids = [user_id for user_id in user_ids if user_id]
+        result = {}
+        if not user_ids:
+            return result
+        conn = self._connect()
+        try:
+            # Лимит параметров SQLite - запрашиваем пачками
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f'SELECT last_user, ip FROM ip_limit_counters WHERE last_user IN ({placeholders}) '
+                    f'ORDER BY updated_at',
+                    chunk
+                ).fetchall()
+                # Более поздние строки перезаписывают ранние
+                result.update(dict(rows))
+        finally:
+            conn.close()
+        return result
+
+    def cleanup(self):
+        """Удаляет счетчики старше retention_days. Возвращает число удаленных строк"""
+        cutoff = (date.today() - timedelta(days=self.retention_days)).isoformat()
+        conn = self._connect()
+        try:
+            deleted = conn.execute('DELETE FROM ip_limit_counters WHERE day < ?', (cutoff,)).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if deleted:
+            logger.info(f"🧹 Удалено устаревших счетчиков IP: {deleted}")
+        return deleted
+
+    def _maybe_cleanup(self):
+        now = time.monotonic()
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + self.cleanup_interval
+        try:
+            self.cleanup()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Ошибка очистки счетчиков IP: {e}")
+
+    def get_stats(self):
+        conn = self._connect()
+        try:
+            rows, days = conn.execute('SELECT COUNT(*), COUNT(DISTINCT day) FROM ip_limit_counters').fetchone()
+        finally:
+            conn.close()
+        return {'backend': 'sqlite', 'path': self.db_path, 'counters': rows, 'days': days}
+
+
+# Слот: хеш IP (0 - пусто), день (date.toordinal), счетчик
+_SLOT = struct.Struct('<QII')
+_MAX_PROBE = 64
+
+
+class SharedMemoryLimitStore:
+    """Счетчики IP в общем mmap-файле (открытая адресация, flock на запись)
+
+    Не хранит last_user: поиск IP по пользователю в этом режиме недоступен.
+    Если все слоты окна пробирования заняты сегодняшними IP, счетчик ведется
+    в overflow (SQLite): чужой живой слот никогда не перезаписывается.
+    Сегодняшние слоты в течение дня не освобождаются, поэтому переполненное
+    окно остается переполненным и get/decrement находят счетчик там же.
+    """
+
+    def __init__(self, path, slots=65536, overflow=None):
+        self.path = path
+        self.slots = slots
+        self.overflow = overflow or SQLiteLimitStore(Config.IP_LIMIT_DB_PATH, Config.IP_LIMIT_RETENTION_DAYS)
+        self._overflow_warned = False
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * _SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    @staticmethod
+    def _hash(ip):
+        # 64-битный хеш из двух crc32; 0 зарезервирован под пустой слот
+        data = ip.encode('utf-8')
+        return ((zlib.crc32(data) << 32) | zlib.crc32(data[::-1] + b'\x01')) or 1
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, key, day):
+        """(смещение слота ключа за день или None, первый свободный слот окна или None)
+
+        Слоты прошлых дней считаются свободными. Оба None - окно занято
+        сегодняшними IP, счетчик ключа ведется в overflow.
+        """
+        start = key % self.slots
+        free = None
+        for probe in range(_MAX_PROBE):
+            offset = ((start + probe) % self.slots) * _SLOT.size
+            slot_key, slot_day, _ = _SLOT.unpack_from(self._map, offset)
+            if slot_key == key and slot_day == day:
+                return offset, None
+            if slot_key == 0 or slot_day != day:
+                if free is None:
+                    free = offset
+                if slot_key == 0:
+                    break
+        return None, free
+
+    def _warn_overflow(self):
+        if not self._overflow_warned:
+            self._overflow_warned = True
+            logger.warning(f"⚠️ Таблица счетчиков IP переполнена ({self.slots} слотов) - часть IP считается в SQLite, "
+                           f"увеличьте IP_LIMIT_SHM_SLOTS")
+
+    def get(self, ip, day):
+        ordinal = date.fromisoformat(day).toordinal()
+        with self._locked():
+            offset, free = self._find(self._hash(ip), ordinal)
+            if offset is not None:
+                return _SLOT.unpack_from(self._map, offset)[2]
+        return 0 if free is not None else self.overflow.get(ip, day)
+
+    def increment(self, ip, day, user_id=None):
+        ordinal = date.fromisoformat(day).toordinal()
+        key = self._hash(ip)
+        with self._locked():
+            offset, free = self._find(key, ordinal)
+            if offset is not None:
+                used = _SLOT.unpack_from(self._map, offset)[2] + 1
+            elif free is not None:
+                offset, used = free, 1
+            if offset is not None:
+                _SLOT.pack_into(self._map, offset, key, ordinal, used)
+                return used
+        self._warn_overflow()
+        return self.overflow.increment(ip, day, user_id)
+
+    def decrement(self, ip, day):
+        ordinal = date.fromisoformat(day).toordinal()
+        key = self._hash(ip)
+        with self._locked():
+            offset, free = self._find(key, ordinal)
+            if offset is not None:
+                used = _SLOT.unpack_from(self._map, offset)[2]
+                _SLOT.pack_into(self._map, offset, key, ordinal, max(used - 1, 0))
+                return
+            if free is not None:
+                return
+        self.overflow.decrement(ip, day)
+
+    def last_ips_by_user(self, user_ids):
+        return {}
+
+    def cleanup(self):
+        # Слоты прошлых дней переиспользуются при вставке, чистить нужно только overflow
+        return self.overflow.cleanup()
+
+    def get_stats(self):
+        today = date.today().toordinal()
+        counters = 0
+        with self._locked():
+            for index in range(self.slots):
+                slot_key, slot_day, _ = _SLOT.unpack_from(self._map, index * _SLOT.size)
+                if slot_key and slot_day == today:
+                    counters += 1
+        return {'backend': 'shm', 'path': self.path, 'slots': self.slots, 'counters': counters}
+
+
+_store_instance = None
+_store_lock = threading.Lock()
+
+
+def get_ip_limit_store():
+    """Возвращает хранилище счетчиков по Config.IP_LIMIT_BACKEND"""
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                backend = Config.IP_LIMIT_BACKEND
+                if backend == 'shm':
+                    try:
+                        _store_instance = SharedMemoryLimitStore(Config.IP_LIMIT_SHM_PATH, Config.IP_LIMIT_SHM_SLOTS)
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"⚠️ Общая память для IP-лимитов недоступна ({e}) - используем SQLite")
+                elif backend != 'sqlite':
+                    logger.warning(f"⚠️ Неизвестный IP_LIMIT_BACKEND={backend!r} - используем SQLite")
+                if _store_instance is None:
+                    _store_instance = SQLiteLimitStore(Config.IP_LIMIT_DB_PATH, Config.IP_LIMIT_RETENTION_DAYS)
+                logger.info(f"🌐 Хранилище IP-лимитов: {type(_store_instance).__name__}")
+    return _store_instance
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сервис рендеринга PDF-отчетов по анализу
+
+reportlab - чистая CPU-нагрузка: в потоке запроса или в цикле пакетной
+обработки он держит GIL и тормозит остальные запросы процесса. Поэтому
+отчеты рендерятся в пуле процессов (PDF_RENDER_WORKERS): в каждом процессе
+шрифты регистрируются и стили собираются один раз при старте.
+
+Готовые PDF кешируются в SQLite-базе (PDF_RENDER_CACHE_PATH) по хешу
+analysis_data, имени файла и настроек брендинга; в ключ входят также дата
+(она печатается в отчете) и mtime/размер файла логотипа. TTL и LRU-вытеснение
+по количеству записей и суммарному размеру - как у кеша текстов.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import multiprocessing
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def make_render_key(analysis_data, filename, branding_settings=None):
+    """Ключ кеша отчета: SHA-256 от данных, имени файла, брендинга, даты и логотипа"""
+    logo_stamp = None
+    logo_path = (branding_settings or {}).get('logo_path')
+    if logo_path and os.path.exists(logo_path):
+        stat = os.stat(logo_path)
+        logo_stamp = [stat.st_mtime_ns, stat.st_size]
+    payload = json.dumps(
+        [analysis_data, filename, branding_settings, logo_stamp, date.today().isoformat()],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RenderedReportCache:
+    """SQLite-кеш готовых PDF-отчетов с TTL и LRU-вытеснением"""
+
+    def __init__(self, db_path, ttl_seconds=24 * 3600, max_entries=2000, max_bytes=300 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        """Открывает соединение с базой кеша (одно соединение на операцию - безопасно для потоков)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._initialized:
+            self._init_schema(conn)
+        return conn
+
+    def _init_schema(self, conn):
+        """Создает таблицы кеша при первом обращении"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS pdf_render_cache (
+                    render_key TEXT PRIMARY KEY,
+                    pdf BLOB NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    render_ms INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_pdf_render_cache_last_accessed
+                    ON pdf_render_cache (last_accessed);
+                CREATE TABLE IF NOT EXISTS pdf_render_cache_stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                );
+            ''')
+            conn.commit()
+            self._initialized = True
+
+    def _bump_counter(self, conn, name, delta=1):
+        conn.execute(
+            'INSERT INTO pdf_render_cache_stats (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, delta)
+        )
+
+    def get(self, render_key):
+        """Возвращает байты PDF или None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT pdf, created_at, render_ms FROM pdf_render_cache WHERE render_key = ?',
+                (render_key,)
+            ).fetchone()
+
+            if row and now - row[1] > self.ttl_seconds:
+                conn.execute('DELETE FROM pdf_render_cache WHERE render_key = ?', (render_key,))
+                self._bump_counter(conn, 'expired')
+                row = None
+
+            if not row:
+                self._bump_counter(conn, 'misses')
+                conn.commit()
+                return None
+
+            conn.execute(
+                'UPDATE pdf_render_cache SET last_accessed = ?, hits = hits + 1 WHERE render_key = ?',
+                (now, render_key)
+            )
+            self._bump_counter(conn, 'hits')
+            self._bump_counter(conn, 'render_ms_saved', row[2])
+            conn.commit()
+            return bytes(row[0])
+        finally:
+            conn.close()
+
+    def set(self, render_key, pdf_bytes, render_ms=0):
+        """Сохраняет PDF и при необходимости вытесняет старые записи"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO pdf_render_cache '
+                '(render_key, pdf, size_bytes, render_ms, created_at, last_accessed, hits) '
+                'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                (render_key, sqlite3.Binary(pdf_bytes), len(pdf_bytes), render_ms, now, now)
+            )
+            self._bump_counter(conn, 'stores')
+            self._evict(conn, now)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _evict(self, conn, now):
+        """Удаляет просроченные записи и вытесняет наименее используемые сверх лимитов"""
+        expired = conn.execute(
+            'DELETE FROM pdf_render_cache WHERE created_at < ?',
+            (now - self.ttl_seconds,)
+        ).rowcount
+        if expired:
+            self._bump_counter(conn, 'expired', expired)
+
+        count, total_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM pdf_render_cache'
+        ).fetchone()
+
+        evicted = 0
+        if self.max_entries and count > self.max_entries:
+            evicted += conn.execute(
+                'DELETE FROM pdf_render_cache WHERE render_key IN ('
+                'SELECT render_key FROM pdf_render_cache ORDER BY last_accessed ASC LIMIT ?)',
+                (count - self.max_entries,)
+            ).rowcount
+            total_bytes = conn.execute(
+                'SELECT COALESCE(SUM(size_bytes), 0) FROM pdf_render_cache'
+            ).fetchone()[0]
+
+        if self.max_bytes and total_bytes > self.max_bytes:
+            rows = conn.execute(
+                'SELECT render_key, size_bytes FROM pdf_render_cache ORDER BY last_accessed ASC'
+            ).fetchall()
+            to_delete = []
+            for key, size in rows:
+                if total_bytes <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                total_bytes -= size
+            conn.executemany('DELETE FROM pdf_render_cache WHERE render_key = ?', to_delete)
+            evicted += len(to_delete)
+
+        if evicted:
+            self._bump_counter(conn, 'evictions', evicted)
+            logger.info(f"🧹 Кеш PDF-отчетов: вытеснено {evicted} записей")
+
+    def get_stats(self):
+        """Статистика кеша: попадания, промахи, размер, сэкономленное время рендеринга"""
+        conn = self._connect()
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM pdf_render_cache_stats').fetchall())
+            count, total_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM pdf_render_cache'
+            ).fetchone()
+        finally:
+            conn.close()
+
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            'enabled': Config.PDF_RENDER_CACHE_ENABLED,
+            'entries': count,
+            'size_bytes': total_bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': hits,
+            'misses': misses,
+            'stores': counters.get('stores', 0),
+            'evictions': counters.get('evictions', 0),
+            'expired': counters.get('expired', 0),
+            'render_seconds_saved': round(counters.get('render_ms_saved', 0) / 1000, 1),
+            'hit_rate': round(hits / lookups * 100, 1) if lookups else 0
+        }
+
+    def clear(self):
+        """Полностью очищает кеш (счетчики сохраняются)"""
+        conn = self._connect()
+        try:
+            deleted = conn.execute('DELETE FROM pdf_render_cache').rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+
+def _init_render_worker():
+    """Инициализация процесса пула: шрифты регистрируются при импорте, стили собираем сразу"""
+    from services import pdf_generator
+    pdf_generator.get_report_styles(pdf_generator.FONT_NAME, pdf_generator.FONT_BOLD)
+
+
+def _render_in_worker(analysis_data, filename, branding_settings):
+    """Рендерит отчет в процессе пула. Возвращает (байты PDF, время в мс)"""
+    from services.pdf_generator import generate_analysis_pdf
+    started = time.perf_counter()
+    pdf_bytes = generate_analysis_pdf(analysis_data, filename, branding_settings)
+    return pdf_bytes, int((time.perf_counter() - started) * 1000)
+
+
+_cache_instance = None
+_render_pool = None
+_instance_lock = threading.Lock()
+
+
+def get_render_cache():
+    """Возвращает общий экземпляр кеша PDF-отчетов"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _instance_lock:
+            if _cache_instance is None:
+                cache_dir = os.path.dirname(Config.PDF_RENDER_CACHE_PATH)
+                if cache_dir:
+                    os.makedirs(cache_dir, exist_ok=True)
+                _cache_instance = RenderedReportCache(
+                    Config.PDF_RENDER_CACHE_PATH,
+                    ttl_seconds=Config.PDF_RENDER_CACHE_TTL,
+                    max_entries=Config.PDF_RENDER_CACHE_MAX_ENTRIES,
+                    max_bytes=Config.PDF_RENDER_CACHE_MAX_BYTES
+                )
+    return _cache_instance
+
+
+def _get_render_pool(workers):
+    global _render_pool
+    if _render_pool is None:
+        with _instance_lock:
+            if _render_pool is None:
+                # spawn: форк из многопоточного веб-процесса небезопасен
+                _render_pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_render_worker
+                )
+                logger.info(f"🚀 Пул рендеринга PDF запущен: {workers} процессов")
+    return _render_pool
+
+
+def _reset_render_pool(pool):
+    """Убирает сломанный пул (процесс упал) - следующий вызов создаст новый"""
+    global _render_pool
+    with _instance_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render(analysis_data, filename, branding_settings, workers):
+    if workers <= 0:
+        return _render_in_worker(analysis_data, filename, branding_settings)
+
+    pool = _get_render_pool(workers)
+    try:
+        future = pool.submit(_render_in_worker, analysis_data, filename, branding_settings)
+        return future.result(timeout=Config.PDF_RENDER_TIMEOUT_SECONDS or None)
+    except BrokenProcessPool as e:
+        _reset_render_pool(pool)
+        logger.error(f"❌ Пул рендеринга PDF сломан ({e}) - рендерим в текущем процессе")
+        return _render_in_worker(analysis_data, filename, branding_settings)
+
+
+def render_analysis_pdf(analysis_data, filename="document.pdf", branding_settings=None, workers=None):
+    """PDF-отчет по анализу: из кеша или отрендеренный в пуле процессов
+
+    Аргументы как у pdf_generator.generate_analysis_pdf; workers - размер пула
+    (по умолчанию PDF_RENDER_WORKERS, 0 - рендер в текущем процессе).
+    """
+    workers = Config.PDF_RENDER_WORKERS if workers is None else workers
+    render_key = None
+    if Config.PDF_RENDER_CACHE_ENABLED:
+        try:
+            render_key = make_render_key(analysis_data, filename, branding_settings)
+            cached = get_render_cache().get(render_key)
+            if cached is not None:
+                logger.info(f"✅ PDF для файла {filename} взят из кеша")
+                return cached
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка чтения кеша PDF-отчетов: {e}")
+
+    pdf_bytes, render_ms = _render(analysis_data, filename, branding_settings, workers)
+
+    if render_key:
+        try:
+            get_render_cache().set(render_key, pdf_bytes, render_ms)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка записи в кеш PDF-отчетов: {e}")
+    return pdf_bytes
+
+
+def shutdown_render_pool():
+    """Останавливает пул рендеринга (для скриптов и тестов)"""
+    global _render_pool
+    with _instance_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
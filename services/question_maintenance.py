@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Фоновая сверка счетчиков ответов на вопросы
+
+answers_count и статус open/answered обновляются транзакционно при создании
+и удалении ответов. Сверка ловит расхождения от ручных правок БД, старых
+данных и удалений в обход SQLiteUserManager.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Первая сверка вскоре после старта процесса, чтобы не замедлять запуск
+FIRST_RUN_DELAY_SECONDS = 60
+
+
+def start_question_reconciler(app_instance, interval):
+    """Фоновый поток, периодически сверяющий счетчики ответов с таблицей answers"""
+    stop_event = threading.Event()
+
+    def run():
+        delay = min(FIRST_RUN_DELAY_SECONDS, interval)
+        while not stop_event.wait(delay):
+            delay = interval
+            try:
+                with app_instance.app_context():
+                    fixed = app_instance.user_manager.reconcile_question_counters()
+                if fixed:
+                    logger.info(f"🧹 Сверка счетчиков вопросов: исправлено {fixed}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка сверки счетчиков вопросов: {e}")
+
+    thread = threading.Thread(target=run, name='question-reconciler', daemon=True)
+    thread.start()
+    return stop_event
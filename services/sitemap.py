@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Генерация sitemap: индекс и дочерние файлы по разделам
+
+Файлы строятся заранее в Config.SITEMAP_DIR и отдаются как статика с
+ETag/Last-Modified. Раз в SITEMAP_CHECK_SECONDS по каждому разделу
+считается дешевая подпись (COUNT и MAX даты одним агрегатным запросом),
+и перестраиваются только изменившиеся разделы. Вопросы разбиты на шарды
+по диапазонам id (SITEMAP_SHARD_SIZE id на файл), поэтому новый вопрос
+перестраивает только последний шард.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from xml.sax.saxutils import escape
+from sqlalchemy import func
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Приоритетные страницы (обновляются часто)
+PRIORITY_PAGES = [
+    ('/', 'daily', '1.0'),
+    ('/news', 'weekly', '0.9'),
+    ('/analiz-dokumentov', 'weekly', '0.9'),
+    ('/proverka-dogovorov', 'weekly', '0.9'),
+    ('/business-ip', 'weekly', '0.8'),
+    ('/articles', 'weekly', '0.9'),
+    ('/questions', 'daily', '0.9'),
+    ('/faq', 'monthly', '0.8'),
+    ('/calculator-penalty', 'monthly', '0.8'),
+    ('/mobile-app', 'weekly', '0.8'),
+    ('/proverka-dokumentov-onlayn', 'weekly', '0.9'),
+    ('/articles/nalogovaya-proverka', 'monthly', '0.8'),
+    ('/partners', 'weekly', '0.8'),
+    ('/tariffs', 'weekly', '0.9'),
+]
+
+# Статьи-шаблоны (не из таблицы articles)
+STATIC_ARTICLES = [
+    '/articles/about',
+    '/articles/guide',
+    '/articles/tech',
+    '/articles/rent',
+    '/articles/labor',
+    '/articles/tax',
+    '/articles/business-protection',
+    '/articles/freelance-gph',
+    '/articles/ipoteka-2025',
+    '/articles/lizing',
+    '/articles/strahovanie',
+    '/articles/okazanie-uslug',
+]
+
+# Дополнительные страницы
+ADDITIONAL_PAGES = [
+    ('/riski-dogovora-zayma', 'weekly', '0.9'),
+    ('/avtokredit-skrytye-usloviya', 'monthly', '0.8'),
+    ('/ii-dlya-proverki-dogovorov-onlayn-besplatno', 'monthly', '0.8'),
+    ('/medicinskie-dokumenty-analiz', 'monthly', '0.8'),
+    ('/contact', 'monthly', '0.7'),
+]
+
+# Служебные страницы (низкий приоритет)
+SERVICE_PAGES = [
+    ('/terms', 'yearly', '0.3'),
+    ('/privacy', 'yearly', '0.3'),
+    ('/offer', 'yearly', '0.3'),
+]
+
+INDEX_FILE = 'sitemap.xml'
+MANIFEST_FILE = 'manifest.json'
+
+_URLSET_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"\n'
+                  '        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">\n')
+
+
+def _date(value, default):
+    """Дата YYYY-MM-DD из ISO-строки"""
+    if isinstance(value, str) and len(value) > 10:
+        return value[:10]
+    return default
+
+
+def _url_entry(loc, lastmod, changefreq, priority):
+    return (f'    <url>\n'
+            f'        <loc>{escape(loc)}</loc>\n'
+            f'        <lastmod>{lastmod}</lastmod>\n'
+            f'        <changefreq>{changefreq}</changefreq>\n'
+            f'        <priority>{priority}</priority>\n'
+            f'    </url>\n')
+
+
+class SitemapBuilder:
+    """Строит и инкрементально обновляет файлы sitemap в каталоге"""
+
+    def __init__(self, directory, base_url, shard_size=5000, check_interval=60):
+        self.directory = directory
+        self.base_url = base_url.rstrip('/')
+        self.shard_size = shard_size
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._next_check = 0
+
+    # ---------- файлы ----------
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _write(self, filename, chunks, known_etag=None):
+        """Атомарно записывает файл и возвращает sha256 содержимого
+
+        Если содержимое совпадает с known_etag и файл на месте, файл не
+        переписывается - его mtime (Last-Modified) остается прежним.
+        """
+        data = ''.join(chunks).encode('utf-8')
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        if etag == known_etag and os.path.exists(self.path(filename)):
+            return etag
+        tmp_path = self.path(f'.{filename}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(filename))
+        return etag
+
+    def _load_manifest(self):
+        try:
+            with open(self.path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'files': {}}
+
+    def _save_manifest(self, manifest):
+        self._write(MANIFEST_FILE, [json.dumps(manifest, ensure_ascii=False, indent=1)])
+
+    def etag(self, filename):
+        """ETag файла (хеш содержимого из манифеста) или None"""
+        manifest = self._load_manifest()
+        entry = manifest.get('index') if filename == INDEX_FILE else manifest.get('files', {}).get(filename)
+        return entry.get('etag') if entry else None
+
+    # ---------- подписи разделов ----------
+
+    def _signatures(self):
+        """Подписи всех файлов: {имя файла: подпись}. Несколько агрегатных запросов на все разделы"""
+        from models.sqlite_users import db, Article, FullNews, Question
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        static = json.dumps([PRIORITY_PAGES, ADDITIONAL_PAGES, SERVICE_PAGES])
+        signatures = {
+            # Статические страницы получают lastmod текущего дня - файл обновляется раз в сутки
+            'sitemap-pages.xml': hashlib.sha256(f'{static}|{today}'.encode('utf-8')).hexdigest()[:16]
+        }
+
+        articles = db.session.query(
+            func.count(Article.id),
+            func.max(func.coalesce(Article.updated_at, Article.published_at, Article.created_at))
+        ).filter(Article.status == 'published').one()
+        signatures['sitemap-articles.xml'] = f'{json.dumps(STATIC_ARTICLES)}|{today}|{articles[0]}|{articles[1]}'
+
+        news = db.session.query(
+            func.count(FullNews.id),
+            func.max(func.coalesce(FullNews.updated_at, FullNews.published_at))
+        ).filter(FullNews.is_published.is_(True)).one()
+        signatures['sitemap-news.xml'] = f'{news[0]}|{news[1]}'
+
+        shard = (Question.id - 1) // self.shard_size
+        rows = db.session.query(
+            shard,
+            func.count(Question.id),
+            func.max(func.coalesce(Question.updated_at, Question.created_at))
+        ).group_by(shard).all()
+        for shard_index, count, last_change in rows:
+            signatures[f'sitemap-questions-{int(shard_index) + 1}.xml'] = f'{count}|{last_change}'
+
+        return signatures
+
+    # ---------- разделы ----------
+
+    def _build_pages(self, today):
+        chunks = [_URLSET_HEADER]
+        for url, changefreq, priority in PRIORITY_PAGES + ADDITIONAL_PAGES + SERVICE_PAGES:
+            chunks.append(_url_entry(f'{self.base_url}{url}', today, changefreq, priority))
+        chunks.append('</urlset>\n')
+        return chunks
+
+    def _build_articles(self, today):
+        from models.sqlite_users import db, Article
+
+        chunks = [_URLSET_HEADER]
+        seen = set()
+        for url in STATIC_ARTICLES:
+            seen.add(url)
+            chunks.append(_url_entry(f'{self.base_url}{url}', today, 'monthly', '0.8'))
+        rows = db.session.query(Article.slug, Article.updated_at, Article.published_at, Article.created_at) \
+            .filter(Article.status == 'published').order_by(Article.id)
+        for slug, updated_at, published_at, created_at in rows:
+            url = f'/articles/{slug}'
+            if url in seen:
+                continue
+            seen.add(url)
+            chunks.append(_url_entry(f'{self.base_url}{url}', _date(updated_at or published_at or created_at, today), 'monthly', '0.8'))
+        chunks.append('</urlset>\n')
+        return chunks
+
+    def _build_news(self, today):
+        from models.sqlite_users import db, FullNews
+
+        chunks = [_URLSET_HEADER]
+        rows = db.session.query(FullNews.slug, FullNews.updated_at, FullNews.published_at) \
+            .filter(FullNews.is_published.is_(True)).order_by(FullNews.id)
+        for slug, updated_at, published_at in rows:
+            chunks.append(_url_entry(f'{self.base_url}/news/{slug}', _date(updated_at or published_at, today), 'weekly', '0.8'))
+        chunks.append('</urlset>\n')
+        return chunks
+
+    def _build_questions_shard(self, shard_number, today):
+        from models.sqlite_users import db, Question
+
+        low = (shard_number - 1) * self.shard_size + 1
+        high = shard_number * self.shard_size
+        chunks = [_URLSET_HEADER]
+        rows = db.session.query(Question.id, Question.updated_at, Question.created_at) \
+            .filter(Question.id.between(low, high)).order_by(Question.id)
+        for question_id, updated_at, created_at in rows:
+            chunks.append(_url_entry(f'{self.base_url}/questions/{question_id}', _date(updated_at or created_at, today), 'weekly', '0.8'))
+        chunks.append('</urlset>\n')
+        return chunks
+
+    def _build_file(self, filename, today):
+        if filename == 'sitemap-pages.xml':
+            return self._build_pages(today)
+        if filename == 'sitemap-articles.xml':
+            return self._build_articles(today)
+        if filename == 'sitemap-news.xml':
+            return self._build_news(today)
+        return self._build_questions_shard(int(filename[len('sitemap-questions-'):-len('.xml')]), today)
+
+    # ---------- обновление ----------
+
+    def refresh(self, force=False):
+        """Перестраивает изменившиеся файлы и индекс. Возвращает список перестроенных файлов"""
+        os.makedirs(self.directory, exist_ok=True)
+        today = datetime.now().strftime('%Y-%m-%d')
+        manifest = self._load_manifest()
+        files = manifest.get('files', {})
+        signatures = self._signatures()
+
+        rebuilt = []
+        for filename, signature in sorted(signatures.items()):
+            entry = files.get(filename)
+            if not force and entry and entry.get('signature') == signature and os.path.exists(self.path(filename)):
+                continue
+            etag = self._write(filename, self._build_file(filename, today), entry.get('etag') if entry else None)
+            if entry and entry.get('etag') == etag:
+                entry['signature'] = signature
+                continue
+            files[filename] = {'signature': signature, 'etag': etag, 'lastmod': today}
+            rebuilt.append(filename)
+
+        # Шарды, которых больше нет (все вопросы диапазона удалены)
+        removed = [filename for filename in files if filename not in signatures]
+        for filename in removed:
+            files.pop(filename)
+            try:
+                os.remove(self.path(filename))
+            except OSError:
+                pass
+
+        if rebuilt or removed or force or not os.path.exists(self.path(INDEX_FILE)):
+            chunks = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+                      '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+            for filename in sorted(files, key=_file_order):
+                chunks.append(f'    <sitemap>\n'
+                              f'        <loc>{escape(self.base_url)}/{filename}</loc>\n'
+                              f'        <lastmod>{files[filename]["lastmod"]}</lastmod>\n'
+                              f'    </sitemap>\n')
+            chunks.append('</sitemapindex>\n')
+            index = manifest.get('index') or {}
+            etag = self._write(INDEX_FILE, chunks, index.get('etag'))
+            if etag != index.get('etag'):
+                manifest['index'] = {'etag': etag, 'lastmod': today}
+
+        manifest['files'] = files
+        manifest['checked_at'] = datetime.now().isoformat()
+        self._save_manifest(manifest)
+        if rebuilt or removed:
+            logger.info(f"🗺️ Sitemap обновлен: перестроено {len(rebuilt)}, удалено {len(removed)} файлов")
+        return rebuilt
+
+    def ensure_fresh(self):
+        """Проверяет подписи не чаще раза в check_interval секунд"""
+        now = time.monotonic()
+        if now < self._next_check and os.path.exists(self.path(INDEX_FILE)):
+            return
+        with self._lock:
+            if now < self._next_check and os.path.exists(self.path(INDEX_FILE)):
+                return
+            try:
+                self.refresh()
+            finally:
+                self._next_check = time.monotonic() + self.check_interval
+
+    def invalidate(self):
+        """Проверить подписи при следующем запросе sitemap"""
+        self._next_check = 0
+
+
+def _file_order(filename):
+    """Порядок файлов в индексе: страницы, статьи, новости, шарды вопросов по номеру"""
+    if filename.startswith('sitemap-questions-'):
+        return (1, int(filename[len('sitemap-questions-'):-len('.xml')]))
+    return (0, ['sitemap-pages.xml', 'sitemap-articles.xml', 'sitemap-news.xml'].index(filename))
+
+
+_builder_instance = None
+_builder_lock = threading.Lock()
+
+
+def get_sitemap_builder():
+    """Возвращает общий для процесса построитель sitemap"""
+    global _builder_instance
+    if _builder_instance is None:
+        with _builder_lock:
+            if _builder_instance is None:
+                _builder_instance = SitemapBuilder(
+                    directory=Config.SITEMAP_DIR,
+                    base_url=Config.SITEMAP_BASE_URL,
+                    shard_size=Config.SITEMAP_SHARD_SIZE,
+                    check_interval=Config.SITEMAP_CHECK_SECONDS
+                )
+    return _builder_instance
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Доставка email через пул постоянных SMTP-соединений
+
+Соединение (STARTTLS + логин) открывается один раз и переиспользуется для
+многих писем; после SMTP_MAX_MESSAGES_PER_CONNECTION писем или при простое
+дольше SMTP_POOL_IDLE_SECONDS (проверка NOOP) оно пересоздается. Ошибки
+классифицируются: временные (4xx, обрыв соединения, таймаут) повторяются
+с экспоненциальной задержкой на новом соединении, 5xx на адрес получателя -
+bounced, прочие 5xx - failed, ошибка авторизации останавливает рассылку.
+Общий для всех потоков лимит скорости (SMTP_RATE_PER_SECOND) - токен-бакет.
+
+Пул и движок принимают параметры явно, поэтому их можно направить на
+локальный тестовый SMTP-сервер (без TLS и авторизации).
+"""
+
+import time
+import queue
+import smtplib
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DeliveryResult = namedtuple('DeliveryResult', 'status error attempts')
+
+# Постоянные отказы, относящиеся к адресу получателя (письма рассылки - по одному адресу)
+RECIPIENT_REJECT_CODES = {550, 551, 553}
+
+
+def classify_smtp_error(error):
+    """Класс ошибки отправки: 'retry', 'bounced', 'failed' или 'auth'"""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return 'auth'
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return 'bounced' if codes and all(code >= 500 for code in codes) else 'retry'
+    if isinstance(error, smtplib.SMTPSenderRefused):
+        return 'retry' if 400 <= error.smtp_code < 500 else 'failed'
+    if isinstance(error, smtplib.SMTPResponseException):
+        if 400 <= error.smtp_code < 500:
+            return 'retry'
+        return 'bounced' if error.smtp_code in RECIPIENT_REJECT_CODES else 'failed'
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return 'retry'
+    if isinstance(error, smtplib.SMTPException):
+        return 'failed'
+    if isinstance(error, OSError):
+        # Сетевые ошибки и таймауты (smtplib.SMTPException - тоже OSError, поэтому проверяется выше)
+        return 'retry'
+    return 'failed'
+
+
+def _connection_reusable(error):
+    """После ответа сервера (кроме 421) smtplib сам делает RSET - соединение можно вернуть в пул"""
+    return (isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+            and getattr(error, 'smtp_code', None) != 421)
+
+
+class _PooledConnection:
+    __slots__ = ('server', 'messages', 'last_used')
+
+    def __init__(self, server):
+        self.server = server
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Пул авторизованных SMTP-соединений, общий для потоков процесса"""
+
+    def __init__(self, host, port, user=None, password=None, use_tls=True, size=3,
+                 timeout=30, max_messages=100, idle_seconds=60):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'reuses': 0, 'messages': 0, 'discarded': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.user:
+                server.login(self.user, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        self._count('connects')
+        return _PooledConnection(server)
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _checkout(self):
+        """Живое соединение из пула или новое"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - conn.last_used > self.idle_seconds:
+                # Сервер мог закрыть соединение за время простоя
+                try:
+                    if conn.server.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected('NOOP failed')
+                except Exception:
+                    self._close(conn.server)
+                    self._count('discarded')
+                    continue
+            self._count('reuses')
+            return conn
+
+    def _checkin(self, conn):
+        if conn.messages >= self.max_messages:
+            self._close(conn.server)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+
+    def send(self, msg):
+        """Отправляет письмо через соединение пула (ошибки - исключения smtplib)"""
+        with self._slots:
+            conn = self._checkout()
+            try:
+                conn.server.send_message(msg)
+            except Exception as e:
+                if _connection_reusable(e):
+                    self._checkin(conn)
+                else:
+                    self._close(conn.server)
+                    self._count('discarded')
+                raise
+            conn.messages += 1
+            self._count('messages')
+            self._checkin(conn)
+
+    def close_all(self):
+        """Закрывает простаивающие соединения"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn.server)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update({'size': self.size, 'idle': self._idle.qsize(), 'host': self.host, 'port': self.port})
+        return stats
+
+
+class RateLimiter:
+    """Токен-бакет: не больше rate_per_second операций в секунду на все потоки (0 - без лимита)"""
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1.0, rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class SMTPAuthError(Exception):
+    """SMTP-сервер отверг учетные данные - продолжать отправку бессмысленно"""
+
+
+class EmailDeliveryEngine:
+    """Отправка писем с повторами, общим лимитом скорости и параллельными отправителями"""
+
+    def __init__(self, pool, rate_per_second=0, workers=3, max_attempts=3, retry_backoff=2.0):
+        self.pool = pool
+        self.limiter = RateLimiter(rate_per_second)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+    def send(self, msg):
+        """Отправляет одно письмо. Возвращает DeliveryResult; SMTPAuthError - при отказе в авторизации"""
+        for attempt in range(1, self.max_attempts + 1):
+            self.limiter.acquire()
+            try:
+                self.pool.send(msg)
+                return DeliveryResult('sent', None, attempt)
+            except Exception as e:
+                kind = classify_smtp_error(e)
+                if kind == 'auth':
+                    raise SMTPAuthError(str(e)) from e
+                if kind == 'retry' and attempt < self.max_attempts:
+                    delay = self.retry_backoff * 2 ** (attempt - 1)
+                    logger.warning(f"⚠️ Временная ошибка SMTP ({e}), попытка {attempt}/{self.max_attempts}, повтор через {delay:.0f} с")
+                    time.sleep(delay)
+                    continue
+                return DeliveryResult('bounced' if kind == 'bounced' else 'failed', str(e), attempt)
+
+    def _send_item(self, item, build_message):
+        return item, self.send(build_message(item))
+
+    def deliver(self, items, build_message, on_result):
+        """Параллельно отправляет письма для items
+
+        build_message(item) собирает письмо (в потоке отправителя),
+        on_result(item, DeliveryResult) вызывается в вызывающем потоке -
+        там можно писать в БД. items читаются с небольшим опережением,
+        поэтому генератор получателей не материализуется целиком.
+        """
+        window = max(self.workers * 4, 1)
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='smtp-sender')
+        pending = set()
+
+        def drain(return_when):
+            nonlocal pending
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                on_result(*future.result())
+
+        try:
+            for item in items:
+                if len(pending) >= window:
+                    drain(FIRST_COMPLETED)
+                pending.add(executor.submit(self._send_item, item, build_message))
+            while pending:
+                drain(FIRST_COMPLETED)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_engine_instance = None
+_transactional_engine_instance = None
+_engine_lock = threading.Lock()
+
+
+def smtp_configured():
+    return bool(Config.SMTP_USER and Config.SMTP_PASSWORD)
+
+
+def _create_pool(size):
+    return SMTPConnectionPool(
+        Config.SMTP_HOST,
+        Config.SMTP_PORT,
+        user=Config.SMTP_USER,
+        password=Config.SMTP_PASSWORD,
+        use_tls=Config.SMTP_USE_TLS,
+        size=size,
+        timeout=Config.SMTP_TIMEOUT,
+        max_messages=Config.SMTP_MAX_MESSAGES_PER_CONNECTION,
+        idle_seconds=Config.SMTP_POOL_IDLE_SECONDS
+    )
+
+
+def get_email_engine():
+    """Возвращает общий для процесса движок доставки рассылок (настройки SMTP из Config)"""
+    global _engine_instance
+    if _engine_instance is None:
+        with _engine_lock:
+            if _engine_instance is None:
+                _engine_instance = EmailDeliveryEngine(
+                    _create_pool(Config.SMTP_POOL_SIZE),
+                    rate_per_second=Config.SMTP_RATE_PER_SECOND,
+                    workers=Config.EMAIL_CAMPAIGN_WORKERS,
+                    max_attempts=Config.SMTP_MAX_ATTEMPTS,
+                    retry_backoff=Config.SMTP_RETRY_BACKOFF_SECONDS
+                )
+    return _engine_instance
+
+
+def get_transactional_email_engine():
+    """Движок для одиночных писем из веб-запросов (send_email)
+
+    Свой пул соединений и без лимита скорости: идущая рассылка не занимает
+    его соединения и токены, а короткие повторы не держат запрос надолго.
+    """
+    global _transactional_engine_instance
+    if _transactional_engine_instance is None:
+        with _engine_lock:
+            if _transactional_engine_instance is None:
+                _transactional_engine_instance = EmailDeliveryEngine(
+                    _create_pool(Config.SMTP_TRANSACTIONAL_POOL_SIZE),
+                    rate_per_second=0,
+                    workers=1,
+                    max_attempts=Config.SMTP_TRANSACTIONAL_MAX_ATTEMPTS,
+                    retry_backoff=Config.SMTP_TRANSACTIONAL_RETRY_BACKOFF_SECONDS
+                )
+    return _transactional_engine_instance
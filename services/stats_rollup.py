@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Предагрегированные метрики для /admin/stats
+
+Компактор пересчитывает дневные и часовые бакеты (новые пользователи,
+гости, анализы, платежи, выручка, боты, просмотры страниц) одним GROUP BY
+на метрику по диапазону дат и пишет их в stats_rollups. Полный пересчет
+делается один раз, дальше - только последние STATS_ROLLUP_RECOMPUTE_DAYS
+дней (туда попадают поздние записи). Итоговые значения по счетчикам строк
+(total_used пользователей, analyses_count гостей) сохраняются как
+granularity='total'. Админ-панель читает O(дней) строк агрегатов вместо
+всей истории.
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime, date, timedelta
+from sqlalchemy import text, func
+from config import Config
+from models.sqlite_users import (
+    db, StatsRollup, User, Guest, AnalysisHistory, Payment, SearchBot, PageView
+)
+
+logger = logging.getLogger(__name__)
+
+# Длина префикса ISO-даты для бакета: 'YYYY-MM-DD' и 'YYYY-MM-DDTHH'
+BUCKET_LENGTH = {'day': 10, 'hour': 13}
+
+DAY_AND_HOUR = ('day', 'hour')
+DAY_ONLY = ('day',)
+
+# Служебная метрика: время последнего пересчета (unix timestamp)
+COMPACTED_AT_METRIC = 'compacted_at'
+
+_compact_lock = threading.Lock()
+
+
+def _event_metrics():
+    """Метрики по событиям: (имя, колонка даты, агрегат, фильтры, гранулярности)
+
+    Метрики DAY_ONLY не суммируются по часам (уникальные IP) или считаются
+    по дате последней активности (last_seen) - для них хватает дневных бакетов.
+    """
+    success = Payment.status == 'success'
+    business_ip = PageView.path == '/business-ip'
+    return [
+        ('new_users', User.created_at, func.count(), [], DAY_AND_HOUR),
+        ('new_guests', Guest.first_seen, func.count(), [], DAY_AND_HOUR),
+        ('registered_analyses', AnalysisHistory.created_at, func.count(), [], DAY_AND_HOUR),
+        ('payments', Payment.created_at, func.count(), [success], DAY_AND_HOUR),
+        ('revenue', Payment.created_at, func.coalesce(func.sum(Payment.amount), 0), [success], DAY_AND_HOUR),
+        ('new_bots', SearchBot.first_seen, func.count(), [], DAY_AND_HOUR),
+        ('page_views', PageView.created_at, func.count(), [], DAY_AND_HOUR),
+        ('business_ip_views', PageView.created_at, func.count(), [business_ip], DAY_AND_HOUR),
+        ('business_ip_unique', PageView.created_at, func.count(func.distinct(PageView.ip_address)), [business_ip], DAY_ONLY),
+        # Гости с анализами, последний визит которых пришелся на этот день
+        ('active_guests', Guest.last_seen, func.count(), [Guest.analyses_count > 0], DAY_ONLY),
+        ('bot_visits', SearchBot.last_seen, func.count(), [], DAY_ONLY),
+    ]
+
+
+def _total_metrics():
+    """Итоговые значения, которые не выводятся из событий (счетчики в строках, удаления)"""
+    return [
+        ('total_users', db.session.query(func.count(User.user_id))),
+        ('total_guests', db.session.query(func.count(Guest.id)).filter(Guest.registered_user_id.is_(None))),
+        ('registered_analyses_total', db.session.query(func.coalesce(func.sum(User.total_used), 0))),
+        ('guest_analyses_total', db.session.query(func.coalesce(func.sum(Guest.analyses_count), 0))),
+        ('total_bots', db.session.query(func.count(SearchBot.id))),
+        ('unique_bot_types', db.session.query(func.count(func.distinct(SearchBot.bot_type)))),
+    ]
+
+
+def _hour_bucket(moment):
+    return moment.isoformat(timespec='hours')
+
+
+class StatsRollupManager:
+    """Пересчет и чтение предагрегированных метрик"""
+
+    @staticmethod
+    def is_available():
+        return db.inspect(db.engine).has_table(StatsRollup.__tablename__)
+
+    @staticmethod
+    def collect(since=None):
+        """Считает бакеты по исходным таблицам начиная с даты since (None - вся история)
+
+        Возвращает {(granularity, bucket, metric): value}.
+        """
+        hourly_since = (date.today() - timedelta(days=Config.STATS_ROLLUP_HOURLY_RETENTION_DAYS)).isoformat()
+        rows = {}
+        for metric, column, aggregate, filters, granularities in _event_metrics():
+            for granularity in granularities:
+                bucket_expr = func.substr(column, 1, BUCKET_LENGTH[granularity])
+                query = db.session.query(bucket_expr, aggregate).filter(*filters)
+                lower_bound = since
+                if granularity == 'hour' and (lower_bound is None or lower_bound < hourly_since):
+                    lower_bound = hourly_since
+                if lower_bound:
+                    query = query.filter(column >= lower_bound)
+                for bucket, value in query.group_by(bucket_expr).all():
+                    if not bucket:
+                        continue
+                    # Даты могли сохраняться и через пробел ('YYYY-MM-DD HH:MM')
+                    key = (granularity, bucket.replace(' ', 'T'), metric)
+                    rows[key] = rows.get(key, 0) + (value or 0)
+
+        for metric, query in _total_metrics():
+            rows[('total', '', metric)] = query.scalar() or 0
+        return rows
+
+    @staticmethod
+    def compact(full=False):
+        """Пересчитывает агрегаты: полностью или начиная с последних дней. Возвращает число записанных строк"""
+        started = time.monotonic()
+        last_compacted = StatsRollupManager._last_compacted_at()
+        since = None
+        if not full and last_compacted:
+            # Если компактор долго не работал - пересчитываем и пропущенные дни
+            last_day = min(datetime.fromtimestamp(last_compacted).date(), date.today())
+            since = (last_day - timedelta(days=Config.STATS_ROLLUP_RECOMPUTE_DAYS)).isoformat()
+
+        try:
+            rows = StatsRollupManager.collect(since)
+            now = datetime.now()
+            rows[('total', '', COMPACTED_AT_METRIC)] = time.time()
+
+            if since:
+                db.session.execute(text(
+                    "DELETE FROM stats_rollups WHERE granularity IN ('day', 'hour') AND bucket >= :since"
+                ), {'since': since})
+            else:
+                db.session.execute(text("DELETE FROM stats_rollups WHERE granularity IN ('day', 'hour')"))
+            db.session.execute(text("DELETE FROM stats_rollups WHERE granularity = 'total'"))
+            # Часовые бакеты храним ограниченное время
+            db.session.execute(text(
+                "DELETE FROM stats_rollups WHERE granularity = 'hour' AND bucket < :cutoff"
+            ), {'cutoff': (date.today() - timedelta(days=Config.STATS_ROLLUP_HOURLY_RETENTION_DAYS)).isoformat()})
+
+            updated_at = now.isoformat(timespec='seconds')
+            db.session.execute(text(
+                "INSERT INTO stats_rollups (granularity, bucket, metric, value, updated_at) "
+                "VALUES (:granularity, :bucket, :metric, :value, :updated_at)"
+            ), [
+                {'granularity': granularity, 'bucket': bucket, 'metric': metric,
+                 'value': float(value), 'updated_at': updated_at}
+                for (granularity, bucket, metric), value in rows.items()
+            ])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logger.info(f"📊 Агрегаты статистики пересчитаны ({'с ' + since if since else 'полностью'}): "
+                    f"{len(rows)} строк за {time.monotonic() - started:.2f} сек")
+        return len(rows)
+
+    @staticmethod
+    def _last_compacted_at():
+        row = StatsRollup.query.filter_by(
+            granularity='total', bucket='', metric=COMPACTED_AT_METRIC
+        ).first()
+        return row.value if row else None
+
+    @staticmethod
+    def ensure_fresh(max_age=None):
+        """Пересчитывает свежие бакеты, если агрегаты старше max_age секунд"""
+        max_age = Config.STATS_ROLLUP_MAX_AGE_SECONDS if max_age is None else max_age
+        last_compacted = StatsRollupManager._last_compacted_at()
+        if last_compacted and time.time() - last_compacted < max_age:
+            return
+        # Пересчет уже идет в другом потоке - отдаем текущие агрегаты
+        if not _compact_lock.acquire(blocking=last_compacted is None):
+            return
+        try:
+            last_compacted = StatsRollupManager._last_compacted_at()
+            if not last_compacted or time.time() - last_compacted >= max_age:
+                StatsRollupManager.compact()
+        finally:
+            _compact_lock.release()
+
+    @staticmethod
+    def _load_rows(week_ago_hour):
+        """Строки агрегатов, нужные для сводки: все дни, итоги и часы за последнюю неделю"""
+        return db.session.query(
+            StatsRollup.granularity, StatsRollup.bucket, StatsRollup.metric, StatsRollup.value
+        ).filter(
+            db.or_(
+                StatsRollup.granularity.in_(('day', 'total')),
+                db.and_(StatsRollup.granularity == 'hour', StatsRollup.bucket >= week_ago_hour)
+            )
+        ).all()
+
+    @staticmethod
+    def get_dashboard_stats():
+        """Сводка для /admin/stats (те же ключи, что отдавались раньше)"""
+        now = datetime.now()
+        today = now.date().isoformat()
+        week_ago_hour = _hour_bucket(now - timedelta(days=7))
+
+        if StatsRollupManager.is_available():
+            StatsRollupManager.ensure_fresh()
+            rows = StatsRollupManager._load_rows(week_ago_hour)
+        else:
+            logger.warning("⚠️ Таблица stats_rollups не найдена - выполните migrate_add_stats_rollups.py")
+            rows = [key + (value,) for key, value in StatsRollupManager.collect().items()]
+
+        totals, all_days, today_values, week = {}, {}, {}, {}
+        for granularity, bucket, metric, value in rows:
+            if granularity == 'total':
+                totals[metric] = value
+            elif granularity == 'day':
+                all_days[metric] = all_days.get(metric, 0) + value
+                if bucket == today:
+                    today_values[metric] = value
+            elif granularity == 'hour' and bucket >= week_ago_hour:
+                week[metric] = week.get(metric, 0) + value
+
+        def count(values, metric):
+            return int(values.get(metric, 0))
+
+        registered_analyses = count(totals, 'registered_analyses_total')
+        guest_analyses = count(totals, 'guest_analyses_total')
+        compacted_at = totals.get(COMPACTED_AT_METRIC)
+        return {
+            'total_users': count(totals, 'total_users'),
+            'total_analyses': registered_analyses + guest_analyses,
+            'today_analyses': count(today_values, 'registered_analyses') + count(today_values, 'active_guests'),
+            'registered_analyses': registered_analyses,
+            'guest_analyses': guest_analyses,
+            'total_guests': count(totals, 'total_guests'),
+            'new_users_24h': count(today_values, 'new_users'),
+            'new_guests_24h': count(today_values, 'new_guests'),
+            'new_bots_24h': count(today_values, 'new_bots'),
+            'total_bots': count(totals, 'total_bots'),
+            'today_visits': count(today_values, 'bot_visits'),
+            'unique_bot_types': count(totals, 'unique_bot_types'),
+            'total_revenue': all_days.get('revenue', 0),
+            'today_revenue': today_values.get('revenue', 0),
+            'week_revenue': week.get('revenue', 0),
+            'total_payments': count(all_days, 'payments'),
+            'today_payments': count(today_values, 'payments'),
+            'business_ip_views_total': count(all_days, 'business_ip_views'),
+            'business_ip_views_today': count(today_values, 'business_ip_views'),
+            'business_ip_unique_today': count(today_values, 'business_ip_unique'),
+            'stats_updated_at': datetime.fromtimestamp(compacted_at).isoformat(timespec='seconds') if compacted_at else now.isoformat(timespec='seconds')
+        }
+
+    @staticmethod
+    def get_timeseries(metric, granularity='day', periods=30):
+        """Ряд значений метрики за последние periods дней/часов (пропуски заполняются нулями)"""
+        now = datetime.now()
+        if granularity == 'hour':
+            buckets = [_hour_bucket(now - timedelta(hours=i)) for i in range(periods - 1, -1, -1)]
+        else:
+            buckets = [(now.date() - timedelta(days=i)).isoformat() for i in range(periods - 1, -1, -1)]
+
+        StatsRollupManager.ensure_fresh()
+        values = dict(db.session.query(StatsRollup.bucket, StatsRollup.value).filter(
+            StatsRollup.granularity == granularity,
+            StatsRollup.metric == metric,
+            StatsRollup.bucket >= buckets[0]
+        ).all())
+        return [{'bucket': bucket, 'value': values.get(bucket, 0)} for bucket in buckets]
+
+
+def start_stats_compactor(app_instance, interval):
+    """Фоновый поток, периодически пересчитывающий свежие бакеты агрегатов"""
+    with app_instance.app_context():
+        if not StatsRollupManager.is_available():
+            logger.warning("⚠️ Таблица stats_rollups не найдена - выполните migrate_add_stats_rollups.py")
+            return None
+
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                with app_instance.app_context():
+                    StatsRollupManager.ensure_fresh(max_age=interval / 2)
+            except Exception as e:
+                logger.error(f"❌ Ошибка пересчета агрегатов статистики: {e}")
+
+    thread = threading.Thread(target=run, name='stats-compactor', daemon=True)
+    thread.start()
+    return stop_event
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш извлеченного текста документов
+
+Ключ - SHA-256 от байтов файла плюс способ извлечения: один и тот же файл
+в /api/analyze, пакетной обработке и сравнении документов извлекается
+(а фото - распознается платным Vision API) только один раз. Текст хранится сжатым в отдельной SQLite-базе
+вместе с метаданными (страницы, символы, признак OCR); TTL и LRU-вытеснение
+по количеству записей и суммарному размеру.
+"""
+
+import os
+import gzip
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Признаки строки-ошибки, которую возвращают функции извлечения текста (такое не кешируем)
+ERROR_PREFIXES = ('❌', 'Ошибка', 'Неподдерживаемый формат')
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """SHA-256 от содержимого файла (читается блоками)"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def normalize_extracted_text(text):
+    """Единые переводы строк и без NUL-символов - такой текст и кладем в кеш"""
+    return text.replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+
+
+class ExtractedTextCache:
+    """SQLite-кеш извлеченного текста с TTL и LRU-вытеснением"""
+
+    def __init__(self, db_path, ttl_seconds=30 * 24 * 3600, max_entries=2000, max_bytes=500 * 1024 * 1024):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        """Открывает соединение с базой кеша (одно соединение на операцию - безопасно для потоков)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if not self._initialized:
+            self._init_schema(conn)
+        return conn
+
+    def _init_schema(self, conn):
+        """Создает таблицы кеша при первом обращении"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS text_cache (
+                    file_hash TEXT PRIMARY KEY,
+                    text_gz BLOB NOT NULL,
+                    max_chars INTEGER,
+                    pages_count INTEGER NOT NULL DEFAULT 1,
+                    char_count INTEGER NOT NULL,
+                    is_ocr INTEGER NOT NULL DEFAULT 0,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_text_cache_last_accessed
+                    ON text_cache (last_accessed);
+                CREATE TABLE IF NOT EXISTS text_cache_stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                );
+            ''')
+            conn.commit()
+            self._initialized = True
+
+    def _bump_counter(self, conn, name, delta=1):
+        conn.execute(
+            'INSERT INTO text_cache_stats (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, delta)
+        )
+
+    def get(self, file_hash, max_chars=None):
+        """Возвращает dict(text, pages_count, char_count, is_ocr) или None
+
+        Запись, извлеченная с бюджетом символов, подходит только для запросов
+        с таким же или меньшим бюджетом; полный текст (max_chars NULL) - для любых.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT text_gz, max_chars, pages_count, char_count, is_ocr, created_at '
+                'FROM text_cache WHERE file_hash = ?',
+                (file_hash,)
+            ).fetchone()
+
+            if row and now - row[5] > self.ttl_seconds:
+                conn.execute('DELETE FROM text_cache WHERE file_hash = ?', (file_hash,))
+                self._bump_counter(conn, 'expired')
+                row = None
+
+            if row and row[1] is not None and (max_chars is None or max_chars > row[1]):
+                # Сохранен усеченный текст, а нужно больше
+                row = None
+
+            if not row:
+                self._bump_counter(conn, 'misses')
+                conn.commit()
+                return None
+
+            conn.execute(
+                'UPDATE text_cache SET last_accessed = ?, hits = hits + 1 WHERE file_hash = ?',
+                (now, file_hash)
+            )
+            self._bump_counter(conn, 'hits')
+            conn.commit()
+            return {
+                'text': gzip.decompress(row[0]).decode('utf-8'),
+                'pages_count': row[2],
+                'char_count': row[3],
+                'is_ocr': bool(row[4])
+            }
+        finally:
+            conn.close()
+
+    def set(self, file_hash, text, pages_count=1, max_chars=None, is_ocr=False):
+        """Сохраняет извлеченный текст и при необходимости вытесняет старые записи"""
+        text_gz = gzip.compress(text.encode('utf-8'), compresslevel=6)
+        now = time.time()
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO text_cache '
+                '(file_hash, text_gz, max_chars, pages_count, char_count, is_ocr, size_bytes, created_at, last_accessed, hits) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)',
+                (file_hash, text_gz, max_chars, pages_count, len(text), int(is_ocr), len(text_gz), now, now)
+            )
+            self._bump_counter(conn, 'stores')
+            self._evict(conn, now)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _evict(self, conn, now):
+        """Удаляет просроченные записи и вытесняет наименее используемые сверх лимитов"""
+        expired = conn.execute(
+            'DELETE FROM text_cache WHERE created_at < ?',
+            (now - self.ttl_seconds,)
+        ).rowcount
+        if expired:
+            self._bump_counter(conn, 'expired', expired)
+
+        count, total_bytes = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM text_cache'
+        ).fetchone()
+
+        evicted = 0
+        if self.max_entries and count > self.max_entries:
+            evicted += conn.execute(
+                'DELETE FROM text_cache WHERE file_hash IN ('
+                'SELECT file_hash FROM text_cache ORDER BY last_accessed ASC LIMIT ?)',
+                (count - self.max_entries,)
+            ).rowcount
+            total_bytes = conn.execute(
+                'SELECT COALESCE(SUM(size_bytes), 0) FROM text_cache'
+            ).fetchone()[0]
+
+        if self.max_bytes and total_bytes > self.max_bytes:
+            rows = conn.execute(
+                'SELECT file_hash, size_bytes FROM text_cache ORDER BY last_accessed ASC'
+            ).fetchall()
+            to_delete = []
+            for key, size in rows:
+                if total_bytes <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                total_bytes -= size
+            conn.executemany('DELETE FROM text_cache WHERE file_hash = ?', to_delete)
+            evicted += len(to_delete)
+
+        if evicted:
+            self._bump_counter(conn, 'evictions', evicted)
+            logger.info(f"🧹 Кеш текстов: вытеснено {evicted} записей")
+
+    def get_stats(self):
+        """Статистика кеша: попадания, промахи, размер"""
+        conn = self._connect()
+        try:
+            counters = dict(conn.execute('SELECT name, value FROM text_cache_stats').fetchall())
+            count, total_bytes, ocr_entries = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(is_ocr), 0) FROM text_cache'
+            ).fetchone()
+        finally:
+            conn.close()
+
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        lookups = hits + misses
+        return {
+            'enabled': Config.TEXT_CACHE_ENABLED,
+            'entries': count,
+            'ocr_entries': ocr_entries,
+            'size_bytes': total_bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': hits,
+            'misses': misses,
+            'stores': counters.get('stores', 0),
+            'evictions': counters.get('evictions', 0),
+            'expired': counters.get('expired', 0),
+            'hit_rate': round(hits / lookups * 100, 1) if lookups else 0
+        }
+
+    def clear(self):
+        """Полностью очищает кеш (счетчики сохраняются)"""
+        conn = self._connect()
+        try:
+            deleted = conn.execute('DELETE FROM text_cache').rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_text_cache():
+    """Возвращает общий экземпляр кеша текстов"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                cache_dir = os.path.dirname(Config.TEXT_CACHE_PATH)
+                if cache_dir:
+                    os.makedirs(cache_dir, exist_ok=True)
+                _cache_instance = ExtractedTextCache(
+                    Config.TEXT_CACHE_PATH,
+                    ttl_seconds=Config.TEXT_CACHE_TTL,
+                    max_entries=Config.TEXT_CACHE_MAX_ENTRIES,
+                    max_bytes=Config.TEXT_CACHE_MAX_BYTES
+                )
+    return _cache_instance
+
+
+def get_cached_text(file_path, kind, max_chars=None):
+    """Ищет текст файла в кеше. Возвращает (ключ, dict или None)
+
+    kind - способ извлечения ('pdf', 'docx', 'txt', 'image'): одни и те же байты
+    с другим расширением извлекаются иначе, поэтому он входит в ключ.
+    """
+    if not Config.TEXT_CACHE_ENABLED:
+        return None, None
+    try:
+        file_hash = f"{kind}:{file_sha256(file_path)}"
+        return file_hash, get_text_cache().get(file_hash, max_chars)
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка чтения кеша текстов: {e}")
+        return None, None
+
+
+def store_cached_text(file_hash, text, pages_count=1, max_chars=None, is_ocr=False):
+    """Сохраняет извлеченный текст (строки-ошибки не кешируются)"""
+    if not file_hash or not isinstance(text, str) or text.startswith(ERROR_PREFIXES):
+        return
+    try:
+        get_text_cache().set(file_hash, text, pages_count, max_chars, is_ocr)
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка записи в кеш текстов: {e}")
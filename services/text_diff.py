@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение версий документа: пункты, patience/Myers diff, пословный diff
+
+Текст режется не по строкам, а на пункты (абзацы, нумерованные пункты,
+предложения), поэтому перенос строк при другой верстке PDF не дает
+ложных изменений. Пункты заменяются целыми числами (одинаковый текст -
+одно число), дальше работает patience diff: уникальные в обеих версиях
+пункты служат опорами, промежутки между ними сравниваются рекурсивно,
+а там, где уникальных опор нет, - алгоритмом Myers O((N+M)D) с лимитом D.
+
+Удаленные и добавленные пункты одного блока сопоставляются по сходству
+слов, для пар строится пословный diff. Все этапы укладываются в общий
+бюджет времени: после него оставшиеся участки считаются заменой целиком,
+а пословный diff не строится (result['budget_exceeded']).
+"""
+
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Начало нового пункта: "1.", "2.3.", "а)", маркер списка
+_CLAUSE_START = re.compile(r'^(?:\d+(?:\.\d+)*\.?|[а-яёa-z]\)|[-–—•])(?:\s|$)', re.IGNORECASE)
+# Граница предложения внутри абзаца
+_SENTENCE_END = re.compile(r'(?<=[.!?;])\s+(?=[«"(]?[А-ЯЁA-Z0-9])')
+_CLAUSE_NUMBER = re.compile(r'^(?:\d+(?:\.\d+)*\.?|[а-яёa-z]\))$', re.IGNORECASE)
+_CLAUSE_LABEL = re.compile(r'^(\d+(?:\.\d+)*)\.?(?:\s|$)')
+_WORD = re.compile(r'\w+', re.UNICODE)
+_TOKEN = re.compile(r'\w+|[^\w\s]+|\s+', re.UNICODE)
+
+MYERS_MAX_COST = 2000  # Больше правок в участке без опор - участок считается заменой целиком
+PAIR_WINDOW = 20  # Сколько добавленных пунктов смотреть вперед при поиске пары удаленному
+PAIR_MIN_SIMILARITY = 0.5
+WORD_DIFF_MAX_TOKENS = 5000
+CLAUSE_HEADING_MAX_CHARS = 40
+
+
+def split_units(text):
+    """Разбивает текст на пункты: склеивает строки абзаца и режет его по предложениям"""
+    paragraphs = []
+    buf = []
+
+    def flush():
+        if buf:
+            paragraphs.append(' '.join(buf))
+            buf.clear()
+
+    for raw in text.split('\n'):
+        line = ' '.join(raw.split())
+        if not line:
+            flush()
+            continue
+        if buf and _CLAUSE_START.match(line) and (buf[-1][-1] in '.;:!?' or len(buf[-1]) < CLAUSE_HEADING_MAX_CHARS):
+            # Номер в начале строки - новый пункт, только если предыдущая строка
+            # закончила фразу или это заголовок (иначе это перенос строки перед числом)
+            flush()
+        if buf and buf[-1][-1:] == '-' and buf[-1][-2:-1].isalpha() and line[:1].islower():
+            # Перенос слова по слогам
+            buf[-1] = buf[-1][:-1] + line
+        else:
+            buf.append(line)
+    flush()
+
+    units = []
+    for paragraph in paragraphs:
+        number = None
+        for part in _SENTENCE_END.split(paragraph):
+            if number:
+                part = f'{number} {part}'
+                number = None
+            if _CLAUSE_NUMBER.match(part):
+                # Номер пункта ("1.") остается с текстом пункта
+                number = part
+            elif part:
+                units.append(part)
+        if number:
+            units.append(number)
+    return units
+
+
+def _unique_anchors(a, a0, a1, b, b0, b1):
+    """Пары (i, j) элементов, уникальных в обоих участках, - самая длинная возрастающая цепочка"""
+    count_a = Counter(a[a0:a1])
+    count_b = Counter(b[b0:b1])
+    index_b = {}
+    for j in range(b0, b1):
+        if count_b[b[j]] == 1:
+            index_b[b[j]] = j
+    pairs = [(i, index_b[a[i]]) for i in range(a0, a1)
+             if count_a[a[i]] == 1 and a[i] in index_b]
+    if not pairs:
+        return []
+
+    # LIS по j (patience sorting)
+    tails = []
+    tail_idx = []
+    prev = [None] * len(pairs)
+    for n, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(n)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = n
+        prev[n] = tail_idx[pos - 1] if pos else None
+    chain = []
+    n = tail_idx[-1]
+    while n is not None:
+        chain.append(pairs[n])
+        n = prev[n]
+    chain.reverse()
+    return chain
+
+
+def _myers(a, a0, a1, b, b0, b1, max_cost, deadline):
+    """Кратчайший скрипт правок; None, если правок больше max_cost или истек бюджет"""
+    n = a1 - a0
+    m = b1 - b0
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_cost) + 1):
+        if time.monotonic() > deadline:
+            return None
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m, a0, b0)
+    return None
+
+
+def _myers_backtrack(trace, x, y, a0, b0):
+    ops = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            ops.append(('equal', a0 + x, a0 + x + 1, b0 + y, b0 + y + 1))
+        if d > 0:
+            if x == prev_x:
+                ops.append(('insert', a0 + x, a0 + x, b0 + prev_y, b0 + y))
+            else:
+                ops.append(('delete', a0 + prev_x, a0 + x, b0 + y, b0 + y))
+        x, y = prev_x, prev_y
+    ops.reverse()
+    return ops
+
+
+def _coalesce(ops):
+    """Склеивает соседние равные участки, а удаления/вставки между ними - в блоки замены"""
+    result = []
+    for tag, i1, i2, j1, j2 in ops:
+        if i1 == i2 and j1 == j2:
+            continue
+        if tag != 'equal':
+            tag = 'replace' if i1 != i2 and j1 != j2 else ('delete' if i1 != i2 else 'insert')
+        if result:
+            ptag, pi1, pi2, pj1, pj2 = result[-1]
+            if (ptag == 'equal') == (tag == 'equal'):
+                if tag != 'equal':
+                    merged_i, merged_j = pi2 - pi1 + i2 - i1, pj2 - pj1 + j2 - j1
+                    tag = 'replace' if merged_i and merged_j else ('delete' if merged_i else 'insert')
+                result[-1] = (tag, pi1, i2, pj1, j2)
+                continue
+        result.append((tag, i1, i2, j1, j2))
+    return result
+
+
+def diff_sequences(a, b, deadline, max_cost=MYERS_MAX_COST):
+    """
+    Опкоды в формате difflib ('equal'/'delete'/'insert'/'replace', i1, i2, j1, j2)
+
+    Возвращает (opcodes, budget_exceeded). Элементы должны быть хешируемыми;
+    для длинных текстов выгодно заранее заменить их на числа (intern_units).
+    """
+    ops = []
+    budget_exceeded = False
+    # Стек задач: ('op', ...) - готовый опкод, ('diff', a0, a1, b0, b1) - участок для сравнения
+    stack = [('diff', 0, len(a), 0, len(b))]
+    while stack:
+        task = stack.pop()
+        if task[0] == 'op':
+            ops.append(task[1])
+            continue
+        _, a0, a1, b0, b1 = task
+
+        prefix_end = a0
+        while prefix_end < a1 and b0 + prefix_end - a0 < b1 and a[prefix_end] == b[b0 + prefix_end - a0]:
+            prefix_end += 1
+        if prefix_end > a0:
+            ops.append(('equal', a0, prefix_end, b0, b0 + prefix_end - a0))
+            b0 += prefix_end - a0
+            a0 = prefix_end
+        suffix = 0
+        while a1 - suffix > a0 and b1 - suffix > b0 and a[a1 - suffix - 1] == b[b1 - suffix - 1]:
+            suffix += 1
+        tail = []
+        if suffix:
+            a1 -= suffix
+            b1 -= suffix
+            tail = [('op', ('equal', a1, a1 + suffix, b1, b1 + suffix))]
+
+        middle = None
+        if a0 == a1 or b0 == b1:
+            middle = [('op', ('change', a0, a1, b0, b1))]
+        elif time.monotonic() > deadline:
+            budget_exceeded = True
+            middle = [('op', ('change', a0, a1, b0, b1))]
+        else:
+            anchors = _unique_anchors(a, a0, a1, b, b0, b1)
+            if anchors:
+                middle = []
+                prev_i, prev_j = a0, b0
+                for i, j in anchors:
+                    middle.append(('diff', prev_i, i, prev_j, j))
+                    middle.append(('op', ('equal', i, i + 1, j, j + 1)))
+                    prev_i, prev_j = i + 1, j + 1
+                middle.append(('diff', prev_i, a1, prev_j, b1))
+            else:
+                found = _myers(a, a0, a1, b, b0, b1, max_cost, deadline)
+                if found is None:
+                    budget_exceeded = budget_exceeded or time.monotonic() > deadline
+                    found = [('change', a0, a1, b0, b1)]
+                middle = [('op', op) for op in found]
+
+        # Задачи в стеке выполняются в обратном порядке
+        stack.extend(reversed(middle + tail))
+    return _coalesce(ops), budget_exceeded
+
+
+def intern_units(*sequences):
+    """Заменяет строки числами (одинаковые строки - одно число) для быстрого сравнения"""
+    ids = {}
+    return [[ids.setdefault(item, len(ids)) for item in seq] for seq in sequences]
+
+
+def similarity(text_a, text_b):
+    """Доля общих слов (0..1), без учета регистра"""
+    words_a = Counter(w.lower() for w in _WORD.findall(text_a))
+    words_b = Counter(w.lower() for w in _WORD.findall(text_b))
+    total = sum(words_a.values()) + sum(words_b.values())
+    if not total:
+        return 0.0
+    return 2.0 * sum((words_a & words_b).values()) / total
+
+
+def word_diff(original, modified, deadline):
+    """Пословный diff пары: список [op, текст], op - '=', '-' или '+'; None при превышении лимитов"""
+    tokens_a = _TOKEN.findall(original)
+    tokens_b = _TOKEN.findall(modified)
+    if len(tokens_a) > WORD_DIFF_MAX_TOKENS or len(tokens_b) > WORD_DIFF_MAX_TOKENS:
+        return None
+    ids_a, ids_b = intern_units(tokens_a, tokens_b)
+    opcodes, exceeded = diff_sequences(ids_a, ids_b, deadline, max_cost=len(ids_a) + len(ids_b))
+    if exceeded:
+        return None
+
+    segments = []
+
+    def put(op, text):
+        if not text:
+            return
+        if segments and segments[-1][0] == op:
+            segments[-1][1] += text
+        else:
+            segments.append([op, text])
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            put('=', ''.join(tokens_a[i1:i2]))
+        else:
+            put('-', ''.join(tokens_a[i1:i2]))
+            put('+', ''.join(tokens_b[j1:j2]))
+    return segments
+
+
+def _pair_block(removed, added, deadline):
+    """Сопоставляет удаленные и добавленные пункты блока: (пары, непарные удаленные, непарные добавленные)"""
+    pairs, lone_removed, lone_added = [], [], []
+    start = 0
+    for r in removed:
+        best, best_score = None, PAIR_MIN_SIMILARITY
+        if time.monotonic() <= deadline:
+            for q in range(start, min(start + PAIR_WINDOW, len(added))):
+                score = similarity(r, added[q])
+                if score >= best_score:
+                    best, best_score = q, score
+        if best is None:
+            lone_removed.append(r)
+            continue
+        lone_added.extend(added[start:best])
+        pairs.append((r, added[best], best_score))
+        start = best + 1
+    lone_added.extend(added[start:])
+    return pairs, lone_removed, lone_added
+
+
+def _clause_label(units):
+    """Номер последнего пункта ("5.2") среди units или None"""
+    for unit in reversed(units):
+        match = _CLAUSE_LABEL.match(unit)
+        if match:
+            return match.group(1)
+    return None
+
+
+def compare_texts(original_text, modified_text, time_budget=10.0, diff_limit=1000):
+    """
+    Сравнивает два текста
+
+    Returns:
+        dict: changes (added/removed/modified/unchanged - списки пунктов,
+        modified - словари original/modified/similarity/words), hunks -
+        блоки изменений по порядку документа с номером пункта (clause),
+        diff - первые diff_limit строк в формате difflib ('  ', '- ', '+ '),
+        budget_exceeded, elapsed_ms
+    """
+    started = time.monotonic()
+    deadline = started + time_budget
+    original_units = split_units(original_text)
+    modified_units = split_units(modified_text)
+    ids_a, ids_b = intern_units(original_units, modified_units)
+    opcodes, budget_exceeded = diff_sequences(ids_a, ids_b, deadline)
+
+    changes = {'added': [], 'removed': [], 'modified': [], 'unchanged': []}
+    hunks = []
+    diff = []
+    clause = None
+
+    def diff_line(prefix, text):
+        if len(diff) < diff_limit:
+            diff.append(prefix + text)
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            changes['unchanged'].extend(original_units[i1:i2])
+            for text in original_units[i1:i2]:
+                diff_line('  ', text)
+            clause = _clause_label(original_units[i1:i2]) or clause
+            continue
+        removed = original_units[i1:i2]
+        added = modified_units[j1:j2]
+        for text in removed:
+            diff_line('- ', text)
+        for text in added:
+            diff_line('+ ', text)
+        # Изменение относится к пункту, с которого начинается блок, или к предыдущему
+        first = (removed or added)[0]
+        hunk_clause = _clause_label([first]) or clause
+        clause = _clause_label(added) or _clause_label(removed) or hunk_clause
+
+        pairs, lone_removed, lone_added = _pair_block(removed, added, deadline)
+        changes['removed'].extend(lone_removed)
+        changes['added'].extend(lone_added)
+        hunk = {'clause': hunk_clause, 'removed': lone_removed, 'added': lone_added, 'modified': []}
+        for original, modified, score in pairs:
+            words = word_diff(original, modified, deadline) if time.monotonic() <= deadline else None
+            budget_exceeded = budget_exceeded or words is None and time.monotonic() > deadline
+            change = {
+                'original': original,
+                'modified': modified,
+                'similarity': round(score, 3),
+                'words': words
+            }
+            changes['modified'].append(change)
+            hunk['modified'].append(change)
+        hunks.append(hunk)
+
+    return {
+        'changes': changes,
+        'hunks': hunks,
+        'diff': diff,
+        'budget_exceeded': budget_exceeded,
+        'elapsed_ms': int((time.monotonic() - started) * 1000)
+    }
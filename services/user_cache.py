@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Двухуровневый кеш записей пользователей для SQLiteUserManager.get_user
+
+1. В пределах запроса - identity map в flask.g: повторные get_user в одном
+   запросе возвращают тот же объект без обращения к БД.
+2. В пределах процесса - TTL/LRU снимков строк users. По снимку собирается
+   объект сессии без SELECT (merge с load=False).
+
+Инвалидация: после commit, изменившего пользователя (тариф, списание
+анализа, вход, оплата - любые изменения через сессию), номер поколения
+пользователя обновляется в общем mmap-файле. Запись кеша помнит поколение
+на момент чтения из БД, поэтому изменения из других воркеров gunicorn
+видны сразу, а не через TTL.
+"""
+
+import os
+import mmap
+import time
+import zlib
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_SLOT = struct.Struct('<Q')
+
+
+class SharedGenerations:
+    """Поколения записей в общем для процессов mmap-файле (слоты по хешу ключа)
+
+    Если файл недоступен, поколения хранятся только в памяти процесса.
+    """
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        self._map = None
+        self._local = {}
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                size = slots * _SLOT.size
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Общий файл инвалидации кеша пользователей недоступен ({e}) - только в пределах процесса")
+
+    def _offset(self, key):
+        return (zlib.crc32(key.encode('utf-8')) % self.slots) * _SLOT.size
+
+    def get(self, key):
+        if self._map is None:
+            return self._local.get(key, 0)
+        return _SLOT.unpack_from(self._map, self._offset(key))[0]
+
+    def bump(self, key):
+        # Пишем время, а не инкремент: запись 8 байт не требует блокировки между процессами
+        value = time.time_ns()
+        if self._map is None:
+            self._local[key] = value
+        else:
+            _SLOT.pack_into(self._map, self._offset(key), value)
+
+
+class UserRecordCache:
+    """Процессный TTL/LRU кеш снимков строк пользователей"""
+
+    def __init__(self, ttl_seconds, max_entries, generations):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.generations = generations
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'request_hits': 0, 'process_hits': 0, 'misses': 0, 'stale': 0, 'invalidations': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def generation(self, user_id):
+        return self.generations.get(user_id)
+
+    def get(self, user_id):
+        """Снимок строки или None (просрочен, вытеснен или пользователь изменен)"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            snapshot, generation, expires_at = entry
+            if time.monotonic() > expires_at or generation != self.generations.get(user_id):
+                del self._entries[user_id]
+                self.stats['stale'] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            return snapshot
+
+    def set(self, user_id, snapshot, generation):
+        with self._lock:
+            self._entries[user_id] = (snapshot, generation, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self.generations.bump(user_id)
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['request_hits'] + stats['process_hits'] + stats['misses']
+        saved = stats['request_hits'] + stats['process_hits']
+        stats.update({
+            'enabled': Config.USER_CACHE_ENABLED,
+            'ttl_seconds': self.ttl_seconds,
+            'max_entries': self.max_entries,
+            'shared_invalidation': self.generations._map is not None,
+            'lookups': lookups,
+            'queries_saved': saved,
+            'hit_rate': round(saved / lookups * 100, 1) if lookups else 0
+        })
+        return stats
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+_hooks_installed = False
+
+
+def get_user_cache():
+    """Возвращает общий для процесса кеш пользователей"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = UserRecordCache(
+                    ttl_seconds=Config.USER_CACHE_TTL,
+                    max_entries=Config.USER_CACHE_MAX_ENTRIES,
+                    generations=SharedGenerations(Config.USER_CACHE_INVALIDATION_PATH, Config.USER_CACHE_INVALIDATION_SLOTS)
+                )
+    return _cache_instance
+
+
+def _request_cache():
+    """Identity map пользователей текущего запроса (None вне запроса)"""
+    from flask import g, has_request_context
+    if not has_request_context():
+        return None
+    if not hasattr(g, '_user_records'):
+        g._user_records = {}
+    return g._user_records
+
+
+def snapshot_user(user):
+    """Значения колонок пользователя для процессного кеша"""
+    return {column.key: getattr(user, column.key) for column in user.__table__.columns}
+
+
+def lookup_user(session, UserModel, user_id):
+    """Ищет пользователя в кешах. Возвращает объект сессии или None при промахе"""
+    cache = get_user_cache()
+    records = _request_cache()
+    if records is not None and user_id in records:
+        user = records[user_id]
+        if user in session:
+            cache._count('request_hits')
+            return user
+
+    snapshot = cache.get(user_id)
+    if snapshot is None:
+        cache._count('misses')
+        return None
+
+    user = UserModel(**snapshot)
+    make_transient_to_detached(user)
+    user = session.merge(user, load=False)
+    cache._count('process_hits')
+    if records is not None:
+        records[user_id] = user
+    return user
+
+
+def remember_user(user, generation):
+    """Кладет пользователя, только что прочитанного из БД, в оба уровня кеша"""
+    records = _request_cache()
+    if records is not None:
+        records[user.user_id] = user
+    get_user_cache().set(user.user_id, snapshot_user(user), generation)
+
+
+def forget_user(user_id):
+    """Сбрасывает пользователя из кешей (во всех воркерах)"""
+    records = _request_cache()
+    if records is not None:
+        records.pop(user_id, None)
+    get_user_cache().invalidate(user_id)
+
+
+def install_invalidation_hooks(session, UserModel):
+    """Инвалидирует кеш после commit, в котором пользователи изменялись или удалялись"""
+    global _hooks_installed
+    with _cache_lock:
+        if _hooks_installed:
+            return
+        _hooks_installed = True
+
+    @event.listens_for(session, 'after_flush')
+    def _collect_changed_users(flush_session, flush_context):
+        changed = flush_session.info.setdefault('changed_user_ids', set())
+        for obj in list(flush_session.dirty) + list(flush_session.deleted) + list(flush_session.new):
+            if isinstance(obj, UserModel) and obj.user_id:
+                changed.add(obj.user_id)
+
+    @event.listens_for(session, 'after_commit')
+    def _invalidate_changed_users(commit_session):
+        for user_id in commit_session.info.pop('changed_user_ids', ()):
+            forget_user(user_id)
+
+    @event.listens_for(session, 'after_soft_rollback')
+    def _discard_changed_users(rollback_session, previous_transaction):
+        rollback_session.info.pop('changed_user_ids', None)
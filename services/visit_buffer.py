@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отложенная запись статистики посещений (гости, поисковые боты, просмотры страниц)
+
+Запросы только кладут визит в буфер процесса: повторные визиты одного гостя
+или бота схлопываются (last_seen, счетчик визитов), просмотры страниц
+копятся списком. Фоновый поток сбрасывает буфер одной транзакцией раз в
+VISIT_BUFFER_FLUSH_SECONDS или раньше, если накопилось
+VISIT_BUFFER_MAX_PENDING записей. При штатной остановке процесса буфер
+сбрасывается через atexit. Без фонового потока (интервал 0) визиты
+записываются сразу, как раньше.
+"""
+
+import atexit
+import logging
+import threading
+from datetime import datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class VisitBuffer:
+    """Буфер визитов процесса со схлопыванием повторов"""
+
+    def __init__(self, max_pending=500):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._guests = {}
+        self._bots = {}
+        self._page_views = []
+        self.app = None
+        self.background = False
+        self.stats = {'visits': 0, 'flushes': 0, 'rows_written': 0, 'errors': 0}
+
+    def _pending(self):
+        return len(self._guests) + len(self._bots) + len(self._page_views)
+
+    def _after_record(self):
+        if not self.background:
+            self.flush()
+        elif self._pending() >= self.max_pending:
+            self._wakeup.set()
+
+    def record_guest_visit(self, ip_address, user_agent=None):
+        """Визит гостя: создать запись или обновить last_seen"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.stats['visits'] += 1
+            visit = self._guests.get(ip_address)
+            if visit is None:
+                self._guests[ip_address] = {'user_agent': user_agent, 'first_seen': now, 'last_seen': now}
+            else:
+                visit['last_seen'] = now
+        self._after_record()
+
+    def record_bot_visit(self, ip_address, user_agent, bot_type):
+        """Визит поискового бота/сканера: создать запись или увеличить visits_count"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.stats['visits'] += 1
+            visit = self._bots.get((ip_address, bot_type))
+            if visit is None:
+                self._bots[(ip_address, bot_type)] = {'user_agent': user_agent, 'first_seen': now, 'last_seen': now, 'visits': 1}
+            else:
+                visit['last_seen'] = now
+                visit['visits'] += 1
+                if user_agent:
+                    visit['user_agent'] = user_agent
+        self._after_record()
+
+    def record_page_view(self, path, ip_address=None, user_id=None, user_agent=None):
+        """Просмотр страницы для веб-аналитики админки"""
+        with self._lock:
+            self.stats['visits'] += 1
+            self._page_views.append({
+                'path': path,
+                'ip_address': ip_address,
+                'user_id': user_id,
+                'user_agent': user_agent[:500] if user_agent else None,
+                'created_at': datetime.now().isoformat()
+            })
+        self._after_record()
+
+    def _drain(self):
+        with self._lock:
+            guests, bots, page_views = self._guests, self._bots, self._page_views
+            self._guests, self._bots, self._page_views = {}, {}, []
+        return guests, bots, page_views
+
+    def _requeue(self, guests, bots, page_views):
+        """Возвращает несохраненные визиты в буфер (поверх новых)"""
+        with self._lock:
+            for ip_address, visit in guests.items():
+                newer = self._guests.get(ip_address)
+                if newer:
+                    visit['last_seen'] = newer['last_seen']
+                self._guests[ip_address] = visit
+            for key, visit in bots.items():
+                newer = self._bots.get(key)
+                if newer:
+                    visit['last_seen'] = newer['last_seen']
+                    visit['visits'] += newer['visits']
+                    visit['user_agent'] = newer['user_agent'] or visit['user_agent']
+                self._bots[key] = visit
+            self._page_views[:0] = page_views
+
+    def flush(self):
+        """Записывает накопленные визиты одной транзакцией. Возвращает число строк"""
+        with self._flush_lock:
+            guests, bots, page_views = self._drain()
+            if not (guests or bots or page_views):
+                return 0
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        written = self._write(guests, bots, page_views)
+                else:
+                    written = self._write(guests, bots, page_views)
+            except Exception as e:
+                self._requeue(guests, bots, page_views)
+                with self._lock:
+                    self.stats['errors'] += 1
+                logger.error(f"❌ Ошибка записи буфера визитов (повтор при следующем сбросе): {e}")
+                return 0
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['rows_written'] += written
+            logger.debug(f"💾 Буфер визитов записан: гостей {len(guests)}, ботов {len(bots)}, просмотров {len(page_views)}")
+            return written
+
+    def _write(self, guests, bots, page_views):
+        from models.sqlite_users import db, Guest, SearchBot, PageView
+
+        try:
+            if guests:
+                existing = {}
+                ips = list(guests)
+                for start in range(0, len(ips), 500):
+                    for guest in Guest.query.filter(
+                        Guest.ip_address.in_(ips[start:start + 500]),
+                        Guest.registered_user_id.is_(None)
+                    ):
+                        existing.setdefault(guest.ip_address, guest)
+                for ip_address, visit in guests.items():
+                    guest = existing.get(ip_address)
+                    if guest is None:
+                        db.session.add(Guest(
+                            ip_address=ip_address,
+                            user_agent=visit['user_agent'] or 'Не определен',
+                            first_seen=visit['first_seen'],
+                            last_seen=visit['last_seen'],
+                            analyses_count=0,
+                            calculator_uses=0,
+                            registration_prompted=False,
+                            registered_user_id=None
+                        ))
+                        logger.info(f"👤 Создан новый гость: IP={ip_address}")
+                    elif (guest.last_seen or '') < visit['last_seen']:
+                        guest.last_seen = visit['last_seen']
+
+            if bots:
+                existing = {}
+                ips = list({ip_address for ip_address, _ in bots})
+                for start in range(0, len(ips), 500):
+                    for bot in SearchBot.query.filter(SearchBot.ip_address.in_(ips[start:start + 500])):
+                        existing.setdefault((bot.ip_address, bot.bot_type), bot)
+                for (ip_address, bot_type), visit in bots.items():
+                    bot = existing.get((ip_address, bot_type))
+                    if bot is None:
+                        # Первый визит создает запись с visits_count=0, как get_or_create_search_bot
+                        db.session.add(SearchBot(
+                            ip_address=ip_address,
+                            user_agent=visit['user_agent'] or 'Не определен',
+                            bot_type=bot_type,
+                            first_seen=visit['first_seen'],
+                            last_seen=visit['last_seen'],
+                            visits_count=visit['visits'] - 1
+                        ))
+                        if bot_type == 'WordPress Scanner':
+                            logger.warning(f"🔍 Создан новый WordPress-сканер: {bot_type} (IP={ip_address})")
+                        else:
+                            logger.info(f"🕷️ Создан новый поисковый бот: {bot_type} (IP={ip_address})")
+                    else:
+                        bot.last_seen = max(bot.last_seen or '', visit['last_seen'])
+                        bot.visits_count = (bot.visits_count or 0) + visit['visits']
+                        if visit['user_agent'] and bot.user_agent != visit['user_agent']:
+                            bot.user_agent = visit['user_agent']
+
+            if page_views:
+                db.session.execute(PageView.__table__.insert(), page_views)
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(guests) + len(bots) + len(page_views)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                'pending_guests': len(self._guests),
+                'pending_bots': len(self._bots),
+                'pending_page_views': len(self._page_views),
+                'background': self.background
+            })
+        return stats
+
+
+_buffer_instance = None
+_buffer_lock = threading.Lock()
+
+
+def get_visit_buffer():
+    """Возвращает общий для процесса буфер визитов"""
+    global _buffer_instance
+    if _buffer_instance is None:
+        with _buffer_lock:
+            if _buffer_instance is None:
+                _buffer_instance = VisitBuffer(max_pending=Config.VISIT_BUFFER_MAX_PENDING)
+    return _buffer_instance
+
+
+def start_visit_buffer(app_instance, interval):
+    """Фоновый поток, сбрасывающий буфер визитов по таймеру или по размеру"""
+    buffer = get_visit_buffer()
+    buffer.app = app_instance
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.is_set():
+            buffer._wakeup.wait(interval)
+            buffer._wakeup.clear()
+            buffer.flush()
+
+    def shutdown():
+        stop_event.set()
+        buffer._wakeup.set()
+        buffer.background = False
+        buffer.flush()
+
+    buffer.background = True
+    thread = threading.Thread(target=run, name='visit-buffer', daemon=True)
+    thread.start()
+    # Сбрасываем остаток при штатной остановке процесса (SIGTERM воркера gunicorn, Ctrl+C)
+    atexit.register(shutdown)
+    return stop_event
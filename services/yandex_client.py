@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общий HTTP-клиент для Yandex Cloud (YandexGPT, Vision)
+
+Один requests.Session с пулом keep-alive соединений на процесс: TCP/TLS
+рукопожатие не повторяется на каждом запросе. Ответы 429/5xx и сетевые
+ошибки повторяются с экспоненциальной задержкой и джиттером (заголовок
+Retry-After учитывается). Circuit breaker на каждый endpoint быстро
+отказывает, пока upstream деградирован, - вызывающий код сразу уходит
+в fallback вместо ожидания таймаутов.
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+YANDEX_COMPLETION_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+YANDEX_VISION_URL = "https://vision.api.cloud.yandex.net/vision/v1/batchAnalyze"
+
+# Коды ответов, после которых запрос имеет смысл повторить
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Сколько последних замеров латентности хранить для перцентилей
+LATENCY_WINDOW = 500
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: circuit breaker разомкнут"""
+
+
+class CircuitBreaker:
+    """Circuit breaker: closed -> open после N сбоев подряд -> half_open через reset_seconds"""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open' and not self._probe_in_flight:
+                # Пропускаем один пробный запрос
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"⚠️ Circuit breaker разомкнут после {self.failures} сбоев, пауза {self.reset_seconds} сек")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class EndpointMetrics:
+    """Счетчики и латентность запросов к одному endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.status_codes = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, latency, status_code=None, error=False):
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+            if status_code is not None:
+                self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+            if error:
+                self.errors += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def to_dict(self):
+        with self._lock:
+            samples = sorted(self.latencies)
+            stats = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected_by_circuit': self.rejected,
+                'status_codes': dict(self.status_codes),
+            }
+        if samples:
+            stats.update({
+                'latency_avg_ms': round(sum(samples) / len(samples) * 1000, 1),
+                'latency_p50_ms': round(samples[len(samples) // 2] * 1000, 1),
+                'latency_p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+                'latency_max_ms': round(samples[-1] * 1000, 1),
+            })
+        return stats
+
+
+class YandexClient:
+    """Клиент Yandex Cloud с пулом соединений, ретраями и circuit breaker"""
+
+    def __init__(self, pool_size, max_retries, backoff_base, backoff_max,
+                 failure_threshold, reset_seconds, connect_timeout):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.connect_timeout = connect_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._breakers = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_endpoint(self, endpoint):
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+                self._metrics[endpoint] = EndpointMetrics()
+            return self._breakers[endpoint], self._metrics[endpoint]
+
+    @staticmethod
+    def _headers():
+        return {
+            "Authorization": f"Api-Key {Config.YANDEX_API_KEY}",
+            "Content-Type": "application/json"
+        }
+
+    def _retry_delay(self, attempt, response=None):
+        """Задержка перед повтором: Retry-After, если есть, иначе экспонента с джиттером"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    try:
+                        delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    except (TypeError, ValueError):
+                        delay = None
+                if delay is not None:
+                    return min(max(delay, 0), self.backoff_max)
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return random.uniform(0, delay)
+
+    def post(self, endpoint, url, payload, timeout):
+        """POST к Yandex Cloud с ретраями
+
+        endpoint - имя для метрик и circuit breaker ('completion', 'vision' и т.п.).
+        Возвращает requests.Response (в том числе с ошибочным статусом после
+        исчерпания попыток). Бросает CircuitOpenError, если breaker разомкнут,
+        и requests.RequestException при сетевой ошибке на последней попытке.
+        """
+        breaker, metrics = self._get_endpoint(endpoint)
+        if not breaker.allow_request():
+            metrics.record_rejected()
+            raise CircuitOpenError(f"Yandex Cloud ({endpoint}) временно недоступен")
+
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                response = self.session.post(
+                    url,
+                    headers=self._headers(),
+                    json=payload,
+                    timeout=(self.connect_timeout, timeout)
+                )
+            except requests.RequestException as e:
+                metrics.record(time.monotonic() - started, error=True)
+                if attempt >= self.max_retries:
+                    breaker.record_failure()
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"⚠️ Yandex {endpoint}: {type(e).__name__}, повтор через {delay:.1f} сек ({attempt + 1}/{self.max_retries})")
+            else:
+                retryable = response.status_code in RETRYABLE_STATUS_CODES
+                metrics.record(time.monotonic() - started, response.status_code, error=retryable)
+                if not retryable:
+                    breaker.record_success()
+                    return response
+                if attempt >= self.max_retries:
+                    breaker.record_failure()
+                    return response
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"⚠️ Yandex {endpoint}: статус {response.status_code}, повтор через {delay:.1f} сек ({attempt + 1}/{self.max_retries})")
+            metrics.record_retry()
+            time.sleep(delay)
+
+    def completion(self, payload, timeout=None, endpoint='completion'):
+        """Запрос к YandexGPT (foundationModels/v1/completion)"""
+        return self.post(endpoint, YANDEX_COMPLETION_URL, payload, timeout or Config.YANDEX_REQUEST_TIMEOUT)
+
+    def vision(self, payload, timeout=None):
+        """Запрос к Vision API (batchAnalyze)"""
+        return self.post('vision', YANDEX_VISION_URL, payload, timeout or Config.YANDEX_REQUEST_TIMEOUT)
+
+    def get_stats(self):
+        """Метрики и состояние circuit breaker по каждому endpoint"""
+        with self._lock:
+            endpoints = list(self._breakers.keys())
+        stats = {}
+        for endpoint in endpoints:
+            breaker, metrics = self._get_endpoint(endpoint)
+            stats[endpoint] = metrics.to_dict()
+            stats[endpoint]['circuit_state'] = breaker.state
+            stats[endpoint]['consecutive_failures'] = breaker.failures
+        return stats
+
+
+_client_instance = None
+_client_lock = threading.Lock()
+
+
+def get_yandex_client():
+    """Возвращает общий экземпляр клиента Yandex Cloud"""
+    global _client_instance
+    if _client_instance is None:
+        with _client_lock:
+            if _client_instance is None:
+                _client_instance = YandexClient(
+                    pool_size=Config.YANDEX_HTTP_POOL_SIZE,
+                    max_retries=Config.YANDEX_HTTP_MAX_RETRIES,
+                    backoff_base=Config.YANDEX_HTTP_BACKOFF_BASE,
+                    backoff_max=Config.YANDEX_HTTP_BACKOFF_MAX,
+                    failure_threshold=Config.YANDEX_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_seconds=Config.YANDEX_CIRCUIT_RESET_SECONDS,
+                    connect_timeout=Config.YANDEX_CONNECT_TIMEOUT
+                )
+    return _client_instance
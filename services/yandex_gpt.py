@@ -1,9 +1,14 @@
-import requests
 import logging
 from config import Config, SMART_ANALYSIS_CONFIG, RISK_LEVELS
+from services.yandex_client import get_yandex_client, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
+
+class YandexGPTError(Exception):
+    """YandexGPT вернул ошибочный статус"""
+
+
 def ask_yandex_gpt(question):
     """
     Генерирует ответ на юридический вопрос через Yandex GPT
@@ -38,11 +43,6 @@ def ask_yandex_gpt(question):
 - Практические рекомендации (если применимо)
 - Напоминание о необходимости консультации с юристом для сложных случаев"""
 
-        headers = {
-            "Authorization": f"Api-Key {Config.YANDEX_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
             "modelUri": f"gpt://{Config.YANDEX_FOLDER_ID}/yandexgpt/latest",
             "completionOptions": {
@@ -64,12 +64,7 @@ def ask_yandex_gpt(question):
         
         logger.info(f"💬 Отправка вопроса в Yandex GPT: {question[:100]}...")
         
-        response = requests.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
+        response = get_yandex_client().completion(data, endpoint='ask')
         
         if response.status_code == 200:
             result = response.json()
@@ -89,10 +84,21 @@ def ask_yandex_gpt(question):
 def detect_document_type(text):
     """
     Умное определение типа документа.
-    1) Сначала пробуем спросить YandexGPT, к какому типу из SMART_ANALYSIS_CONFIG относится документ.
-    2) Если ИИ не дал понятный ответ или нет доступа к API — используем ключевые слова (старый механизм).
+    1) Локальный классификатор (ключевые слова + размеченные тексты). Если он уверен - ответ сразу, без сети.
+    2) При низкой уверенности спрашиваем YandexGPT, к какому типу из SMART_ANALYSIS_CONFIG относится документ;
+       его ответ вместе с текстом сохраняется как пример для обучения классификатора.
+    3) Если ИИ не дал понятный ответ или нет доступа к API — лучший вариант локального классификатора.
     """
-    # --- Шаг 1. Попытка определить тип через YandexGPT ---
+    from services.document_classifier import classify_document_type
+    from services.classifier_samples import record_labeled_sample
+
+    # --- Шаг 1. Локальный классификатор ---
+    local_type, confidence, scores = classify_document_type(text)
+    if confidence >= Config.DOC_CLASSIFIER_MIN_CONFIDENCE:
+        logger.info(f"📄 Тип документа определен локально: {SMART_ANALYSIS_CONFIG[local_type]['name']} (ключ: {local_type}, уверенность: {confidence:.2f})")
+        return local_type
+    
+    # --- Шаг 2. Низкая уверенность - уточняем через YandexGPT ---
     if Config.YANDEX_API_KEY and Config.YANDEX_FOLDER_ID:
         try:
             # Формируем список допустимых типов (ключей)
@@ -131,17 +137,7 @@ def detect_document_type(text):
                 ]
             }
             
-            headers = {
-                "Authorization": f"Api-Key {Config.YANDEX_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            resp = requests.post(
-                "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
+            resp = get_yandex_client().completion(data, endpoint='detect_type')
             
             if resp.status_code == 200:
                 result = resp.json()
@@ -151,121 +147,126 @@ def detect_document_type(text):
                 # Пробуем сначала точное совпадение
                 if ai_text_lower in SMART_ANALYSIS_CONFIG:
                     logger.info(f"📄 Тип документа определен YandexGPT: {SMART_ANALYSIS_CONFIG[ai_text_lower]['name']} (ключ: {ai_text_lower})")
+                    record_labeled_sample(ai_text_lower, text)
                     return ai_text_lower
                 
                 # Если модель вернула что-то вроде "lease (договор аренды)" — ищем по вхождению ключа
                 for key in SMART_ANALYSIS_CONFIG.keys():
                     if key in ai_text_lower:
                         logger.info(f"📄 Тип документа определен YandexGPT (по вхождению): {SMART_ANALYSIS_CONFIG[key]['name']} (ключ: {key}, ответ: '{ai_text}')")
+                        record_labeled_sample(key, text)
                         return key
                 
-                logger.warning(f"⚠️ YandexGPT вернул непонятный тип документа: '{ai_text}', переходим к ключевым словам")
+                logger.warning(f"⚠️ YandexGPT вернул непонятный тип документа: '{ai_text}', используем локальный классификатор")
             else:
                 logger.error(f"❌ Ошибка YandexGPT при определении типа документа: {resp.status_code} - {resp.text}")
         except Exception as e:
             logger.error(f"❌ Исключение при определении типа документа через YandexGPT: {e}")
     
-    # --- Шаг 2. Fallback: определение типа по ключевым словам (старый механизм) ---
-    text_lower = text.lower()
-    
-    # Приоритетный порядок проверки - сначала более специфичные типы
-    # Судебные документы и бизнес-планы проверяем первыми, затем документы с уникальными ключевыми словами, потом общие
-    priority_order = [
-        'court',           # Судебные документы (самые специфичные)
-        'business_plan',   # Бизнес-планы и пояснительные записки по проектам
-        'invoice',         # Счет-фактура (уникальные слова)
-        'waybill',         # Накладная (уникальные слова)
-        'act',             # Акт (уникальные слова)
-        'power_of_attorney', # Доверенность (уникальные слова)
-        'loan',            # Договор займа/кредита
-        'insurance',       # Страхование (уникальные слова)
-        'lease',           # Договор аренды
-        'employment',      # Трудовой договор
-        'contract',        # Договор подряда
-        'supply',          # Договор поставки
-        'nda',             # Соглашение о конфиденциальности
-        'partnership',     # Договор партнерства
-        'service',         # Договор оказания услуг
-        'commission',      # Договор комиссии
-        'agency',          # Договор агентирования
-        'mandate',         # Договор поручения
-        'gift',            # Договор дарения
-        'exchange',        # Договор мены
-        'sale',            # Договор купли-продажи
-        'general'         # Общий договор (fallback)
-    ]
-    
-    # Сначала проверяем приоритетные типы
-    for doc_type in priority_order:
-        if doc_type not in SMART_ANALYSIS_CONFIG:
-            continue
-            
-        config = SMART_ANALYSIS_CONFIG[doc_type]
-        
-        # Проверяем все ключевые слова
-        for keyword in config['keywords']:
-            if keyword in text_lower:
-                logger.info(f"📄 Определен тип документа по ключевым словам: {config['name']} (ключ: {doc_type}, слово: '{keyword}')")
-                return doc_type
+    # --- Шаг 3. Fallback: лучший вариант локального классификатора ---
+    if scores:
+        logger.info(f"📄 Определен тип документа по ключевым словам: {SMART_ANALYSIS_CONFIG[local_type]['name']} (ключ: {local_type}, уверенность: {confidence:.2f})")
+        return local_type
     
     logger.info("📄 Документ определен как: Общий договор (general) по умолчанию")
     return 'general'
 
 def analyze_with_yandexgpt(text, document_type='general', analysis_settings=None):
     """Умный комплексный анализ документа с расширенной экспертизой
-    
+
+    Сначала проверяет кеш результатов (одинаковый текст + тип + настройки),
+    и только при промахе обращается к YandexGPT.
+
     Args:
         text: Текст документа
         document_type: Тип документа
         analysis_settings: Настройки анализа пользователя (приоритеты, уровень детализации, кастомные проверки)
     """
+    from services.analysis_cache import get_cached_analysis, store_cached_analysis
+
+    cache_key, cached_result = get_cached_analysis(text, document_type, analysis_settings)
+    if cached_result is not None:
+        logger.info(f"⚡ Результат анализа взят из кеша (ключ: {cache_key[:12]}...)")
+        return cached_result
+
+    result = _request_yandexgpt_analysis(text, document_type, analysis_settings)
+    store_cached_analysis(cache_key, result, document_type)
+    return result
+
+def _request_yandexgpt_analysis(text, document_type='general', analysis_settings=None):
+    """Запрос комплексного анализа к YandexGPT (без кеша)
+
+    Документы длиннее ANALYSIS_CHUNK_CHARS анализируются по частям (map-reduce).
+    """
     # Проверяем наличие API ключей
     if not Config.YANDEX_API_KEY or not Config.YANDEX_FOLDER_ID:
         error_msg = "API ключи Yandex Cloud не настроены"
         logger.error(error_msg)
         return create_fallback_analysis(document_type, error_msg)
+
+    if len(text) > Config.ANALYSIS_CHUNK_CHARS:
+        from services.chunked_analysis import analyze_in_chunks
+        return analyze_in_chunks(text, document_type, analysis_settings)
+
     try:
-        doc_config = SMART_ANALYSIS_CONFIG[document_type]
-        
-        # Формируем промпт с учетом настроек
-        priority_instructions = ""
-        if analysis_settings and not analysis_settings.get('use_default'):
-            legal_priority = analysis_settings.get('legal_priority', 5)
-            financial_priority = analysis_settings.get('financial_priority', 5)
-            operational_priority = analysis_settings.get('operational_priority', 5)
-            strategic_priority = analysis_settings.get('strategic_priority', 5)
+        ai_response = request_analysis_response(text, document_type, analysis_settings)
+        logger.info(f"✅ Получен развернутый анализ от YandexGPT")
+        return parse_smart_analysis(ai_response, document_type)
+
+    except YandexGPTError as e:
+        logger.error(str(e))
+        return create_fallback_analysis(document_type, str(e))
+
+    except CircuitOpenError as e:
+        logger.warning(f"⚡ {e} - используем резервный анализ")
+        return create_fallback_analysis(document_type, str(e))
             
-            priority_instructions = "\n\nОСОБЫЕ ИНСТРУКЦИИ ПО ПРИОРИТЕТАМ:\n"
-            if legal_priority >= 8:
-                priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на юридическую экспертизу (приоритет {legal_priority}/10). Дай максимально детальную оценку соответствия законодательству, полноты условий, ясности формулировок.\n"
-            if financial_priority >= 8:
-                priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на финансовый анализ (приоритет {financial_priority}/10). Детально проанализируй все финансовые условия, процентные ставки, платежи, штрафы.\n"
-            if operational_priority >= 8:
-                priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на операционные риски (приоритет {operational_priority}/10). Детально оцени реализуемость условий, возможности для злоупотреблений.\n"
-            if strategic_priority >= 8:
-                priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на стратегическую оценку (приоритет {strategic_priority}/10). Детально оцени долгосрочные последствия, гибкость договора.\n"
-        
-        # Добавляем кастомные проверки
-        custom_checks_text = ""
-        if analysis_settings and not analysis_settings.get('use_default'):
-            custom_checks = analysis_settings.get('custom_checks', [])
-            if custom_checks:
-                custom_checks_text = "\n\nДОПОЛНИТЕЛЬНЫЕ КРИТЕРИИ ПРОВЕРКИ (обязательно проверь):\n"
-                for check in custom_checks:
-                    custom_checks_text += f"- {check}\n"
-        
-        # Определяем уровень детализации
-        detail_level = analysis_settings.get('detail_level', 'standard') if analysis_settings and not analysis_settings.get('use_default') else 'standard'
-        detail_instruction = ""
-        if detail_level == 'brief':
-            detail_instruction = "\n\nУРОВЕНЬ ДЕТАЛИЗАЦИИ: КРАТКИЙ. Дай краткую оценку основных рисков без излишних деталей. Каждый раздел - 1-2 предложения."
-        elif detail_level == 'detailed':
-            detail_instruction = "\n\nУРОВЕНЬ ДЕТАЛИЗАЦИИ: ДЕТАЛЬНЫЙ. Дай максимально подробный анализ с примерами, ссылками на конкретные пункты договора, развернутыми рекомендациями. Каждый раздел - минимум 4-5 предложений."
-        else:
-            detail_instruction = "\n\nУРОВЕНЬ ДЕТАЛИЗАЦИИ: СТАНДАРТНЫЙ. Дай сбалансированный анализ с рекомендациями. Каждый раздел - 2-3 предложения."
+    except Exception as e:
+        error_msg = f"Ошибка соединения: {str(e)}"
+        logger.error(error_msg)
+        return create_fallback_analysis(document_type, error_msg)
+
+def _build_analysis_system_prompt(analysis_settings=None):
+    """Системный промпт комплексного анализа с учетом настроек пользователя"""
+    # Формируем промпт с учетом настроек
+    priority_instructions = ""
+    if analysis_settings and not analysis_settings.get('use_default'):
+        legal_priority = analysis_settings.get('legal_priority', 5)
+        financial_priority = analysis_settings.get('financial_priority', 5)
+        operational_priority = analysis_settings.get('operational_priority', 5)
+        strategic_priority = analysis_settings.get('strategic_priority', 5)
         
-        # Умный промпт для комплексного анализа
-        system_prompt = f"""Ты - ведущий юридический эксперт с многолетним опытом. Проведи комплексный анализ документа и предоставь развернутую экспертизу.
+        priority_instructions = "\n\nОСОБЫЕ ИНСТРУКЦИИ ПО ПРИОРИТЕТАМ:\n"
+        if legal_priority >= 8:
+            priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на юридическую экспертизу (приоритет {legal_priority}/10). Дай максимально детальную оценку соответствия законодательству, полноты условий, ясности формулировок.\n"
+        if financial_priority >= 8:
+            priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на финансовый анализ (приоритет {financial_priority}/10). Детально проанализируй все финансовые условия, процентные ставки, платежи, штрафы.\n"
+        if operational_priority >= 8:
+            priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на операционные риски (приоритет {operational_priority}/10). Детально оцени реализуемость условий, возможности для злоупотреблений.\n"
+        if strategic_priority >= 8:
+            priority_instructions += f"- Обрати ОСОБОЕ ВНИМАНИЕ на стратегическую оценку (приоритет {strategic_priority}/10). Детально оцени долгосрочные последствия, гибкость договора.\n"
+    
+    # Добавляем кастомные проверки
+    custom_checks_text = ""
+    if analysis_settings and not analysis_settings.get('use_default'):
+        custom_checks = analysis_settings.get('custom_checks', [])
+        if custom_checks:
+            custom_checks_text = "\n\nДОПОЛНИТЕЛЬНЫЕ КРИТЕРИИ ПРОВЕРКИ (обязательно проверь):\n"
+            for check in custom_checks:
+                custom_checks_text += f"- {check}\n"
+    
+    # Определяем уровень детализации
+    detail_level = analysis_settings.get('detail_level', 'standard') if analysis_settings and not analysis_settings.get('use_default') else 'standard'
+    detail_instruction = ""
+    if detail_level == 'brief':
+        detail_instruction = "\n\nУРОВЕНЬ ДЕТАЛИЗАЦИИ: КРАТКИЙ. Дай краткую оценку основных рисков без излишних деталей. Каждый раздел - 1-2 предложения."
+    elif detail_level == 'detailed':
+        detail_instruction = "\n\nУРОВЕНЬ ДЕТАЛИЗАЦИИ: ДЕТАЛЬНЫЙ. Дай максимально подробный анализ с примерами, ссылками на конкретные пункты договора, развернутыми рекомендациями. Каждый раздел - минимум 4-5 предложений."
+    else:
+        detail_instruction = "\n\nУРОВЕНЬ ДЕТАЛИЗАЦИИ: СТАНДАРТНЫЙ. Дай сбалансированный анализ с рекомендациями. Каждый раздел - 2-3 предложения."
+    
+    # Умный промпт для комплексного анализа
+    system_prompt = f"""Ты - ведущий юридический эксперт с многолетним опытом. Проведи комплексный анализ документа и предоставь развернутую экспертизу.
 
 ВАЖНО: Для договоров займа/кредита обязательно анализируй процентную ставку. Ставка выше 30% годовых - это HIGH риск, выше 40% - CRITICAL риск.
 
@@ -331,66 +332,67 @@ LOW|Название риска|Детальное описание риска (
 
 ЭКСПЕРТНОЕ ЗАКЛЮЧЕНИЕ:
 [общая оценка и выводы]{priority_instructions}{custom_checks_text}{detail_instruction}"""
+    return system_prompt
 
-        headers = {
-            "Authorization": f"Api-Key {Config.YANDEX_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "modelUri": f"gpt://{Config.YANDEX_FOLDER_ID}/yandexgpt/latest",
-            "completionOptions": {
-                "stream": False,
-                "temperature": 0.1,
-                "maxTokens": 4000
+def request_analysis_response(text, document_type='general', analysis_settings=None, part=None):
+    """Отправляет текст (или его часть) на анализ и возвращает ответ YandexGPT
+
+    part - (номер, всего, описание фрагмента) при анализе по частям.
+    Бросает YandexGPTError при ошибочном статусе ответа; CircuitOpenError
+    и сетевые ошибки пробрасываются как есть.
+    """
+    doc_config = SMART_ANALYSIS_CONFIG[document_type]
+
+    if part:
+        part_num, part_total, part_label = part
+        scope_instruction = f"""ВАЖНО: Это часть {part_num} из {part_total} документа ({part_label}). Остальные части анализируются отдельно.
+Анализируй только условия из этого фрагмента и не делай выводов об отсутствующих в нем разделах."""
+        text_limit = Config.ANALYSIS_CHUNK_CHARS
+    else:
+        scope_instruction = "ВАЖНО: Проанализируй ВЕСЬ документ, включая все страницы и все условия."
+        text_limit = 50000
+
+    data = {
+        "modelUri": f"gpt://{Config.YANDEX_FOLDER_ID}/yandexgpt/latest",
+        "completionOptions": {
+            "stream": False,
+            "temperature": 0.1,
+            "maxTokens": 4000
+        },
+        "messages": [
+            {
+                "role": "system", 
+                "text": _build_analysis_system_prompt(analysis_settings)
             },
-            "messages": [
-                {
-                    "role": "system", 
-                    "text": system_prompt
-                },
-                {
-                    "role": "user",
-                    "text": f"""Проведи комплексный экспертный анализ этого {doc_config['name']}:
+            {
+                "role": "user",
+                "text": f"""Проведи комплексный экспертный анализ этого {doc_config['name']}:
 
-{text[:50000]}
+{text[:text_limit]}
 
-ВАЖНО: Проанализируй ВЕСЬ документ, включая все страницы и все условия.
+{scope_instruction}
 Проанализируй с позиций: {', '.join(doc_config['expert_areas'])}.
 Будь максимально конкретен и практичен в рекомендациях.
 Обрати особое внимание на финансовые условия, процентные ставки, сроки, штрафы и неустойки."""
-                }
-            ]
-        }
-        
-        logger.info(f"🧠 Запускаем умный анализ для {doc_config['name']}")
-        response = requests.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers=headers,
-            json=data,
-            timeout=60
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            ai_response = result['result']['alternatives'][0]['message']['text']
-            
-            logger.info(f"✅ Получен развернутый анализ от YandexGPT")
-            return parse_smart_analysis(ai_response, document_type)
-        else:
-            error_msg = f"Ошибка YandexGPT: {response.status_code}"
-            logger.error(error_msg)
-            return create_fallback_analysis(document_type, error_msg)
-            
-    except Exception as e:
-        error_msg = f"Ошибка соединения: {str(e)}"
-        logger.error(error_msg)
-        return create_fallback_analysis(document_type, error_msg)
+            }
+        ]
+    }
+    
+    logger.info(f"🧠 Запускаем умный анализ для {doc_config['name']}" + (f" (часть {part[0]}/{part[1]})" if part else ""))
+    response = get_yandex_client().completion(data, timeout=Config.YANDEX_ANALYSIS_TIMEOUT, endpoint='analysis')
+    
+    if response.status_code != 200:
+        raise YandexGPTError(f"Ошибка YandexGPT: {response.status_code}")
+
+    result = response.json()
+    return result['result']['alternatives'][0]['message']['text']
 
 def parse_smart_analysis(ai_response, document_type):
     """Парсинг комплексного анализа от AI"""
-    doc_config = SMART_ANALYSIS_CONFIG[document_type]
-    
+    return create_smart_analysis_result(parse_analysis_sections(ai_response, document_type), document_type)
+
+def parse_analysis_sections(ai_response, document_type):
+    """Разбирает ответ AI на разделы (риски, рекомендации, тексты экспертизы)"""
     sections = {
         'legal_expertise': '',
         'financial_analysis': '', 
@@ -688,8 +690,7 @@ def parse_smart_analysis(ai_response, document_type):
                 except ValueError:
                     continue
     
-    # Создаем итоговый результат
-    return create_smart_analysis_result(sections, document_type)
+    return sections
 
 def create_smart_analysis_result(sections, document_type):
     """Создает структурированный результат умного анализа"""
@@ -2121,19 +2121,20 @@
     
     // ========== ФУНКЦИИ ДЛЯ РЕЗЕРВНЫХ КОПИЙ ==========
     
-    function createBackup() {
+    function createBackup(kind) {
         const statusEl = document.getElementById('backupStatus');
         statusEl.innerHTML = '<span style="color: #667eea;">⏳ Создание бэкапа...</span>';
         
         fetch('/admin/create-backup', {
             method: 'POST',
-            credentials: 'include'
+            credentials: 'include',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ kind: kind || 'full' })
         })
         .then(r => r.json())
         .then(result => {
             if (result.success) {
-                statusEl.innerHTML = '<span style="color: #48bb78;">✅ ' + result.message + '</span>';
-                loadBackups();
+                pollBackupStatus(statusEl, result.job_id);
             } else {
                 statusEl.innerHTML = '<span style="color: #e53e3e;">❌ ' + result.error + '</span>';
             }
@@ -2143,6 +2144,36 @@
         });
     }
     
+    function pollBackupStatus(statusEl, jobId) {
+        const stages = { snapshot: 'снимок базы', compress: 'сжатие' };
+        fetch('/admin/backup-status', {
+            method: 'GET',
+            credentials: 'include'
+        })
+        .then(r => r.json())
+        .then(result => {
+            const job = result.job || {};
+            const backup = result.backup || {};
+            if (!result.success || job.id !== jobId) {
+                statusEl.innerHTML = '<span style="color: #e53e3e;">❌ ' + (result.error || 'Задача бэкапа не найдена') + '</span>';
+            } else if (job.status === 'completed') {
+                statusEl.innerHTML = '<span style="color: #48bb78;">✅ Резервная копия создана: ' + (backup.filename || '') + '</span>';
+                loadBackups();
+            } else if (job.status === 'failed') {
+                statusEl.innerHTML = '<span style="color: #e53e3e;">❌ Ошибка создания бэкапа: ' + (job.last_error || backup.error || '') + '</span>';
+            } else {
+                const text = job.status === 'running' && backup.state === 'running'
+                    ? 'Создание бэкапа: ' + (stages[backup.stage] || backup.stage) + ', ' + (backup.progress || 0) + '%'
+                    : 'Бэкап в очереди...';
+                statusEl.innerHTML = '<span style="color: #667eea;">⏳ ' + text + '</span>';
+                setTimeout(() => pollBackupStatus(statusEl, jobId), 1000);
+            }
+        })
+        .catch(error => {
+            statusEl.innerHTML = '<span style="color: #e53e3e;">❌ Ошибка: ' + error.message + '</span>';
+        });
+    }
+    
     function loadBackups() {
         fetch('/admin/list-backups', {
             method: 'GET',
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш анализов: что попадает в кеш, а что нет
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.analysis_cache as analysis_cache
+from config import Config
+
+
+class FakeCache:
+    def __init__(self):
+        self.stored = {}
+
+    def set(self, key, result, document_type=None):
+        self.stored[key] = result
+
+
+def _store(monkeypatch, result):
+    cache = FakeCache()
+    monkeypatch.setattr(Config, 'ANALYSIS_CACHE_ENABLED', True)
+    monkeypatch.setattr(analysis_cache, 'get_analysis_cache', lambda: cache)
+    analysis_cache.store_cached_analysis('key', result, 'general')
+    return cache.stored
+
+
+def test_complete_analysis_is_cached(monkeypatch):
+    assert _store(monkeypatch, {'ai_used': True}) == {'key': {'ai_used': True}}
+
+
+def test_fallback_analysis_is_not_cached(monkeypatch):
+    assert _store(monkeypatch, {'ai_used': False}) == {}
+
+
+def test_partial_chunked_analysis_is_not_cached(monkeypatch):
+    assert _store(monkeypatch, {'ai_used': True, 'partial': True}) == {}
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Асинхронный анализ в очереди: анализ, зарезервированный при приеме, списывается или возвращается
+"""
+
+import os
+import sys
+from datetime import date
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.analysis as analysis
+import services.file_processing as file_processing
+import services.user_cache as user_cache
+import services.yandex_gpt as yandex_gpt
+from config import Config
+from models.sqlite_users import db, User, AnalysisJob, SQLiteUserManager
+from services.analysis_pipeline import create_analysis_job, run_analysis_job, fail_analysis_job
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'USER_CACHE_ENABLED', False)
+    monkeypatch.setattr(Config, 'USER_CACHE_INVALIDATION_PATH', str(tmp_path / 'user_cache_generations.bin'))
+    monkeypatch.setattr(user_cache, '_cache_instance', None)
+    monkeypatch.setattr(yandex_gpt, 'detect_document_type', lambda text: 'lease')
+    monkeypatch.setattr(analysis, 'analyze_text', lambda text, plan_type, **kwargs: {'ai_used': True})
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        app.user_manager = SQLiteUserManager(db, User)
+        app.user_manager.create_user({
+            'user_id': 'u1',
+            'plan': 'standard',
+            'available_analyses': 2,
+            'created_at': date.today().isoformat()
+        })
+        yield app
+        db.session.remove()
+
+
+def _submit(app, tmp_path):
+    """То, что делает /api/analyze/async: резерв анализа, файл, запись задачи"""
+    upload = tmp_path / 'contract.txt'
+    upload.write_text('Договор аренды нежилого помещения')
+    ctx = {
+        'temp_path': str(upload),
+        'filename': 'contract.txt',
+        'user_id': 'u1',
+        'is_authenticated': True,
+        'plan_type': 'standard',
+        'real_ip': '127.0.0.1',
+        'user_agent': 'pytest',
+        'reservation': app.user_manager.reserve_analysis('u1')
+    }
+    return {'analysis_job_id': create_analysis_job(ctx), 'ctx': ctx}
+
+
+def _user(app):
+    db.session.expire_all()
+    return app.user_manager.get_user('u1', fresh=True)
+
+
+def test_submit_reserves_analysis_before_job_runs(app, tmp_path):
+    _submit(app, tmp_path)
+    _submit(app, tmp_path)
+
+    assert _user(app).available_analyses == 0
+    assert app.user_manager.reserve_analysis('u1') is None
+
+
+def test_completed_job_commits_reservation(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(file_processing, 'extract_text_from_file', lambda path, filename, max_chars=None: 'Текст договора аренды')
+    payload = _submit(app, tmp_path)
+
+    run_analysis_job(app, payload)
+
+    job = db.session.get(AnalysisJob, payload['analysis_job_id'])
+    user = _user(app)
+    assert job.status == 'completed'
+    assert (user.available_analyses, user.total_used) == (1, 1)
+    assert not os.path.exists(payload['ctx']['temp_path'])
+
+
+def test_failed_job_refunds_reservation(app, tmp_path):
+    payload = _submit(app, tmp_path)
+
+    fail_analysis_job(payload, 'Не удалось извлечь текст из файла')
+    fail_analysis_job(payload, 'Не удалось извлечь текст из файла')
+
+    job = db.session.get(AnalysisJob, payload['analysis_job_id'])
+    user = _user(app)
+    assert job.status == 'failed'
+    assert (user.available_analyses, user.total_used) == (2, 0)
+    assert not os.path.exists(payload['ctx']['temp_path'])
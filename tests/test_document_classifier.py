@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Классификатор типов документов: обучение на размеченных текстах документов
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.classifier_samples as classifier_samples
+import services.document_classifier as document_classifier
+from config import Config
+from services.classifier_samples import ClassifierSampleStore, record_labeled_sample
+
+LEASE_TEXT = 'Арендодатель передает арендатору помещение, арендная плата вносится ежемесячно. '
+LOAN_TEXT = 'Заемщик возвращает заимодавцу сумму займа и проценты за пользование займом. '
+
+
+def test_store_keeps_newest_samples(tmp_path):
+    store = ClassifierSampleStore(str(tmp_path / 'samples.db'), max_samples=2)
+    store.add('lease', 'первый')
+    store.add('loan', 'второй')
+    store.add('lease', 'третий')
+    store.add('loan', 'второй')
+
+    assert sorted(store.load()) == [('lease', 'третий'), ('loan', 'второй')]
+
+
+def test_recorded_sample_is_document_head(tmp_path, monkeypatch):
+    store = ClassifierSampleStore(str(tmp_path / 'samples.db'))
+    monkeypatch.setattr(classifier_samples, 'get_classifier_samples', lambda: store)
+    monkeypatch.setattr(Config, 'DOC_CLASSIFIER_MAX_CHARS', 10)
+
+    record_labeled_sample('lease', 'Договор аренды помещения')
+    record_labeled_sample('lease', '   ')
+
+    assert store.load() == [('lease', 'Договор ар')]
+
+
+def test_training_uses_stored_document_texts(tmp_path, monkeypatch):
+    store = ClassifierSampleStore(str(tmp_path / 'samples.db'))
+    for i in range(document_classifier.MIN_HISTORY_SAMPLES):
+        store.add('lease', f'{LEASE_TEXT} №{i}')
+        store.add('loan', f'{LOAN_TEXT} №{i}')
+    monkeypatch.setattr(classifier_samples, 'get_classifier_samples', lambda: store)
+    monkeypatch.setattr(document_classifier, '_classifier_instance', None)
+
+    assert document_classifier.train_document_classifier() == 2 * document_classifier.MIN_HISTORY_SAMPLES
+
+    scores = document_classifier.get_document_classifier()._history_scores('арендатор вносит арендную плату')
+    assert scores['lease'] > scores['loan']
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Счетчики IP-лимитов в общей памяти: переполнение окна пробирования
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ip_limit_store import SharedMemoryLimitStore, SQLiteLimitStore
+
+# Сегодняшний день: счетчики старше retention_days SQLiteLimitStore удаляет
+DAY = date.today().isoformat()
+YESTERDAY = (date.today() - timedelta(days=1)).isoformat()
+
+
+def _store(tmp_path, slots):
+    overflow = SQLiteLimitStore(str(tmp_path / 'ip_limits.db'))
+    return SharedMemoryLimitStore(str(tmp_path / 'ip_limits.bin'), slots=slots, overflow=overflow), overflow
+
+
+def test_counts_in_shared_memory(tmp_path):
+    store, overflow = _store(tmp_path, 64)
+
+    assert store.increment('10.0.0.1', DAY) == 1
+    assert store.increment('10.0.0.1', DAY) == 2
+    store.decrement('10.0.0.1', DAY)
+
+    assert store.get('10.0.0.1', DAY) == 1
+    assert store.get('10.0.0.2', DAY) == 0
+    assert overflow.get('10.0.0.1', DAY) == 0
+
+
+def test_full_table_spills_to_sqlite_without_resetting_live_slots(tmp_path):
+    store, overflow = _store(tmp_path, 4)
+    ips = [f'10.0.0.{i}' for i in range(1, 5)]
+    for ip in ips:
+        store.increment(ip, DAY)
+        store.increment(ip, DAY)
+
+    for _ in range(3):
+        store.increment('192.168.1.1', DAY)
+    store.decrement('192.168.1.1', DAY)
+
+    assert [store.get(ip, DAY) for ip in ips] == [2, 2, 2, 2]
+    assert store.get('192.168.1.1', DAY) == 2
+    assert overflow.get('192.168.1.1', DAY) == 2
+
+
+def test_previous_day_slots_are_reused(tmp_path):
+    store, overflow = _store(tmp_path, 4)
+    for i in range(1, 5):
+        store.increment(f'10.0.0.{i}', YESTERDAY)
+
+    assert store.increment('192.168.1.1', DAY) == 1
+    assert overflow.get('192.168.1.1', DAY) == 0
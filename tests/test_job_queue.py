@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Очередь фоновых задач: задачи с истекшей арендой и исчерпанными попытками
+"""
+
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.job_queue as job_queue
+from models.sqlite_users import db, BackgroundJob
+from utils.job_queue import JobQueue
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def failed_payloads(monkeypatch):
+    failed = []
+    monkeypatch.setitem(job_queue.JOB_HANDLERS, 'test', (
+        lambda app_instance, payload: None,
+        lambda payload, error: failed.append((payload, error))
+    ))
+    return failed
+
+
+def _expire_lease(job_id):
+    job = db.session.get(BackgroundJob, job_id)
+    job.lease_expires_at = '2000-01-01T00:00:00'
+    db.session.commit()
+
+
+def test_expired_job_is_reclaimed_while_attempts_remain(app, failed_payloads):
+    job_id, _ = JobQueue.enqueue('test', {'n': 1}, max_attempts=2)
+    assert JobQueue.claim('w1').id == job_id
+    _expire_lease(job_id)
+
+    job = JobQueue.claim('w2')
+    assert job.id == job_id
+    assert job.attempts == 2
+    assert failed_payloads == []
+
+
+def test_expired_job_without_attempts_is_failed_through_handler(app, failed_payloads):
+    job_id, _ = JobQueue.enqueue('test', {'n': 1}, max_attempts=1)
+    JobQueue.claim('w1')
+    _expire_lease(job_id)
+
+    assert JobQueue.claim('w2') is None
+    assert JobQueue.fail_exhausted_jobs() == 1
+    assert JobQueue.fail_exhausted_jobs() == 0
+
+    job = db.session.get(BackgroundJob, job_id)
+    assert job.status == 'failed'
+    assert job.lease_token is None
+    assert [payload for payload, _ in failed_payloads] == [{'n': 1}]
+
+
+def test_recovery_does_not_requeue_exhausted_jobs(app, failed_payloads):
+    job_id, _ = JobQueue.enqueue('test', {'n': 1}, max_attempts=1)
+    JobQueue.claim('w1')
+    _expire_lease(job_id)
+
+    requeued, _ = JobQueue.recover_stale_jobs()
+
+    assert requeued == 0
+    assert db.session.get(BackgroundJob, job_id).status == 'failed'
+    assert len(failed_payloads) == 1
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Резервирование анализов в БД: reserve_analysis / commit_analysis / refund_analysis
+"""
+
+import os
+import sys
+from datetime import date
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.user_cache as user_cache
+from config import Config
+from models.sqlite_users import db, User, SQLiteUserManager
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'USER_CACHE_ENABLED', False)
+    # Хуки инвалидации пишут поколения в файл - держим его во временном каталоге
+    monkeypatch.setattr(Config, 'USER_CACHE_INVALIDATION_PATH', str(tmp_path / 'user_cache_generations.bin'))
+    monkeypatch.setattr(user_cache, '_cache_instance', None)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield SQLiteUserManager(db, User)
+        db.session.remove()
+
+
+def _create(manager, plan='standard', available=0):
+    manager.create_user({
+        'user_id': 'u1',
+        'plan': plan,
+        'available_analyses': available,
+        'created_at': date.today().isoformat()
+    })
+
+
+def _user(manager):
+    db.session.expire_all()
+    return manager.get_user('u1', fresh=True)
+
+
+def test_paid_reservations_never_exceed_balance(manager):
+    _create(manager, available=2)
+
+    reservations = [manager.reserve_analysis('u1') for _ in range(3)]
+
+    assert [r is not None for r in reservations] == [True, True, False]
+    assert _user(manager).available_analyses == 0
+
+
+def test_commit_switches_exhausted_plan_to_free(manager):
+    _create(manager, available=1)
+    reservation = manager.reserve_analysis('u1')
+
+    manager.commit_analysis(reservation)
+
+    user = _user(manager)
+    assert (user.plan, user.available_analyses, user.total_used) == ('free', 0, 1)
+
+
+def test_refund_restores_analysis_and_plan(manager):
+    _create(manager, available=2)
+    first = manager.reserve_analysis('u1')
+    second = manager.reserve_analysis('u1')
+    manager.commit_analysis(first)
+
+    manager.refund_analysis(second)
+
+    user = _user(manager)
+    assert (user.plan, user.available_analyses, user.total_used) == ('standard', 1, 1)
+
+
+def test_free_analysis_is_reserved_once_and_refundable(manager):
+    _create(manager, plan='free')
+
+    reservation = manager.reserve_analysis('u1')
+    assert manager.reserve_analysis('u1') is None
+
+    manager.refund_analysis(reservation)
+    assert _user(manager).free_analysis_used is False
+    assert manager.reserve_analysis('u1') is not None
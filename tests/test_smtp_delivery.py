@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Доставка email через пул SMTP-соединений на локальном тестовом SMTP-сервере
+"""
+
+import os
+import sys
+import threading
+import socketserver
+from collections import Counter
+from email.message import EmailMessage
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.smtp_delivery import SMTPConnectionPool, EmailDeliveryEngine
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-диалог. Поведение задается адресом получателя:
+
+    bounce@ - 550 на RCPT, tempfail@ - 451 на первый RCPT,
+    drop@ - обрыв соединения на первом RCPT, остальные адреса принимаются.
+    """
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 stub ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-stub')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 stub')
+            elif verb in ('MAIL', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip('<> ')
+                local = address.split('@', 1)[0]
+                with server.lock:
+                    server.rcpt_attempts[local] += 1
+                    first = server.rcpt_attempts[local] == 1
+                if local == 'bounce':
+                    self.reply('550 5.1.1 No such user')
+                elif local == 'tempfail' and first:
+                    self.reply('451 4.7.1 Try again later')
+                elif local == 'drop' and first:
+                    return
+                else:
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.delivered += 1
+                self.reply('250 Queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.delivered = 0
+        self.rcpt_attempts = Counter()
+
+
+@pytest.fixture
+def smtp_server():
+    server = _SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def engine(smtp_server):
+    pool = SMTPConnectionPool('127.0.0.1', smtp_server.server_address[1], use_tls=False, size=1, timeout=5)
+    yield EmailDeliveryEngine(pool, workers=1, max_attempts=3, retry_backoff=0)
+    pool.close_all()
+
+
+def _message(to_email):
+    msg = EmailMessage()
+    msg['From'] = 'noreply@docscan-ai.ru'
+    msg['To'] = to_email
+    msg['Subject'] = 'Тест'
+    msg.set_content('Текст письма')
+    return msg
+
+
+def test_connection_is_reused_for_many_messages(engine, smtp_server):
+    results = [engine.send(_message(f'user{i}@example.com')) for i in range(3)]
+
+    assert [r.status for r in results] == ['sent'] * 3
+    assert smtp_server.delivered == 3
+    assert smtp_server.connections == 1
+    assert engine.pool.stats['connects'] == 1
+    assert engine.pool.stats['reuses'] == 2
+
+
+def test_temporary_rejection_is_retried(engine, smtp_server):
+    result = engine.send(_message('tempfail@example.com'))
+
+    assert (result.status, result.attempts) == ('sent', 2)
+    assert smtp_server.delivered == 1
+    assert smtp_server.connections == 1
+
+
+def test_permanent_rejection_bounces_and_keeps_connection(engine, smtp_server):
+    result = engine.send(_message('bounce@example.com'))
+
+    assert (result.status, result.attempts) == ('bounced', 1)
+    assert '550' in result.error
+
+    assert engine.send(_message('user@example.com')).status == 'sent'
+    assert smtp_server.connections == 1
+
+
+def test_dropped_connection_is_retried_on_new_connection(engine, smtp_server):
+    result = engine.send(_message('drop@example.com'))
+
+    assert (result.status, result.attempts) == ('sent', 2)
+    assert smtp_server.delivered == 1
+    assert smtp_server.connections == 2
+    assert engine.pool.stats['discarded'] == 1
+
+
+def test_deliver_reports_every_recipient(engine, smtp_server):
+    recipients = ['a@example.com', 'bounce@example.com', 'tempfail@example.com', 'b@example.com']
+    statuses = {}
+
+    engine.deliver(recipients, _message, lambda item, result: statuses.__setitem__(item, result.status))
+
+    assert statuses == {
+        'a@example.com': 'sent',
+        'bounce@example.com': 'bounced',
+        'tempfail@example.com': 'sent',
+        'b@example.com': 'sent'
+    }
+    assert smtp_server.delivered == 3
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Юридический чат (/api/chat/ask -> ask_yandex_gpt) без обращения к YandexGPT
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import services.yandex_gpt as yandex_gpt
+from config import Config
+
+
+class FakeResponse:
+    status_code = 200
+    text = ''
+
+    def __init__(self, answer):
+        self._answer = answer
+
+    def json(self):
+        return {'result': {'alternatives': [{'message': {'text': self._answer}}]}}
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def completion(self, data, endpoint=None):
+        self.calls.append((data, endpoint))
+        return FakeResponse('Ответ юриста')
+
+
+def test_ask_yandex_gpt_returns_answer(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(Config, 'YANDEX_API_KEY', 'test-key')
+    monkeypatch.setattr(Config, 'YANDEX_FOLDER_ID', 'test-folder')
+    monkeypatch.setattr(yandex_gpt, 'get_yandex_client', lambda: client)
+
+    answer = yandex_gpt.ask_yandex_gpt('Можно ли расторгнуть договор аренды досрочно?')
+
+    assert answer == 'Ответ юриста'
+    data, endpoint = client.calls[0]
+    assert endpoint == 'ask'
+    system, user = data['messages']
+    assert system['role'] == 'system'
+    assert 'юридический консультант' in system['text']
+    assert user == {'role': 'user', 'text': 'Можно ли расторгнуть договор аренды досрочно?'}
+
+
+def test_ask_yandex_gpt_without_keys(monkeypatch):
+    monkeypatch.setattr(Config, 'YANDEX_API_KEY', None)
+    assert yandex_gpt.ask_yandex_gpt('Вопрос') is None
@@ -10,9 +10,13 @@ import hashlib
 import logging
 from datetime import datetime
 from models.sqlite_users import db, APIKey, User
+from services.api_key_cache import get_api_key_cache, get_api_key_usage_buffer, install_invalidation_hooks
 
 logger = logging.getLogger(__name__)
 
+# Деактивация/удаление ключа (в том числе из админки) сбрасывает его из кеша проверок
+install_invalidation_hooks(db.session, APIKey)
+
 class APIKeyManager:
     """Менеджер для работы с API-ключами"""
     
@@ -72,11 +76,23 @@ class APIKeyManager:
     
     @staticmethod
     def verify_api_key(api_key):
-        """Проверяет API-ключ и возвращает информацию о пользователе"""
+        """Проверяет API-ключ и возвращает информацию о пользователе
+
+        Повторные проверки ключа обслуживаются из кеша процесса без обращения
+        к БД, счетчики использования пишутся пакетно (services.api_key_cache).
+        """
         try:
             # Хешируем переданный ключ
             api_key_hash = APIKeyManager.hash_api_key(api_key)
             
+            cache = get_api_key_cache()
+            cached = cache.get(api_key_hash)
+            if cached is not None:
+                user_info, error = cached
+                if user_info:
+                    get_api_key_usage_buffer().record(user_info['api_key_id'])
+                return user_info, error
+            
             # Ищем ключ в БД
             key_record = APIKey.query.filter_by(
                 api_key_hash=api_key_hash,
@@ -86,28 +102,33 @@ class APIKeyManager:
             if not key_record:
                 return None, "Неверный или неактивный API-ключ"
             
+            # Поколения читаем до пользователя: изменение между чтениями сбросит запись
+            generations = cache.generations_for(key_record.id, key_record.user_id)
+            
             # Проверяем срок действия
+            expires = None
             if key_record.expires_at:
                 expires = datetime.fromisoformat(key_record.expires_at)
                 if datetime.now() > expires:
                     return None, "API-ключ истек"
             
-            # Обновляем статистику использования
-            key_record.last_used = datetime.now().isoformat()
-            key_record.requests_count += 1
-            db.session.commit()
-            
             # Получаем информацию о пользователе
             user = User.query.filter_by(user_id=key_record.user_id).first()
             if not user:
                 return None, "Пользователь не найден"
             
-            return {
+            user_info = {
                 'user_id': user.user_id,
                 'plan': user.plan,
                 'api_key_id': key_record.id,
                 'api_key_name': key_record.name
-            }, None
+            }
+            cache.set(api_key_hash, user_info, expires, generations)
+            
+            # Обновляем статистику использования
+            get_api_key_usage_buffer().record(key_record.id)
+            
+            return user_info, None
             
         except Exception as e:
             logger.error(f"❌ Ошибка проверки API-ключа: {e}")
@@ -118,7 +139,17 @@ class APIKeyManager:
         """Получает все API-ключи пользователя"""
         try:
             keys = APIKey.query.filter_by(user_id=user_id).order_by(APIKey.created_at.desc()).all()
-            return [key.to_dict() for key in keys]
+            usage_buffer = get_api_key_usage_buffer()
+            result = []
+            for key in keys:
+                key_dict = key.to_dict()
+                # Учитываем запросы, еще не записанные буфером
+                pending = usage_buffer.pending_for(key.id)
+                if pending:
+                    key_dict['requests_count'] = (key_dict['requests_count'] or 0) + pending[0]
+                    key_dict['last_used'] = max(key_dict['last_used'] or '', pending[1])
+                result.append(key_dict)
+            return result
         except Exception as e:
             logger.error(f"❌ Ошибка получения API-ключей: {e}")
             return []
@@ -8,14 +8,35 @@ import os
 import json
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from sqlalchemy import func
+from config import Config
 from models.sqlite_users import db, BatchProcessingTask, BatchProcessingFile, AnalysisHistory
-from services.file_processing import extract_text_from_file, validate_file
+from services.file_processing import extract_text_with_pages, validate_file
 from services.analysis import analyze_text
 from utils.analysis_settings_manager import AnalysisSettingsManager
 
 logger = logging.getLogger(__name__)
 
+# Глобальный лимит одновременно обрабатываемых файлов (на процесс)
+_global_semaphore = threading.BoundedSemaphore(Config.BATCH_GLOBAL_CONCURRENCY)
+
+# Лимиты одновременно обрабатываемых файлов на пользователя
+_user_semaphores = {}
+_user_semaphores_lock = threading.Lock()
+
+
+def _get_user_semaphore(user_id):
+    """Возвращает семафор пользователя (создает при первом обращении)"""
+    with _user_semaphores_lock:
+        semaphore = _user_semaphores.get(user_id)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(Config.BATCH_PER_USER_CONCURRENCY)
+            _user_semaphores[user_id] = semaphore
+        return semaphore
+
+
 class BatchProcessor:
     """Менеджер для пакетной обработки документов"""
     
@@ -64,239 +85,317 @@ class BatchProcessor:
     
     @staticmethod
     def process_batch_task_async(task_id, user_id, app_instance):
-        """Асинхронная обработка пакетной задачи (запускается в отдельном потоке)"""
-        def process_task():
-            # Создаем контекст приложения для работы с БД в отдельном потоке
-            with app_instance.app_context():
+        """Асинхронная обработка пакетной задачи (через персистентную очередь)
+
+        Задача ставится в background_jobs и выполняется воркером очереди - она
+        переживает рестарт процесса. Файлы задачи обрабатываются параллельно пулом
+        потоков размером Config.BATCH_TASK_WORKERS с ограничениями на пользователя
+        и на весь процесс.
+        """
+        from utils.job_queue import JobQueue
+        with app_instance.app_context():
+            job_id, error = JobQueue.enqueue(
+                'batch_task',
+                {'task_id': task_id, 'user_id': user_id},
+                dedupe_key=f'batch_task:{task_id}'
+            )
+        if error:
+            raise Exception(f"Не удалось поставить задачу в очередь: {error}")
+        return job_id
+    
+    @staticmethod
+    def run_batch_task(task_id, user_id, app_instance):
+        """Обработка пакетной задачи (блокирующая)
+
+        Повторный запуск (после рестарта или ретрая очереди) не обрабатывает
+        заново уже завершенные файлы - их результаты берутся из БД.
+        При критической ошибке исключение пробрасывается, чтобы очередь
+        могла повторить задачу.
+        """
+        # Создаем контекст приложения для работы с БД в отдельном потоке
+        with app_instance.app_context():
+            try:
+                logger.info(f"🚀 Начало обработки пакетной задачи {task_id}")
+                
+                # Обновляем статус задачи
+                task = BatchProcessingTask.query.get(task_id)
+                if not task:
+                    logger.error(f"❌ Задача {task_id} не найдена")
+                    return
+                
+                task.status = 'processing'
+                task.started_at = datetime.now().isoformat()
+                db.session.commit()
+            
+                # Получаем все файлы задачи; завершенные при прошлом запуске не обрабатываем повторно
+                files = BatchProcessingFile.query.filter_by(task_id=task_id).order_by(BatchProcessingFile.id.asc()).all()
+                done_results = {}
+                for f in files:
+                    if f.status == 'completed' and f.analysis_result_json:
+                        done_results[f.id] = {
+                            'filename': f.filename,
+                            'status': 'completed',
+                            'analysis': json.loads(f.analysis_result_json)
+                        }
+                all_file_ids = [f.id for f in files]
+                file_ids = [f_id for f_id in all_file_ids if f_id not in done_results]
+                if done_results:
+                    logger.info(f"♻️ Задача {task_id}: возобновление, уже обработано {len(done_results)} файлов")
+                # Счетчики прошлого запуска не переносим: потоки увеличивают их заново
+                task.processed_files = len(done_results)
+                task.failed_files = 0
+                db.session.commit()
+                
+                # Загружаем настройки анализа пользователя
+                analysis_settings = None
                 try:
-                    logger.info(f"🚀 Начало обработки пакетной задачи {task_id}")
-                    
-                    # Обновляем статус задачи
-                    task = BatchProcessingTask.query.get(task_id)
-                    if not task:
-                        logger.error(f"❌ Задача {task_id} не найдена")
-                        return
-                    
-                    task.status = 'processing'
-                    task.started_at = datetime.now().isoformat()
-                    db.session.commit()
+                    user = app_instance.user_manager.get_user(user_id)
+                    if user and user.plan == 'premium':
+                        analysis_settings = AnalysisSettingsManager.get_user_settings(user_id)
+                        if analysis_settings and analysis_settings.get('use_default'):
+                            analysis_settings = None
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось загрузить настройки анализа: {e}")
                 
-                    # Получаем все файлы задачи
-                    files = BatchProcessingFile.query.filter_by(task_id=task_id).all()
-                    
-                    results = []
-                    processed_count = 0
-                    failed_count = 0
-                    
-                    # Загружаем настройки анализа пользователя
-                    analysis_settings = None
-                    try:
-                        user = app_instance.user_manager.get_user(user_id)
-                        if user and user.plan == 'premium':
-                            analysis_settings = AnalysisSettingsManager.get_user_settings(user_id)
-                            if analysis_settings and analysis_settings.get('use_default'):
-                                analysis_settings = None
-                    except Exception as e:
-                        logger.warning(f"⚠️ Не удалось загрузить настройки анализа: {e}")
-                    
-                    # Обрабатываем каждый файл
-                    for file_record in files:
-                        try:
-                            logger.info(f"📄 Обработка файла: {file_record.filename}")
-                            
-                            file_record.status = 'processing'
-                            db.session.commit()
-                            
-                            # Извлекаем текст из файла
-                            if not file_record.file_path:
-                                raise Exception(f"Путь к файлу не указан для {file_record.filename}")
-                            
-                            if not os.path.exists(file_record.file_path):
-                                raise Exception(f"Файл не найден: {file_record.file_path}")
-                            
-                            # extract_text_from_file возвращает либо текст, либо строку ошибки
-                            # Проверяем, что это текст (не ошибка)
-                            text_result = extract_text_from_file(file_record.file_path, file_record.filename)
-                            
-                            # Если результат начинается с "❌" или "Ошибка", это ошибка
-                            if isinstance(text_result, str) and (text_result.startswith("❌") or text_result.startswith("Ошибка") or text_result.startswith("Ошибка чтения")):
-                                raise Exception(text_result)
-                            
-                            text = text_result
-                            # Для PDF пытаемся определить количество страниц
-                            pages_count = 1
-                            if file_record.filename.lower().endswith('.pdf'):
-                                try:
-                                    import PyPDF2
-                                    with open(file_record.file_path, 'rb') as f:
-                                        reader = PyPDF2.PdfReader(f)
-                                        pages_count = len(reader.pages)
-                                except:
-                                    pass
-                            
-                            if not text or len(text.strip()) < 50:
-                                raise Exception("Не удалось извлечь текст или документ слишком короткий")
-                            
-                            # Получаем пользователя для проверки лимитов
-                            user = app_instance.user_manager.get_user(user_id)
-                            if not user:
-                                raise Exception("Пользователь не найден")
-                            
-                            # Проверяем лимиты
-                            if not app_instance.user_manager.can_analyze(user_id):
-                                raise Exception("Достигнут дневной лимит анализов")
-                            
-                            # Выполняем анализ
-                            analysis_result = analyze_text(
-                                text=text,
-                                user_plan=user.plan if hasattr(user, 'plan') else user.get('plan', 'free'),
-                                is_authenticated=True,
-                                user_id=user_id,
-                                analysis_settings=analysis_settings
-                            )
-                            
-                            # Записываем использование
-                            app_instance.user_manager.record_usage(user_id)
-                            
-                            # Сохраняем в историю
-                            history = AnalysisHistory(
-                                user_id=user_id,
-                                filename=file_record.filename,
-                                document_type=analysis_result.get('document_type'),
-                                document_type_name=analysis_result.get('document_type_name'),
-                                risk_level=analysis_result.get('risk_level'),
-                                created_at=datetime.now().isoformat(),
-                                analysis_summary=analysis_result.get('summary', '')[:500]
-                            )
-                            db.session.add(history)
-                            db.session.flush()
-                            
-                            # Генерируем полный отчет (PDF) для документа
-                            report_path = None
-                            try:
-                                from services.pdf_generator import generate_analysis_pdf
-                                
-                                # Получаем настройки брендинга
-                                branding_settings = None
-                                try:
-                                    from models.sqlite_users import BrandingSettings
-                                    branding_obj = BrandingSettings.query.filter_by(user_id=user_id).first()
-                                    if branding_obj and branding_obj.is_active:
-                                        branding_settings = {
-                                            'is_active': True,
-                                            'logo_path': branding_obj.logo_path,
-                                            'primary_color': branding_obj.primary_color,
-                                            'secondary_color': branding_obj.secondary_color,
-                                            'company_name': branding_obj.company_name
-                                        }
-                                except Exception as e:
-                                    logger.warning(f"⚠️ Не удалось загрузить настройки брендинга: {e}")
-                                
-                                reports_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'reports', 'batch', f'task_{task_id}')
-                                os.makedirs(reports_dir, exist_ok=True)
-                                
-                                safe_filename = "".join(c for c in file_record.filename if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-                                report_filename = f"{safe_filename}_report.pdf"
-                                report_path_full = os.path.join(reports_dir, report_filename)
-                                
-                                # generate_analysis_pdf принимает: (analysis_data, filename="document.pdf", branding_settings=None)
-                                pdf_content = generate_analysis_pdf(
-                                    analysis_result,  # analysis_data
-                                    file_record.filename,  # filename
-                                    branding_settings  # branding_settings
-                                )
-                                
-                                with open(report_path_full, 'wb') as f:
-                                    f.write(pdf_content)
-                                
-                                report_path = f'static/reports/batch/task_{task_id}/{report_filename}'
-                                logger.info(f"✅ Полный отчет создан: {report_path}")
-                            except Exception as e:
-                                logger.warning(f"⚠️ Не удалось создать полный отчет для {file_record.filename}: {e}")
-                            
-                            # Обновляем запись файла
-                            file_record.status = 'completed'
-                            file_record.analysis_result_json = json.dumps(analysis_result, ensure_ascii=False)
-                            file_record.analysis_history_id = history.id
-                            file_record.full_report_path = report_path
-                            file_record.processed_at = datetime.now().isoformat()
-                            db.session.commit()
-                            
-                            results.append({
-                                'filename': file_record.filename,
-                                'status': 'completed',
-                                'analysis': analysis_result
-                            })
-                            
-                            processed_count += 1
-                            task.processed_files = processed_count
-                            db.session.commit()
-                            
-                            logger.info(f"✅ Файл {file_record.filename} обработан успешно")
-                            
-                        except Exception as e:
-                            logger.error(f"❌ Ошибка обработки файла {file_record.filename}: {e}")
-                            file_record.status = 'failed'
-                            file_record.error_message = str(e)
-                            file_record.processed_at = datetime.now().isoformat()
-                            db.session.commit()
-                            
-                            results.append({
-                                'filename': file_record.filename,
-                                'status': 'failed',
-                                'error': str(e)
-                            })
-                            
-                            failed_count += 1
-                            task.failed_files = failed_count
-                            db.session.commit()
-                    
-                    # Сохраняем результаты
-                    task.results_json = json.dumps(results, ensure_ascii=False)
-                    task.status = 'completed'
-                    task.completed_at = datetime.now().isoformat()
+                # Обрабатываем файлы параллельно, сохраняя исходный порядок результатов
+                workers = max(1, min(Config.BATCH_TASK_WORKERS, len(file_ids) or 1))
+                logger.info(f"⚙️ Задача {task_id}: {len(file_ids)} файлов, потоков: {workers}")
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'batch-{task_id}') as executor:
+                    new_results = dict(zip(file_ids, executor.map(
+                        lambda file_id: BatchProcessor._process_file_guarded(
+                            app_instance, task_id, file_id, user_id, analysis_settings
+                        ),
+                        file_ids
+                    )))
+                results = [done_results.get(f_id) or new_results[f_id] for f_id in all_file_ids]
+                
+                processed_count = len([r for r in results if r['status'] == 'completed'])
+                failed_count = len([r for r in results if r['status'] == 'failed'])
+                
+                # Сохраняем результаты
+                db.session.expire_all()
+                task = BatchProcessingTask.query.get(task_id)
+                task.processed_files = processed_count
+                task.failed_files = failed_count
+                task.results_json = json.dumps(results, ensure_ascii=False)
+                task.status = 'completed'
+                task.completed_at = datetime.now().isoformat()
+                db.session.commit()
+                
+                logger.info(f"✅ Пакетная задача {task_id} завершена. Обработано: {processed_count}, Ошибок: {failed_count}")
+                
+                # Генерируем сводный отчет (опционально)
+                try:
+                    BatchProcessor.generate_summary_report(task_id, results)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось сгенерировать сводный отчет: {e}")
+                
+                # Создаем уведомление о завершении
+                try:
+                    from models.sqlite_users import Notification
+                    notification = Notification(
+                        user_id=user_id,
+                        title=f"Пакетная обработка завершена",
+                        message=f"Задача '{task.task_name or f'Задача #{task_id}'}' завершена. Обработано: {processed_count} из {task.total_files} файлов.",
+                        type='batch_completed',
+                        created_at=datetime.now().isoformat()
+                    )
+                    db.session.add(notification)
                     db.session.commit()
-                    
-                    logger.info(f"✅ Пакетная задача {task_id} завершена. Обработано: {processed_count}, Ошибок: {failed_count}")
-                    
-                    # Генерируем сводный отчет (опционально)
-                    try:
-                        BatchProcessor.generate_summary_report(task_id, results)
-                    except Exception as e:
-                        logger.warning(f"⚠️ Не удалось сгенерировать сводный отчет: {e}")
-                    
-                    # Создаем уведомление о завершении
-                    try:
-                        from models.sqlite_users import Notification
-                        notification = Notification(
-                            user_id=user_id,
-                            title=f"Пакетная обработка завершена",
-                            message=f"Задача '{task.task_name or f'Задача #{task_id}'}' завершена. Обработано: {processed_count} из {task.total_files} файлов.",
-                            type='batch_completed',
-                            created_at=datetime.now().isoformat()
-                        )
-                        db.session.add(notification)
+                    logger.info(f"✅ Уведомление создано для пользователя {user_id}")
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось создать уведомление: {e}")
+                
+            except Exception as e:
+                logger.error(f"❌ Критическая ошибка обработки пакетной задачи {task_id}: {e}")
+                try:
+                    db.session.rollback()
+                    task = BatchProcessingTask.query.get(task_id)
+                    if task:
+                        task.status = 'failed'
+                        task.error_message = str(e)
+                        task.completed_at = datetime.now().isoformat()
                         db.session.commit()
-                        logger.info(f"✅ Уведомление создано для пользователя {user_id}")
-                    except Exception as e:
-                        logger.warning(f"⚠️ Не удалось создать уведомление: {e}")
-                    
+                except Exception as db_error:
+                    logger.error(f"❌ Ошибка сохранения статуса ошибки: {db_error}")
+                raise
+    
+    @staticmethod
+    def _process_file_guarded(app_instance, task_id, file_id, user_id, analysis_settings):
+        """Обработка одного файла с учетом лимитов параллельности (на пользователя и глобального)"""
+        with _get_user_semaphore(user_id), _global_semaphore:
+            # У каждого потока пула своя сессия БД - открываем отдельный контекст приложения
+            with app_instance.app_context():
+                return BatchProcessor._process_file(app_instance, task_id, file_id, user_id, analysis_settings)
+    
+    @staticmethod
+    def _process_file(app_instance, task_id, file_id, user_id, analysis_settings):
+        """Извлечение текста, анализ и генерация отчета для одного файла задачи"""
+        file_record = BatchProcessingFile.query.get(file_id)
+        filename = file_record.filename
+        reservation = None
+        try:
+            logger.info(f"📄 Обработка файла: {filename}")
+            
+            file_record.status = 'processing'
+            db.session.commit()
+            
+            # Извлекаем текст из файла
+            if not file_record.file_path:
+                raise Exception(f"Путь к файлу не указан для {filename}")
+            
+            if not os.path.exists(file_record.file_path):
+                raise Exception(f"Файл не найден: {file_record.file_path}")
+            
+            # extract_text_with_pages возвращает либо текст, либо строку ошибки
+            # Проверяем, что это текст (не ошибка)
+            # Текст и число страниц за один проход; для анализа читаем PDF только до бюджета символов
+            text_result, pages_count = extract_text_with_pages(
+                file_record.file_path, filename, max_chars=Config.PDF_TEXT_CHAR_BUDGET
+            )
+            
+            # Если результат начинается с "❌" или "Ошибка", это ошибка
+            if isinstance(text_result, str) and (text_result.startswith("❌") or text_result.startswith("Ошибка") or text_result.startswith("Ошибка чтения")):
+                raise Exception(text_result)
+            
+            text = text_result
+            logger.info(f"📄 {filename}: {len(text)} символов, страниц: {pages_count}")
+            
+            if not text or len(text.strip()) < 50:
+                raise Exception("Не удалось извлечь текст или документ слишком короткий")
+            
+            # Получаем пользователя для проверки лимитов
+            user = app_instance.user_manager.get_user(user_id)
+            if not user:
+                raise Exception("Пользователь не найден")
+            user_plan = user.plan if hasattr(user, 'plan') else user.get('plan', 'free')
+            
+            # Списываем анализ заранее одним UPDATE в БД - атомарно для всех потоков и процессов
+            reservation = app_instance.user_manager.reserve_analysis(user_id)
+            if not reservation:
+                raise Exception("Достигнут дневной лимит анализов")
+            
+            # Выполняем анализ
+            analysis_result = analyze_text(
+                text=text,
+                user_plan=user_plan,
+                is_authenticated=True,
+                user_id=user_id,
+                analysis_settings=analysis_settings
+            )
+            
+            # Записываем использование
+            app_instance.user_manager.commit_analysis(reservation)
+            reservation = None
+            
+            # Сохраняем в историю
+            history = AnalysisHistory(
+                user_id=user_id,
+                filename=filename,
+                document_type=analysis_result.get('document_type'),
+                document_type_name=analysis_result.get('document_type_name'),
+                risk_level=analysis_result.get('risk_level'),
+                created_at=datetime.now().isoformat(),
+                analysis_summary=analysis_result.get('summary', '')[:500]
+            )
+            db.session.add(history)
+            db.session.flush()
+            
+            # Генерируем полный отчет (PDF) для документа
+            report_path = None
+            try:
+                from services.pdf_render_service import render_analysis_pdf
+                
+                # Получаем настройки брендинга
+                branding_settings = None
+                try:
+                    from models.sqlite_users import BrandingSettings
+                    branding_obj = BrandingSettings.query.filter_by(user_id=user_id).first()
+                    if branding_obj and branding_obj.is_active:
+                        branding_settings = {
+                            'is_active': True,
+                            'logo_path': branding_obj.logo_path,
+                            'primary_color': branding_obj.primary_color,
+                            'secondary_color': branding_obj.secondary_color,
+                            'company_name': branding_obj.company_name
+                        }
                 except Exception as e:
-                    logger.error(f"❌ Критическая ошибка обработки пакетной задачи {task_id}: {e}")
-                    try:
-                        task = BatchProcessingTask.query.get(task_id)
-                        if task:
-                            task.status = 'failed'
-                            task.error_message = str(e)
-                            task.completed_at = datetime.now().isoformat()
-                            db.session.commit()
-                    except Exception as db_error:
-                        logger.error(f"❌ Ошибка сохранения статуса ошибки: {db_error}")
-        
-        # Запускаем обработку в отдельном потоке
-        thread = threading.Thread(target=process_task)
-        thread.daemon = True
-        thread.start()
+                    logger.warning(f"⚠️ Не удалось загрузить настройки брендинга: {e}")
+                
+                reports_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'reports', 'batch', f'task_{task_id}')
+                os.makedirs(reports_dir, exist_ok=True)
+                
+                safe_filename = "".join(c for c in filename if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
+                report_filename = f"{safe_filename}_report.pdf"
+                report_path_full = os.path.join(reports_dir, report_filename)
+                
+                # Рендер в пуле процессов, чтобы не держать GIL потоков пакетной обработки
+                pdf_content = render_analysis_pdf(
+                    analysis_result,  # analysis_data
+                    filename,  # filename
+                    branding_settings  # branding_settings
+                )
+                
+                with open(report_path_full, 'wb') as f:
+                    f.write(pdf_content)
+                
+                report_path = f'static/reports/batch/task_{task_id}/{report_filename}'
+                logger.info(f"✅ Полный отчет создан: {report_path}")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось создать полный отчет для {filename}: {e}")
+            
+            # Обновляем запись файла
+            file_record.status = 'completed'
+            file_record.analysis_result_json = json.dumps(analysis_result, ensure_ascii=False)
+            file_record.analysis_history_id = history.id
+            file_record.full_report_path = report_path
+            file_record.processed_at = datetime.now().isoformat()
+            db.session.commit()
+            
+            # Прогресс задачи увеличиваем атомарным UPDATE - потоки не затирают счетчики друг друга
+            BatchProcessor._increment_task_counter(task_id, BatchProcessingTask.processed_files)
+            
+            logger.info(f"✅ Файл {filename} обработан успешно")
+            return {
+                'filename': filename,
+                'status': 'completed',
+                'analysis': analysis_result
+            }
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки файла {filename}: {e}")
+            if reservation:
+                try:
+                    app_instance.user_manager.refund_analysis(reservation)
+                except Exception as refund_error:
+                    db.session.rollback()
+                    logger.error(f"❌ Не удалось вернуть анализ пользователю {user_id}: {refund_error}")
+            try:
+                db.session.rollback()
+                file_record = BatchProcessingFile.query.get(file_id)
+                file_record.status = 'failed'
+                file_record.error_message = str(e)
+                file_record.processed_at = datetime.now().isoformat()
+                db.session.commit()
+                BatchProcessor._increment_task_counter(task_id, BatchProcessingTask.failed_files)
+            except Exception as db_error:
+                db.session.rollback()
+                logger.error(f"❌ Ошибка сохранения статуса файла {filename}: {db_error}")
+            
+            return {
+                'filename': filename,
+                'status': 'failed',
+                'error': str(e)
+            }
+    
+    @staticmethod
+    def _increment_task_counter(task_id, column):
+        """Атомарно увеличивает счетчик прогресса задачи"""
+        BatchProcessingTask.query.filter_by(id=task_id).update(
+            {column: func.coalesce(column, 0) + 1},
+            synchronize_session=False
+        )
+        db.session.commit()
     
     @staticmethod
     def generate_summary_report(task_id, results):
@@ -1,5 +1,15 @@
-"""Утилита для определения и блокировки ботов"""
+"""Утилита для определения и блокировки ботов
+
+Все списки паттернов собраны в один скомпилированный матчер: User-Agent
+просматривается одним проходом регулярного выражения, а полный вердикт
+(вредоносный бот / поисковый бот / WordPress-сканер) кешируется по строке
+User-Agent (LRU). После изменения списков вызовите reload_patterns().
+"""
+import re
 import logging
+import threading
+from functools import lru_cache
+from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +76,256 @@ SEARCH_BOTS = {
     'VKRobotRB': 'VK Robot'
 }
 
+# Подозрительные паттерны (URL-подобные строки) - бот, если это не браузер
+SUSPICIOUS_UA_PATTERNS = [
+    '.com/scan',
+    '.ru/',
+    'http://',
+    'https://',
+    'visionheight.com',
+    'compatible;',
+    'Hello from'
+]
+
+# Характерные признаки ботов (учитываются, только если это не обычный браузер)
+BOT_INDICATORS = [
+    'bot', 'crawler', 'spider', 'scraper', 'fetcher', 'indexer',
+    'preview', 'proxy', 'lighthouse', 'headless', 'phantom',
+    'selenium', 'webdriver', 'puppeteer', 'playwright', 'scanner'
+]
+
+# Признаки браузера для подозрительных паттернов и для индикаторов ботов
+BROWSER_MARKERS_STRICT = ['mozilla/5.0', 'webkit', 'chrome', 'safari', 'firefox']
+BROWSER_MARKERS = ['mozilla', 'chrome', 'safari', 'firefox', 'edge', 'opera', 'webkit']
+
+# Признаки WordPress-сканера в User-Agent
+WORDPRESS_UA_INDICATORS = [
+    'wordpress',
+    'wp-admin',
+    'wp-login',
+    'wp-config',
+    'wp-content'
+]
+
+# Пути, которые ищут WordPress-сканеры
+WORDPRESS_PATHS = [
+    '/wp-admin',
+    '/wp-login',
+    '/wp-content',
+    '/wp-includes',
+    '/wordpress',
+    '/wp-config',
+    '/xmlrpc.php',
+    '/wp-json',
+    '/wp-cron',
+    '/wp-mail.php',
+    '/wp-load.php',
+    '/wp-signup.php',
+    '/wp-trackback.php',
+    '/wp-comments-post.php'
+]
+
+# Размер LRU-кеша вердиктов по строке User-Agent
+VERDICT_CACHE_SIZE = 4096
+
+_SUSPICIOUS_TOKENS = frozenset(pattern.lower() for pattern in SUSPICIOUS_UA_PATTERNS)
+_BOT_INDICATOR_TOKENS = frozenset(BOT_INDICATORS)
+_BROWSER_STRICT_TOKENS = frozenset(BROWSER_MARKERS_STRICT)
+_BROWSER_TOKENS = frozenset(BROWSER_MARKERS)
+_WORDPRESS_UA_TOKENS = frozenset(WORDPRESS_UA_INDICATORS)
+
+# Вердикт по User-Agent:
+# malicious_reason - None, 'empty', 'short' или имя из MALICIOUS_BOTS;
+# search_bot - ключ SEARCH_BOTS, 'Python Bot', 'Unknown Bot' или None
+UAVerdict = namedtuple('UAVerdict', ['malicious', 'malicious_reason', 'search_bot', 'search_bot_type', 'wordpress_ua'])
+
+
+def _trie_pattern(node):
+    """Регулярное выражение по префиксному дереву: общие префиксы проверяются один раз"""
+    branches = []
+    for char in sorted(node):
+        if char == '':
+            continue
+        branches.append(re.escape(char) + _trie_pattern(node[char]))
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # Конец токена в этом узле: продолжение необязательно, жадный ? дает самый длинный токен
+    if '' in node:
+        return '(?:' + body + ')?'
+    return body
+
+
+def _token_regex(tokens):
+    """Регулярное выражение, находящее самый длинный токен, начинающийся левее всех"""
+    trie = {}
+    for token in tokens:
+        node = trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return re.compile(_trie_pattern(trie))
+
+
+class UserAgentMatcher:
+    """Скомпилированный матчер всех списков паттернов
+
+    Все токены собраны в одно регулярное выражение по префиксному дереву,
+    совпадение - самый длинный токен в позиции. Токены внутри найденного
+    учитываются через заранее посчитанные "подстроки" токена, а поиск
+    продолжается с конца совпадения. Только если хвост токена может быть
+    началом другого токена, поиск продолжается со следующего символа.
+    Приоритеты списков (первое совпадение в порядке списка) сохраняются.
+    """
+
+    def __init__(self, malicious_bots, search_bots, wordpress_paths, cache_size=VERDICT_CACHE_SIZE):
+        self.malicious_bots = [(name, name.lower()) for name in malicious_bots]
+        self.search_bots = [(name, name.lower(), bot_type) for name, bot_type in search_bots.items()]
+        tokens = (
+            [token for _, token in self.malicious_bots] +
+            [token for _, token, _ in self.search_bots] +
+            [pattern.lower() for pattern in SUSPICIOUS_UA_PATTERNS] +
+            BOT_INDICATORS + BROWSER_MARKERS_STRICT + BROWSER_MARKERS +
+            WORDPRESS_UA_INDICATORS + ['python', 'aiohttp']
+        )
+        unique = {token for token in tokens if token}
+        self._regex = _token_regex(unique)
+        # Для каждого токена - все токены, которые в нем содержатся (включая его самого)
+        self._contained = {token: frozenset(other for other in unique if other in token) for token in unique}
+        # Токены, чей хвост может начинать другой токен, выходящий за их конец
+        self._overlapping = frozenset(
+            token for token in unique
+            if any(token[-size:] == other[:size] for other in unique
+                   for size in range(1, min(len(token), len(other))) if other not in token)
+        )
+        # Приоритет совпадений - порядок в списках
+        self._malicious_rank = {}
+        for index, (name, token) in enumerate(self.malicious_bots):
+            self._malicious_rank.setdefault(token, (index, name))
+        self._search_rank = {}
+        for index, (name, token, bot_type) in enumerate(self.search_bots):
+            self._search_rank.setdefault(token, (index, name, bot_type))
+        self._malicious_tokens = frozenset(self._malicious_rank)
+        self._search_tokens = frozenset(self._search_rank)
+        self._path_regex = re.compile('|'.join(re.escape(path.lower()) for path in wordpress_paths)) if wordpress_paths else None
+        self.classify = lru_cache(maxsize=cache_size)(self._classify)
+
+    def tokens_in(self, text_lower):
+        """Множество всех токенов, входящих в строку (строка уже в нижнем регистре)"""
+        matched = set()
+        search = self._regex.search
+        match = search(text_lower)
+        while match:
+            token = match.group()
+            matched.add(token)
+            position = match.start() + 1 if token in self._overlapping else match.end()
+            match = search(text_lower, position)
+        contained = self._contained
+        return frozenset().union(*[contained[token] for token in matched])
+
+    def _classify(self, user_agent):
+        if not user_agent or user_agent == 'Не определен' or user_agent == '-' or user_agent.strip() == '':
+            malicious_reason = 'empty'
+        elif len(user_agent.strip()) < 5:
+            malicious_reason = 'short'
+        else:
+            malicious_reason = None
+
+        if not user_agent:
+            return UAVerdict(True, malicious_reason, None, None, False)
+
+        user_agent_lower = user_agent.lower()
+        found = self.tokens_in(user_agent_lower)
+
+        if malicious_reason is None:
+            hits = found & self._malicious_tokens
+            if hits:
+                malicious_reason = min(self._malicious_rank[token] for token in hits)[1]
+
+        wordpress_ua = not found.isdisjoint(_WORDPRESS_UA_TOKENS)
+        search_bot, search_bot_type = self._search_bot(user_agent, found)
+        return UAVerdict(malicious_reason is not None, malicious_reason, search_bot, search_bot_type, wordpress_ua)
+
+    def _search_bot(self, user_agent, found):
+        if user_agent == 'Не определен':
+            return None, None
+
+        hits = found & self._search_tokens
+        if hits:
+            _, name, bot_type = min(self._search_rank[token] for token in hits)
+            return name, bot_type
+
+        # Python-боты (aiohttp, но не httpx и requests - они блокируются как вредоносные)
+        if 'python' in found and 'aiohttp' in found:
+            return 'Python Bot', 'Python Bot'
+
+        if not found.isdisjoint(_SUSPICIOUS_TOKENS):
+            if found.isdisjoint(_BROWSER_STRICT_TOKENS):
+                return 'Unknown Bot', 'Unknown Bot'
+
+        if user_agent in ['-', ''] or len(user_agent.strip()) < 5:
+            if 'mozilla' not in found and 'webkit' not in found:
+                return 'Unknown Bot', 'Unknown Bot'
+
+        if not found.isdisjoint(_BOT_INDICATOR_TOKENS) and found.isdisjoint(_BROWSER_TOKENS):
+            return 'Unknown Bot', 'Unknown Bot'
+
+        return None, None
+
+    def is_wordpress_path(self, request_path):
+        return bool(self._path_regex and self._path_regex.search(request_path.lower()))
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """Текущий скомпилированный матчер (строится при первом обращении)"""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = UserAgentMatcher(MALICIOUS_BOTS, SEARCH_BOTS, WORDPRESS_PATHS)
+    return _matcher
+
+
+def reload_patterns(malicious_bots=None, search_bots=None, wordpress_paths=None):
+    """Заменяет списки паттернов и пересобирает матчер (кеш вердиктов сбрасывается)
+
+    Переданные списки заменяют соответствующие модульные; None - оставить как есть.
+    """
+    global _matcher, MALICIOUS_BOTS, SEARCH_BOTS, WORDPRESS_PATHS
+    with _matcher_lock:
+        if malicious_bots is not None:
+            MALICIOUS_BOTS = list(malicious_bots)
+        if search_bots is not None:
+            SEARCH_BOTS = dict(search_bots)
+        if wordpress_paths is not None:
+            WORDPRESS_PATHS = list(wordpress_paths)
+        # Новый матчер собирается целиком и подменяется одной операцией
+        _matcher = UserAgentMatcher(MALICIOUS_BOTS, SEARCH_BOTS, WORDPRESS_PATHS)
+    logger.info(f"🔄 Паттерны ботов перезагружены: {len(MALICIOUS_BOTS)} вредоносных, {len(SEARCH_BOTS)} поисковых, {len(WORDPRESS_PATHS)} путей WordPress")
+    return _matcher
+
+
+def classify_user_agent(user_agent):
+    """Полный вердикт по User-Agent (из LRU-кеша)"""
+    return get_matcher().classify(user_agent)
+
+
+def get_verdict_cache_stats():
+    """Статистика кеша вердиктов"""
+    info = get_matcher().classify.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'entries': info.currsize,
+        'max_entries': info.maxsize,
+        'hit_rate': round(info.hits / lookups * 100, 1) if lookups else 0
+    }
+
 def is_malicious_bot(user_agent):
     """
     Проверяет является ли запрос от вредоносного бота
@@ -76,25 +336,15 @@ def is_malicious_bot(user_agent):
     Returns:
         bool: True если это вредоносный бот, False если нет
     """
-    # Проверяем пустой или подозрительный User-Agent
-    if not user_agent or user_agent == 'Не определен' or user_agent == '-' or user_agent.strip() == '':
+    verdict = classify_user_agent(user_agent)
+    if verdict.malicious_reason == 'empty':
         # Пустой User-Agent часто указывает на бота или скрипт
         logger.warning(f"🚫 Обнаружен запрос с пустым/подозрительным User-Agent: '{user_agent}'")
-        return True
-    
-    # Проверяем очень короткие User-Agent (менее 5 символов) - подозрительно
-    if len(user_agent.strip()) < 5:
+    elif verdict.malicious_reason == 'short':
         logger.warning(f"🚫 Обнаружен запрос с очень коротким User-Agent: '{user_agent}'")
-        return True
-    
-    user_agent_lower = user_agent.lower()
-    
-    for bot_name in MALICIOUS_BOTS:
-        if bot_name.lower() in user_agent_lower:
-            logger.warning(f"🚫 Обнаружен вредоносный бот: {bot_name} (User-Agent: {user_agent[:50]}...)")
-            return True
-    
-    return False
+    elif verdict.malicious:
+        logger.warning(f"🚫 Обнаружен вредоносный бот: {verdict.malicious_reason} (User-Agent: {user_agent[:50]}...)")
+    return verdict.malicious
 
 def is_search_bot(user_agent):
     """
@@ -106,68 +356,18 @@ def is_search_bot(user_agent):
     Returns:
         tuple: (is_bot: bool, bot_type: str) - является ли ботом и тип бота
     """
-    if not user_agent or user_agent == 'Не определен':
+    if not user_agent:
         return False, None
     
-    user_agent_lower = user_agent.lower()
-    
-    # Проверяем по точным совпадениям из списка
-    for bot_name, bot_type in SEARCH_BOTS.items():
-        if bot_name.lower() in user_agent_lower:
-            logger.info(f"🕷️ Обнаружен поисковый бот: {bot_type} ({bot_name})")
-            return True, bot_name
-    
-    # Проверяем Python-боты (aiohttp, но не httpx и requests - они теперь блокируются)
-    if 'python' in user_agent_lower and 'aiohttp' in user_agent_lower:
-        logger.info(f"🕷️ Обнаружен Python-бот: {user_agent[:50]}...")
-        return True, 'Python Bot'
-    
-    # Go-клиенты теперь блокируются как вредоносные, поэтому не проверяем здесь
-    
-    # Проверяем подозрительные паттерны в User-Agent (URL-подобные строки)
-    suspicious_patterns = [
-        '.com/scan',
-        '.ru/',
-        'http://',
-        'https://',
-        'visionheight.com',
-        'compatible;',
-        'Hello from'
-    ]
-    for pattern in suspicious_patterns:
-        if pattern.lower() in user_agent_lower:
-            # Но исключаем если это реальный браузер с нормальным UA
-            if not any(browser in user_agent_lower for browser in ['mozilla/5.0', 'webkit', 'chrome', 'safari', 'firefox']):
-                logger.info(f"🕷️ Обнаружен бот с подозрительным паттерном: {user_agent[:50]}...")
-                return True, 'Unknown Bot'
-    
-    # Проверяем пустые или подозрительные User-Agent
-    if user_agent in ['-', 'Не определен', ''] or len(user_agent.strip()) < 5:
-        # Но исключаем если это может быть реальный браузер с коротким UA
-        if 'mozilla' not in user_agent_lower and 'webkit' not in user_agent_lower:
-            logger.info(f"🕷️ Обнаружен бот с пустым/подозрительным User-Agent: {user_agent}")
-            return True, 'Unknown Bot'
-    
-    # Дополнительные проверки по характерным признакам ботов
-    bot_indicators = [
-        'bot', 'crawler', 'spider', 'scraper', 'fetcher', 'indexer',
-        'preview', 'proxy', 'lighthouse', 'headless', 'phantom',
-        'selenium', 'webdriver', 'puppeteer', 'playwright', 'scanner'
-    ]
-    
-    # Проверяем наличие индикаторов ботов (но исключаем обычные браузеры)
-    has_bot_indicator = any(indicator in user_agent_lower for indicator in bot_indicators)
-    
-    # Исключаем обычные браузеры, которые могут содержать слово "bot" в других контекстах
-    browser_indicators = ['mozilla', 'chrome', 'safari', 'firefox', 'edge', 'opera', 'webkit']
-    is_browser = any(browser in user_agent_lower for browser in browser_indicators)
-    
-    # Если есть индикатор бота, но это не обычный браузер - считаем ботом
-    if has_bot_indicator and not is_browser:
-        logger.info(f"🕷️ Обнаружен бот по индикаторам: {user_agent[:50]}...")
-        return True, 'Unknown Bot'
+    verdict = classify_user_agent(user_agent)
+    if verdict.search_bot is None:
+        return False, None
     
-    return False, None
+    if verdict.search_bot in SEARCH_BOTS:
+        logger.info(f"🕷️ Обнаружен поисковый бот: {verdict.search_bot_type} ({verdict.search_bot})")
+    else:
+        logger.info(f"🕷️ Обнаружен бот ({verdict.search_bot}): {user_agent[:50]}...")
+    return True, verdict.search_bot
 
 def get_bot_type(user_agent):
     """
@@ -179,10 +379,9 @@ def get_bot_type(user_agent):
     Returns:
         str: Тип бота или None если это не бот
     """
-    is_bot, bot_type = is_search_bot(user_agent)
-    if is_bot:
-        return SEARCH_BOTS.get(bot_type, bot_type)
-    return None
+    if not user_agent:
+        return None
+    return classify_user_agent(user_agent).search_bot_type
 
 def is_wordpress_scanner(request_path=None, user_agent=None):
     """
@@ -196,48 +395,14 @@ def is_wordpress_scanner(request_path=None, user_agent=None):
         bool: True если это WordPress-сканер, False если нет
     """
     # Проверяем User-Agent на наличие WordPress-сканеров
-    if user_agent:
-        user_agent_lower = user_agent.lower()
-        wordpress_ua_indicators = [
-            'wordpress',
-            'wp-admin',
-            'wp-login',
-            'wp-config',
-            'wp-content'
-        ]
-        for indicator in wordpress_ua_indicators:
-            if indicator in user_agent_lower:
-                logger.warning(f"🔍 Обнаружен WordPress-сканер по User-Agent: {user_agent[:50]}...")
-                return True
+    if user_agent and classify_user_agent(user_agent).wordpress_ua:
+        logger.warning(f"🔍 Обнаружен WordPress-сканер по User-Agent: {user_agent[:50]}...")
+        return True
     
     # Проверяем путь запроса
-    if not request_path:
-        return False
-    
-    # Список путей, которые ищут WordPress-сканеры
-    wordpress_paths = [
-        '/wp-admin',
-        '/wp-login',
-        '/wp-content',
-        '/wp-includes',
-        '/wordpress',
-        '/wp-config',
-        '/xmlrpc.php',
-        '/wp-json',
-        '/wp-cron',
-        '/wp-mail.php',
-        '/wp-load.php',
-        '/wp-signup.php',
-        '/wp-trackback.php',
-        '/wp-comments-post.php'
-    ]
-    
-    request_path_lower = request_path.lower()
-    
-    for wp_path in wordpress_paths:
-        if wp_path in request_path_lower:
-            logger.warning(f"🔍 Обнаружен WordPress-сканер по пути: {request_path}")
-            return True
+    if request_path and get_matcher().is_wordpress_path(request_path):
+        logger.warning(f"🔍 Обнаружен WordPress-сканер по пути: {request_path}")
+        return True
     
     return False
 
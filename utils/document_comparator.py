@@ -7,12 +7,14 @@
 import os
 import json
 import logging
-import difflib
+import html
 from datetime import datetime
 from models.sqlite_users import db, DocumentComparison
 from services.file_processing import extract_text_from_file
 from config import Config
-import requests
+from services.text_diff import compare_texts
+from services.comparison_review import review_changes
+from utils.job_queue import is_transient_error
 
 logger = logging.getLogger(__name__)
 
@@ -41,15 +43,39 @@ class DocumentComparator:
             logger.error(f"❌ Ошибка создания сравнения: {e}")
             return None, str(e)
     
+    @staticmethod
+    def compare_documents_async(comparison_id, user_id):
+        """Поставить сравнение в персистентную очередь фоновых задач"""
+        from utils.job_queue import JobQueue
+        return JobQueue.enqueue(
+            'document_comparison',
+            {'comparison_id': comparison_id, 'user_id': user_id},
+            dedupe_key=f'document_comparison:{comparison_id}'
+        )
+    
+    @staticmethod
+    def _set_progress(comparison, stage, progress):
+        """Этап и процент выполнения - видны в cabinet, пока статус 'processing'"""
+        comparison.stage = stage
+        comparison.progress = progress
+        db.session.commit()
+    
     @staticmethod
     def compare_documents(comparison_id, user_id, app_instance):
-        """Сравнить два документа"""
+        """Сравнить два документа
+
+        Временные ошибки (БД занята, сеть) пробрасываются - очередь повторит
+        сравнение; остальные помечают сравнение failed и возвращаются как (None, error).
+        """
+        comparison = None
         try:
             comparison = DocumentComparison.query.get(comparison_id)
             if not comparison:
                 return None, "Сравнение не найдено"
             
             comparison.status = 'processing'
+            comparison.stage = 'extracting'
+            comparison.progress = 0
             db.session.commit()
             
             logger.info(f"🔍 Начало сравнения документов {comparison_id}")
@@ -64,71 +90,18 @@ class DocumentComparator:
             if not modified_text or len(modified_text.strip()) < 10:
                 raise Exception("Не удалось извлечь текст из измененного документа")
             
-            # Нормализуем текст для сравнения
-            original_lines = [line.strip() for line in original_text.split('\n') if line.strip()]
-            modified_lines = [line.strip() for line in modified_text.split('\n') if line.strip()]
-            
-            # Используем difflib для сравнения
-            differ = difflib.Differ()
-            diff = list(differ.compare(original_lines, modified_lines))
-            
-            # Анализируем различия
-            changes = {
-                'added': [],
-                'removed': [],
-                'modified': [],
-                'unchanged': []
-            }
-            
-            current_change = None
-            for line in diff:
-                if line.startswith('+ '):
-                    text = line[2:]
-                    if text.strip():
-                        changes['added'].append(text)
-                        if current_change and current_change['type'] == 'removed':
-                            changes['modified'].append({
-                                'original': current_change['text'],
-                                'modified': text
-                            })
-                            current_change = None
-                        else:
-                            current_change = {'type': 'added', 'text': text}
-                elif line.startswith('- '):
-                    text = line[2:]
-                    if text.strip():
-                        changes['removed'].append(text)
-                        current_change = {'type': 'removed', 'text': text}
-                elif line.startswith('  '):
-                    text = line[2:]
-                    if text.strip():
-                        changes['unchanged'].append(text)
-                    current_change = None
+            # Сравниваем по пунктам (patience/Myers diff с бюджетом времени)
+            DocumentComparator._set_progress(comparison, 'diffing', 10)
+            diff_result = compare_texts(original_text, modified_text, time_budget=Config.COMPARISON_DIFF_TIME_BUDGET)
+            changes = diff_result['changes']
+            diff = diff_result['diff']
+            if diff_result['budget_exceeded']:
+                logger.warning(f"⚠️ Сравнение {comparison_id}: превышен бюджет времени diff, часть участков показана заменой целиком")
             
             # Подсчитываем статистику
             total_changes = len(changes['added']) + len(changes['removed']) + len(changes['modified'])
             
-            # Формируем текст для анализа AI
-            changes_summary = []
-            if changes['added']:
-                changes_summary.append(f"Добавлено {len(changes['added'])} фрагментов:")
-                for i, change in enumerate(changes['added'][:5], 1):
-                    changes_summary.append(f"{i}. {change[:200]}")
-            
-            if changes['removed']:
-                changes_summary.append(f"\nУдалено {len(changes['removed'])} фрагментов:")
-                for i, change in enumerate(changes['removed'][:5], 1):
-                    changes_summary.append(f"{i}. {change[:200]}")
-            
-            if changes['modified']:
-                changes_summary.append(f"\nИзменено {len(changes['modified'])} фрагментов:")
-                for i, change in enumerate(changes['modified'][:3], 1):
-                    changes_summary.append(f"{i}. Было: {change['original'][:150]}")
-                    changes_summary.append(f"   Стало: {change['modified'][:150]}")
-            
-            changes_text = '\n'.join(changes_summary)
-            
-            # Анализируем изменения через AI
+            # Оцениваем риски всех изменений: части по пунктам параллельно
             risk_analysis = None
             try:
                 if not Config.YANDEX_API_KEY or not Config.YANDEX_FOLDER_ID:
@@ -136,85 +109,12 @@ class DocumentComparator:
                 elif total_changes == 0:
                     logger.info(f"ℹ️ Изменений не обнаружено, анализ AI не требуется")
                 else:
-                    logger.info(f"🤖 Отправка запроса к YandexGPT для анализа {total_changes} изменений")
-                if Config.YANDEX_API_KEY and Config.YANDEX_FOLDER_ID and total_changes > 0:
-                    system_prompt = """Ты эксперт по анализу изменений в юридических документах. Проанализируй изменения между двумя версиями документа и оцени риски.
-
-Для каждого изменения определи:
-1. Тип изменения (условия оплаты, сроки, ответственность, права сторон, условия расторжения и т.д.)
-2. Уровень риска (CRITICAL, HIGH, MEDIUM, LOW, INFO)
-3. Влияние на права и обязанности сторон
-4. Рекомендации
+                    DocumentComparator._set_progress(comparison, 'reviewing', 20)
 
-Верни результат ТОЛЬКО в формате JSON без дополнительного текста с полями:
-- summary: краткое резюме изменений
-- overall_risk: общий уровень риска изменений (CRITICAL, HIGH, MEDIUM, LOW, INFO)
-- key_warnings: массив ключевых предупреждений
-- changes_analysis: массив объектов с полями:
-  - type: тип изменения
-  - risk_level: уровень риска
-  - description: описание изменения
-  - impact: влияние на стороны
-  - recommendation: рекомендация"""
-                    
-                    user_prompt = f"""ОРИГИНАЛЬНЫЙ ДОКУМЕНТ (первые 2000 символов):
-{original_text[:2000]}
+                    def on_progress(done, total):
+                        DocumentComparator._set_progress(comparison, 'reviewing', 20 + 70 * done // total)
 
-ИЗМЕНЕННЫЙ ДОКУМЕНТ (первые 2000 символов):
-{modified_text[:2000]}
-
-ВЫЯВЛЕННЫЕ ИЗМЕНЕНИЯ:
-{changes_text}
-
-Проанализируй эти изменения и верни JSON с анализом рисков."""
-                    
-                    data = {
-                        "modelUri": f"gpt://{Config.YANDEX_FOLDER_ID}/yandexgpt/latest",
-                        "completionOptions": {
-                            "stream": False,
-                            "temperature": 0.3,
-                            "maxTokens": 2000
-                        },
-                        "messages": [
-                            {"role": "system", "text": system_prompt},
-                            {"role": "user", "text": user_prompt}
-                        ]
-                    }
-                    
-                    headers = {
-                        "Authorization": f"Api-Key {Config.YANDEX_API_KEY}",
-                        "Content-Type": "application/json"
-                    }
-                    
-                    resp = requests.post(
-                        "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-                        headers=headers,
-                        json=data,
-                        timeout=30
-                    )
-                    
-                    if resp.status_code == 200:
-                        result = resp.json()
-                        response_text = result['result']['alternatives'][0]['message']['text'].strip()
-                        logger.info(f"✅ Получен ответ от YandexGPT для сравнения {comparison_id}")
-                        
-                        # Парсим JSON из ответа
-                        import re
-                        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                        if json_match:
-                            risk_analysis = json.loads(json_match.group())
-                            logger.info(f"✅ Анализ рисков успешно распарсен для сравнения {comparison_id}")
-                        else:
-                            # Если не удалось распарсить JSON, создаем простой анализ
-                            logger.warning(f"⚠️ Не удалось распарсить JSON ответ от YandexGPT для сравнения {comparison_id}")
-                            risk_analysis = {
-                                'summary': 'Изменения проанализированы',
-                                'overall_risk': 'MEDIUM' if total_changes > 5 else 'LOW',
-                                'key_warnings': ['Рекомендуется внимательно изучить все изменения'],
-                                'changes_analysis': []
-                            }
-                    else:
-                        logger.warning(f"⚠️ Ошибка YandexGPT при анализе изменений: {resp.status_code} - {resp.text[:200]}")
+                    risk_analysis = review_changes(diff_result['hunks'], original_text, on_progress=on_progress)
             except Exception as e:
                 logger.warning(f"⚠️ Не удалось получить анализ рисков от AI: {e}")
             
@@ -228,13 +128,16 @@ class DocumentComparator:
                     'modified_count': len(changes['modified']),
                     'unchanged_count': len(changes['unchanged'])
                 },
-                'diff': diff[:1000]  # Ограничиваем размер
+                'diff': diff,  # Первые 1000 строк
+                'diff_elapsed_ms': diff_result['elapsed_ms'],
+                'diff_budget_exceeded': diff_result['budget_exceeded']
             }, ensure_ascii=False)
             
             if risk_analysis:
                 comparison.risk_analysis_json = json.dumps(risk_analysis, ensure_ascii=False)
             
             # Генерируем HTML отчет
+            DocumentComparator._set_progress(comparison, 'report', 95)
             report_path = DocumentComparator.generate_comparison_report(comparison_id, changes, risk_analysis, 
                                                                          comparison.original_filename, 
                                                                          comparison.modified_filename)
@@ -242,6 +145,8 @@ class DocumentComparator:
                 comparison.report_path = report_path
             
             comparison.status = 'completed'
+            comparison.stage = 'completed'
+            comparison.progress = 100
             comparison.completed_at = datetime.now().isoformat()
             db.session.commit()
             
@@ -249,6 +154,10 @@ class DocumentComparator:
             return comparison.to_dict(), None
             
         except Exception as e:
+            db.session.rollback()
+            if is_transient_error(e):
+                logger.warning(f"⚠️ Временная ошибка сравнения документов {comparison_id}, будет повтор: {e}")
+                raise
             logger.error(f"❌ Ошибка сравнения документов {comparison_id}: {e}")
             if comparison:
                 comparison.status = 'failed'
@@ -279,6 +188,8 @@ class DocumentComparator:
         .added {{ background-color: #d4edda; padding: 5px; margin: 5px 0; border-left: 4px solid #28a745; }}
         .removed {{ background-color: #f8d7da; padding: 5px; margin: 5px 0; border-left: 4px solid #dc3545; text-decoration: line-through; }}
         .modified {{ background-color: #fff3cd; padding: 5px; margin: 5px 0; border-left: 4px solid #ffc107; }}
+        .modified del {{ background-color: #f8d7da; }}
+        .modified ins {{ background-color: #d4edda; text-decoration: none; }}
         .statistics {{ background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 20px 0; }}
         .risk-high {{ color: #dc3545; font-weight: bold; }}
         .risk-medium {{ color: #ffc107; font-weight: bold; }}
@@ -307,10 +218,15 @@ class DocumentComparator:
 """
                 if isinstance(risk_analysis, dict):
                     if 'summary' in risk_analysis:
-                        html_content += f"<p><strong>Резюме:</strong> {risk_analysis['summary']}</p>"
+                        html_content += f"<p><strong>Резюме:</strong> {html.escape(str(risk_analysis['summary']))}</p>"
                     if 'overall_risk' in risk_analysis:
                         risk_class = 'risk-high' if risk_analysis['overall_risk'] in ['CRITICAL', 'HIGH'] else 'risk-medium' if risk_analysis['overall_risk'] == 'MEDIUM' else 'risk-low'
                         html_content += f"<p><strong>Общий уровень риска:</strong> <span class=\"{risk_class}\">{risk_analysis['overall_risk']}</span></p>"
+                    if risk_analysis.get('key_warnings'):
+                        html_content += "<ul>" + ''.join(f"<li>{html.escape(str(w))}</li>" for w in risk_analysis['key_warnings']) + "</ul>"
+                    coverage = risk_analysis.get('coverage')
+                    if coverage:
+                        html_content += f"<p>Оценено изменений: {coverage['reviewed_changes']} из {coverage['total_changes']}</p>"
             
             # Добавляем список изменений
             html_content += """
@@ -320,17 +236,25 @@ class DocumentComparator:
             if changes['added']:
                 html_content += "<h3>Добавленные фрагменты:</h3>"
                 for change in changes['added'][:20]:  # Ограничиваем для читаемости
-                    html_content += f'<div class="added">+ {change}</div>'
+                    html_content += f'<div class="added">+ {html.escape(change)}</div>'
             
             if changes['removed']:
                 html_content += "<h3>Удаленные фрагменты:</h3>"
                 for change in changes['removed'][:20]:
-                    html_content += f'<div class="removed">- {change}</div>'
+                    html_content += f'<div class="removed">- {html.escape(change)}</div>'
             
             if changes['modified']:
                 html_content += "<h3>Измененные фрагменты:</h3>"
                 for change in changes['modified'][:10]:
-                    html_content += f'<div class="modified"><strong>Было:</strong> {change.get("original", "")[:200]}<br><strong>Стало:</strong> {change.get("modified", "")[:200]}</div>'
+                    if change.get('words'):
+                        # Пословный diff: удаленные слова зачеркнуты, добавленные выделены
+                        parts = []
+                        for op, text in change['words']:
+                            text = html.escape(text)
+                            parts.append(f'<del>{text}</del>' if op == '-' else f'<ins>{text}</ins>' if op == '+' else text)
+                        html_content += f'<div class="modified">{"".join(parts)}</div>'
+                    else:
+                        html_content += f'<div class="modified"><strong>Было:</strong> {html.escape(change.get("original", "")[:200])}<br><strong>Стало:</strong> {html.escape(change.get("modified", "")[:200])}</div>'
             
             html_content += """
 </body>
@@ -1,5 +1,4 @@
 """Сервис для отправки email"""
-import smtplib
 import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -8,9 +7,26 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+def build_email_message(to_email, subject, html_content, text_content=None):
+    """Собирает письмо (HTML + необязательная текстовая версия)"""
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = Config.FROM_EMAIL
+    msg['To'] = to_email
+    
+    # Текстовая версия
+    if text_content:
+        part1 = MIMEText(text_content, 'plain', 'utf-8')
+        msg.attach(part1)
+    
+    # HTML версия
+    part2 = MIMEText(html_content, 'html', 'utf-8')
+    msg.attach(part2)
+    return msg
+
 def send_email(to_email, subject, html_content, text_content=None):
     """
-    Отправляет email через SMTP
+    Отправляет email через SMTP (пул транзакционных писем, отдельный от рассылок)
     
     Требует переменные окружения:
     - SMTP_HOST (например, smtp.gmail.com)
@@ -19,37 +35,19 @@ def send_email(to_email, subject, html_content, text_content=None):
     - SMTP_PASSWORD (пароль от email)
     - FROM_EMAIL (email отправителя для отображения)
     """
+    from services.smtp_delivery import get_transactional_email_engine, smtp_configured
+    
     try:
-        smtp_host = os.getenv('SMTP_HOST', 'smtp.gmail.com')
-        smtp_port = int(os.getenv('SMTP_PORT', '587'))
-        smtp_user = os.getenv('SMTP_USER')
-        smtp_password = os.getenv('SMTP_PASSWORD')
-        from_email = os.getenv('FROM_EMAIL', smtp_user or 'noreply@docscan-ai.ru')
-        
-        if not smtp_user or not smtp_password:
+        if not smtp_configured():
             logger.warning("⚠️ SMTP настройки не заданы. Email не будет отправлен.")
             logger.info(f"📧 Письмо НЕ отправлено (для отладки): {to_email}, тема: {subject}")
             return False
         
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = from_email
-        msg['To'] = to_email
-        
-        # Текстовая версия
-        if text_content:
-            part1 = MIMEText(text_content, 'plain', 'utf-8')
-            msg.attach(part1)
-        
-        # HTML версия
-        part2 = MIMEText(html_content, 'html', 'utf-8')
-        msg.attach(part2)
-        
-        # Отправка
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
+        msg = build_email_message(to_email, subject, html_content, text_content)
+        result = get_transactional_email_engine().send(msg)
+        if result.status != 'sent':
+            logger.error(f"❌ Ошибка отправки email ({result.status}): {result.error}")
+            return False
         
         logger.info(f"✅ Email отправлен: {to_email}, тема: {subject}")
         return True
@@ -223,98 +221,109 @@ def personalize_email_content(html_content, user_data):
     return personalized
 
 
-def send_campaign_email(campaign, recipient, user_manager):
+def build_campaign_message(campaign, recipient):
     """
-    Отправляет одно письмо из рассылки
+    Собирает персонализированное письмо рассылки
     
     Args:
-        campaign: объект EmailCampaign
+        campaign: объект EmailCampaign (или его снимок с subject/html_content/text_content)
         recipient: словарь с данными получателя (user_id, email, plan)
-        user_manager: экземпляр SQLiteUserManager для работы с БД
-    
-    Returns:
-        tuple: (success: bool, error_message: str or None)
     """
-    from datetime import datetime
     from config import PLANS
     
-    try:
-        # Персонализируем содержимое
-        user_data = {
-            'email': recipient['email'],
-            'user_id': recipient.get('user_id', ''),
-            'plan': recipient.get('plan', 'free'),
-            'plan_name': PLANS.get(recipient.get('plan', 'free'), {}).get('name', 'Бесплатный')
-        }
-        
-        html_content = personalize_email_content(campaign.html_content, user_data)
-        text_content = None
-        if campaign.text_content:
-            text_content = personalize_email_content(campaign.text_content, user_data)
-        
-        # Отправляем письмо
-        success = send_email(
-            to_email=recipient['email'],
-            subject=campaign.subject,
-            html_content=html_content,
-            text_content=text_content
-        )
-        
-        # Создаем запись об отправке
-        email_send = user_manager.create_email_send(
-            campaign_id=campaign.id,
-            user_id=recipient.get('user_id'),
-            email=recipient['email'],
-            status='sent' if success else 'failed'
-        )
-        
-        if not success:
-            # Обновляем статус с ошибкой
-            user_manager.update_email_send_status(
-                email_send_id=email_send.id,
-                status='failed',
-                error_message='Ошибка отправки email'
-            )
-            return False, 'Ошибка отправки email'
-        
-        return True, None
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправки письма из рассылки {campaign.id} получателю {recipient.get('email')}: {e}")
-        # Создаем запись об ошибке
+    user_data = {
+        'email': recipient['email'],
+        'user_id': recipient.get('user_id', ''),
+        'plan': recipient.get('plan', 'free'),
+        'plan_name': PLANS.get(recipient.get('plan', 'free'), {}).get('name', 'Бесплатный')
+    }
+    
+    html_content = personalize_email_content(campaign.html_content, user_data)
+    text_content = None
+    if campaign.text_content:
+        text_content = personalize_email_content(campaign.text_content, user_data)
+    
+    return build_email_message(recipient['email'], campaign.subject, html_content, text_content)
+
+
+def _campaign_recipient_chunks(campaign, user_manager, chunk_size):
+    """Получатели рассылки пачками (ручной список или фильтр)"""
+    if campaign.recipient_filter == 'manual':
+        import json as _json
+        raw = campaign.recipient_list or "[]"
         try:
-            email_send = user_manager.create_email_send(
-                campaign_id=campaign.id,
-                user_id=recipient.get('user_id'),
-                email=recipient.get('email', 'unknown'),
-                status='failed'
-            )
-            user_manager.update_email_send_status(
-                email_send_id=email_send.id,
-                status='failed',
-                error_message=str(e)
-            )
-        except:
-            pass
-        
-        return False, str(e)
+            selected = _json.loads(raw)
+        except Exception:
+            selected = []
+        # selected может быть списком строк email или списком объектов
+        recipients = []
+        for item in selected if isinstance(selected, list) else []:
+            if isinstance(item, str):
+                recipients.append({'user_id': None, 'email': item})
+            elif isinstance(item, dict) and item.get('email'):
+                recipients.append({'user_id': item.get('user_id'), 'email': item.get('email')})
+        for i in range(0, len(recipients), chunk_size):
+            yield recipients[i:i + chunk_size]
+    else:
+        yield from user_manager.iter_recipients_for_campaign(campaign.recipient_filter, chunk_size)
+
 
+def _claim_pending_sends(campaign_id, chunk, session):
+    """
+    Заводит pending-записи email_sends для пачки получателей и возвращает
+    тех, кому еще нужно отправить
+    
+    INSERT ... ON CONFLICT DO NOTHING по уникальному (campaign_id, email):
+    адреса, обработанные прошлым запуском, остаются со своим статусом и
+    отсеиваются выборкой по status = 'pending'. Pending-записи прерванного
+    запуска отправляются повторно.
+    """
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from models.sqlite_users import EmailSend
+    
+    by_email = {}
+    for recipient in chunk:
+        by_email.setdefault(recipient['email'], recipient)
+    
+    session.execute(
+        sqlite_insert(EmailSend.__table__).on_conflict_do_nothing(index_elements=['campaign_id', 'email']),
+        [{'campaign_id': campaign_id, 'user_id': r.get('user_id'), 'email': email, 'status': 'pending'}
+         for email, r in by_email.items()]
+    )
+    rows = session.query(EmailSend.id, EmailSend.email).filter(
+        EmailSend.campaign_id == campaign_id,
+        EmailSend.email.in_(list(by_email)),
+        EmailSend.status == 'pending'
+    ).all()
+    session.commit()
+    return [dict(by_email[row.email], send_id=row.id) for row in rows]
 
-def send_email_campaign(campaign_id, user_manager, batch_size=10, delay_between_batches=1):
+
+def send_email_campaign(campaign_id, user_manager, engine=None, checkpoint_size=None, chunk_size=None):
     """
     Отправляет email-рассылку получателям
     
+    Конвейер по пачкам: получатели читаются keyset-пагинацией, на пачку -
+    одна транзакция с pending-записями email_sends; письма уходят параллельно
+    через пул SMTP-соединений (services.smtp_delivery), а статусы пишутся
+    пакетными UPDATE по checkpoint_size результатов. Повторный запуск
+    продолжает с необработанных адресов.
+    
     Args:
         campaign_id: ID рассылки
         user_manager: экземпляр SQLiteUserManager
-        batch_size: размер батча для отправки (по умолчанию 10 писем за раз)
-        delay_between_batches: задержка между батчами в секундах
+        engine: EmailDeliveryEngine (по умолчанию - общий, из настроек SMTP)
+        checkpoint_size: результатов на одну запись в БД (по умолчанию EMAIL_CHECKPOINT_SIZE)
+        chunk_size: получателей в пачке (по умолчанию EMAIL_RECIPIENT_CHUNK_SIZE)
     
     Returns:
         dict: статистика отправки
     """
-    import time
     from datetime import datetime
+    from types import SimpleNamespace
+    from sqlalchemy import bindparam
+    from models.sqlite_users import EmailSend
+    from services.smtp_delivery import get_email_engine, smtp_configured, SMTPAuthError
     
     campaign = user_manager.get_email_campaign(campaign_id)
     if not campaign:
@@ -325,88 +334,101 @@ def send_email_campaign(campaign_id, user_manager, batch_size=10, delay_between_
         logger.warning(f"⚠️ Рассылка {campaign_id} уже отправлена")
         return {'success': False, 'error': 'Рассылка уже отправлена'}
     
+    if engine is None:
+        if not smtp_configured():
+            logger.warning("⚠️ SMTP настройки не заданы. Рассылка не будет отправлена.")
+            return {'success': False, 'error': 'SMTP настройки не заданы'}
+        engine = get_email_engine()
+    checkpoint_size = checkpoint_size or Config.EMAIL_CHECKPOINT_SIZE
+    chunk_size = chunk_size or Config.EMAIL_RECIPIENT_CHUNK_SIZE
+    session = user_manager.db.session
+    
     # Обновляем статус рассылки на "отправляется"
     campaign.status = 'sending'
-    user_manager.db.session.commit()
+    session.commit()
+    
+    stats = {'recipients': 0, 'skipped': 0, 'sent': 0, 'failed': 0, 'bounced': 0}
+    checkpoint = []
+    update_status = EmailSend.__table__.update().where(
+        EmailSend.__table__.c.id == bindparam('send_id')
+    ).values(
+        status=bindparam('new_status'),
+        sent_at=bindparam('new_sent_at'),
+        error_message=bindparam('new_error')
+    )
+    
+    def flush_checkpoint():
+        if not checkpoint:
+            return
+        session.execute(update_status, checkpoint)
+        session.commit()
+        checkpoint.clear()
+    
+    def pending_recipients():
+        for chunk in _campaign_recipient_chunks(campaign, user_manager, chunk_size):
+            stats['recipients'] += len(chunk)
+            pending = _claim_pending_sends(campaign_id, chunk, session)
+            stats['skipped'] += len(chunk) - len(pending)
+            yield from pending
+    
+    def on_result(recipient, result):
+        stats[result.status] += 1
+        checkpoint.append({
+            'send_id': recipient['send_id'],
+            'new_status': result.status,
+            'new_sent_at': datetime.now().isoformat() if result.status == 'sent' else None,
+            'new_error': result.error
+        })
+        if len(checkpoint) >= checkpoint_size:
+            flush_checkpoint()
     
     try:
-        # Получаем список получателей
-        if campaign.recipient_filter == 'manual':
-            import json as _json
-            raw = campaign.recipient_list or "[]"
-            try:
-                selected = _json.loads(raw)
-            except Exception:
-                selected = []
-            # selected может быть списком строк email или списком объектов
-            recipients = []
-            for item in selected if isinstance(selected, list) else []:
-                if isinstance(item, str):
-                    recipients.append({'user_id': None, 'email': item})
-                elif isinstance(item, dict) and item.get('email'):
-                    recipients.append({'user_id': item.get('user_id'), 'email': item.get('email')})
-        else:
-            recipients = user_manager.get_recipients_for_campaign(campaign.recipient_filter)
+        logger.info(f"📧 Начинаем отправку рассылки {campaign.name} ({campaign_id})")
+        
+        # Потоки отправителей не трогают ORM-объект рассылки
+        content = SimpleNamespace(
+            subject=campaign.subject,
+            html_content=campaign.html_content,
+            text_content=campaign.text_content
+        )
+        try:
+            engine.deliver(pending_recipients(), lambda recipient: build_campaign_message(content, recipient), on_result)
+        finally:
+            # Уже полученные результаты сохраняем и при обрыве рассылки
+            flush_checkpoint()
         
-        if not recipients:
+        if not stats['recipients']:
             campaign.status = 'draft'
-            user_manager.db.session.commit()
+            session.commit()
             logger.warning(f"⚠️ Нет получателей для рассылки {campaign_id}")
             return {'success': False, 'error': 'Нет получателей для рассылки'}
-
-        # Идемпотентность: если рассылку запускают повторно, не отправляем тем,
-        # кому уже отправляли (чтобы не было дублей писем).
-        try:
-            from models.sqlite_users import EmailSend
-            already_processed = EmailSend.query.filter(
-                EmailSend.campaign_id == campaign_id,
-                EmailSend.status.in_(['sent', 'failed', 'bounced'])
-            ).with_entities(EmailSend.email).all()
-            already_processed_emails = set([row[0] for row in already_processed if row and row[0]])
-            if already_processed_emails:
-                before = len(recipients)
-                recipients = [r for r in recipients if r.get('email') not in already_processed_emails]
-                logger.info(f"📧 Идемпотентность: исключили {before - len(recipients)} получателей (уже обработаны ранее)")
-        except Exception as e:
-            logger.warning(f"⚠️ Не удалось применить идемпотентность рассылки {campaign_id}: {e}")
-        
-        logger.info(f"📧 Начинаем отправку рассылки {campaign.name} ({campaign_id}) получателям: {len(recipients)}")
-        
-        # Отправляем письма батчами
-        sent_count = 0
-        failed_count = 0
         
-        for i in range(0, len(recipients), batch_size):
-            batch = recipients[i:i + batch_size]
-            
-            for recipient in batch:
-                success, error = send_campaign_email(campaign, recipient, user_manager)
-                if success:
-                    sent_count += 1
-                else:
-                    failed_count += 1
-            
-            # Задержка между батчами (чтобы не перегружать SMTP-сервер)
-            if i + batch_size < len(recipients):
-                time.sleep(delay_between_batches)
+        if stats['skipped']:
+            # Идемпотентность: при повторном запуске не отправляем тем, кому уже отправляли
+            logger.info(f"📧 Идемпотентность: исключили {stats['skipped']} получателей (уже обработаны ранее)")
         
         # Обновляем статус рассылки на "отправлено"
         campaign.status = 'sent'
         campaign.sent_at = datetime.now().isoformat()
-        user_manager.db.session.commit()
+        session.commit()
         
-        logger.info(f"✅ Рассылка {campaign.name} ({campaign_id}) завершена: отправлено {sent_count}, ошибок {failed_count}")
+        failed_count = stats['failed'] + stats['bounced']
+        logger.info(f"✅ Рассылка {campaign.name} ({campaign_id}) завершена: отправлено {stats['sent']}, ошибок {failed_count} (bounced {stats['bounced']})")
         
         return {
             'success': True,
-            'total': len(recipients),
-            'sent': sent_count,
-            'failed': failed_count
+            'total': stats['sent'] + failed_count,
+            'sent': stats['sent'],
+            'failed': failed_count,
+            'bounced': stats['bounced']
         }
         
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки рассылки {campaign_id}: {e}")
+        if isinstance(e, SMTPAuthError):
+            logger.error(f"❌ Рассылка {campaign_id} остановлена: SMTP отверг авторизацию ({e})")
+        else:
+            logger.error(f"❌ Ошибка отправки рассылки {campaign_id}: {e}")
+        session.rollback()
         campaign.status = 'draft'  # Возвращаем статус в черновик при ошибке
-        user_manager.db.session.commit()
-        return {'success': False, 'error': str(e)}
-
+        session.commit()
+        return {'success': False, 'error': str(e), 'sent': stats['sent'], 'failed': stats['failed'] + stats['bounced']}
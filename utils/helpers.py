@@ -67,6 +67,32 @@ def is_plan_expired(expiry_date):
         logger.error(f"❌ Ошибка проверки срока тарифа {expiry_date}: {e}")
         return True
 
+def day_bounds(day=None):
+    """Полуоткрытый диапазон суток [начало дня, начало следующего дня) в виде ISO-строк
+
+    Даты в БД хранятся ISO-строками, поэтому условие >= / < идет по индексу,
+    а LIKE 'YYYY-MM-DD%' - полным сканированием таблицы.
+    """
+    day = day or date.today()
+    return day.isoformat(), (day + timedelta(days=1)).isoformat()
+
+def month_bounds(day=None):
+    """Полуоткрытый диапазон календарного месяца в виде ISO-строк"""
+    first = (day or date.today()).replace(day=1)
+    next_month = (first + timedelta(days=32)).replace(day=1)
+    return first.isoformat(), next_month.isoformat()
+
+def date_range_filter(column, start, end=None):
+    """Условия start <= column < end для query.filter(*...)"""
+    conditions = [column >= start]
+    if end:
+        conditions.append(column < end)
+    return conditions
+
+def today_filter(column):
+    """Условия "запись сделана сегодня" для query.filter(*...)"""
+    return date_range_filter(column, *day_bounds())
+
 def validate_email(email):
     """Простая валидация email"""
     if not email or '@' not in email:
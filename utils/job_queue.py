@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Персистентная очередь фоновых задач на SQLite
+
+Задачи хранятся в таблице background_jobs. Воркер захватывает задачу
+атомарным UPDATE с арендой (lease), продлевает аренду heartbeat-ом во время
+выполнения, а при ошибке переставляет задачу в очередь с экспоненциальной
+задержкой. Если процесс воркера умер (рестарт gunicorn, деплой), аренда
+истекает и задачу подхватывает другой воркер.
+"""
+
+import os
+import json
+import uuid
+import random
+import socket
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+import requests
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from config import Config
+from models.sqlite_users import db, BackgroundJob, BatchProcessingTask, DocumentComparison, AnalysisJob
+
+try:
+    import fcntl
+except ImportError:  # Windows: без выбора ведущего процесса
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class PermanentJobError(Exception):
+    """Ошибка, которую повтор не исправит (неверные входные данные, запись не найдена) - задача сразу failed"""
+
+
+def is_transient_error(error):
+    """Временная ошибка (БД занята, сеть, таймаут) - задачу имеет смысл повторить"""
+    return isinstance(error, (OperationalError, sqlite3.OperationalError, ConnectionError, TimeoutError,
+                              requests.RequestException))
+
+
+def _now():
+    """Текущее время в ISO-формате с точностью до секунд (строки сравниваются лексикографически)"""
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _in_seconds(seconds):
+    return (datetime.now() + timedelta(seconds=seconds)).isoformat(timespec='seconds')
+
+
+def _run_batch_task(app_instance, payload):
+    from utils.batch_processor import BatchProcessor
+    BatchProcessor.run_batch_task(payload['task_id'], payload['user_id'], app_instance)
+
+
+def _fail_batch_task(payload, error):
+    task = BatchProcessingTask.query.get(payload['task_id'])
+    if task and task.status != 'completed':
+        task.status = 'failed'
+        task.error_message = error
+        task.completed_at = datetime.now().isoformat()
+        db.session.commit()
+
+
+def _run_document_comparison(app_instance, payload):
+    from utils.document_comparator import DocumentComparator
+    with app_instance.app_context():
+        _, error = DocumentComparator.compare_documents(payload['comparison_id'], payload['user_id'], app_instance)
+    if error:
+        # Временные ошибки compare_documents пробрасывает сам, здесь - результат, который повтор не изменит
+        raise PermanentJobError(error)
+
+
+def _fail_document_comparison(payload, error):
+    comparison = DocumentComparison.query.get(payload['comparison_id'])
+    if comparison and comparison.status != 'completed':
+        comparison.status = 'failed'
+        comparison.error_message = error
+        db.session.commit()
+
+
+def _run_db_backup(app_instance, payload):
+    from services.db_backup import run_backup
+    run_backup(payload.get('kind', 'full'))
+
+
+def _fail_db_backup(payload, error):
+    from services.db_backup import mark_backup_failed
+    mark_backup_failed(error)
+
+
+def _run_analysis(app_instance, payload):
+    from services.analysis_pipeline import run_analysis_job
+    run_analysis_job(app_instance, payload)
+
+
+def _fail_analysis(payload, error):
+    from services.analysis_pipeline import fail_analysis_job
+    fail_analysis_job(payload, error)
+
+
+# Обработчики задач: job_type -> (выполнение, пометка доменной записи как failed после всех попыток)
+JOB_HANDLERS = {
+    'batch_task': (_run_batch_task, _fail_batch_task),
+    'document_comparison': (_run_document_comparison, _fail_document_comparison),
+    'db_backup': (_run_db_backup, _fail_db_backup),
+    'analysis': (_run_analysis, _fail_analysis),
+}
+
+
+class JobQueue:
+    """Менеджер очереди фоновых задач"""
+
+    @staticmethod
+    def enqueue(job_type, payload, dedupe_key=None, priority=100, max_attempts=None):
+        """Поставить задачу в очередь. Если активная задача с тем же dedupe_key уже есть - вернуть ее id"""
+        try:
+            if dedupe_key:
+                existing = BackgroundJob.query.filter(
+                    BackgroundJob.dedupe_key == dedupe_key,
+                    BackgroundJob.status.in_(ACTIVE_STATUSES)
+                ).first()
+                if existing:
+                    return existing.id, None
+
+            now = _now()
+            job = BackgroundJob(
+                job_type=job_type,
+                payload_json=json.dumps(payload, ensure_ascii=False),
+                dedupe_key=dedupe_key,
+                status='queued',
+                priority=priority,
+                attempts=0,
+                max_attempts=max_attempts or Config.JOB_QUEUE_MAX_ATTEMPTS,
+                run_after=now,
+                created_at=now
+            )
+            db.session.add(job)
+            db.session.commit()
+            logger.info(f"📥 Задача {job_type} #{job.id} поставлена в очередь ({dedupe_key or '-'})")
+            return job.id, None
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Ошибка постановки задачи в очередь: {e}")
+            return None, str(e)
+
+    @staticmethod
+    def claim(worker_id):
+        """Атомарно захватить следующую готовую задачу (или задачу с истекшей арендой)"""
+        now = _now()
+        token = str(uuid.uuid4())
+        result = db.session.execute(text("""
+            UPDATE background_jobs
+            SET status = 'running',
+                lease_owner = :worker_id,
+                lease_token = :token,
+                lease_expires_at = :lease_expires_at,
+                heartbeat_at = :now,
+                started_at = COALESCE(started_at, :now),
+                attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM background_jobs
+                WHERE (status = 'queued' AND run_after <= :now)
+                   OR (status = 'running' AND lease_expires_at < :now AND attempts < max_attempts)
+                ORDER BY priority ASC, id ASC
+                LIMIT 1
+            )
+        """), {
+            'worker_id': worker_id,
+            'token': token,
+            'now': now,
+            'lease_expires_at': _in_seconds(Config.JOB_QUEUE_LEASE_SECONDS)
+        })
+        db.session.commit()
+        if not result.rowcount:
+            return None
+        return BackgroundJob.query.filter_by(lease_token=token).first()
+
+    @staticmethod
+    def heartbeat(job_id, token):
+        """Продлить аренду задачи. Возвращает False, если аренду перехватил другой воркер"""
+        result = db.session.execute(text("""
+            UPDATE background_jobs
+            SET heartbeat_at = :now, lease_expires_at = :lease_expires_at
+            WHERE id = :job_id AND lease_token = :token AND status = 'running'
+        """), {
+            'now': _now(),
+            'lease_expires_at': _in_seconds(Config.JOB_QUEUE_LEASE_SECONDS),
+            'job_id': job_id,
+            'token': token
+        })
+        db.session.commit()
+        return bool(result.rowcount)
+
+    @staticmethod
+    def complete(job_id, token):
+        """Отметить задачу выполненной"""
+        db.session.execute(text("""
+            UPDATE background_jobs
+            SET status = 'completed', completed_at = :now, lease_token = NULL, lease_expires_at = NULL
+            WHERE id = :job_id AND lease_token = :token
+        """), {'now': _now(), 'job_id': job_id, 'token': token})
+        db.session.commit()
+
+    @staticmethod
+    def fail(job_id, token, error, retry=True):
+        """Обработать ошибку: повторить с задержкой или окончательно пометить failed (retry=False - сразу)"""
+        job = BackgroundJob.query.filter_by(id=job_id, lease_token=token).first()
+        if not job:
+            return
+        job.last_error = error
+        job.lease_token = None
+        job.lease_expires_at = None
+
+        if retry and job.attempts < job.max_attempts:
+            delay = JobQueue.backoff_seconds(job.attempts)
+            job.status = 'queued'
+            job.run_after = _in_seconds(delay)
+            db.session.commit()
+            logger.warning(f"🔁 Задача {job.job_type} #{job.id} будет повторена через {delay:.0f} сек (попытка {job.attempts}/{job.max_attempts})")
+            return
+
+        job.status = 'failed'
+        job.completed_at = _now()
+        db.session.commit()
+        if retry:
+            logger.error(f"❌ Задача {job.job_type} #{job.id} окончательно провалена после {job.attempts} попыток: {error}")
+        else:
+            logger.error(f"❌ Задача {job.job_type} #{job.id} провалена без повторов (ошибка не временная): {error}")
+        JobQueue._run_fail_handler(job.id, job.job_type, job.payload_json, error)
+
+    @staticmethod
+    def fail_exhausted_jobs():
+        """Окончательно провалить задачи с истекшей арендой, у которых кончились попытки
+
+        Так заканчиваются задачи, которые убивают своего воркера (OOM, падение при
+        разборе PDF): claim их больше не берет, а доменная запись помечается failed.
+        Возвращает число проваленных задач.
+        """
+        now = _now()
+        exhausted = BackgroundJob.query.filter(
+            BackgroundJob.status == 'running',
+            BackgroundJob.lease_expires_at < now,
+            BackgroundJob.attempts >= BackgroundJob.max_attempts
+        ).all()
+        expired = [(job.id, job.job_type, job.payload_json, job.lease_token, job.attempts) for job in exhausted]
+
+        failed = 0
+        for job_id, job_type, payload_json, token, attempts in expired:
+            error = f"Воркер не завершил задачу за {attempts} попыток (аренда истекла)"
+            # Условие на токен аренды: запись помечает и обрабатывает только один процесс
+            result = db.session.execute(text("""
+                UPDATE background_jobs
+                SET status = 'failed', completed_at = :now, last_error = :error,
+                    lease_token = NULL, lease_expires_at = NULL
+                WHERE id = :job_id AND lease_token = :token AND status = 'running'
+            """), {'now': now, 'error': error, 'job_id': job_id, 'token': token})
+            db.session.commit()
+            if not result.rowcount:
+                continue
+            logger.error(f"❌ Задача {job_type} #{job_id} окончательно провалена: {error}")
+            JobQueue._run_fail_handler(job_id, job_type, payload_json, error)
+            failed += 1
+        return failed
+
+    @staticmethod
+    def _run_fail_handler(job_id, job_type, payload_json, error):
+        """Пометить доменную запись задачи как failed (обработчик из JOB_HANDLERS)"""
+        handler = JOB_HANDLERS.get(job_type)
+        if not handler:
+            return
+        try:
+            handler[1](json.loads(payload_json or '{}'), error)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Ошибка пометки записи задачи #{job_id} как failed: {e}")
+
+    @staticmethod
+    def backoff_seconds(attempt):
+        """Экспоненциальная задержка с джиттером"""
+        base = Config.JOB_QUEUE_RETRY_BASE_SECONDS * (2 ** max(0, attempt - 1))
+        delay = min(base, Config.JOB_QUEUE_RETRY_MAX_SECONDS)
+        return delay * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def recover_stale_jobs():
+        """Вернуть в очередь задачи с истекшей арендой и поставить задачи для записей, зависших в 'processing'
+
+        Вызывается при старте воркера: после рестарта/деплоя ничего не должно остаться
+        в подвешенном состоянии. Записи моложе JOB_QUEUE_RECOVERY_GRACE_SECONDS не трогаем:
+        пакетная задача создается раньше, чем к ней добавлены файлы и поставлена задача в очередь.
+        """
+        now = _now()
+        grace_cutoff = (datetime.now() - timedelta(seconds=Config.JOB_QUEUE_RECOVERY_GRACE_SECONDS)).isoformat(timespec='seconds')
+        try:
+            exhausted = JobQueue.fail_exhausted_jobs()
+            result = db.session.execute(text("""
+                UPDATE background_jobs
+                SET status = 'queued', lease_token = NULL, lease_expires_at = NULL, run_after = :now
+                WHERE status = 'running' AND lease_expires_at < :now AND attempts < max_attempts
+            """), {'now': now})
+            db.session.commit()
+            requeued = result.rowcount
+
+            # Записи, которые запускались старым способом (daemon-поток) и остались без задачи в очереди
+            resumed = 0
+            stuck_tasks = BatchProcessingTask.query.filter(
+                BatchProcessingTask.status.in_(('pending', 'processing')),
+                BatchProcessingTask.created_at < grace_cutoff
+            ).all()
+            for task in stuck_tasks:
+                key = f'batch_task:{task.id}'
+                if not JobQueue._has_job(key):
+                    JobQueue.enqueue('batch_task', {'task_id': task.id, 'user_id': task.user_id}, dedupe_key=key)
+                    resumed += 1
+
+            stuck_comparisons = DocumentComparison.query.filter(
+                DocumentComparison.status.in_(('pending', 'processing')),
+                DocumentComparison.created_at < grace_cutoff
+            ).all()
+            for comparison in stuck_comparisons:
+                key = f'document_comparison:{comparison.id}'
+                if not JobQueue._has_job(key):
+                    JobQueue.enqueue('document_comparison', {'comparison_id': comparison.id, 'user_id': comparison.user_id}, dedupe_key=key)
+                    resumed += 1
+
+            # Асинхронные анализы без задачи в очереди (приняты до перехода на очередь): данных для повтора нет
+            from services.analysis_pipeline import update_analysis_job
+            stuck_analyses = AnalysisJob.query.filter(
+                AnalysisJob.status.in_(('queued', 'processing')),
+                AnalysisJob.created_at < grace_cutoff
+            ).all()
+            for analysis_job in stuck_analyses:
+                if not JobQueue._has_job(f'analysis:{analysis_job.id}'):
+                    update_analysis_job(analysis_job.id, status='failed',
+                                        error='Анализ прерван (перезапуск сервера). Загрузите документ повторно.')
+
+            if requeued or resumed or exhausted:
+                logger.info(f"♻️ Восстановление очереди: возвращено {requeued} задач с истекшей арендой, "
+                            f"провалено {exhausted} без попыток, поставлено {resumed} зависших записей")
+            return requeued, resumed
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"❌ Ошибка восстановления зависших задач: {e}")
+            return 0, 0
+
+    @staticmethod
+    def _has_job(dedupe_key):
+        """Есть ли уже задача (любая, кроме failed) с таким ключом"""
+        return BackgroundJob.query.filter(
+            BackgroundJob.dedupe_key == dedupe_key,
+            BackgroundJob.status != 'failed'
+        ).first() is not None
+
+    @staticmethod
+    def get_stats():
+        """Количество задач по статусам"""
+        rows = db.session.query(BackgroundJob.status, db.func.count(BackgroundJob.id)).group_by(BackgroundJob.status).all()
+        return {status: count for status, count in rows}
+
+
+class JobWorker:
+    """Воркер очереди: берет задачи и выполняет их, продлевая аренду heartbeat-ом"""
+
+    def __init__(self, app_instance, name=None):
+        self.app = app_instance
+        self.worker_id = name or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        """Основной цикл воркера"""
+        logger.info(f"👷 Воркер очереди запущен: {self.worker_id}")
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка цикла воркера {self.worker_id}: {e}")
+                processed = False
+            if not processed:
+                self._stop.wait(Config.JOB_QUEUE_POLL_SECONDS)
+        logger.info(f"👷 Воркер очереди остановлен: {self.worker_id}")
+
+    def run_once(self):
+        """Взять и выполнить одну задачу. Возвращает False, если очередь пуста"""
+        with self.app.app_context():
+            JobQueue.fail_exhausted_jobs()
+            job = JobQueue.claim(self.worker_id)
+            if not job:
+                return False
+            job_id, token, job_type = job.id, job.lease_token, job.job_type
+            payload = json.loads(job.payload_json or '{}')
+            attempt = job.attempts
+
+        logger.info(f"▶️ {self.worker_id}: задача {job_type} #{job_id} (попытка {attempt})")
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(job_id, token, heartbeat_stop), daemon=True)
+        heartbeat.start()
+        try:
+            handler = JOB_HANDLERS.get(job_type)
+            if not handler:
+                raise Exception(f"Неизвестный тип задачи: {job_type}")
+            handler[0](self.app, payload)
+        except Exception as e:
+            heartbeat_stop.set()
+            heartbeat.join()
+            logger.error(f"❌ Задача {job_type} #{job_id} завершилась с ошибкой: {e}")
+            with self.app.app_context():
+                JobQueue.fail(job_id, token, str(e), retry=not isinstance(e, PermanentJobError))
+            return True
+
+        heartbeat_stop.set()
+        heartbeat.join()
+        with self.app.app_context():
+            JobQueue.complete(job_id, token)
+        logger.info(f"✅ {self.worker_id}: задача {job_type} #{job_id} выполнена")
+        return True
+
+    def _heartbeat_loop(self, job_id, token, stop_event):
+        interval = max(1, Config.JOB_QUEUE_LEASE_SECONDS // 3)
+        while not stop_event.wait(interval):
+            try:
+                with self.app.app_context():
+                    if not JobQueue.heartbeat(job_id, token):
+                        logger.warning(f"⚠️ Аренда задачи #{job_id} потеряна воркером {self.worker_id}")
+                        return
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка heartbeat задачи #{job_id}: {e}")
+
+
+_leader_lock = None
+_leader_lock_guard = threading.Lock()
+
+
+def acquire_queue_leadership():
+    """Стать ведущим процессом очереди на этом хосте (неблокирующий flock на JOB_QUEUE_LEADER_LOCK)
+
+    Блокировка держится до конца процесса; если процесс умер, ОС снимает ее сама,
+    и ведущим становится следующий стартующий процесс. job_worker.py берет ту же
+    блокировку, поэтому при запущенном отдельном воркере веб-процессы свои не запускают.
+    Returns: True, если этот процесс ведущий (без fcntl - всегда True).
+    """
+    global _leader_lock
+    if fcntl is None:
+        return True
+    with _leader_lock_guard:
+        if _leader_lock is not None:
+            return True
+        lock_file = open(Config.JOB_QUEUE_LEADER_LOCK, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        _leader_lock = lock_file
+        return True
+
+
+def start_embedded_workers(app_instance, count):
+    """Запускает воркеры очереди потоками внутри веб-процесса
+
+    Используется, когда отдельный job_worker.py не запущен. Из всех процессов
+    gunicorn воркеры и восстановление очереди запускает только ведущий
+    (acquire_queue_leadership). Задачи все равно переживают рестарт: после
+    остановки процесса аренда истечет и задачу подхватит следующий воркер.
+    """
+    if not acquire_queue_leadership():
+        logger.info(f"ℹ️ Воркеры очереди работают в другом процессе - встроенные воркеры в процессе {os.getpid()} не запускаются")
+        return []
+
+    with app_instance.app_context():
+        if not db.inspect(db.engine).has_table(BackgroundJob.__tablename__):
+            logger.warning("⚠️ Таблица background_jobs не найдена - выполните migrate_add_background_jobs.py")
+            return []
+        JobQueue.recover_stale_jobs()
+
+    workers = []
+    for i in range(count):
+        worker = JobWorker(app_instance, name=f"{socket.gethostname()}:{os.getpid()}:embedded-{i}")
+        thread = threading.Thread(target=worker.run_forever, name=f'job-worker-{i}', daemon=True)
+        thread.start()
+        workers.append(worker)
+    return workers